@@ -0,0 +1,41 @@
+"""
+Cipher benchmark: encrypt+decrypt round trips per second for every cipher
+PyVault can write, at record sizes from a short password to a large note.
+
+    python benchmarks/bench_ciphers.py [--duration SECONDS]
+
+`pyvault init` runs the same measurement (64-byte records, AES-256-GCM vs
+ChaCha20-Poly1305) to pick the vault's cipher automatically.
+"""
+
+import argparse
+import platform
+
+from pyvault.crypto import CIPHER_NAMES, benchmark_ciphers, select_cipher
+
+PAYLOAD_SIZES = (64, 1024, 64 * 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--duration", type=float, default=0.5)
+    args = parser.parse_args()
+
+    print(f"Host: {platform.machine()} / {platform.processor() or 'unknown CPU'}")
+    header = f"{'cipher':<22}" + "".join(f"{size:>12,} B" for size in PAYLOAD_SIZES)
+    print(header)
+    print("-" * len(header))
+
+    results = {
+        size: benchmark_ciphers(CIPHER_NAMES, payload_size=size, duration=args.duration)
+        for size in PAYLOAD_SIZES
+    }
+    for cipher, name in CIPHER_NAMES.items():
+        row = "".join(f"{results[size][cipher]:>12,.0f}/s" for size in PAYLOAD_SIZES)
+        print(f"{name:<22}{row}")
+
+    print(f"\nAutomatic choice at init: {CIPHER_NAMES[select_cipher()]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Storage engine benchmark: the SQLite file against the encrypted memory file.
+
+    python benchmarks/bench_engines.py [--records N ...] [--runs R]
+
+Builds a vault of N records with each engine, then times opening and
+unlocking it (key derivation excluded: unlock_with_key), point lookups,
+a full `list`, the first page of a `list`, and a committed single-record
+write. Also reports the file sizes.
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from pyvault.engines import ENGINES
+from pyvault.session import VaultSession
+
+LOOKUPS = 1_000
+
+
+def build(path, engine, records):
+    with VaultSession.open(path, engine=engine) as session:
+        session.initialize("master")
+        key = bytes(session.key)
+        blob = session.encrypt("correct horse battery staple")
+        with session.transaction(write=True):
+            session.storage.conn.executemany(
+                "INSERT INTO credentials (service, username, password_blob) "
+                "VALUES (?, ?, ?)",
+                ((f"service-{i:08d}", f"user{i}", blob) for i in range(records)),
+            )
+    return key
+
+
+def timed(action, runs):
+    """Median seconds of `runs` calls."""
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        action()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def measure(path, key, records, runs):
+    def unlock():
+        with VaultSession.open(path) as session:
+            session.unlock_with_key(key)
+
+    results = {"unlock": timed(unlock, runs)}
+    with VaultSession.open(path) as session:
+        session.unlock_with_key(key)
+        services = [f"service-{(i * 7919) % records:08d}" for i in range(LOOKUPS)]
+        session.storage.get_credential(services[0])  # builds the memory index
+        results["lookup"] = timed(
+            lambda: [session.storage.get_credential(s) for s in services], runs
+        ) / len(services)
+        results["list"] = timed(lambda: [*session.catalog()], runs)
+        results["list page"] = timed(lambda: [*session.catalog(limit=50)], runs)
+        counter = iter(range(10**9))
+        results["write"] = timed(
+            lambda: session.add(f"new-{next(counter)}", "user", "password"), runs
+        )
+    results["size"] = os.path.getsize(path)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--records", type=int, nargs="+", default=[1_000, 10_000, 100_000]
+    )
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"medians of {args.runs} runs; lookup: per call, over {LOOKUPS:,} calls")
+    for records in args.records:
+        print(f"{records:,} records")
+        for engine in ENGINES:
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, "vault.db")
+                key = build(path, engine, records)
+                r = measure(path, key, records, args.runs)
+            print(
+                f"  {engine:6} unlock {r['unlock'] * 1000:8.1f} ms | "
+                f"lookup {r['lookup'] * 1e6:6.1f} µs | "
+                f"list {r['list'] * 1000:7.2f} ms | "
+                f"list page {r['list page'] * 1000:5.2f} ms | "
+                f"write {r['write'] * 1000:7.1f} ms | "
+                f"file {r['size'] / 1024 / 1024:6.1f} MiB"
+            )
+
+
+if __name__ == "__main__":
+    main()
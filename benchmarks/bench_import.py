@@ -0,0 +1,82 @@
+"""
+Import benchmark: serial import against the staged import pipeline.
+
+    python benchmarks/bench_import.py [--files N] [--rows N] [--workers N ...]
+
+Writes N formatted CSVs and imports them into fresh vaults: first the way a
+single-threaded import does (parse, encrypt and write each row in turn), then
+with ImportPipeline for each requested worker count (default: 1 and one per
+CPU). Rows per second are reported per stage.
+"""
+
+import argparse
+import csv
+import os
+import tempfile
+import time
+
+from pyvault.importer import STAGES, ImportPipeline
+from pyvault.session import VaultSession
+
+
+def write_files(directory, files, rows):
+    paths = []
+    for n in range(files):
+        path = os.path.join(directory, f"team{n:03d}.csv")
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["service", "username", "password"])
+            for i in range(rows):
+                writer.writerow([f"team{n:03d}-{i:06d}", f"user{i}", f"password-{i}"])
+        paths.append(path)
+    return paths
+
+
+def open_vault(path):
+    session = VaultSession.open(path)
+    session.initialize("master")
+    return session
+
+
+def serial_import(session, paths):
+    with session.transaction(write=True):
+        for path in paths:
+            with open(path, newline="", encoding="utf-8") as f:
+                for row in csv.DictReader(f):
+                    if not session.exists(row["service"]):
+                        session.add(row["service"], row["username"], row["password"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--workers", type=int, nargs="*")
+    args = parser.parse_args()
+    worker_counts = args.workers or sorted({1, os.cpu_count() or 1})
+    total = args.files * args.rows
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = write_files(tmp, args.files, args.rows)
+        print(f"{args.files} files, {total:,} rows")
+
+        session = open_vault(os.path.join(tmp, "serial.db"))
+        start = time.perf_counter()
+        serial_import(session, paths)
+        seconds = time.perf_counter() - start
+        session.close()
+        print(f"{'serial':>12}: {seconds:6.1f}s ({total / seconds:,.0f} rows/s)")
+
+        for workers in worker_counts:
+            session = open_vault(os.path.join(tmp, f"pipeline{workers}.db"))
+            report = ImportPipeline(session, workers=workers).run(paths)
+            session.close()
+            stages = ", ".join(f"{s} {report.rate(s):,.0f}/s" for s in STAGES)
+            print(
+                f"{workers:>2} worker(s): {report.seconds:6.1f}s "
+                f"({report.total_imported / report.seconds:,.0f} rows/s; {stages})"
+            )
+
+
+if __name__ == "__main__":
+    main()
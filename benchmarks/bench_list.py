@@ -0,0 +1,88 @@
+"""
+List benchmark: time to the first line and to the end of `pyvault list`.
+
+    python benchmarks/bench_list.py [--records N]
+
+Builds a vault of N records and renders its listing the way each output
+format of `list` does: the rich table (every row read and laid out before
+anything prints) and the streamed formats (one line per row as it is read).
+"""
+
+import argparse
+import io
+import os
+import tempfile
+import time
+from contextlib import closing
+
+from rich.console import Console
+from rich.table import Table
+
+from pyvault.crypto import CryptoManager
+from pyvault.main import CatalogPage, catalog_lines
+from pyvault.storage import VaultStorage
+
+
+def table_output(storage, out):
+    rows = storage.get_catalog()
+    table = Table(title="Stored Credentials")
+    table.add_column("Service")
+    table.add_column("Username")
+    for service, username, _, _ in rows:
+        table.add_row(service, username)
+    Console(file=out, width=120).print(table)
+    yield out.getvalue()
+
+
+def streamed_output(storage, output_format, limit=None):
+    rows = storage.get_catalog(limit=None if limit is None else limit + 1, stream=True)
+    with closing(rows):
+        yield from catalog_lines(CatalogPage(rows, limit), output_format)
+
+
+def measure(lines):
+    start = time.perf_counter()
+    first = None
+    for _ in lines:
+        if first is None:
+            first = time.perf_counter() - start
+    return first, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--records", type=int, default=100_000)
+    args = parser.parse_args()
+
+    crypto = CryptoManager()
+    key = os.urandom(crypto.key_size)
+    blob = crypto.encrypt("password", key)
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = VaultStorage(os.path.join(tmp, "vault.db"))
+        with storage.transaction(write=True):
+            storage.conn.executemany(
+                "INSERT INTO credentials (service, username, password_blob) "
+                "VALUES (?, ?, ?)",
+                ((f"service-{i:07d}", f"user{i}", blob) for i in range(args.records)),
+            )
+        print(f"{args.records:,} records")
+
+        cases = [("table", lambda: table_output(storage, io.StringIO()))]
+        for output_format in ("plain", "tsv", "json", "ndjson"):
+            cases.append(
+                (output_format, lambda f=output_format: streamed_output(storage, f))
+            )
+        cases.append(
+            ("plain --limit 50", lambda: streamed_output(storage, "plain", 50))
+        )
+        for name, lines in cases:
+            first, total = measure(lines())
+            print(
+                f"{name:>18}: first line {first * 1000:8.1f} ms, "
+                f"all {total * 1000:8.0f} ms"
+            )
+        storage.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Log engine benchmark: write throughput and open time against SQLite.
+
+    python benchmarks/bench_log.py [--records N ...] [--commits C] [--batch B]
+
+Builds a vault of N records with each engine, then times C committed
+single-record overwrites (a rotation job), C commits of B new records each
+(bulk provisioning), and opening and unlocking the vault afterwards (key
+derivation excluded: unlock_with_key). For the log engine opening is timed
+with the hint file and without it (the whole log replayed). Also reports the
+file size after the writes. Every commit is synced to disk. The memory
+engine, which rewrites its whole file on every commit, is measured too.
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from pyvault.recordlog import hint_path
+from pyvault.session import VaultSession
+
+ENGINES = ("sqlite", "memory", "log")
+
+
+def build(path, engine, records):
+    with VaultSession.open(path, engine=engine) as session:
+        session.initialize("master")
+        key = bytes(session.key)
+        blob = session.encrypt("correct horse battery staple")
+        with session.transaction(write=True):
+            session.storage.conn.executemany(
+                "INSERT INTO credentials (service, username, password_blob) "
+                "VALUES (?, ?, ?)",
+                ((f"service-{i:08d}", f"user{i}", blob) for i in range(records)),
+            )
+    return key, blob
+
+
+def write(path, key, blob, records, commits, batch):
+    """(single-record commits per second, records per second in batches)"""
+    with VaultSession.open(path) as session:
+        session.unlock_with_key(key)
+        storage = session.storage
+        start = time.perf_counter()
+        for i in range(commits):
+            storage.add_credential(f"service-{i * 7919 % records:08d}", "user", blob)
+        single = commits / (time.perf_counter() - start)
+        start = time.perf_counter()
+        for i in range(commits):
+            with storage.transaction(write=True):
+                for j in range(batch):
+                    storage.add_credential(f"new-{i:05d}-{j:04d}", "user", blob)
+        batched = commits * batch / (time.perf_counter() - start)
+    return single, batched
+
+
+def open_time(path, key, runs, hint=True):
+    samples = []
+    for _ in range(runs):
+        if not hint:
+            os.remove(hint_path(path))
+        start = time.perf_counter()
+        with VaultSession.open(path) as session:
+            session.unlock_with_key(key)
+            samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--records", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--commits", type=int, default=200)
+    parser.add_argument("--batch", type=int, default=100)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    print(
+        f"{args.commits} commits of 1 and of {args.batch} records; "
+        f"open: median of {args.runs} runs"
+    )
+    for records in args.records:
+        print(f"{records:,} records")
+        for engine in ENGINES:
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, "vault.db")
+                key, blob = build(path, engine, records)
+                single, batched = write(
+                    path, key, blob, records, args.commits, args.batch
+                )
+                opened = open_time(path, key, args.runs)
+                line = (
+                    f"  {engine:6} {single:7,.0f} commits/s | "
+                    f"{batched:8,.0f} records/s in batches | "
+                    f"open {opened * 1000:7.1f} ms"
+                )
+                if engine == "log":
+                    # Without the hint the whole log is replayed (and a new
+                    # hint written at close)
+                    opened = open_time(path, key, args.runs, hint=False)
+                    line += f" ({opened * 1000:.1f} ms no hint)"
+                size = os.path.getsize(path)
+            print(f"{line} | file {size / 1024 / 1024:5.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Optimize benchmark: file size and lookup latency under a delete-heavy churn.
+
+    python benchmarks/bench_optimize.py [--records N] [--rounds R] [--churn F]
+
+Builds two vaults of N records, then runs R rounds where a fraction F of the
+records is deleted and half as many new ones (with new names) written. One
+vault is never maintained (auto_vacuum off, no automatic maintenance); the
+other runs `pyvault optimize` after every round. After each round the file
+size, fragmentation and median time of a random lookup are reported for
+both.
+"""
+
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from pyvault.crypto import CryptoManager
+from pyvault.maintenance import database_stats, optimize
+from pyvault.storage import VaultStorage
+
+LOOKUPS = 5000
+
+
+def build(path, records, blob, maintained):
+    storage = VaultStorage(path)
+    if not maintained:
+        storage.conn.execute("PRAGMA auto_vacuum = NONE")
+        storage.conn.execute("VACUUM")
+        storage.set_auto_maintenance(False)
+    with storage.transaction(write=True):
+        storage.conn.executemany(
+            "INSERT INTO credentials (service, username, password_blob) "
+            "VALUES (?, ?, ?)",
+            ((f"service-{i:08d}", f"user{i}", blob) for i in range(records)),
+        )
+    return storage
+
+
+def churn(storage, services, fraction, blob, rng, next_id):
+    gone = rng.sample(sorted(services), int(len(services) * fraction))
+    with storage.transaction(write=True):
+        for service in gone:
+            storage.delete_credential(service)
+            services.discard(service)
+        for i in range(next_id, next_id + len(gone) // 2):
+            service = f"service-{rng.randrange(10**8):08d}-{i}"
+            storage.add_credential(service, f"user{i}", blob)
+            services.add(service)
+    return next_id + len(gone)
+
+
+def lookup_time(storage, services, rng):
+    names = rng.choices(sorted(services), k=LOOKUPS)
+    timings = []
+    for name in names:
+        start = time.perf_counter()
+        storage.get_credential(name)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1e6
+
+
+def size(path):
+    wal = f"{path}-wal"
+    return os.path.getsize(path) + (os.path.getsize(wal) if os.path.exists(wal) else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--records", type=int, default=50_000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--churn", type=float, default=0.3)
+    args = parser.parse_args()
+
+    crypto = CryptoManager()
+    key = os.urandom(crypto.key_size)
+    blob = crypto.encrypt("correct horse battery staple", key)
+    with tempfile.TemporaryDirectory() as tmp:
+        vaults = {}
+        for name, maintained in (("unmaintained", False), ("optimized", True)):
+            path = os.path.join(tmp, f"{name}.db")
+            vaults[name] = (
+                path,
+                build(path, args.records, blob, maintained),
+                {f"service-{i:08d}" for i in range(args.records)},
+            )
+        print(
+            f"{args.records:,} records, {args.churn:.0%} deleted and "
+            f"{args.churn / 2:.0%} added per round"
+        )
+        for round_number in range(1, args.rounds + 1):
+            row = []
+            for name, (path, storage, services) in vaults.items():
+                rng = random.Random(round_number)
+                churn(storage, services, args.churn, blob, rng, round_number * 10**7)
+                extra = ""
+                if name == "optimized":
+                    start = time.perf_counter()
+                    optimize(storage)
+                    extra = f", optimize {time.perf_counter() - start:5.2f} s"
+                else:
+                    storage.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                micros = lookup_time(storage, services, rng)
+                fragmentation = database_stats(storage.conn, path).fragmentation
+                row.append(
+                    f"{name} {size(path) / 2**20:5.1f} MiB, "
+                    f"fragmentation {fragmentation:4.0%}, lookup {micros:5.1f} µs"
+                    f"{extra}"
+                )
+            print(f"round {round_number}: {len(services):,} records")
+            for line in row:
+                print(f"  {line}")
+        for _, storage, _ in vaults.values():
+            storage.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Policy check benchmark: the NumPy backend against the pure-Python one.
+
+    python benchmarks/bench_policy.py [--records N ...] [--runs R]
+
+Generates N passwords: mostly generated ones (16 to 32 characters of
+every class), one in twenty short and lowercase, one in a thousand
+reused, a tenth tagged prod. Then times pyvault.policy.evaluate() on them with each
+available backend, decryption excluded. The policy uses every rule.
+"""
+
+import argparse
+import random
+import statistics
+import string
+import time
+
+from pyvault.policy import Policy, available_backends, evaluate
+
+POLICY = {
+    "min_length": 12,
+    "require": ["lower", "upper", "digit", "symbol"],
+    "banned": ["password", "acme", "qwerty", "2024"],
+    "max_age": "1y",
+    "tags": {"prod": {"min_length": 20, "banned": ["admin"]}},
+}
+ALPHABET = string.ascii_letters + string.digits + "!-_@#"
+
+
+def generate(records):
+    rng = random.Random(42)
+    now = time.time()
+    rows = []
+    for i in range(records):
+        if i % 20 == 0:
+            password = "".join(rng.choices(string.ascii_lowercase, k=8))
+        else:
+            password = "".join(rng.choices(ALPHABET, k=rng.randrange(16, 33)))
+            password += rng.choice("!-_@#") + rng.choice(string.digits) + "Aa"
+        if i % 1000 == 1:
+            password = rows[-1][1]
+        tags = ("prod",) if i % 10 == 0 else ()
+        rows.append(
+            (f"service-{i:08d}", password, now - rng.randrange(120) * 86400, tags)
+        )
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--records", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    policy = Policy.from_dict(POLICY)
+    print(f"medians of {args.runs} runs; backends: {', '.join(available_backends())}")
+    for records in args.records:
+        rows = generate(records)
+        print(f"{records:,} records")
+        for backend in available_backends():
+            samples = []
+            for _ in range(args.runs):
+                report = evaluate(policy, rows, backend=backend)
+                samples.append(report.seconds)
+            seconds = statistics.median(samples)
+            print(
+                f"  {backend:6} {seconds:6.2f} s | "
+                f"{records / seconds / 1e6:5.2f} M passwords/s | "
+                f"{len(report.violations):,} violations"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Verify benchmark: authenticates every record of a large vault.
+
+    python benchmarks/bench_verify.py [--records N] [--workers N ...]
+
+Builds a vault of N AES-256-GCM records and runs verify_vault() with each
+requested worker count (default: 1 and one per CPU).
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from pyvault.crypto import CryptoManager
+from pyvault.storage import VaultStorage
+from pyvault.verify import verify_vault
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--records", type=int, default=1_000_000)
+    parser.add_argument("--workers", type=int, nargs="*")
+    args = parser.parse_args()
+    worker_counts = args.workers or sorted({1, os.cpu_count() or 1})
+
+    crypto = CryptoManager()
+    key = os.urandom(crypto.key_size)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "vault.db")
+        storage = VaultStorage(db_path)
+        start = time.perf_counter()
+        with storage.transaction(write=True):
+            storage.conn.executemany(
+                "INSERT INTO credentials (service, username, password_blob) "
+                "VALUES (?, ?, ?)",
+                (
+                    (f"service-{i:07d}", "user", crypto.encrypt(f"password-{i}", key))
+                    for i in range(args.records)
+                ),
+            )
+        print(f"Created {args.records:,} records in {time.perf_counter() - start:.1f}s")
+
+        for workers in worker_counts:
+            report = verify_vault(db_path, storage.conn, key, workers=workers)
+            print(
+                f"{workers:>3} worker(s): {report.seconds:.1f}s "
+                f"({report.throughput:,.0f} records/s), {len(report.problems)} damaged"
+            )
+        storage.close()
+
+
+if __name__ == "__main__":
+    main()
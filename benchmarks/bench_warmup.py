@@ -0,0 +1,115 @@
+"""
+Warm-up benchmark: time from the Master Password prompt to the command's end.
+
+    python benchmarks/bench_warmup.py [--records N] [--think S] [--runs R]
+
+Builds a vault of N records, then runs `pyvault get` and `pyvault list` in
+fresh processes, each with a scripted prompt answered after S seconds of
+"typing", with the background warm-up on and off (PYVAULT_WARMUP=0). It
+reports the median time from the answer to the command's end, split into the
+key derivation (which has to wait for the password) and everything else.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from pyvault.session import VaultSession
+
+COMMANDS = {
+    "get": ["get", "service-00000042"],
+    "list": ["list", "--format", "plain", "--no-pager"],
+    "list --limit 50": ["list", "--format", "plain", "--no-pager", "--limit", "50"],
+}
+
+# Runs one command in this (fresh) process and prints the seconds from the
+# prompt's answer to the command's end, and those spent deriving the key
+CHILD = """
+import sys, time
+from unittest.mock import patch
+from pyvault import main
+from pyvault.crypto import CryptoManager
+
+answered = []
+kdf = []
+derive_key = CryptoManager.derive_key
+
+def timed_derive_key(self, *args):
+    start = time.perf_counter()
+    try:
+        return derive_key(self, *args)
+    finally:
+        kdf.append(time.perf_counter() - start)
+
+class Prompt:
+    def ask(self):
+        time.sleep(float(sys.argv[1]))
+        answered.append(time.perf_counter())
+        return "master"
+
+with patch.object(main.questionary, "password", return_value=Prompt()), patch.object(
+    main.SecurityProtections, "check_input_speed", return_value=True
+), patch.object(CryptoManager, "derive_key", timed_derive_key):
+    main.cli.main(args=sys.argv[2:], standalone_mode=False)
+print(time.perf_counter() - answered[0], sum(kdf), file=sys.stderr)
+"""
+
+
+def build(path, records):
+    with VaultSession.open(path) as session:
+        session.initialize("master")
+        blob = session.encrypt("correct horse battery staple")
+        with session.transaction(write=True):
+            session.storage.conn.executemany(
+                "INSERT INTO credentials (service, username, password_blob) "
+                "VALUES (?, ?, ?)",
+                ((f"service-{i:08d}", f"user{i}", blob) for i in range(records)),
+            )
+
+
+def run(directory, args, think, warmup):
+    env = dict(os.environ, PYVAULT_WARMUP="1" if warmup else "0")
+    result = subprocess.run(
+        [sys.executable, "-c", CHILD, str(think), *args],
+        cwd=directory,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        check=True,
+    )
+    total, kdf = map(float, result.stderr.strip().splitlines()[-1].split())
+    return total, kdf
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--records", type=int, default=20_000)
+    parser.add_argument("--think", type=float, default=1.0)
+    parser.add_argument("--runs", type=int, default=9)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        build(os.path.join(tmp, "vault.db"), args.records)
+        print(
+            f"{args.records:,} records, prompt answered after {args.think:.1f} s "
+            f"(medians of {args.runs} runs, ms)"
+        )
+        for name, command in COMMANDS.items():
+            for warmup in (False, True):
+                runs = [run(tmp, command, args.think, warmup) for _ in range(args.runs)]
+                total = statistics.median(t for t, _ in runs)
+                kdf = statistics.median(k for _, k in runs)
+                rest = statistics.median(t - k for t, k in runs)
+                print(
+                    f"  {name:16} warm-up {'on ' if warmup else 'off'}: "
+                    f"{total * 1000:6.1f} after the prompt = key derivation "
+                    f"{kdf * 1000:6.1f} + rest {rest * 1000:5.1f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
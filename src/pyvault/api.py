@@ -0,0 +1,319 @@
+"""
+Library access to a PyVault vault, for Python programs that read or write
+secrets without the CLI. Nothing here prompts or prints, and click, rich and
+questionary are never imported.
+
+    from pyvault.api import Vault
+
+    with Vault.open("vault.db", password=os.environ["VAULT_PASSWORD"]) as vault:
+        db = vault.get("db")  # Credential(username=..., password=...) or None
+
+Thread safety: one Vault may be shared by the threads of a process. Database
+access is serialized by an internal lock (one SQLite connection, used by one
+thread at a time); decryption and cache hits run outside it. A Vault must not
+be used across fork(): open one per process. Changes made by other processes
+are seen on the next read that goes to the database; cached entries they
+changed are dropped then, by refresh(), or as soon as the file changes when
+the Vault watches it (see Vault.open(watch=True)).
+"""
+
+import os
+import threading
+from collections import deque
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from pyvault.cache import CacheStats, Credential, SecretCache
+from pyvault.changes import ChangeFeed, VaultWatcher
+from pyvault.session import AuthenticationError, VaultSession
+
+# Rows read per query (and per lock hold) by Vault.iter()
+ITER_PAGE_SIZE = 500
+
+__all__ = ["AuthenticationError", "CacheStats", "Credential", "SecretCache", "Vault"]
+
+
+class Vault:
+    """
+    An unlocked vault. Open it with Vault.open() and close it (or use it as a
+    context manager) when done: closing overwrites the key in memory.
+
+    With cache_size > 0, decrypted credentials read by get() and get_many()
+    are kept in a SecretCache (plaintext in this process's memory, for at most
+    cache_ttl seconds if set). Writes through this Vault invalidate their
+    entries. Writes by other processes drop the entries they changed (and
+    only those, see ChangeFeed) on the next cache miss or refresh(); with
+    watch=True a background thread refreshes as soon as the file changes.
+    prefetch() fills the cache with the services read most often lately.
+
+    Reads are counted (see VaultSession.record_access) and written back in
+    batches, at the latest when the Vault is closed.
+    """
+
+    def __init__(
+        self,
+        session: VaultSession,
+        cache_size: int = 0,
+        cache_ttl: Optional[float] = None,
+    ):
+        self._session = session
+        self._lock = threading.RLock()
+        self.cache = SecretCache(cache_size, cache_ttl) if cache_size else None
+        self._changes = ChangeFeed(session.storage) if cache_size else None
+        self._watcher: Optional[VaultWatcher] = None
+        # Services served from the cache, counted as reads next time the
+        # database lock is held (so cache hits never wait for it)
+        self._cached_reads: deque = deque()
+
+    @classmethod
+    def open(
+        cls,
+        path: Union[str, "os.PathLike[str]"],
+        password: Optional[str] = None,
+        key: Optional[bytes] = None,
+        cache_size: int = 0,
+        cache_ttl: Optional[float] = None,
+        prefetch: int = 0,
+        watch: bool = False,
+    ) -> "Vault":
+        """
+        Unlocks an existing vault with its Master Password, or with the key
+        returned by export_key() (which skips the deliberately slow key
+        derivation). Raises FileNotFoundError if there is no vault at path
+        and AuthenticationError if the password or key is wrong.
+        With a cache, `prefetch` hot services are decrypted into it at once,
+        and `watch` keeps it in step with other processes' writes (inotify on
+        Linux, a stat() poll every second elsewhere).
+        """
+        if (password is None) == (key is None):
+            raise ValueError("Pass exactly one of password or key.")
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"No vault at '{path}'.")
+        session = VaultSession.open(path, check_same_thread=False)
+        try:
+            if password is not None:
+                session.unlock(password)
+            else:
+                session.unlock_with_key(key)
+        except BaseException:
+            session.close()
+            raise
+        vault = cls(session, cache_size, cache_ttl)
+        if prefetch and vault.cache is not None:
+            vault.prefetch(prefetch)
+        if watch and vault.cache is not None:
+            vault._watcher = VaultWatcher(path, vault.refresh).start()
+        return vault
+
+    # --- Lifecycle ---
+
+    def __enter__(self) -> "Vault":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def close(self):
+        """Drops the cache, overwrites the key and closes the database."""
+        # Before taking the lock: the watcher's refresh() may be waiting for it
+        if self._watcher is not None:
+            self._watcher.stop()
+            self._watcher = None
+        with self._lock:
+            if self.cache is not None:
+                self.cache.clear()
+            if self._session is not None:
+                self._record_reads(self._session, [])
+                self._session.close()
+                self._session = None
+
+    @property
+    def closed(self) -> bool:
+        return self._session is None
+
+    def _open_session(self) -> VaultSession:
+        if self._session is None:
+            raise ValueError("The vault is closed.")
+        return self._session
+
+    def _record_reads(self, session: VaultSession, services: List[str]):
+        """Counts reads of services (and pending cache hits); lock held."""
+        while self._cached_reads:
+            services.append(self._cached_reads.popleft())
+        session.storage.record_access(services)
+
+    def _apply_changes(self) -> Optional[List[str]]:
+        """Drops the cached entries changed by other writers; lock held."""
+        changed = self._changes.poll()
+        if changed is None:
+            self.cache.clear()
+        elif changed:
+            self.cache.invalidate(changed)
+        return changed
+
+    def export_key(self) -> bytes:
+        """
+        The vault's derived key, for Vault.open(key=...). Anyone holding it
+        can read the vault: keep it as secret as the Master Password.
+        """
+        with self._lock:
+            return bytes(self._open_session().key)
+
+    # --- Reading ---
+
+    def get(self, service: str) -> Optional[Credential]:
+        """The credential stored for a service, or None."""
+        return self.get_many([service]).get(service)
+
+    def get_many(self, services: Iterable[str]) -> Dict[str, Credential]:
+        """
+        {service: Credential} for the requested services that are stored,
+        read with one query (cached entries are not read again).
+        """
+        services = [*dict.fromkeys(services)]
+        found: Dict[str, Credential] = {}
+        missing = services
+        if self.cache is not None:
+            missing = []
+            for service in services:
+                credential = self.cache.get(service)
+                if credential is None:
+                    missing.append(service)
+                else:
+                    found[service] = credential
+                    self._cached_reads.append(service)
+        if not missing:
+            return found
+
+        generation = 0
+        with self._lock:
+            session = self._open_session()
+            if self.cache is not None:
+                self._apply_changes()
+                generation = self.cache.generation
+            rows = session.storage.get_credentials(missing)
+            self._record_reads(session, [*rows])
+        for service, (username, blob) in rows.items():
+            credential = Credential(username, session.decrypt(blob))
+            found[service] = credential
+            if self.cache is not None:
+                self.cache.put(service, credential, generation)
+        return {service: found[service] for service in services if service in found}
+
+    def prefetch(self, limit: int) -> List[str]:
+        """
+        Decrypts the `limit` services read most often (among those read in
+        the last 30 days) into the cache, without counting them as reads.
+        Returns the services loaded. Needs cache_size > 0.
+        """
+        if self.cache is None:
+            raise ValueError("prefetch() needs a cache (cache_size > 0).")
+        with self._lock:
+            session = self._open_session()
+            self._apply_changes()
+            generation = self.cache.generation
+            rows = session.storage.get_credentials(session.storage.get_hot(limit))
+        hot = [
+            (service, Credential(username, session.decrypt(blob)))
+            for service, (username, blob) in rows.items()
+        ]
+        self.cache.warm(hot, generation)
+        return [service for service, _ in hot]
+
+    def refresh(self) -> Optional[List[str]]:
+        """
+        Drops the cached entries changed in the vault since the last check,
+        by any process; returns their services (None if the whole cache was
+        dropped because the vault went back to an older state).
+        """
+        with self._lock:
+            self._open_session()
+            return self._apply_changes() if self.cache is not None else []
+
+    def change_seq(self) -> int:
+        """The vault's change sequence number, for changes_since()."""
+        with self._lock:
+            return self._open_session().storage.change_seq()
+
+    def changes_since(self, seq: int) -> Tuple[int, Optional[List[str]]]:
+        """
+        (current change_seq, services changed after `seq`), for callers that
+        keep their own caches of secrets. The services are None if the vault
+        is behind `seq`: drop everything then.
+        """
+        with self._lock:
+            return self._open_session().storage.changes_since(seq)
+
+    def cache_stats(self) -> Optional[CacheStats]:
+        """Cache hits and misses so far (None without a cache)."""
+        return self.cache.stats() if self.cache is not None else None
+
+    def iter(self, where: Optional[str] = None) -> Iterator[Tuple[str, Credential]]:
+        """
+        Yields (service, Credential) sorted by service, for every credential
+        or those matching a filter expression (see pyvault.query). Rows are
+        read a page at a time, so other threads are not held up meanwhile.
+        Bypasses the cache.
+        """
+        after = None
+        while True:
+            with self._lock:
+                session = self._open_session()
+                page = session.storage.get_credentials_page(
+                    after, ITER_PAGE_SIZE, where
+                )
+            for service, username, blob in page:
+                yield service, Credential(username, session.decrypt(blob))
+            if len(page) < ITER_PAGE_SIZE:
+                return
+            after = page[-1][0]
+
+    def __contains__(self, service: str) -> bool:
+        return self.get(service) is not None
+
+    # --- Writing ---
+
+    def put(self, service: str, username: str, password: str):
+        """Stores (or replaces) one credential."""
+        self.put_many([(service, username, password)])
+
+    def put_many(
+        self,
+        credentials: Union[Iterable[Tuple[str, str, str]], Dict[str, Tuple[str, str]]],
+    ):
+        """
+        Stores (or replaces) credentials given as (service, username,
+        password) tuples or {service: (username, password)}, in one
+        transaction: either all of them are written or none is.
+        """
+        if isinstance(credentials, dict):
+            credentials = [(s, u, p) for s, (u, p) in credentials.items()]
+        session = self._open_session()
+        # Encrypted before taking the lock, so readers only wait for SQLite
+        rows = [
+            (service, username, session.encrypt(password))
+            for service, username, password in credentials
+        ]
+        with self._lock:
+            session = self._open_session()
+            try:
+                with session.transaction(write=True):
+                    for service, username, blob in rows:
+                        session.storage.add_credential(service, username, blob)
+            finally:
+                if self.cache is not None:
+                    self.cache.invalidate(service for service, _, _ in rows)
+
+    def delete(self, service: str) -> bool:
+        """Deletes a credential; False if it was not stored."""
+        with self._lock:
+            session = self._open_session()
+            try:
+                with session.transaction(write=True):
+                    if not session.exists(service):
+                        return False
+                    session.delete(service)
+                    return True
+            finally:
+                if self.cache is not None:
+                    self.cache.invalidate([service])
@@ -0,0 +1,166 @@
+import json
+import time
+from typing import Dict, Iterable, Iterator
+
+from pyvault.passwords import generate_password
+from pyvault.session import VaultSession
+
+
+class BatchError(Exception):
+    """An operation of the stream could not be executed."""
+
+
+class BatchRunner:
+    """
+    Executes newline-delimited JSON operations against one unlocked session.
+
+    Supported operations (an optional "id" is echoed back in the result):
+      {"op": "add", "service": "...", "username": "...", "password": "..."}
+      {"op": "add", "service": "...", "username": "...", "generate": 24}
+      {"op": "get", "service": "..."}
+      {"op": "rm", "service": "..."}
+      {"op": "list"}
+
+    Operations are grouped into write transactions of `batch_size`; each one
+    runs in its own savepoint so a failing operation never leaves partial work.
+    With atomic=True the whole stream is one transaction, rolled back on the
+    first error. Otherwise the stream stops at the first error (committing what
+    already succeeded) unless continue_on_error is set.
+    """
+
+    def __init__(
+        self,
+        session: VaultSession,
+        batch_size: int = 100,
+        atomic: bool = False,
+        continue_on_error: bool = False,
+    ):
+        if atomic and continue_on_error:
+            raise ValueError("atomic and continue_on_error are mutually exclusive.")
+        self.session = session
+        self.batch_size = batch_size
+        self.atomic = atomic
+        self.continue_on_error = continue_on_error
+        self.stats = {"ok": 0, "failed": 0, "transactions": 0, "seconds": 0.0}
+        self.committed = True
+
+    # --- Operations ---
+
+    def _require(self, operation: Dict, field: str) -> str:
+        value = operation.get(field)
+        if not isinstance(value, str) or not value:
+            raise BatchError(f"Missing or invalid field '{field}'.")
+        return value
+
+    def _execute(self, operation: Dict) -> Dict:
+        op = operation.get("op")
+        if op == "add":
+            service = self._require(operation, "service")
+            username = self._require(operation, "username")
+            result = {}
+            if "generate" in operation:
+                length = operation["generate"]
+                if not isinstance(length, int) or not 4 <= length <= 1024:
+                    raise BatchError("'generate' must be a length between 4 and 1024.")
+                password = generate_password(length)
+                result["password"] = password
+            else:
+                password = self._require(operation, "password")
+            self.session.add(service, username, password)
+            return result
+        if op == "get":
+            service = self._require(operation, "service")
+            credential = self.session.get(service)
+            if credential is None:
+                raise BatchError(f"No credentials found for service '{service}'.")
+            return {"username": credential[0], "password": credential[1]}
+        if op == "rm":
+            service = self._require(operation, "service")
+            if not self.session.exists(service):
+                raise BatchError(f"Service '{service}' not found.")
+            self.session.delete(service)
+            return {}
+        if op == "list":
+            return {"services": [service for service, _ in self.session.list()]}
+        raise BatchError(f"Unknown operation: {op!r}.")
+
+    def _run_one(self, line_no: int, line: str) -> Dict:
+        result = {"line": line_no}
+        try:
+            operation = json.loads(line)
+            if not isinstance(operation, dict):
+                raise BatchError("Each line must be a JSON object.")
+            if "id" in operation:
+                result["id"] = operation["id"]
+            result["op"] = operation.get("op")
+            with self.session.transaction():
+                result.update(self._execute(operation))
+            result["ok"] = True
+            self.stats["ok"] += 1
+        except json.JSONDecodeError as e:
+            result.update(ok=False, error=f"Invalid JSON: {e.msg}")
+            self.stats["failed"] += 1
+        except (BatchError, ValueError) as e:
+            result.update(ok=False, error=str(e))
+            self.stats["failed"] += 1
+        except Exception as e:
+            result.update(ok=False, error=f"{type(e).__name__}: {e}")
+            self.stats["failed"] += 1
+        return result
+
+    # --- Stream execution ---
+
+    def run(self, lines: Iterable[str]) -> Iterator[Dict]:
+        """Executes the stream lazily, yielding one result dict per operation."""
+        started = time.perf_counter()
+        numbered = (
+            (line_no, line.strip())
+            for line_no, line in enumerate(lines, start=1)
+            if line.strip()
+        )
+        try:
+            if self.atomic:
+                yield from self._run_atomic(numbered)
+            else:
+                yield from self._run_batched(numbered)
+        finally:
+            self.stats["seconds"] = time.perf_counter() - started
+
+    def _run_atomic(self, numbered) -> Iterator[Dict]:
+        self.stats["transactions"] = 1
+        try:
+            with self.session.transaction(write=True):
+                for line_no, line in numbered:
+                    result = self._run_one(line_no, line)
+                    yield result
+                    if not result["ok"]:
+                        raise _Abort()
+        except _Abort:
+            self.committed = False
+
+    def _run_batched(self, numbered) -> Iterator[Dict]:
+        # Operations run as soon as their line arrives; the transaction is
+        # committed every `batch_size` operations (or at the end of the stream)
+        numbered = iter(numbered)
+        item = next(numbered, None)
+        while item is not None:
+            self.stats["transactions"] += 1
+            with self.session.transaction(write=True):
+                for _ in range(self.batch_size):
+                    result = self._run_one(*item)
+                    yield result
+                    if not result["ok"] and not self.continue_on_error:
+                        return
+                    item = next(numbered, None)
+                    if item is None:
+                        break
+
+    @property
+    def throughput(self) -> float:
+        """Operations per second over the whole stream."""
+        total = self.stats["ok"] + self.stats["failed"]
+        return total / self.stats["seconds"] if self.stats["seconds"] else 0.0
+
+
+class _Abort(Exception):
+    """Internal: rolls back the atomic transaction."""
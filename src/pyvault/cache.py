@@ -0,0 +1,123 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Iterable, NamedTuple, Optional, Tuple
+
+# Services pre-decrypted at unlock by long-running modes (shell, library)
+DEFAULT_PREFETCH = 20
+# Only services read within this many seconds belong to the hot set
+HOT_WINDOW = 30 * 86400
+
+
+class Credential(NamedTuple):
+    username: str
+    password: str
+
+
+class CacheStats(NamedTuple):
+    hits: int
+    misses: int
+    entries: int
+    max_entries: int
+    prefetched: int
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class SecretCache:
+    """
+    Least-recently-used cache of decrypted credentials, at most `max_entries`
+    of them, each dropped `ttl` seconds after it was stored (None: kept until
+    evicted or invalidated). Thread-safe.
+
+    Every invalidation bumps `generation`. A reader passes the generation it
+    saw before reading the vault to put(), which ignores the value if a write
+    happened in between, so a stale read never lands in the cache.
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        ttl: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1.")
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+        self._entries: "OrderedDict[str, Tuple[Credential, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, service: str) -> Optional[Credential]:
+        with self._lock:
+            entry = self._entries.get(service)
+            if entry is not None and (self.ttl is None or entry[1] > self.clock()):
+                self._entries.move_to_end(service)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[service]
+            self.misses += 1
+            return None
+
+    def put(self, service: str, credential: Credential, generation: int):
+        with self._lock:
+            self._store(service, credential, generation)
+
+    def warm(self, credentials: Iterable[Tuple[str, Credential]], generation: int):
+        """
+        Stores prefetched credentials, hottest first: they go in at the cold
+        end of the LRU order, so they never evict entries read since.
+        """
+        with self._lock:
+            for service, credential in credentials:
+                if len(self._entries) >= self.max_entries:
+                    break
+                if service in self._entries:
+                    continue
+                if self._store(service, credential, generation):
+                    self._entries.move_to_end(service, last=False)
+                    self.prefetched += 1
+
+    def _store(self, service: str, credential: Credential, generation: int) -> bool:
+        if generation != self.generation:
+            return False
+        expires = self.clock() + self.ttl if self.ttl is not None else 0.0
+        self._entries[service] = (credential, expires)
+        self._entries.move_to_end(service)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return True
+
+    def invalidate(self, services: Iterable[str]):
+        with self._lock:
+            self.generation += 1
+            for service in services:
+                self._entries.pop(service, None)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def stats(self) -> CacheStats:
+        """Hit and miss counts since the cache was created, for sizing it."""
+        with self._lock:
+            return CacheStats(
+                self.hits,
+                self.misses,
+                len(self._entries),
+                self.max_entries,
+                self.prefetched,
+            )
@@ -0,0 +1,175 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+from typing import Callable, List, Optional
+
+from pyvault.storage import VaultStorage
+
+# inotify(7) events that mean the vault file or its WAL was written
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+_EVENT = struct.Struct("iIII")
+# Seconds between stat() polls where inotify is not available
+DEFAULT_INTERVAL = 1.0
+# Quiet time after a write before calling back: a commit ends with a few
+# more writes (the last WAL frames, the shared-memory index)
+SETTLE = 0.05
+
+
+class ChangeFeed:
+    """
+    Tells a cache which services changed since it last asked.
+
+    poll() is cheap when nothing happened: it compares the connection's
+    change token (PRAGMA data_version and its own change count) and only
+    reads the changes table when another commit landed. It returns the
+    services changed since the previous poll, or None when the vault went
+    back in time (e.g. restored from a copy) and everything must be dropped.
+    """
+
+    def __init__(self, storage: VaultStorage):
+        self.storage = storage
+        self.token = storage.change_token()
+        self.seq = storage.change_seq()
+
+    def poll(self) -> Optional[List[str]]:
+        token = self.storage.change_token()
+        if token == self.token:
+            return []
+        # Taken before reading, so a commit in between is seen by the next poll
+        self.token = token
+        self.seq, services = self.storage.changes_since(self.seq)
+        return services
+
+
+class VaultWatcher:
+    """
+    Calls `callback` from a background thread shortly after the vault file
+    changes on disk, so a long-running process can refresh its cache
+    before the next read instead of on it. Uses inotify on Linux and
+    compares stat() results every `interval` seconds elsewhere. Changes
+    made through the process's own connection also wake it.
+    """
+
+    def __init__(
+        self,
+        db_path,
+        callback: Callable[[], None],
+        interval: float = DEFAULT_INTERVAL,
+    ):
+        self.db_path = os.path.abspath(db_path)
+        self.callback = callback
+        self.interval = interval
+        self.uses_inotify = False
+        self._names = {
+            os.fsencode(os.path.basename(self.db_path) + suffix)
+            for suffix in ("", "-wal")
+        }
+        self._inotify = None
+        self._last = None
+        self._wake_read, self._wake_write = os.pipe()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "VaultWatcher":
+        self._inotify = _open_inotify(os.path.dirname(self.db_path))
+        self.uses_inotify = self._inotify is not None
+        self._last = self._stat()
+        self._thread = threading.Thread(
+            target=self._run, name="pyvault-watcher", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            os.write(self._wake_write, b"x")
+            self._thread.join()
+            self._thread = None
+        for fd in (self._inotify, self._wake_read, self._wake_write):
+            if fd is not None:
+                os.close(fd)
+        self._inotify = self._wake_read = self._wake_write = None
+
+    def _run(self):
+        if self._inotify is not None:
+            self._watch_inotify()
+        else:
+            self._watch_stat()
+
+    def _watch_inotify(self):
+        while True:
+            ready, _, _ = select.select([self._inotify, self._wake_read], [], [])
+            if self._wake_read in ready:
+                return
+            if not any(name in self._names for name in _read_events(self._inotify)):
+                continue
+            while select.select([self._inotify], [], [], SETTLE)[0]:
+                _read_events(self._inotify)
+            self._notify()
+
+    def _watch_stat(self):
+        while not select.select([self._wake_read], [], [], self.interval)[0]:
+            current = self._stat()
+            if current != self._last:
+                self._last = current
+                self._notify()
+
+    def _stat(self):
+        result = []
+        for suffix in ("", "-wal"):
+            try:
+                info = os.stat(self.db_path + suffix)
+            except FileNotFoundError:
+                result.append(None)
+            else:
+                result.append((info.st_size, info.st_mtime_ns, info.st_ino))
+        return result
+
+    def _notify(self):
+        try:
+            self.callback()
+        except Exception:
+            # A failed refresh is retried on the next change or read
+            pass
+
+
+def _open_inotify(directory) -> Optional[int]:
+    """An inotify descriptor watching `directory`, or None if unavailable."""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6")
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    if libc.inotify_add_watch(fd, os.fsencode(directory), mask) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+def _read_events(fd) -> List[bytes]:
+    """Names of the files in the queued inotify events."""
+    names = []
+    try:
+        data = os.read(fd, 64 * 1024)
+    except BlockingIOError:
+        return names
+    offset = 0
+    while offset < len(data):
+        _, _, _, length = _EVENT.unpack_from(data, offset)
+        offset += _EVENT.size
+        names.append(data[offset : offset + length].rstrip(b"\0"))
+        offset += length
+    return names
@@ -1,15 +1,141 @@
 import os
+import struct
+import time
+from typing import BinaryIO, Dict, Iterable, Iterator, Optional, Tuple
+
 from argon2 import low_level
-from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+# --- Blob format ---
+# Version 1 blobs: MAGIC | FORMAT_VERSION | cipher id | nonce | ciphertext+tag.
+# The 4-byte header is authenticated as associated data. Blobs written before
+# the header existed are plain AES-256-GCM: nonce (12 bytes) | ciphertext+tag.
+MAGIC = b"PV"
+FORMAT_VERSION = 1
+HEADER_SIZE = 4
+# Authentication tag appended by every supported AEAD
+TAG_SIZE = 16
+
+# Cipher ids (stored in every blob, never reuse a number)
+AES_256_GCM = 1
+CHACHA20_POLY1305 = 2
+XCHACHA20_POLY1305 = 3
+# Headerless blobs from before cipher agility
+LEGACY_AES_256_GCM = 0
+
+CIPHER_NAMES = {
+    AES_256_GCM: "aes-256-gcm",
+    CHACHA20_POLY1305: "chacha20-poly1305",
+    XCHACHA20_POLY1305: "xchacha20-poly1305",
+}
+CIPHER_IDS = {name: cipher for cipher, name in CIPHER_NAMES.items()}
+
+# Candidates for the automatic choice at init; XChaCha's longer nonce is only
+# useful for very large vaults and costs an extra HChaCha20 per record
+AUTO_CANDIDATES = (AES_256_GCM, CHACHA20_POLY1305)
+DEFAULT_CIPHER = AES_256_GCM
+
+_SIGMA = struct.unpack("<4I", b"expand 32-byte k")
+
+
+def _hchacha20(key: bytes, nonce: bytes) -> bytes:
+    """
+    HChaCha20 subkey derivation (draft-irtf-cfrg-xchacha, section 2.2).
+
+    The first ChaCha20 keystream block for counter||nonce = nonce is the 20-round
+    state plus the initial state; subtracting the known initial words back out
+    yields the HChaCha20 output words (0-3 and 12-15).
+    """
+    encryptor = Cipher(algorithms.ChaCha20(key, nonce), mode=None).encryptor()
+    block = struct.unpack("<16I", encryptor.update(bytes(64)))
+    initial = _SIGMA + struct.unpack("<4I", nonce)
+    words = [(block[i] - initial[i]) & 0xFFFFFFFF for i in range(4)]
+    words += [(block[12 + i] - initial[4 + i]) & 0xFFFFFFFF for i in range(4)]
+    return struct.pack("<8I", *words)
+
+
+class XChaCha20Poly1305:
+    """XChaCha20-Poly1305 AEAD (24-byte nonce) with the cryptography AEAD API."""
+
+    def __init__(self, key: bytes):
+        self._key = bytes(key)
+
+    def _split(self, nonce: bytes):
+        if len(nonce) != 24:
+            raise ValueError("XChaCha20-Poly1305 requires a 24-byte nonce.")
+        subkey = _hchacha20(self._key, nonce[:16])
+        return ChaCha20Poly1305(subkey), b"\x00" * 4 + nonce[16:]
+
+    def encrypt(self, nonce: bytes, data: bytes, associated_data: Optional[bytes]):
+        aead, inner_nonce = self._split(nonce)
+        return aead.encrypt(inner_nonce, data, associated_data)
+
+    def decrypt(self, nonce: bytes, data: bytes, associated_data: Optional[bytes]):
+        aead, inner_nonce = self._split(nonce)
+        return aead.decrypt(inner_nonce, data, associated_data)
+
+
+# cipher id -> (AEAD class, nonce size)
+_AEADS = {
+    AES_256_GCM: (AESGCM, 12),
+    CHACHA20_POLY1305: (ChaCha20Poly1305, 12),
+    XCHACHA20_POLY1305: (XChaCha20Poly1305, 24),
+}
+
+
+def _header(cipher: int) -> bytes:
+    return MAGIC + bytes((FORMAT_VERSION, cipher))
+
+
+def benchmark_ciphers(
+    ciphers: Iterable[int] = AUTO_CANDIDATES,
+    payload_size: int = 64,
+    duration: float = 0.03,
+) -> Dict[int, float]:
+    """
+    Measures encrypt+decrypt round trips per second for each cipher on this
+    host, with payloads the size of a typical stored password.
+    """
+    crypto = CryptoManager()
+    key = os.urandom(crypto.key_size)
+    payload = "x" * payload_size
+    results = {}
+    for cipher in ciphers:
+        crypto.cipher = cipher
+        crypto.decrypt(crypto.encrypt(payload, key), key)  # warm-up
+        rounds = 0
+        start = time.perf_counter()
+        deadline = start + duration
+        while True:
+            crypto.decrypt(crypto.encrypt(payload, key), key)
+            rounds += 1
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+        results[cipher] = rounds / (now - start)
+    return results
+
+
+def select_cipher(ciphers: Iterable[int] = AUTO_CANDIDATES) -> int:
+    """Picks the fastest cipher on this host (e.g. ChaCha20 on CPUs without AES-NI)."""
+    results = benchmark_ciphers(ciphers)
+    return max(results, key=results.get)
 
 
 class CryptoManager:
     """
     Handles cryptographic operations including key derivation and
     authenticated encryption/decryption.
+
+    New blobs are written with `cipher`; blobs written with any supported
+    cipher (or the original headerless AES-GCM format) can be decrypted.
     """
 
-    def __init__(self):
+    def __init__(self, cipher: int = DEFAULT_CIPHER):
         # AES-256-GCM standard sizes
         self.key_size = 32  # 256 bits
         self.salt_size = 16  # 128 bits
@@ -20,6 +146,8 @@ class CryptoManager:
         self.memory_cost = 65536  # 64MB
         self.parallelism = 4
 
+        self.cipher = cipher
+
     def derive_key(self, master_password: str, salt: bytes) -> bytes:
         """
         Derives a high-entropy 32-byte key from a password using Argon2id.
@@ -34,23 +162,168 @@ class CryptoManager:
             type=low_level.Type.ID,
         )
 
+    def warm_up(self, cipher: Optional[int] = None):
+        """
+        One throwaway encrypt and decrypt with `cipher` (default: the
+        configured one), which pays the backend's one-time setup cost before
+        the first real operation needs it.
+        """
+        aead_class, nonce_size = _AEADS.get(cipher or self.cipher, _AEADS[AES_256_GCM])
+        aead = aead_class(bytes(self.key_size))
+        nonce = bytes(nonce_size)
+        aead.decrypt(nonce, aead.encrypt(nonce, b"", None), None)
+
     def encrypt(self, data: str, key: bytes) -> bytes:
         """
-        Encrypts data using AES-256-GCM.
-        Returns: nonce + ciphertext (tag is included by cryptography lib).
+        Encrypts data with the configured cipher.
+        Returns: header + nonce + ciphertext (tag included by the AEAD).
         """
-        aesgcm = AESGCM(key)
-        nonce = os.urandom(self.nonce_size)
-        ciphertext = aesgcm.encrypt(nonce, data.encode(), None)
-        return nonce + ciphertext
+        if self.cipher not in _AEADS:
+            raise ValueError(f"Unsupported cipher id: {self.cipher!r}")
+        aead_class, nonce_size = _AEADS[self.cipher]
+        header = _header(self.cipher)
+        nonce = os.urandom(nonce_size)
+        ciphertext = aead_class(key).encrypt(nonce, data.encode(), header)
+        return header + nonce + ciphertext
 
     def decrypt(self, encrypted_bundle: bytes, key: bytes) -> str:
         """
-        Decrypts an AES-256-GCM encrypted bundle.
+        Decrypts a bundle written by any supported cipher.
+        Raises InvalidTag if the key is wrong or the bundle was tampered with.
         """
+        cipher = self.cipher_of(encrypted_bundle)
+        if cipher != LEGACY_AES_256_GCM:
+            aead_class, nonce_size = _AEADS[cipher]
+            nonce = encrypted_bundle[HEADER_SIZE : HEADER_SIZE + nonce_size]
+            ciphertext = encrypted_bundle[HEADER_SIZE + nonce_size :]
+            try:
+                return (
+                    aead_class(key)
+                    .decrypt(nonce, ciphertext, encrypted_bundle[:HEADER_SIZE])
+                    .decode()
+                )
+            except InvalidTag:
+                # A legacy nonce can start with bytes that look like a header
+                pass
+        return self._decrypt_legacy(encrypted_bundle, key)
+
+    def _decrypt_legacy(self, encrypted_bundle: bytes, key: bytes) -> str:
         nonce = encrypted_bundle[: self.nonce_size]
         ciphertext = encrypted_bundle[self.nonce_size :]
 
         aesgcm = AESGCM(key)
         decrypted_data = aesgcm.decrypt(nonce, ciphertext, None)
         return decrypted_data.decode()
+
+    @staticmethod
+    def minimum_size(encrypted_bundle: bytes) -> int:
+        """Smallest valid size (header + nonce + tag) for the bundle's format."""
+        cipher = CryptoManager.cipher_of(encrypted_bundle)
+        if cipher == LEGACY_AES_256_GCM:
+            return 12 + TAG_SIZE
+        return HEADER_SIZE + _AEADS[cipher][1] + TAG_SIZE
+
+    @staticmethod
+    def cipher_of(encrypted_bundle: bytes) -> int:
+        """Cipher id announced by a bundle's header (LEGACY_AES_256_GCM if none)."""
+        if (
+            encrypted_bundle[:2] == MAGIC
+            and len(encrypted_bundle) > HEADER_SIZE
+            and encrypted_bundle[2] == FORMAT_VERSION
+            and encrypted_bundle[3] in _AEADS
+        ):
+            return encrypted_bundle[3]
+        return LEGACY_AES_256_GCM
+
+
+# --- Streaming encryption (attachments) ---
+# Data too large to encrypt in one piece is split into chunks (the STREAM
+# construction). Stream header: STREAM_MAGIC | FORMAT_VERSION | cipher id | salt.
+# Every stream is encrypted under its own key, HKDF(vault key, salt), so chunk
+# nonces can simply count: nonce = chunk index | final flag. The header, the
+# index and the flag are also authenticated as associated data, so chunks
+# cannot be reordered, dropped, swapped with another stream's or cut off at
+# the end without detection.
+STREAM_MAGIC = b"PS"
+STREAM_SALT_SIZE = 16
+STREAM_HEADER_SIZE = HEADER_SIZE + STREAM_SALT_SIZE
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+class StreamCipher:
+    """Encrypts and decrypts one chunked stream; see the format notes above."""
+
+    def __init__(self, key: bytes, header: bytes):
+        if (
+            len(header) != STREAM_HEADER_SIZE
+            or header[:2] != STREAM_MAGIC
+            or header[2] != FORMAT_VERSION
+            or header[3] not in _AEADS
+        ):
+            raise ValueError("Unsupported stream header.")
+        aead_class, self._nonce_size = _AEADS[header[3]]
+        subkey = HKDF(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=header[HEADER_SIZE:],
+            info=b"pyvault stream",
+        ).derive(bytes(key))
+        self._aead = aead_class(subkey)
+        self.header = header
+
+    @classmethod
+    def create(cls, key: bytes, cipher: int = DEFAULT_CIPHER) -> "StreamCipher":
+        """A new stream (fresh salt, hence fresh key) for the given cipher."""
+        if cipher not in _AEADS:
+            raise ValueError(f"Unsupported cipher id: {cipher!r}")
+        header = STREAM_MAGIC + bytes((FORMAT_VERSION, cipher))
+        return cls(key, header + os.urandom(STREAM_SALT_SIZE))
+
+    def _nonce_and_aad(self, index: int, final: bool) -> Tuple[bytes, bytes]:
+        nonce = index.to_bytes(self._nonce_size - 1, "big") + bytes((final,))
+        return nonce, self.header + struct.pack(">Q?", index, final)
+
+    def encrypt_chunk(self, index: int, data: bytes, final: bool) -> bytes:
+        nonce, aad = self._nonce_and_aad(index, final)
+        return self._aead.encrypt(nonce, data, aad)
+
+    def decrypt_chunk(self, index: int, data: bytes, final: bool) -> bytes:
+        """Raises InvalidTag if the chunk is not chunk `index` (or not the end)."""
+        nonce, aad = self._nonce_and_aad(index, final)
+        return self._aead.decrypt(nonce, data, aad)
+
+    def encrypt_file(
+        self, source: BinaryIO, chunk_size: int = DEFAULT_CHUNK_SIZE
+    ) -> Iterator[Tuple[int, bytes]]:
+        """
+        Reads source to the end and yields (plaintext size, encrypted chunk).
+        At most two chunks are held at a time; an empty source is one empty
+        final chunk.
+        """
+        index = 0
+        chunk = source.read(chunk_size)
+        while True:
+            following = source.read(chunk_size) if chunk else b""
+            final = not following
+            yield len(chunk), self.encrypt_chunk(index, chunk, final)
+            if final:
+                return
+            chunk = following
+            index += 1
+
+    def decrypt_chunks(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """
+        Decrypts encrypted chunks in order, yielding plaintext as it goes.
+        Raises InvalidTag as soon as a chunk is out of place, altered or
+        missing; data yielded before that point is authentic.
+        """
+        chunks = iter(chunks)
+        current = next(chunks, None)
+        if current is None:
+            raise InvalidTag()
+        index = 0
+        for following in chunks:
+            yield self.decrypt_chunk(index, current, final=False)
+            current = following
+            index += 1
+        yield self.decrypt_chunk(index, current, final=True)
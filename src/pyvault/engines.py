@@ -0,0 +1,127 @@
+import os
+import sqlite3
+from typing import Optional, Tuple
+
+from pyvault.memory import MemoryVaultStorage, is_memory_vault, require_images
+from pyvault.memory import write_atomically
+from pyvault.memory import seal_image, write_lock_path
+from pyvault.recordlog import LogVaultStorage, is_log_vault, log_files, write_log
+from pyvault.storage import VaultStorage
+
+# Storage engines a vault can use:
+# - sqlite: a SQLite file; records are encrypted one by one, names and
+#   usernames are stored in the clear, queries run against the file.
+# - memory: one encrypted file decrypted into memory at unlock (see
+#   pyvault.memory); for small and medium vaults read more than written.
+# - log: decrypted into memory like memory, but the file is an append-only
+#   log of encrypted records (see pyvault.recordlog); for write-heavy vaults.
+# An engine is a VaultStorage subclass: _open_connection(),
+# _configure_connection() and _initialize_db() set up its connection,
+# transaction() brackets every read and write, and the ones that keep the
+# data elsewhere than in a SQLite file also implement unseal(), seal(),
+# image() and change_token().
+ENGINES = {
+    "sqlite": VaultStorage,
+    "memory": MemoryVaultStorage,
+    "log": LogVaultStorage,
+}
+DEFAULT_ENGINE = "sqlite"
+
+
+def detect_engine(db_path) -> str:
+    """Engine of the vault file at db_path (the default if there is none)."""
+    if is_memory_vault(db_path):
+        return "memory"
+    if is_log_vault(db_path):
+        return "log"
+    return DEFAULT_ENGINE
+
+
+def resolve_engine(db_path, engine: Optional[str] = None) -> str:
+    """
+    The engine the file at db_path was written by, or `engine` if there is
+    no file yet (or an empty one).
+    """
+    if engine is None or (os.path.exists(db_path) and os.path.getsize(db_path)):
+        return detect_engine(db_path)
+    return engine
+
+
+def open_storage(db_path, engine: Optional[str] = None, **options) -> VaultStorage:
+    """Opens the vault at db_path with its engine (see resolve_engine)."""
+    return ENGINES[resolve_engine(db_path, engine)](db_path, **options)
+
+
+def check_engine(engine: str):
+    """
+    Raises VaultFileError if this Python cannot run `engine`: the engines
+    that keep the vault in memory load it as a SQLite image (3.11+).
+    """
+    if engine != "sqlite":
+        require_images(f"The {engine} engine")
+
+
+def check_conversion(engine: str):
+    """Raises VaultFileError if this Python cannot convert a vault to `engine`."""
+    check_engine(engine)
+    # The vault is read as a SQLite image, whatever the target
+    require_images("Converting a vault")
+
+
+def convert(db_path, key: bytes, engine: str) -> Tuple[int, int]:
+    """
+    Rewrites the vault at db_path for `engine`, replacing the file in one
+    rename. The caller holds the exclusive vault lock and the vault key.
+    Returns the file size before and after.
+    """
+    check_conversion(engine)
+    before = os.path.getsize(db_path)
+    source = open_storage(db_path)
+    try:
+        source.unseal(key)
+        source.flush_access()
+        image = source.image()
+        if engine != "sqlite":
+            master = source.conn.execute(
+                "SELECT master_salt, master_verifier, cipher FROM config WHERE id = 1"
+            ).fetchone()
+    finally:
+        source.close()
+
+    if engine == "memory":
+        write_atomically(db_path, seal_image(image, key, *master))
+    elif engine == "log":
+        write_log(db_path, image, key, *master)
+    else:
+        _write_sqlite(db_path, image)
+    leftovers = [f"{db_path}-wal", f"{db_path}-shm", write_lock_path(db_path)]
+    if engine != "log":
+        leftovers += log_files(db_path)
+    for path in leftovers:
+        if os.path.exists(path):
+            os.remove(path)
+    return before, os.path.getsize(db_path)
+
+
+def _write_sqlite(db_path, image: bytes):
+    """Writes a SQLite image as a WAL-mode vault file, then renames it in place."""
+    temporary = f"{db_path}.tmp-{os.getpid()}"
+    memory = sqlite3.connect(":memory:")
+    target = sqlite3.connect(temporary, isolation_level=None)
+    try:
+        memory.deserialize(image)
+        memory.backup(target)
+        # As VaultStorage sets up new files (see _configure_connection)
+        target.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        target.execute("VACUUM")
+        target.execute("PRAGMA journal_mode = WAL")
+        target.close()
+        os.chmod(temporary, 0o600)
+        os.replace(temporary, db_path)
+    except BaseException:
+        target.close()
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    finally:
+        memory.close()
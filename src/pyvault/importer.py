@@ -0,0 +1,287 @@
+import csv
+import glob
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional
+
+from pyvault.crypto import CryptoManager
+from pyvault.session import VaultSession
+
+REQUIRED_COLUMNS = ("service", "username", "password")
+
+# Rows travel between stages in chunks: one queue operation (and, with
+# worker processes, one round trip) per chunk rather than per row
+DEFAULT_CHUNK_SIZE = 256
+# Rows written per transaction
+DEFAULT_BATCH_SIZE = 2000
+
+PARSE, ENCRYPT, WRITE = "parse", "encrypt", "write"
+STAGES = (PARSE, ENCRYPT, WRITE)
+
+# End of a stage's input
+_DONE = None
+
+
+class ImportFileError(Exception):
+    """A file could not be imported (missing, unreadable or wrong format)."""
+
+
+def expand_paths(patterns: Iterable[str]) -> List[str]:
+    """
+    Absolute paths for file arguments, expanding '~' and glob patterns
+    (for shells that do not, e.g. on Windows). Duplicates are dropped.
+    """
+    paths = []
+    for pattern in patterns:
+        pattern = os.path.expanduser(pattern)
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        if not matches:
+            raise ImportFileError(f"No file matches '{pattern}'.")
+        for path in matches:
+            path = os.path.abspath(path)
+            if not os.path.isfile(path):
+                raise ImportFileError(f"'{path}' is not a file.")
+            if path not in paths:
+                paths.append(path)
+    return paths
+
+
+def _encrypt_rows(cipher: int, key: bytes, rows):
+    """Encryption stage: (file, service, username, password) -> blob rows."""
+    crypto = CryptoManager(cipher)
+    return [
+        (index, service, username, crypto.encrypt(password, key))
+        for index, service, username, password in rows
+    ]
+
+
+class ImportReport:
+    """Outcome of ImportPipeline.run(), per file and per stage."""
+
+    def __init__(self, paths: List[str]):
+        self.paths = paths
+        self.imported = [0] * len(paths)
+        self.skipped = [0] * len(paths)  # already in the vault
+        self.invalid = [0] * len(paths)  # rows without a service or password
+        self.errors: Dict[str, str] = {}
+        self.rows = dict.fromkeys(STAGES, 0)
+        self.workers = 1
+        self.transactions = 0
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+
+    @property
+    def total_imported(self) -> int:
+        return sum(self.imported)
+
+    @property
+    def total_skipped(self) -> int:
+        return sum(self.skipped)
+
+    def rate(self, stage: str) -> float:
+        """Rows per second through a stage so far."""
+        elapsed = self.seconds or time.perf_counter() - self.started
+        return self.rows[stage] / elapsed if elapsed else 0.0
+
+
+class ImportPipeline:
+    """
+    Imports formatted CSV files (service, username, password) as a pipeline:
+
+      parsers (a thread per file) -> encryption (a pool of `workers`
+      processes, or a thread when workers=1) -> one writer (the calling
+      thread, which owns the SQLite connection)
+
+    Stages are joined by bounded queues, so a fast stage blocks instead of
+    piling up rows: memory stays flat and the import runs at the pace of the
+    slowest stage. The writer commits every `batch_size` rows; services
+    already in the vault (or seen earlier in the import) are skipped. When
+    the same service appears in several files, the first row written wins.
+    """
+
+    def __init__(
+        self,
+        session: VaultSession,
+        workers: Optional[int] = None,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+    ):
+        self.session = session
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        # Two chunks in flight per worker keep every stage busy
+        self.parsed: queue.Queue = queue.Queue(maxsize=2 * self.workers)
+        self.encrypted: queue.Queue = queue.Queue(maxsize=2 * self.workers)
+        self.cancelled = threading.Event()
+        self.lock = threading.Lock()
+
+    # --- Queues (every blocking call gives up once the import is cancelled) ---
+
+    def _put(self, target: queue.Queue, item) -> bool:
+        while not self.cancelled.is_set():
+            try:
+                target.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, source: queue.Queue):
+        while not self.cancelled.is_set():
+            try:
+                return source.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        raise InterruptedError
+
+    # --- Stages ---
+
+    def _parse(self, index: int, path: str, report: ImportReport):
+        try:
+            with open(path, mode="r", encoding="utf-8", newline="") as f:
+                reader = csv.DictReader(f)
+                if not set(REQUIRED_COLUMNS) <= set(reader.fieldnames or ()):
+                    raise ImportFileError(
+                        "Incompatible CSV format. Use 'pyvault formatter' first."
+                    )
+                chunk = []
+                for row in reader:
+                    service, password = row["service"], row["password"]
+                    if not service or not password:
+                        report.invalid[index] += 1
+                        continue
+                    chunk.append((index, service, row["username"] or "", password))
+                    if len(chunk) == self.chunk_size:
+                        if not self._put(self.parsed, chunk):
+                            return
+                        self._count(report, PARSE, len(chunk))
+                        chunk = []
+                if chunk and self._put(self.parsed, chunk):
+                    self._count(report, PARSE, len(chunk))
+        except (OSError, UnicodeDecodeError, csv.Error, ImportFileError) as e:
+            report.errors[path] = str(e)
+
+    def _parse_all(self, report: ImportReport):
+        parsers = [
+            threading.Thread(target=self._parse, args=(index, path, report))
+            for index, path in enumerate(report.paths)
+        ]
+        for parser in parsers:
+            parser.start()
+        for parser in parsers:
+            parser.join()
+        self._put(self.parsed, _DONE)
+
+    def _encrypt(self, report: ImportReport):
+        cipher = self.session.crypto.cipher
+        key = bytes(self.session.key)
+        try:
+            if self.workers == 1:
+                while True:
+                    chunk = self._get(self.parsed)
+                    if chunk is _DONE:
+                        break
+                    self._forward(report, _encrypt_rows(cipher, key, chunk))
+            else:
+                self._encrypt_on_pool(report, cipher, key)
+            self._put(self.encrypted, _DONE)
+        except InterruptedError:
+            pass
+        except BaseException as e:
+            # Handed to the writer, which stops the import
+            self._put(self.encrypted, e)
+
+    def _encrypt_on_pool(self, report: ImportReport, cipher: int, key: bytes):
+        pending: deque = deque()
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            while True:
+                chunk = self._get(self.parsed)
+                if chunk is _DONE:
+                    break
+                pending.append(pool.submit(_encrypt_rows, cipher, key, chunk))
+                # Bounded in-flight work; results leave in submission order
+                if len(pending) >= 2 * self.workers:
+                    self._forward(report, pending.popleft().result())
+            while pending:
+                self._forward(report, pending.popleft().result())
+
+    def _forward(self, report: ImportReport, rows):
+        if self._put(self.encrypted, rows):
+            self._count(report, ENCRYPT, len(rows))
+
+    def _count(self, report: ImportReport, stage: str, rows: int):
+        with self.lock:
+            report.rows[stage] += rows
+
+    def _encrypted_chunks(self):
+        while True:
+            rows = self._get(self.encrypted)
+            if rows is _DONE:
+                return
+            if isinstance(rows, BaseException):
+                raise rows
+            yield rows
+
+    def _write_rows(self, report: ImportReport, rows) -> int:
+        storage = self.session.storage
+        for index, service, username, blob in rows:
+            if storage.get_credential(service):
+                report.skipped[index] += 1
+            else:
+                storage.add_credential(service, username, blob)
+                report.imported[index] += 1
+        self._count(report, WRITE, len(rows))
+        return len(rows)
+
+    def _write(self, report: ImportReport, progress):
+        # Chunks are written as they arrive, in a transaction committed
+        # every batch_size rows: nothing waits in memory for its commit
+        chunks = self._encrypted_chunks()
+        for rows in chunks:
+            with self.session.transaction(write=True):
+                written = self._write_rows(report, rows)
+                while written < self.batch_size:
+                    if progress:
+                        progress(report)
+                    rows = next(chunks, None)
+                    if rows is None:
+                        break
+                    written += self._write_rows(report, rows)
+            report.transactions += 1
+            if progress:
+                progress(report)
+
+    def run(
+        self,
+        paths: List[str],
+        progress: Optional[Callable[[ImportReport], None]] = None,
+    ) -> ImportReport:
+        """
+        Imports the files; `progress(report)` is called from the calling
+        thread as rows reach the writer. A file that cannot be read is listed
+        in report.errors and the others are still imported. Any other error
+        stops the import (batches already committed stay) and is raised.
+        """
+        report = ImportReport(paths)
+        report.workers = self.workers
+        stages = [
+            threading.Thread(target=self._parse_all, args=(report,), daemon=True),
+            threading.Thread(target=self._encrypt, args=(report,), daemon=True),
+        ]
+        for stage in stages:
+            stage.start()
+        try:
+            self._write(report, progress)
+        finally:
+            self.cancelled.set()
+            for stage in stages:
+                stage.join()
+            report.seconds = time.perf_counter() - report.started
+        if progress:
+            progress(report)
+        return report
@@ -0,0 +1,91 @@
+import os
+import time
+from contextlib import contextmanager
+
+try:  # POSIX
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+    import msvcrt
+
+
+class VaultLockedError(Exception):
+    """Raised when a whole-vault lock cannot be acquired in time."""
+
+
+def lock_path_for(db_path) -> str:
+    return f"{db_path}.lock"
+
+
+class VaultLock:
+    """
+    Advisory lock on '<vault>.lock', shared by every process using the vault.
+
+    Regular sessions hold it in shared mode; whole-vault operations (wipe,
+    engine conversions, optimize when it rebuilds the file) take it
+    exclusively, so they wait for running commands to finish and no new
+    command can start while they run. migrate does not: it works in short
+    write transactions and the vault stays usable meanwhile. The file is
+    never removed, so every process contends for the same inode.
+    On Windows only exclusive locks are enforced (msvcrt has no shared mode).
+    """
+
+    def __init__(self, db_path, exclusive: bool = False, timeout: float = 10.0):
+        self.path = lock_path_for(db_path)
+        self.exclusive = exclusive
+        self.timeout = timeout
+        self._fd = None
+
+    def acquire(self):
+        if self._fd is not None:
+            return
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        deadline = time.monotonic() + self.timeout
+        delay = 0.01
+        while True:
+            try:
+                self._try_lock(fd)
+                break
+            except OSError:
+                if time.monotonic() >= deadline:
+                    os.close(fd)
+                    raise VaultLockedError(
+                        "The vault is in use by another PyVault process. Try again later."
+                    )
+                time.sleep(delay)
+                delay = min(delay * 2, 0.25)
+        self._fd = fd
+
+    def _try_lock(self, fd):
+        if fcntl is not None:
+            mode = fcntl.LOCK_EX if self.exclusive else fcntl.LOCK_SH
+            fcntl.flock(fd, mode | fcntl.LOCK_NB)
+        elif self.exclusive:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+
+    def release(self):
+        if self._fd is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            elif self.exclusive:
+                msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+
+@contextmanager
+def exclusive_vault_lock(db_path, timeout: float = 10.0):
+    """Holds the exclusive whole-vault lock for the duration of the block."""
+    with VaultLock(db_path, exclusive=True, timeout=timeout) as lock:
+        yield lock
@@ -1,26 +1,59 @@
 import os
 import time
-import secrets
-import string
+import sys
 import questionary
 import click
 import pyperclip
 import threading
 import json
 import csv
+import textwrap
+import shlex
 import importlib.metadata
+from contextlib import closing, contextmanager, nullcontext
+from cryptography.exceptions import InvalidTag
+from prompt_toolkit.application import create_app_session
+from prompt_toolkit.output import create_output
 from rich.table import Table
 from rich.console import Console
 from rich.panel import Panel
 from rich.align import Align
+from rich.progress import BarColumn, Progress, TextColumn, TimeRemainingColumn
+from rich.markup import escape
 
 # Local imports
-from pyvault.crypto import CryptoManager
+from pyvault.crypto import CIPHER_IDS, CIPHER_NAMES, benchmark_ciphers
+from pyvault.session import AuthenticationError, BulkChangeError, VaultSession
 from pyvault.storage import VaultStorage
+from pyvault.migrations import MigrationError
+from pyvault.maintenance import DEFAULT_STEP_PAGES, database_stats, needs_rebuild
+from pyvault.maintenance import optimize as optimize_vault
+from pyvault.locking import VaultLockedError, exclusive_vault_lock
+from pyvault.engines import DEFAULT_ENGINE, ENGINES, check_conversion, check_engine
+from pyvault.engines import convert, detect_engine
+from pyvault.memory import VaultFileError, write_lock_path
+from pyvault.recordlog import log_files
 from pyvault.protections import SecurityProtections
+from pyvault.similarity import SimilarityDetector
+from pyvault.passwords import generate_password
+from pyvault.policy import DEFAULT_POLICY, Policy, PolicyError, evaluate
+from pyvault.policy import to_json, to_sarif
+from pyvault.query import QueryError, compile_filter, escape_glob, parse_age, renamer
+from pyvault.batch import BatchRunner
+from pyvault.importer import DEFAULT_BATCH_SIZE as DEFAULT_IMPORT_BATCH_SIZE
+from pyvault.importer import STAGES as IMPORT_STAGES
+from pyvault.importer import ImportFileError, ImportPipeline, expand_paths
+from pyvault.cache import DEFAULT_PREFETCH
+from pyvault.shell import DEFAULT_IDLE_TIMEOUT, VaultShell
+from pyvault.sync import SyncError, VaultSync, check_same_vault, newer
+from pyvault.warmup import VaultWarmup
+from pyvault.verify import repair_records, verify_vault
 
 console = Console()
 
+# Vault database, relative to the working directory
+DB_PATH = "vault.db"
+
 # --- UI UTILITIES ---
 
 
@@ -38,6 +71,172 @@ def print_security_error(message="Invalid Master Password. Authorization failed.
     )
 
 
+def print_not_initialized():
+    """Standardized error for commands run before 'pyvault init'."""
+    console.print(
+        Panel(
+            "[bold red]Error:[/bold red] Vault not initialized. Run 'pyvault init' first.",
+            border_style="red",
+            expand=False,
+        )
+    )
+
+
+def unlock_session(
+    prompt="Enter your Master Password:",
+    denied_message=None,
+    db_path=DB_PATH,
+    master_pwd=None,
+    prepare=None,
+):
+    """
+    Asks for the Master Password and returns an unlocked VaultSession.
+    A master_pwd supplied by the caller (non-interactive use) skips the prompt.
+    Returns None, after telling the user why, if the vault is missing,
+    the input looks automated or the password is wrong.
+    Inside 'pyvault shell' the shell's already unlocked session is returned.
+
+    While the prompt is open the vault is opened in the background, and
+    prepare(session), if given, preloads what the command will read (see
+    VaultWarmup). PYVAULT_WARMUP=0 turns this off.
+    """
+    shared = shell_session()
+    if shared is not None:
+        return shared
+
+    if not os.path.exists(db_path):
+        print_not_initialized()
+        return None
+
+    warmup = None
+    if master_pwd is None:
+        if os.environ.get("PYVAULT_WARMUP", "1") != "0":
+            warmup = VaultWarmup(db_path, prepare).start()
+        start_time = time.time()
+        master_pwd = questionary.password(prompt).ask()
+
+        if not master_pwd or not SecurityProtections.check_input_speed(
+            master_pwd, start_time
+        ):
+            if warmup is not None:
+                warmup.cancel()
+            return None
+
+    try:
+        session = warmup.session() if warmup else VaultSession.open(db_path)
+    except (MigrationError, VaultFileError, VaultLockedError) as e:
+        console.print(f"[bold red]Error:[/bold red] {e}")
+        return None
+
+    try:
+        session.unlock(master_pwd)
+    except VaultFileError as e:
+        session.close()
+        console.print(f"[bold red]Error:[/bold red] {e}")
+        return None
+    except AuthenticationError:
+        session.close()
+        if denied_message:
+            print_security_error(denied_message)
+        else:
+            print_security_error()
+        return None
+
+    if os.environ.get("PYVAULT_TIMINGS"):
+        # Printed once the command returns, so the whole session is measured
+        click.get_current_context().call_on_close(
+            lambda: console.print(
+                f"[dim]Session timings: {session.format_timings()}[/dim]"
+            )
+        )
+    return session
+
+
+def shell_session():
+    """The unlocked session of the running 'pyvault shell', if any."""
+    ctx = click.get_current_context(silent=True)
+    session = ctx.find_object(VaultSession) if ctx else None
+    return session if session is not None and session.unlocked else None
+
+
+def format_duration(seconds):
+    """Compact human readable duration (e.g. '850ms', '12.4s', '3m 05s')."""
+    if seconds < 1:
+        return f"{seconds * 1000:.0f}ms"
+    if seconds < 60:
+        return f"{seconds:.1f}s"
+    minutes, secs = divmod(int(seconds), 60)
+    return f"{minutes}m {secs:02d}s"
+
+
+def format_size(size):
+    """Compact human readable size (e.g. '512 B', '3.2 KiB', '14.0 MiB')."""
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024 or unit == "MiB":
+            return f"{size} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+@contextmanager
+def messages_to_stderr():
+    """Sends prompts and messages to stderr while stdout carries file data."""
+    console.stderr = True
+    try:
+        with create_app_session(output=create_output(stdout=sys.stderr)):
+            yield
+    finally:
+        console.stderr = False
+
+
+def parse_where(ctx, param, value):
+    """--where option: checks the filter expression before any prompt."""
+    if value is None:
+        return None
+    try:
+        compile_filter(value)
+    except QueryError as e:
+        raise click.BadParameter(str(e))
+    return value
+
+
+def parse_tags(ctx, param, value):
+    """Tag arguments: listings join tags with commas, so a tag cannot hold one."""
+    for tag_name in value:
+        if not tag_name.strip() or "," in tag_name:
+            raise click.BadParameter(f"'{tag_name}' is not a valid tag name.")
+    return tuple(tag_name.strip() for tag_name in value)
+
+
+def parse_age_option(ctx, param, value):
+    """Age option such as '90d' (units: h, d, w, y), returned in seconds."""
+    if value is None:
+        return None
+    seconds = parse_age(value)
+    if seconds is None or seconds <= 0:
+        raise click.BadParameter(f"'{value}' is not an age (e.g. 36h, 90d, 12w, 1y).")
+    return seconds
+
+
+def format_age(timestamp):
+    """Days since a record change (e.g. '214 days')."""
+    if not timestamp:
+        return "unknown"
+    return f"{int((time.time() - timestamp) // 86400)} days"
+
+
+def parse_policy_option(ctx, param, value):
+    """Policy file option, loaded (see pyvault.policy)."""
+    if value is None:
+        return None
+    try:
+        return Policy.load(value)
+    except PolicyError as e:
+        raise click.BadParameter(str(e))
+
+
+WHERE_HELP = "Only credentials matching a filter, e.g. 'tag:prod and updated<90d'."
+
+
 def show_banner():
     """Displays a professional ASCII banner."""
     banner = """
@@ -114,13 +313,43 @@ def cli(ctx):
 
 
 @cli.command()
-def init():
+@click.option(
+    "--cipher",
+    type=click.Choice(["auto", *CIPHER_IDS]),
+    default="auto",
+    show_default=True,
+    help="Cipher for stored records; 'auto' benchmarks this machine.",
+)
+@click.option(
+    "--engine",
+    type=click.Choice([*ENGINES]),
+    default=DEFAULT_ENGINE,
+    show_default=True,
+    help=(
+        "Storage engine: a SQLite file, one encrypted file served from memory, "
+        "or an encrypted append-only log served from memory."
+    ),
+)
+def init(cipher, engine):
     """Initialize the secure vault and set the Master Password."""
-    db_path = "vault.db"
-    storage = VaultStorage(db_path)
-    crypto = CryptoManager()
-
-    if os.path.exists(db_path) and storage.get_master_salt():
+    db_path = DB_PATH
+    try:
+        check_engine(engine)
+    except VaultFileError as e:
+        console.print(f"[bold red]Error:[/bold red] {e}")
+        return
+    session = VaultSession.open(db_path, engine=engine)
+
+    if not session.is_initialized() and session.storage.engine != engine:
+        # An empty file left by an earlier command: start over with the engine
+        session.close()
+        for path in (db_path, f"{db_path}-wal", f"{db_path}-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+        session = VaultSession.open(db_path, engine=engine)
+
+    if session.is_initialized():
+        session.close()
         console.print(
             Panel(
                 "[bold red]Error:[/bold red] Vault already initialized.",
@@ -133,6 +362,12 @@ def init():
     show_banner()
     console.print("[bold cyan]Starting Vault Initialization...[/bold cyan]\n")
 
+    def abort():
+        # Rimuoviamo il file database se è stato creato per errore
+        session.close()
+        if os.path.exists(db_path):
+            os.remove(db_path)
+
     # 1. Primo inserimento (Nascosto)
     start_time = time.time()
     master_pwd_first = questionary.password(
@@ -141,6 +376,7 @@ def init():
 
     if not master_pwd_first:
         console.print("[red]Password cannot be empty.[/red]")
+        abort()
         return
 
     # 2. Conferma (Nascosto)
@@ -156,21 +392,17 @@ def init():
                 expand=False,
             )
         )
-        # Rimuoviamo il file database se è stato creato per errore
-        if os.path.exists(db_path):
-            os.remove(db_path)
+        abort()
         return
 
     master_pwd = master_pwd_first
 
     # 3. Security Protections (Velocità e Sfida Casuale)
     if not SecurityProtections.check_input_speed(master_pwd, start_time):
-        if os.path.exists(db_path):
-            os.remove(db_path)
+        abort()
         return
     if not SecurityProtections.random_confirmation_challenge():
-        if os.path.exists(db_path):
-            os.remove(db_path)
+        abort()
         return
 
     # 4. Cryptographic Setup
@@ -179,22 +411,23 @@ def init():
     )
 
     try:
-        salt = os.urandom(16)
-        key = crypto.derive_key(master_pwd, salt)
-        verifier_blob = crypto.encrypt("PYVAULT_VERIFIER", key)
-        storage.store_master_data(salt, verifier_blob)
+        with session:
+            session.initialize(
+                master_pwd, cipher=None if cipher == "auto" else CIPHER_IDS[cipher]
+            )
 
         console.print(
             Panel(
-                "[bold green]Success![/bold green] Your vault has been initialized.",
+                "[bold green]Success![/bold green] Your vault has been initialized.\n"
+                f"Cipher: [bold cyan]{CIPHER_NAMES[session.crypto.cipher]}[/bold cyan]\n"
+                f"Engine: [bold cyan]{engine}[/bold cyan]",
                 border_style="green",
                 expand=False,
             )
         )
     except Exception as e:
         console.print(f"[bold red]Critical Error during initialization:[/bold red] {e}")
-        if os.path.exists(db_path):
-            os.remove(db_path)
+        abort()
 
 
 @cli.command(cls=OrderedUsageCommand)
@@ -204,52 +437,39 @@ def init():
 )
 @click.option("--gen", is_flag=True, help="Generate a secure random password.")
 @click.option("--length", default=20, help="Length of the password to generate.")
-def add(service, username, gen, length):
+@click.option(
+    "--tag",
+    "tags",
+    multiple=True,
+    callback=parse_tags,
+    help="Tag the credential (repeatable).",
+)
+@click.option("--folder", help="Put the credential in a folder, e.g. work/aws.")
+def add(service, username, gen, length, tags, folder):
     """Add a new credential to the vault."""
-    db_path = "vault.db"
-    storage = VaultStorage(db_path)
-    crypto = CryptoManager()
-
-    if not os.path.exists(db_path):
-        console.print(
-            Panel(
-                "[bold red]Error:[/bold red] Vault not initialized. Run 'pyvault init' first.",
-                border_style="red",
-                expand=False,
-            )
-        )
-        return
-
-    start_time = time.time()
-    master_pwd = questionary.password("Enter your Master Password:").ask()
-
-    if not master_pwd or not SecurityProtections.check_input_speed(
-        master_pwd, start_time
-    ):
+    session = unlock_session()
+    if session is None:
         return
 
-    try:
-        salt = storage.get_master_salt()
-        verifier_blob = storage.get_verifier()
-        key = crypto.derive_key(master_pwd, salt)
-        crypto.decrypt(verifier_blob, key)
-    except Exception:
-        print_security_error()
-        return
-
-    if gen:
-        alphabet = string.ascii_letters + string.digits + string.punctuation
-        target_password = "".join(secrets.choice(alphabet) for _ in range(length))
-        console.print(f"[bold green]Generated password:[/bold green] {target_password}")
-    else:
-        target_password = questionary.password(f"Enter password for {service}:").ask()
-
-    if target_password:
-        encrypted_blob = crypto.encrypt(target_password, key)
-        storage.add_credential(service, username, encrypted_blob)
-        console.print(
-            f"\n[bold green]✔[/bold green] Credentials for [bold cyan]{service}[/bold cyan] saved successfully!"
-        )
+    with session:
+        if gen:
+            target_password = generate_password(length)
+            console.print(
+                f"[bold green]Generated password:[/bold green] {target_password}"
+            )
+        else:
+            target_password = questionary.password(
+                f"Enter password for {service}:"
+            ).ask()
+
+        if target_password:
+            with session.transaction(write=True):
+                session.add(service, username, target_password)
+                if tags or folder is not None:
+                    session.label(service, add=tags, folder=folder)
+            console.print(
+                f"\n[bold green]✔[/bold green] Credentials for [bold cyan]{service}[/bold cyan] saved successfully!"
+            )
 
 
 def delayed_clipboard_clear(delay):
@@ -261,112 +481,300 @@ def delayed_clipboard_clear(delay):
 @cli.command(cls=OrderedUsageCommand)
 @click.argument("service")
 @click.option("--copy", is_flag=True, help="Copy the password to the clipboard.")
-def get(service, copy):
+@click.option(
+    "--version",
+    type=click.IntRange(min=1),
+    help="Show a previous version (see 'pyvault history').",
+)
+@click.option(
+    "--attachment",
+    "attachment_name",
+    metavar="NAME",
+    help="Write the attached file NAME to stdout instead of showing the password.",
+)
+@click.option(
+    "-o",
+    "--output",
+    type=click.Path(dir_okay=False),
+    help="With --attachment: write the file to this path instead of stdout.",
+)
+def get(service, copy, version, attachment_name, output):
     """Retrieve and decrypt credentials for a specific service."""
-    db_path = "vault.db"
-    storage = VaultStorage(db_path)
-    crypto = CryptoManager()
-
-    if not os.path.exists(db_path):
-        console.print(
-            Panel(
-                "[bold red]Error:[/bold red] Vault not initialized.",
-                border_style="red",
-                expand=False,
-            )
-        )
+    if attachment_name is not None:
+        write_attachment(service, attachment_name, output)
         return
 
-    start_time = time.time()
-    master_pwd = questionary.password("Enter your Master Password:").ask()
-
-    if not master_pwd or not SecurityProtections.check_input_speed(
-        master_pwd, start_time
-    ):
+    # The current version is read while the prompt is open
+    prepare = (lambda session: session.preload([service])) if version is None else None
+    session = unlock_session(prepare=prepare)
+    if session is None:
         return
 
-    try:
-        salt = storage.get_master_salt()
-        verifier_blob = storage.get_verifier()
-        key = crypto.derive_key(master_pwd, salt)
-        crypto.decrypt(verifier_blob, key)
-    except Exception:
-        print_security_error()
-        return
+    with session:
+        try:
+            if version is None:
+                credential = session.get(service)
+            else:
+                credential = session.get_version(service, version)
+        except Exception as e:
+            console.print(
+                f"\n[bold red]Error:[/bold red] Could not decrypt the credential. Details: {e}"
+            )
+            return
+        attachments = session.attachments(service) if credential else []
 
-    credential = storage.get_credential(service)
     if not credential:
+        if version is not None:
+            console.print(
+                f"\n[bold yellow]Version {version} of '{service}' is not in the history.[/bold yellow]"
+            )
+            return
         console.print(
             f"\n[bold yellow]No credentials found for service:[/bold yellow] {service}"
         )
         return
 
-    try:
-        username = credential[0]
-        password_blob = credential[1]
-        decrypted_password = crypto.decrypt(password_blob, key)
-
-        if copy:
-            pyperclip.copy(decrypted_password)
-            console.print(
-                f"\n[bold green]✔[/bold green] Password for [bold cyan]{service}[/bold cyan] copied to clipboard for 30s!"
-            )
-            threading.Thread(
-                target=delayed_clipboard_clear, args=(30,), daemon=True
-            ).start()
-        else:
-            console.print(f"\n[bold green]Credentials for {service}:[/bold green]")
-            console.print(f"Username: [bold cyan]{username}[/bold cyan]")
-            console.print(f"Password: [bold red]{decrypted_password}[/bold red]")
-    except Exception as e:
+    username, decrypted_password = credential
+    if copy:
+        pyperclip.copy(decrypted_password)
         console.print(
-            f"\n[bold red]Error:[/bold red] Could not decrypt the credential. Details: {e}"
+            f"\n[bold green]✔[/bold green] Password for [bold cyan]{service}[/bold cyan] copied to clipboard for 30s!"
         )
+        threading.Thread(
+            target=delayed_clipboard_clear, args=(30,), daemon=True
+        ).start()
+    else:
+        label = service if version is None else f"{service} (version {version})"
+        console.print(f"\n[bold green]Credentials for {label}:[/bold green]")
+        console.print(f"Username: [bold cyan]{username}[/bold cyan]")
+        console.print(f"Password: [bold red]{decrypted_password}[/bold red]")
+    files = ", ".join(f"{name} ({format_size(size)})" for name, size in attachments)
+    if files:
+        console.print(f"Attachments: [bold cyan]{files}[/bold cyan]")
 
 
-@cli.command(cls=OrderedUsageCommand)
-def list():
-    """List all stored services in the vault."""
-    db_path = "vault.db"
-    storage = VaultStorage(db_path)
-    crypto = CryptoManager()
+def write_attachment(service, name, output):
+    """
+    get --attachment: decrypts an attached file chunk by chunk to `output`
+    (created with owner-only permissions) or to stdout, never holding it whole.
+    """
+    to_stdout = output in (None, "-")
+    with messages_to_stderr() if to_stdout else nullcontext():
+        session = unlock_session()
+        if session is None:
+            sys.exit(1)
+
+        with session:
+            if not session.exists(service):
+                console.print(
+                    f"[bold yellow]No credentials found for service:[/bold yellow] {service}"
+                )
+                sys.exit(1)
+            if name not in dict(session.attachments(service)):
+                console.print(
+                    f"[bold yellow]No attachment '{name}' for service:[/bold yellow] {service}"
+                )
+                sys.exit(1)
+
+            if to_stdout:
+                dest = click.get_binary_stream("stdout")
+            else:
+                path = os.path.abspath(os.path.expanduser(output))
+                fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+                dest = os.fdopen(fd, "wb")
+            try:
+                written = session.read_attachment(service, name, dest)
+                dest.flush()
+            except InvalidTag:
+                if not to_stdout:
+                    dest.close()
+                    os.remove(path)
+                console.print(
+                    f"[bold red]Error:[/bold red] Attachment '{name}' is damaged "
+                    "or was tampered with (authentication failed)."
+                )
+                sys.exit(1)
+            finally:
+                if not to_stdout:
+                    dest.close()
 
-    if not os.path.exists(db_path):
+    if not to_stdout:
         console.print(
-            Panel(
-                "[bold red]Error:[/bold red] Vault not initialized.",
-                border_style="red",
-                expand=False,
+            f"[bold green]✔[/bold green] Attachment '{name}' written to "
+            f"[cyan]{path}[/cyan] ({format_size(written)})."
+        )
+
+
+class CatalogPage:
+    """
+    The rows of one 'list' page. Iterates at most `limit` rows of a query
+    made with limit + 1 and remembers where the next page starts (pages
+    sorted by name only: other orders have no --after).
+    """
+
+    def __init__(self, rows, limit, resumable=True):
+        self.rows = rows
+        self.limit = limit
+        self.resumable = resumable
+        self.last = None
+        self.more = False
+
+    def __iter__(self):
+        for count, row in enumerate(self.rows):
+            if count == self.limit:
+                self.more = True
+                return
+            self.last = row[0]
+            yield row
+
+    def next_page_hint(self):
+        if self.more and self.resumable:
+            return f"More results: continue with --after {shlex.quote(self.last)}"
+        if self.more:
+            return f"Only the first {self.limit} shown: raise --limit to see more."
+        return None
+
+
+def catalog_lines(rows, output_format):
+    """
+    'list' output in a streaming format, one line at a time: nothing is laid
+    out or buffered, so the first line is ready as soon as its row is read.
+    """
+    if output_format == "plain":
+        for service, *_ in rows:
+            yield service
+    elif output_format == "tsv":
+        yield "service\tusername\tfolder\ttags"
+        for row in rows:
+            yield "\t".join(tsv_field(value) for value in row)
+    else:
+        records = (
+            json.dumps(
+                {
+                    "service": service,
+                    "username": username,
+                    "folder": folder,
+                    "tags": tags.split(", ") if tags else [],
+                },
+                ensure_ascii=False,
             )
+            for service, username, folder, tags in rows
         )
-        return
+        if output_format == "ndjson":
+            yield from records
+            return
+        # A JSON array: each element is written once the next one is known
+        yield "["
+        previous = None
+        for record in records:
+            if previous is not None:
+                yield f"  {previous},"
+            previous = record
+        if previous is not None:
+            yield f"  {previous}"
+        yield "]"
+
+
+def tsv_field(value):
+    """A TSV cell: tabs, newlines and backslashes escaped, NULL empty."""
+    if value is None:
+        return ""
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
 
-    start_time = time.time()
-    master_pwd = questionary.password("Enter your Master Password:").ask()
 
-    if not master_pwd or not SecurityProtections.check_input_speed(
-        master_pwd, start_time
-    ):
+def write_lines(lines, pager):
+    """Writes lines to stdout, through $PAGER on a terminal unless disabled."""
+    stdout = click.get_text_stream("stdout")
+    if pager is None:
+        pager = stdout.isatty()
+    if pager:
+        click.echo_via_pager(f"{line}\n" for line in lines)
         return
-
     try:
-        salt = storage.get_master_salt()
-        verifier_blob = storage.get_verifier()
-        key = crypto.derive_key(master_pwd, salt)
-        crypto.decrypt(verifier_blob, key)
-    except Exception:
-        print_security_error()
-        return
+        for line in lines:
+            stdout.write(f"{line}\n")
+        stdout.flush()
+    except BrokenPipeError:
+        # The reader went away (e.g. '| head'): stop quietly
+        os.dup2(os.open(os.devnull, os.O_WRONLY), stdout.fileno())
+
+
+LIST_FORMATS = ["table", "plain", "tsv", "json", "ndjson"]
+LIST_ORDERS = ["name", "recent", "frequent"]
+
+
+@cli.command(cls=OrderedUsageCommand)
+@click.option("--where", callback=parse_where, help=WHERE_HELP)
+@click.option(
+    "--limit", type=click.IntRange(min=1), help="Show at most N services (a page)."
+)
+@click.option(
+    "--after", metavar="SERVICE", help="Start after this service (the next page)."
+)
+@click.option(
+    "--format",
+    "output_format",
+    type=click.Choice(LIST_FORMATS),
+    default="table",
+    show_default=True,
+    help="Output format; all but 'table' stream, one record per line.",
+)
+@click.option(
+    "--sort",
+    "order",
+    type=click.Choice(LIST_ORDERS),
+    default="name",
+    show_default=True,
+    help="Order: by name, last used first, or most used first.",
+)
+@click.option(
+    "--pager/--no-pager",
+    default=None,
+    help="Page the output (default: on a terminal, when it does not fit).",
+)
+def list(where, limit, after, output_format, order, pager):
+    """List all stored services in the vault."""
+    if after is not None and order != "name":
+        raise click.UsageError("--after only works with --sort name.")
+    streaming = output_format != "table"
+    # Streamed output goes to stdout alone, so it can be piped
+    query_limit = None if limit is None else limit + 1
+    with messages_to_stderr() if streaming else nullcontext():
+        session = unlock_session(
+            prepare=lambda session: session.preload_catalog(
+                where, after, query_limit, order
+            )
+        )
+        if session is None:
+            return
+
+        with session:
+            rows = session.catalog(where, after, query_limit, order)
+            page = CatalogPage(rows, limit, resumable=order == "name")
+            if streaming:
+                with closing(rows):
+                    write_lines(catalog_lines(page, output_format), pager)
+                hint = page.next_page_hint()
+                if hint:
+                    console.print(f"[dim]{hint}[/dim]")
+                return
+            with closing(rows):
+                credentials = [*page]
 
     try:
-        credentials = storage.get_all_credentials()
         if not credentials:
+            if where or after:
+                message = "No credentials match the filter."
+            else:
+                message = "The vault is currently empty."
             console.print(
-                Panel(
-                    "[yellow]The vault is currently empty.[/yellow]",
-                    title="Info",
-                    expand=False,
-                )
+                Panel(f"[yellow]{message}[/yellow]", title="Info", expand=False)
             )
             return
 
@@ -375,129 +783,378 @@ def list():
         )
         table.add_column("Service", style="cyan", no_wrap=True)
         table.add_column("Username", style="green")
-
-        for cred in credentials:
-            table.add_row(str(cred[0]), str(cred[1]))
-
-        console.print("\n")
-        console.print(table)
+        # Folder and tag columns only once something is labelled
+        labelled = any(folder or tags for _, _, folder, tags in credentials)
+        if labelled:
+            table.add_column("Folder", style="yellow")
+            table.add_column("Tags", style="magenta")
+
+        for service, username, folder, tags in credentials:
+            labels = (folder or "", tags or "") if labelled else ()
+            table.add_row(str(service), str(username), *labels)
+
+        if pager is None:
+            # Title, header and borders take 6 lines
+            pager = console.is_terminal and len(credentials) + 6 > console.height
+        with console.pager(styles=True) if pager else nullcontext():
+            console.print("\n")
+            console.print(table)
+        hint = page.next_page_hint()
+        if hint:
+            console.print(f"[dim]{hint}[/dim]")
     except Exception as e:
         console.print(f"[bold red]Developer Error:[/bold red] {e}")
 
 
-@cli.command(cls=OrderedUsageCommand)
-@click.argument("service")
-def rm(service):
-    """Delete a stored service from the vault."""
-    db_path = "vault.db"
-    storage = VaultStorage(db_path)
-    crypto = CryptoManager()
+# Rows shown in the preview of a bulk change
+PREVIEW_ROWS = 10
 
-    if not os.path.exists(db_path):
-        console.print(
-            Panel(
-                "[bold red]Error:[/bold red] Vault not initialized.",
-                border_style="red",
-                expand=False,
-            )
+
+def print_preview(title, columns, rows):
+    """Table of the first PREVIEW_ROWS rows a bulk change touches, and a count."""
+    table = Table(title=f"{title} ({len(rows)})", border_style="yellow")
+    for column in columns:
+        table.add_column(column, style="cyan", no_wrap=True)
+    for row in rows[:PREVIEW_ROWS]:
+        table.add_row(*map(escape, row))
+    console.print(table)
+    if len(rows) > PREVIEW_ROWS:
+        console.print(f"[dim]... and {len(rows) - PREVIEW_ROWS} more[/dim]")
+
+
+def print_bulk_result(message, seconds):
+    console.print(
+        Panel(
+            f"[bold green]✔ {message}[/bold green] in one transaction "
+            f"({format_duration(seconds)}).",
+            border_style="green",
+            expand=False,
         )
-        return
+    )
 
-    start_time = time.time()
-    master_pwd = questionary.password("Enter your Master Password:").ask()
 
-    if not master_pwd or not SecurityProtections.check_input_speed(
-        master_pwd, start_time
-    ):
-        return
+LITERAL_HELP = "Match the name exactly, wildcards included."
 
-    try:
-        salt = storage.get_master_salt()
-        verifier_blob = storage.get_verifier()
-        key = crypto.derive_key(master_pwd, salt)
-        crypto.decrypt(verifier_blob, key)
-    except Exception:
-        print_security_error()
+
+@cli.command(cls=OrderedUsageCommand)
+@click.argument("service")
+@click.option("--where", callback=parse_where, help=WHERE_HELP)
+@click.option("--dry-run", is_flag=True, help="Only list what would be deleted.")
+@click.option("--literal", is_flag=True, help=LITERAL_HELP)
+def rm(service, where, dry_run, literal):
+    """
+    Delete a stored service from the vault.
+    SERVICE may be a pattern ('cluster-a/*'): every matching credential
+    (narrowed down by --where) is deleted after one confirmation. The name
+    of a stored service always matches only that service.
+    """
+    session = unlock_session()
+    if session is None:
         return
 
-    credential = storage.get_credential(service)
-    if not credential:
-        console.print(f"\n[bold yellow]Service '{service}' not found.[/bold yellow]")
+    with session:
+        pattern = session.name_pattern(service, literal)
+        if pattern == escape_glob(service) and where is None and not dry_run:
+            rm_one(session, service)
+        else:
+            rm_matching(session, pattern, where, dry_run)
+
+
+def rm_one(session, service):
+    if not session.exists(service):
+        console.print(
+            f"\n[bold yellow]Service '{escape(service)}' not found.[/bold yellow]"
+        )
         return
 
-    if questionary.confirm(
+    if not questionary.confirm(
         f"Are you sure you want to PERMANENTLY delete '{service}'?"
     ).ask():
-        try:
-            storage.delete_credential(service)
-            console.print(
-                Panel(
-                    f"[bold green]✔ Success:[/bold green] '{service}' has been removed.",
-                    border_style="green",
-                    expand=False,
-                )
-            )
-        except Exception as e:
-            console.print(f"[bold red]Error during deletion:[/bold red] {e}")
-
-
-@cli.command(cls=OrderedUsageCommand)
-def audit():
-    """Scan the vault for weak or reused passwords."""
-    db_path = "vault.db"
-    storage = VaultStorage(db_path)
-    crypto = CryptoManager()
+        console.print("[green]Deletion cancelled.[/green]")
+        return
 
-    if not os.path.exists(db_path):
+    try:
+        session.delete(service)
         console.print(
             Panel(
-                "[bold red]Error:[/bold red] Vault not initialized.",
-                border_style="red",
+                f"[bold green]✔ Success:[/bold green] '{escape(service)}' has been "
+                "removed.",
+                border_style="green",
                 expand=False,
             )
         )
-        return
+    except Exception as e:
+        console.print(f"[bold red]Error during deletion:[/bold red] {e}")
 
-    start_time = time.time()
-    master_pwd = questionary.password("Enter Master Password:").ask()
 
-    if not master_pwd or not SecurityProtections.check_input_speed(
-        master_pwd, start_time
-    ):
+def rm_matching(session, pattern, where, dry_run):
+    matches = session.matching(pattern, where)
+    if not matches:
+        console.print("[bold yellow]No credentials match.[/bold yellow]")
+        return
+    print_preview("Credentials to delete", ("Service", "Username"), matches)
+    if dry_run:
+        return
+    if not questionary.confirm(
+        f"PERMANENTLY delete these {len(matches)} credential(s), with their "
+        "history and attachments?"
+    ).ask():
+        console.print("[green]Deletion cancelled.[/green]")
         return
 
+    start = time.perf_counter()
     try:
-        salt = storage.get_master_salt()
-        verifier_blob = storage.get_verifier()
-        key = crypto.derive_key(master_pwd, salt)
-        crypto.decrypt(verifier_blob, key)
-    except Exception:
-        print_security_error()
+        deleted = session.delete_matching(pattern, where)
+    except Exception as e:
+        console.print(f"[bold red]Deletion failed, nothing changed:[/bold red] {e}")
         return
+    print_bulk_result(
+        f"{len(deleted)} credential(s) deleted", time.perf_counter() - start
+    )
 
-    try:
-        items = storage.get_full_inventory()
-        if not items:
-            console.print("[yellow]Vault is empty. Nothing to audit.[/yellow]")
-            return
 
-        total_count = len(items)
-        weak_passwords = []
-        passwords_map = {}
+@cli.command(cls=MultiArgUsageCommand)
+@click.argument("source")
+@click.argument("target")
+@click.option("--where", callback=parse_where, help=WHERE_HELP)
+@click.option("--dry-run", is_flag=True, help="Only list the new names.")
+@click.option("--literal", is_flag=True, help=LITERAL_HELP)
+def mv(source, target, where, dry_run, literal):
+    """
+    Rename a service, or every service matching a pattern.
+    Each * or ? in TARGET takes the text the same wildcard matched in
+    SOURCE: 'pyvault mv "prod-*" "legacy/prod-*"'. History, tags, folder and
+    attachments follow the credential. The name of a stored service always
+    matches only that service, and TARGET is then taken as it is.
+    """
+    session = unlock_session()
+    if session is None:
+        return
 
-        with console.status("[bold green]Analyzing credentials..."):
-            for service, username, blob in items:
-                raw_pwd = crypto.decrypt(blob, key)
-                if len(raw_pwd) < 12:
-                    weak_passwords.append(service)
-                if raw_pwd not in passwords_map:
+    with session:
+        pattern = session.name_pattern(source, literal)
+        if pattern == escape_glob(source):
+            target = escape_glob(target)
+        try:
+            renamer(pattern, target)
+        except QueryError as e:
+            raise click.BadParameter(str(e), param_hint="TARGET")
+        try:
+            plan = session.rename_plan(pattern, target, where)
+        except BulkChangeError as e:
+            console.print(f"[bold red]Rename refused:[/bold red] {e}")
+            return
+        if not plan:
+            console.print("[bold yellow]No credentials to rename.[/bold yellow]")
+            return
+        print_preview("Credentials to rename", ("Service", "New name"), plan)
+        if dry_run:
+            return
+        if not questionary.confirm(f"Rename these {len(plan)} credential(s)?").ask():
+            console.print("[green]Rename cancelled.[/green]")
+            return
+
+        start = time.perf_counter()
+        try:
+            renamed = session.rename_matching(pattern, target, where)
+        except Exception as e:
+            console.print(f"[bold red]Rename failed, nothing changed:[/bold red] {e}")
+            return
+    print_bulk_result(
+        f"{len(renamed)} credential(s) renamed", time.perf_counter() - start
+    )
+
+
+@cli.command(name="set-username", cls=MultiArgUsageCommand)
+@click.argument("pattern")
+@click.argument("username")
+@click.option("--where", callback=parse_where, help=WHERE_HELP)
+@click.option("--dry-run", is_flag=True, help="Only list what would change.")
+@click.option("--literal", is_flag=True, help=LITERAL_HELP)
+def set_username(pattern, username, where, dry_run, literal):
+    """
+    Change the username of a service, or of every service matching a pattern.
+    Each credential gets a new version; the previous one stays in the history.
+    """
+    session = unlock_session()
+    if session is None:
+        return
+
+    with session:
+        pattern = session.name_pattern(pattern, literal)
+        changes = [
+            (service, current, username)
+            for service, current in session.matching(pattern, where)
+            if current != username
+        ]
+        if not changes:
+            console.print("[bold yellow]No usernames to change.[/bold yellow]")
+            return
+        print_preview(
+            "Usernames to change", ("Service", "Username", "New username"), changes
+        )
+        if dry_run:
+            return
+        if not questionary.confirm(
+            f"Set the username of these {len(changes)} credential(s) to '{username}'?"
+        ).ask():
+            console.print("[green]Change cancelled.[/green]")
+            return
+
+        start = time.perf_counter()
+        try:
+            changed = session.set_username_matching(pattern, username, where)
+        except Exception as e:
+            console.print(f"[bold red]Change failed, nothing changed:[/bold red] {e}")
+            return
+    print_bulk_result(
+        f"{len(changed)} username(s) changed", time.perf_counter() - start
+    )
+
+
+def print_policy_report(report, output_format):
+    """Policy audit results as a table, JSON or SARIF (see pyvault.policy)."""
+    if output_format == "json":
+        click.echo(json.dumps(to_json(report), indent=2))
+        return
+    if output_format == "sarif":
+        click.echo(json.dumps(to_sarif(report, get_version()), indent=2))
+        return
+
+    console.print(
+        Panel(
+            f"[bold]Security Audit Report[/bold]\n"
+            f"Total Credentials Scanned: {report.scanned}",
+            expand=False,
+        )
+    )
+    if not report.violations:
+        console.print("[bold green]✔ Every password meets the policy.[/bold green]")
+    else:
+        table = Table(title="Policy Violations", border_style="red")
+        table.add_column("Service", style="bold red")
+        table.add_column("Rule")
+        table.add_column("Detail", style="dim")
+        for violation in report.violations:
+            table.add_row(*violation)
+        console.print(table)
+        counts = ", ".join(f"{n} {rule}" for rule, n in report.counts().items())
+        console.print(
+            f"[bold red]{len(report.violations)} violation(s):[/bold red] {counts}"
+        )
+    console.print(
+        f"[dim]Checked in {format_duration(report.seconds)} "
+        f"({report.backend} backend).[/dim]"
+    )
+
+
+@cli.command(cls=OrderedUsageCommand)
+@click.option(
+    "--similarity-threshold",
+    type=click.FloatRange(0.0, 1.0, min_open=True),
+    default=0.6,
+    show_default=True,
+    help=(
+        "Minimum similarity (0-1) for two passwords to be grouped; passwords "
+        "with the same pattern are grouped regardless."
+    ),
+)
+@click.option(
+    "--no-similarity", is_flag=True, help="Skip near-duplicate password detection."
+)
+@click.option("--where", callback=parse_where, help=WHERE_HELP)
+@click.option(
+    "--stale-after",
+    "stale_after",
+    default="90d",
+    show_default=True,
+    metavar="AGE",
+    callback=parse_age_option,
+    help="Flag passwords not changed for this long.",
+)
+@click.option(
+    "--policy",
+    metavar="FILE",
+    callback=parse_policy_option,
+    help="Check against a TOML or JSON policy file; exit 1 on violations.",
+)
+@click.option(
+    "--format",
+    "output_format",
+    type=click.Choice(["table", "json", "sarif"]),
+    default="table",
+    show_default=True,
+    help="Report format; json and sarif apply the policy (default: built-in).",
+)
+@click.option(
+    "--password-env",
+    metavar="NAME",
+    help="Read the Master Password from this environment variable.",
+)
+def audit(
+    similarity_threshold,
+    no_similarity,
+    where,
+    stale_after,
+    policy,
+    output_format,
+    password_env,
+):
+    """Scan the vault for weak, reused or near-identical passwords."""
+    master_pwd = None
+    if password_env:
+        master_pwd = os.environ.get(password_env)
+        if not master_pwd:
+            raise click.UsageError(f"Environment variable {password_env} is not set.")
+    session = unlock_session("Enter Master Password:", master_pwd=master_pwd)
+    if session is None:
+        if policy is not None or output_format != "table":
+            sys.exit(1)
+        return
+
+    if policy is not None or output_format != "table":
+        with session:
+            report = evaluate(policy or DEFAULT_POLICY, session.policy_inventory(where))
+        print_policy_report(report, output_format)
+        if report.violations and policy is not None:
+            sys.exit(1)
+        return
+
+    try:
+        total_count = 0
+        weak_passwords = []
+        passwords_map = {}
+
+        with session, console.status("[bold green]Analyzing credentials..."):
+            for service, username, raw_pwd in session.inventory(where):
+                total_count += 1
+                if len(raw_pwd) < 12:
+                    weak_passwords.append(service)
+                if raw_pwd not in passwords_map:
                     passwords_map[raw_pwd] = []
                 passwords_map[raw_pwd].append(service)
+            # Read from the updated_at index, no decryption needed
+            stale = session.stale(stale_after, where)
+
+        if not total_count:
+            if where:
+                console.print("[yellow]No credentials match the filter.[/yellow]")
+                return
+            console.print("[yellow]Vault is empty. Nothing to audit.[/yellow]")
+            return
 
         reused_groups = {
             pwd: svcs for pwd, svcs in passwords_map.items() if len(svcs) > 1
         }
 
+        similar_clusters = []
+        if not no_similarity:
+            with console.status("[bold green]Looking for similar passwords..."):
+                detector = SimilarityDetector(threshold=similarity_threshold)
+                similar_clusters = detector.find_clusters(
+                    (svc, pwd) for pwd, svcs in passwords_map.items() for svc in svcs
+                )
+
         console.print(
             Panel(
                 f"[bold]Security Audit Report[/bold]\nTotal Credentials Scanned: {total_count}",
@@ -514,6 +1171,25 @@ def audit():
         else:
             console.print("[bold green]✔ No weak passwords found.[/bold green]")
 
+        stale_days = f"{stale_after / 86400:g} days"
+        if stale:
+            stale_table = Table(title="Stale Passwords", border_style="yellow")
+            stale_table.add_column("Service", style="bold yellow")
+            stale_table.add_column("Last changed")
+            for service, _, updated_at, _ in stale:
+                stale_table.add_row(service, format_timestamp(updated_at))
+            console.print(stale_table)
+            command = f"pyvault rotate --older-than {stale_after / 86400:g}d"
+            if where:
+                command += f" --where {shlex.quote(where)}"
+            console.print(
+                f"[dim]Not changed for {stale_days}. Rotate them with: {command}[/dim]"
+            )
+        else:
+            console.print(
+                f"[bold green]✔ No passwords older than {stale_days}.[/bold green]"
+            )
+
         if reused_groups:
             reuse_table = Table(title="Password Reuse Detected", border_style="yellow")
             reuse_table.add_column("Reused Services", style="bold yellow")
@@ -523,6 +1199,18 @@ def audit():
         else:
             console.print("[bold green]✔ No password reuse detected.[/bold green]")
 
+        if similar_clusters:
+            similar_table = Table(
+                title="Similar Passwords Detected", border_style="yellow"
+            )
+            similar_table.add_column("Similar Services", style="bold yellow")
+            similar_table.add_column("Match", style="dim")
+            for cluster in similar_clusters:
+                similar_table.add_row(", ".join(cluster["services"]), cluster["match"])
+            console.print(similar_table)
+        elif not no_similarity:
+            console.print("[bold green]✔ No similar passwords detected.[/bold green]")
+
     except Exception as e:
         console.print(f"[bold red]Audit Error:[/bold red] {e}")
 
@@ -530,7 +1218,7 @@ def audit():
 @cli.command(cls=OrderedUsageCommand)
 def wipe():
     """PERMANENTLY destroy the vault and all stored data."""
-    db_path = "vault.db"
+    db_path = DB_PATH
 
     if not os.path.exists(db_path):
         console.print(
@@ -558,39 +1246,34 @@ def wipe():
         return
 
     # 2. Security Challenge (Master Password)
-    storage = VaultStorage(db_path)
-    crypto = CryptoManager()
-
-    start_time = time.time()
-    master_pwd = questionary.password(
-        "Enter Master Password to authorize DESTRUCTION:"
-    ).ask()
-
-    if not master_pwd or not SecurityProtections.check_input_speed(
-        master_pwd, start_time
-    ):
-        return
-
     # --- GUARDIA: Verifica della Master Password ---
-    try:
-        salt = storage.get_master_salt()
-        verifier_blob = storage.get_verifier()
-        key = crypto.derive_key(master_pwd, salt)
-        crypto.decrypt(verifier_blob, key)
-    except Exception:
-        print_security_error(
-            "Authorization failed. Wipe cancelled for security reasons."
-        )
+    session = unlock_session(
+        "Enter Master Password to authorize DESTRUCTION:",
+        denied_message="Authorization failed. Wipe cancelled for security reasons.",
+    )
+    if session is None:
         return
+    # The file is about to be removed: release the connection first
+    session.close()
 
     # 3. Final Random Challenge (Human check)
     if not SecurityProtections.random_confirmation_challenge(length=6):
         return
 
-    # 4. Destruction
+    # 4. Destruction (waits for other pyvault processes to release the vault)
     try:
-        # Chiudiamo eventuali connessioni attive se necessario (sqlite3 lo gestisce, ma rm è brutale)
-        os.remove(db_path)
+        with exclusive_vault_lock(db_path):
+            for path in (
+                db_path,
+                f"{db_path}-wal",
+                f"{db_path}-shm",
+                write_lock_path(db_path),
+                *log_files(db_path),
+            ):
+                if os.path.exists(path):
+                    os.remove(path)
+            # vault.db.lock stays: a process waiting on it and one starting
+            # after the wipe must contend for the same file
         console.print("\n")
         console.print(
             Panel(
@@ -599,10 +1282,335 @@ def wipe():
                 border_style="white",
             )
         )
+    except VaultLockedError as e:
+        console.print(f"[bold yellow]Wipe postponed:[/bold yellow] {e}")
     except Exception as e:
         console.print(f"[bold red]Error during destruction:[/bold red] {e}")
 
 
+# --- HISTORY COMMANDS ---
+def parse_limit(ctx, param, value):
+    """Retention limit option: a positive number, or 'all' for no limit."""
+    if value is None or value == "all":
+        return value
+    try:
+        number = float(value) if param.name == "keep_days" else int(value)
+    except ValueError:
+        number = 0
+    if number <= 0:
+        raise click.BadParameter("expected a positive number or 'all'.")
+    return number
+
+
+def format_timestamp(timestamp):
+    """Local date and time of a record change (0: written before versioning)."""
+    if not timestamp:
+        return "before versioning"
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(timestamp))
+
+
+@cli.command(cls=OrderedUsageCommand)
+@click.argument("service", required=False)
+@click.option(
+    "--keep",
+    metavar="N|all",
+    callback=parse_limit,
+    help="Set how many previous versions are kept per service.",
+)
+@click.option(
+    "--keep-days",
+    metavar="DAYS|all",
+    callback=parse_limit,
+    help="Set for how many days a replaced version is kept.",
+)
+def history(service, keep, keep_days):
+    """
+    Show the previous versions of a credential.\n
+    Without SERVICE, show the retention policy. --keep and --keep-days change
+    it; versions outside the new limits are pruned right away.
+    """
+    session = unlock_session()
+    if session is None:
+        return
+
+    with session:
+        storage = session.storage
+        if keep is not None or keep_days is not None:
+            current_keep, current_days = storage.get_history_policy()
+            storage.set_history_policy(
+                current_keep if keep is None else (None if keep == "all" else keep),
+                current_days
+                if keep_days is None
+                else (None if keep_days == "all" else keep_days),
+            )
+            with console.status("[bold green]Pruning history..."):
+                removed = storage.prune_history()
+            console.print(
+                f"[bold green]✔[/bold green] Retention policy updated, "
+                f"{removed} old version(s) pruned."
+            )
+
+        if service is None:
+            versions, days = storage.get_history_policy()
+            console.print(
+                "Previous versions kept per service: "
+                f"[bold cyan]{'all' if versions is None else versions}[/bold cyan]"
+            )
+            console.print(
+                "Replaced versions kept for: "
+                f"[bold cyan]{'ever' if days is None else f'{days:g} day(s)'}[/bold cyan]"
+            )
+            return
+        rows = session.history(service)
+
+    if not rows:
+        console.print(
+            f"[bold yellow]No credentials found for service:[/bold yellow] {service}"
+        )
+        return
+
+    table = Table(title=f"History of {service}", border_style="blue")
+    table.add_column("Version", justify="right", style="cyan")
+    table.add_column("Username", style="green")
+    table.add_column("Saved")
+    table.add_column("Replaced")
+    for version, username, saved_at, replaced_at in rows:
+        table.add_row(
+            str(version),
+            username,
+            format_timestamp(saved_at),
+            "[bold]current[/bold]"
+            if replaced_at is None
+            else format_timestamp(replaced_at),
+        )
+    console.print(table)
+    console.print("Use 'pyvault get SERVICE --version N' to see a previous password.")
+
+
+@cli.command(cls=MultiArgUsageCommand)
+@click.argument("service")
+@click.argument("version", type=click.IntRange(min=1))
+def restore(service, version):
+    """
+    Make a previous version of a credential current again.\n
+    The version it replaces is kept in the history.
+    """
+    session = unlock_session()
+    if session is None:
+        return
+
+    with session:
+        try:
+            new_version = session.restore(service, version)
+        except Exception as e:
+            console.print(f"[bold red]Restore failed:[/bold red] {e}")
+            return
+
+    if new_version is None:
+        console.print(
+            f"[bold yellow]Version {version} of '{service}' is not in the history.[/bold yellow]"
+        )
+        return
+    console.print(
+        f"[bold green]✔[/bold green] [bold cyan]{service}[/bold cyan] restored from "
+        f"version {version} (now version {new_version})."
+    )
+
+
+@cli.command(cls=OrderedUsageCommand)
+@click.option(
+    "--older-than",
+    "max_age",
+    required=True,
+    metavar="AGE",
+    callback=parse_age_option,
+    help="Rotate passwords not changed for this long, e.g. 90d.",
+)
+@click.option("--where", callback=parse_where, help=WHERE_HELP)
+@click.option(
+    "--length",
+    default=20,
+    type=click.IntRange(min=8),
+    show_default=True,
+    help="Length of the new passwords.",
+)
+@click.option("--dry-run", is_flag=True, help="Only list what would be rotated.")
+def rotate(max_age, where, length, dry_run):
+    """
+    Replace old passwords with generated ones, all in one transaction.
+    The replaced passwords stay in the history (see 'pyvault history').
+    """
+    session = unlock_session()
+    if session is None:
+        return
+
+    with session:
+        stale = session.stale(max_age, where)
+        if not stale:
+            console.print("[bold green]✔ No passwords to rotate.[/bold green]")
+            return
+
+        preview = Table(
+            title=f"Passwords to rotate ({len(stale)})", border_style="yellow"
+        )
+        preview.add_column("Service", style="cyan", no_wrap=True)
+        preview.add_column("Username", style="green")
+        preview.add_column("Last changed")
+        preview.add_column("Age", justify="right")
+        for service, username, updated_at, _ in stale:
+            preview.add_row(
+                service, username, format_timestamp(updated_at), format_age(updated_at)
+            )
+        console.print(preview)
+        if dry_run:
+            return
+        if not questionary.confirm(
+            f"Generate new passwords for these {len(stale)} credential(s)?"
+        ).ask():
+            console.print("[green]Rotation cancelled.[/green]")
+            return
+
+        try:
+            rotated = session.rotate(max_age, where, length)
+        except Exception as e:
+            console.print(f"[bold red]Rotation failed, nothing changed:[/bold red] {e}")
+            return
+
+    report = Table(title="Rotated Passwords", border_style="green")
+    report.add_column("Service", style="cyan", no_wrap=True)
+    report.add_column("Username", style="green")
+    report.add_column("Previously changed")
+    report.add_column("New version", justify="right")
+    for service, username, updated_at, version in rotated:
+        report.add_row(service, username, format_timestamp(updated_at), str(version))
+    console.print(report)
+    console.print(
+        Panel(
+            f"[bold green]✔ {len(rotated)} password(s) rotated.[/bold green]\n"
+            "Update them on each site ('pyvault get SERVICE'); the previous ones "
+            "are kept in the history.",
+            border_style="green",
+            expand=False,
+        )
+    )
+
+
+# --- ATTACHMENT COMMANDS ---
+@cli.command(cls=MultiArgUsageCommand)
+@click.argument("service")
+@click.argument("file", type=click.Path(exists=True, dir_okay=False, allow_dash=True))
+@click.option(
+    "--name", help="Attachment name (default: the file name; required for stdin)."
+)
+@click.option(
+    "--password-env",
+    metavar="VAR",
+    help="Read the Master Password from this environment variable.",
+)
+def attach(service, file, name, password_env):
+    """
+    Attach a file (SSH key, kubeconfig, certificate...) to a service.\n
+    Use '-' as FILE to read from stdin. The file is encrypted in chunks as it
+    is read, so large files never have to fit in memory. An attachment with
+    the same name is replaced.
+    """
+    from_stdin = file == "-"
+    if name is None:
+        if from_stdin:
+            raise click.UsageError("--name is required when reading from stdin.")
+        name = os.path.basename(file)
+
+    master_pwd = None
+    if password_env:
+        master_pwd = os.environ.get(password_env)
+        if not master_pwd:
+            raise click.UsageError(f"Environment variable {password_env} is not set.")
+    elif from_stdin and not sys.stdin.isatty():
+        raise click.UsageError(
+            "The file is read from stdin: pass the Master Password with --password-env."
+        )
+
+    session = unlock_session(master_pwd=master_pwd)
+    if session is None:
+        sys.exit(1)
+
+    with session:
+        if not session.exists(service):
+            console.print(
+                f"[bold yellow]Service '{service}' not found.[/bold yellow] "
+                "Add the credential first."
+            )
+            sys.exit(1)
+        try:
+            with console.status(f"[bold green]Encrypting {name}..."), (
+                nullcontext(click.get_binary_stream("stdin"))
+                if from_stdin
+                else open(file, "rb")
+            ) as source:
+                size = session.attach(service, name, source)
+        except Exception as e:
+            console.print(f"[bold red]Attach failed:[/bold red] {e}")
+            sys.exit(1)
+
+    console.print(
+        f"[bold green]✔[/bold green] '{name}' ({format_size(size)}) attached to "
+        f"[bold cyan]{service}[/bold cyan]."
+    )
+
+
+@cli.command(cls=MultiArgUsageCommand)
+@click.argument("service")
+@click.argument("name")
+def detach(service, name):
+    """Remove the attached file NAME from a service."""
+    session = unlock_session()
+    if session is None:
+        return
+
+    with session:
+        if not session.detach(service, name):
+            console.print(
+                f"[bold yellow]No attachment '{name}' for service:[/bold yellow] {service}"
+            )
+            return
+    console.print(
+        f"[bold green]✔[/bold green] '{name}' removed from [bold cyan]{service}[/bold cyan]."
+    )
+
+
+@cli.command(cls=MultiArgUsageCommand)
+@click.argument("service")
+@click.argument("tags", nargs=-1, callback=parse_tags)
+@click.option(
+    "--remove",
+    "removed",
+    multiple=True,
+    callback=parse_tags,
+    help="Remove a tag (repeatable).",
+)
+@click.option("--folder", help="Move to a folder, e.g. work/aws ('' for none).")
+def tag(service, tags, removed, folder):
+    """
+    Add tags to SERVICE, remove them or move it to a folder.
+    Tags and folders can be filtered on with --where (list, export, audit).
+    """
+    session = unlock_session()
+    if session is None:
+        return
+
+    with session:
+        if not session.label(service, add=tags, remove=removed, folder=folder):
+            console.print(
+                f"\n[bold yellow]Service '{service}' not found.[/bold yellow]"
+            )
+            return
+        folder_name, tag_list = session.labels(service)
+    console.print(
+        f"[bold green]✔[/bold green] [bold cyan]{service}[/bold cyan] "
+        f"folder: {folder_name or '-'}, tags: {', '.join(tag_list) or '-'}"
+    )
+
+
 # --- EXPORT COMMAND ---
 @cli.command(cls=MultiArgUsageCommand)
 @click.argument("dest_path", type=click.Path())
@@ -610,15 +1618,12 @@ def wipe():
 @click.option(
     "--format", type=click.Choice(["json", "csv"]), default="csv", help="Export format."
 )
-def export(dest_path, new_file_name, format):
+@click.option("--where", callback=parse_where, help=WHERE_HELP)
+def export(dest_path, new_file_name, format, where):
     """
     Extract, decrypt, and save vault data to a specific path.
     Note: You can use '~/Desktop' or similar paths for the destination.
     """
-    db_path = "vault.db"
-    storage = VaultStorage(db_path)
-    crypto = CryptoManager()
-
     # Ensure automatic extension
     extension = f".{format}"
     clean_name = (
@@ -631,69 +1636,72 @@ def export(dest_path, new_file_name, format):
     )
 
     # 1. Identity Verification
-    start_time = time.time()
-    master_pwd = questionary.password(
-        "Enter Master Password to authorize export:"
-    ).ask()
-    if not master_pwd or not SecurityProtections.check_input_speed(
-        master_pwd, start_time
-    ):
+    session = unlock_session("Enter Master Password to authorize export:")
+    if session is None:
         return
 
-    try:
-        salt = storage.get_master_salt()
-        key = crypto.derive_key(master_pwd, salt)
-        crypto.decrypt(storage.get_verifier(), key)
-    except Exception:
-        print_security_error()
-        return
-
-    # 2. Security Warning
-    console.print(
-        Panel(
-            "[bold red]DANGER:[/bold red] You are exporting your passwords in PLAIN TEXT.\n"
-            "Ensure the destination folder is secure. Note: Paths like [cyan]~/Desktop[/cyan] are supported.",
-            border_style="red",
-            expand=False,
+    with session:
+        # 2. Security Warning
+        console.print(
+            Panel(
+                "[bold red]DANGER:[/bold red] You are exporting your passwords in PLAIN TEXT.\n"
+                "Ensure the destination folder is secure. Note: Paths like [cyan]~/Desktop[/cyan] are supported.",
+                border_style="red",
+                expand=False,
+            )
         )
-    )
-    if not questionary.confirm(
-        "Do you really want to proceed with an unencrypted export?"
-    ).ask():
-        return
-
-    # 3. Fetch and Decrypt
-    raw_data = storage.get_full_inventory()
-    decrypted_list = []
+        if not questionary.confirm(
+            "Do you really want to proceed with an unencrypted export?"
+        ).ask():
+            return
 
-    for service, username, blob in raw_data:
-        decrypted_list.append(
-            {
-                "service": service,
-                "username": username,
-                "password": crypto.decrypt(blob, key),
-            }
+        # 3. Decrypt and write one record at a time (memory does not grow
+        # with the size of the vault)
+        inventory = session.inventory(where)
+        records = (
+            {"service": service, "username": username, "password": password}
+            for service, username, password in inventory
         )
+        try:
+            os.makedirs(os.path.dirname(full_output_path), exist_ok=True)
+            # closing(): the read transaction ends here even if writing fails
+            if format == "json":
+                with closing(inventory), open(
+                    full_output_path, "w", encoding="utf-8"
+                ) as f:
+                    write_json_records(f, records)
+            else:
+                with closing(inventory), open(
+                    full_output_path, "w", newline="", encoding="utf-8"
+                ) as f:
+                    writer = csv.DictWriter(
+                        f, fieldnames=["service", "username", "password"]
+                    )
+                    writer.writeheader()
+                    writer.writerows(records)
 
-    # 4. File Writing
-    try:
-        os.makedirs(os.path.dirname(full_output_path), exist_ok=True)
-        if format == "json":
-            with open(full_output_path, "w", encoding="utf-8") as f:
-                json.dump(decrypted_list, f, indent=4)
-        else:
-            with open(full_output_path, "w", newline="", encoding="utf-8") as f:
-                writer = csv.DictWriter(
-                    f, fieldnames=["service", "username", "password"]
-                )
-                writer.writeheader()
-                writer.writerows(decrypted_list)
+            console.print(
+                f"[bold green]✔ Export successful:[/bold green] [cyan]{full_output_path}[/cyan]"
+            )
+        except Exception as e:
+            # Never leave a partial plain-text copy behind
+            if os.path.exists(full_output_path):
+                os.remove(full_output_path)
+            console.print(f"[bold red]Export failed:[/bold red] {e}")
 
-        console.print(
-            f"[bold green]✔ Export successful:[/bold green] [cyan]{full_output_path}[/cyan]"
-        )
-    except Exception as e:
-        console.print(f"[bold red]Export failed:[/bold red] {e}")
+
+def write_json_records(f, records):
+    """
+    Writes records as a JSON array, one at a time. The output is identical to
+    json.dump(list(records), f, indent=4).
+    """
+    f.write("[")
+    separator = "\n"
+    for record in records:
+        f.write(separator)
+        f.write(textwrap.indent(json.dumps(record, indent=4), "    "))
+        separator = ",\n"
+    f.write("]" if separator == "\n" else "\n]")
 
 
 # --- FORMATTER COMMAND ---
@@ -774,62 +1782,825 @@ def formatter(file_path, dest_path, new_file_name):
 
 # --- IMPORT COMMAND ---
 @cli.command(name="import", cls=OrderedUsageCommand)
-@click.argument("file_path", type=click.Path(exists=True))
-def import_cmd(file_path):
+@click.argument("file_paths", nargs=-1, required=True)
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    help="Encryption processes (default: one per CPU).",
+)
+@click.option(
+    "--batch-size",
+    type=click.IntRange(min=1),
+    default=DEFAULT_IMPORT_BATCH_SIZE,
+    show_default=True,
+    help="Rows committed per transaction.",
+)
+def import_cmd(file_paths, workers, batch_size):
     """
-    Import data from a formatted CSV and encrypt it into the vault.
+    Import data from formatted CSVs and encrypt it into the vault.
+    Accepts several files and glob patterns (e.g. 'exports/*.csv'); they are
+    parsed, encrypted and written concurrently.
     Note: Supports paths like '~/Downloads/ready.csv'.
     """
-    db_path = "vault.db"
-    storage = VaultStorage(db_path)
-    crypto = CryptoManager()
-    full_path = os.path.abspath(os.path.expanduser(file_path))
+    try:
+        paths = expand_paths(file_paths)
+    except ImportFileError as e:
+        console.print(f"[bold red]Error:[/bold red] {e}")
+        return
 
     # 1. Identity Verification
-    master_pwd = questionary.password(
-        "Enter Master Password to authorize import:"
-    ).ask()
+    session = unlock_session("Enter Master Password to authorize import:")
+    if session is None:
+        return
+
+    # 2. Parse, encrypt and write in a pipeline, committing in batches
     try:
-        salt = storage.get_master_salt()
-        key = crypto.derive_key(master_pwd, salt)
-        crypto.decrypt(storage.get_verifier(), key)
-    except Exception:
-        print_security_error()
+        with session, Progress(
+            TextColumn("[bold blue]{task.description:>8}"),
+            TextColumn("{task.completed:>10,.0f} rows"),
+            TextColumn("[dim]{task.fields[rate]:>12,.0f} rows/s"),
+            console=console,
+            transient=True,
+        ) as progress_bar:
+            tasks = {
+                stage: progress_bar.add_task(stage, total=None, rate=0.0)
+                for stage in IMPORT_STAGES
+            }
+
+            def report_progress(report):
+                for stage, task in tasks.items():
+                    progress_bar.update(
+                        task, completed=report.rows[stage], rate=report.rate(stage)
+                    )
+
+            pipeline = ImportPipeline(session, workers=workers, batch_size=batch_size)
+            report = pipeline.run(paths, progress=report_progress)
+    except Exception as e:
+        console.print(f"[bold red]Import failed:[/bold red] {e}")
         return
 
-    # 2. Reading and Importing
-    count = 0
-    skipped = 0
+    for path, message in report.errors.items():
+        console.print(
+            f"[bold red]Error:[/bold red] {os.path.basename(path)}: {message}"
+        )
+    if len(paths) == 1:
+        if report.errors:
+            return
+        title = f"Import from {os.path.basename(paths[0])} complete!"
+    else:
+        title = f"Import of {len(paths) - len(report.errors)} file(s) complete!"
+    lines = [
+        f"[bold green]✔ {title}[/bold green]",
+        f"Imported: {report.total_imported}",
+        f"Skipped (duplicates): {report.total_skipped}",
+    ]
+    if any(report.invalid):
+        lines.append(f"Skipped (no service or password): {sum(report.invalid)}")
+    if len(paths) > 1:
+        lines += [
+            f"  {os.path.basename(path)}: {imported} imported, {skipped} skipped"
+            for path, imported, skipped in zip(paths, report.imported, report.skipped)
+            if path not in report.errors
+        ]
+    rates = ", ".join(f"{stage} {report.rate(stage):,.0f}/s" for stage in IMPORT_STAGES)
+    lines.append(
+        f"[dim]{format_duration(report.seconds)}, {report.workers} worker(s); "
+        f"rows per second: {rates}[/dim]"
+    )
+    console.print(Panel("\n".join(lines), border_style="green", expand=False))
+
+
+# --- BATCH COMMAND ---
+@cli.command(cls=OrderedUsageCommand)
+@click.argument("ops_file", default="-", type=click.File("r", encoding="utf-8"))
+@click.option(
+    "--atomic", is_flag=True, help="All-or-nothing: roll back everything on error."
+)
+@click.option(
+    "--continue-on-error",
+    is_flag=True,
+    help="Report failed operations and keep going.",
+)
+@click.option(
+    "--batch-size",
+    default=100,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Operations committed per transaction.",
+)
+@click.option(
+    "--password-env",
+    metavar="NAME",
+    help="Read the Master Password from this environment variable.",
+)
+def batch(ops_file, atomic, continue_on_error, batch_size, password_env):
+    """
+    Run newline-delimited JSON operations under a single unlock.\n
+    Reads OPS_FILE (default: stdin) and writes one JSON result per line to
+    stdout. Operations: add, get, rm, list. Example line:\n
+    {"op": "add", "service": "db", "username": "svc", "generate": 32}
+    """
+    errors = Console(stderr=True)
+    if atomic and continue_on_error:
+        raise click.UsageError("--atomic and --continue-on-error cannot be combined.")
+
+    master_pwd = None
+    if password_env:
+        master_pwd = os.environ.get(password_env)
+        if not master_pwd:
+            raise click.UsageError(f"Environment variable {password_env} is not set.")
+    elif ops_file.name == "<stdin>" and not sys.stdin.isatty():
+        raise click.UsageError(
+            "Operations are read from stdin: pass the Master Password with --password-env."
+        )
+
+    session = unlock_session(master_pwd=master_pwd)
+    if session is None:
+        sys.exit(1)
+
+    runner = BatchRunner(
+        session,
+        batch_size=batch_size,
+        atomic=atomic,
+        continue_on_error=continue_on_error,
+    )
+    with session:
+        for result in runner.run(ops_file):
+            click.echo(json.dumps(result))
+
+    stats = runner.stats
+    total = stats["ok"] + stats["failed"]
+    outcome = "committed" if runner.committed else "[bold red]rolled back[/bold red]"
+    errors.print(
+        f"[bold]Batch finished:[/bold] {total} operation(s), {stats['ok']} ok, "
+        f"{stats['failed']} failed, {stats['transactions']} transaction(s) {outcome} "
+        f"in {format_duration(stats['seconds'])} ({runner.throughput:.0f} ops/s)"
+    )
+    if stats["failed"]:
+        sys.exit(1)
+
+
+# --- MIGRATE COMMAND ---
+@cli.command(cls=OrderedUsageCommand)
+@click.option(
+    "--dry-run",
+    is_flag=True,
+    help="List pending migrations and estimate their duration without changing the vault.",
+)
+@click.option(
+    "--rows",
+    type=click.IntRange(min=0),
+    help="With --dry-run: estimate for a vault holding this many credentials.",
+)
+@click.option(
+    "--batch-size",
+    default=500,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Rows migrated per committed batch.",
+)
+def migrate(dry_run, rows, batch_size):
+    """
+    Upgrade the vault schema to the current version.
+    Data migrations run in small committed batches: the vault stays readable
+    and an interrupted upgrade resumes where it stopped. Only ciphertext is
+    touched, so no Master Password is required.
+    """
+    if not os.path.exists(DB_PATH):
+        print_not_initialized()
+        return
+    engine = detect_engine(DB_PATH)
+    if engine != "sqlite":
+        console.print(
+            f"[bold yellow]{engine.capitalize()}-engine vaults are upgraded when "
+            "unlocked:[/bold yellow] the schema is inside the encrypted file."
+        )
+        return
+
+    storage = VaultStorage(DB_PATH, auto_migrate=False)
     try:
-        with open(full_path, mode="r", encoding="utf-8") as f:
-            sample = f.read(1024)
-            f.seek(0)
-            if "service" not in sample or "password" not in sample:
-                console.print(
-                    "[bold red]Error:[/bold red] Incompatible CSV format. Use 'pyvault formatter' first."
+        current = storage.schema_version()
+        pending = storage.pending_migrations()
+        if not pending:
+            console.print(
+                f"[bold green]✔ Vault schema is up to date[/bold green] (v{current})."
+            )
+            return
+
+        if dry_run:
+            report = storage.estimate_migrations(rows=rows, batch_size=batch_size)
+            table = Table(
+                title=f"Pending Migrations (v{current} → v{report[-1]['version']})",
+                border_style="blue",
+                header_style="bold magenta",
+            )
+            table.add_column("Version", style="cyan")
+            table.add_column("Description")
+            table.add_column("Rows", justify="right")
+            table.add_column("Estimated Time", justify="right", style="green")
+            for item in report:
+                table.add_row(
+                    f"v{item['version']}",
+                    item["description"],
+                    str(item["rows"]),
+                    format_duration(item["seconds"]),
                 )
-                return
+            console.print(table)
+            total = sum(item["seconds"] for item in report)
+            console.print(f"Estimated total: [bold]{format_duration(total)}[/bold]")
+            return
 
-            reader = csv.DictReader(f)
-            for row in reader:
-                if storage.get_credential(row["service"]):
-                    skipped += 1
-                    continue
+        with Progress(
+            TextColumn("[bold blue]{task.description}"),
+            BarColumn(),
+            TextColumn("{task.completed}/{task.total} rows"),
+            TimeRemainingColumn(),
+            console=console,
+        ) as progress_bar:
+            tasks = {}
+
+            def report_progress(migration, done, total):
+                if migration.version not in tasks:
+                    tasks[migration.version] = progress_bar.add_task(
+                        f"v{migration.version} {migration.description}", total=total
+                    )
+                progress_bar.update(
+                    tasks[migration.version], completed=done, total=total
+                )
 
-                encrypted_blob = crypto.encrypt(row["password"], key)
-                storage.add_credential(row["service"], row["username"], encrypted_blob)
-                count += 1
+            applied = storage.migrate(batch_size=batch_size, progress=report_progress)
 
         console.print(
             Panel(
-                f"[bold green]✔ Import from {os.path.basename(full_path)} complete![/bold green]\n"
-                f"Imported: {count}\nSkipped (duplicates): {skipped}",
+                f"[bold green]✔ Migration complete![/bold green]\n"
+                f"Schema: v{current} → v{storage.schema_version()} "
+                f"({len(applied)} migration(s) applied)",
                 border_style="green",
                 expand=False,
             )
         )
-    except Exception as e:
-        console.print(f"[bold red]Import failed:[/bold red] {e}")
+    except MigrationError as e:
+        console.print(f"[bold red]Migration error:[/bold red] {e}")
+    finally:
+        storage.close()
+
+
+# --- OPTIMIZE COMMAND ---
+OPTIMIZE_STEPS = {
+    "vacuum": "Rebuilding the vault file (VACUUM)...",
+    "reclaim": "Reclaiming free pages... {done:,}/{total:,}",
+    "analyze": "Gathering query planner statistics (ANALYZE)...",
+    "refresh": "Refreshing query planner statistics...",
+    "checkpoint": "Checkpointing the write-ahead log...",
+}
+
+
+def storage_stats_rows(stats):
+    """(metric, value) rows describing a DatabaseStats."""
+    fragmentation = (
+        "n/a" if stats.fragmentation is None else f"{stats.fragmentation:.1%}"
+    )
+    return [
+        ("File size", format_size(stats.file_size)),
+        ("Write-ahead log", format_size(stats.wal_size)),
+        ("Pages", f"{stats.pages:,} × {stats.page_size:,} B"),
+        ("Free pages", f"{stats.free_pages:,} ({format_size(stats.free_bytes)})"),
+        ("Unused space in pages", f"{stats.slack:.1%}"),
+        ("Fragmentation", fragmentation),
+        ("Auto-vacuum", stats.auto_vacuum),
+        ("Planner statistics", "yes" if stats.analyzed else "no"),
+    ]
+
+
+@cli.command(cls=OrderedUsageCommand)
+@click.option(
+    "--full",
+    is_flag=True,
+    help="Rebuild the whole file with VACUUM and gather fresh statistics.",
+)
+@click.option("--stats", "stats_only", is_flag=True, help="Only show the statistics.")
+@click.option(
+    "--auto/--no-auto",
+    default=None,
+    help="Turn automatic maintenance after writes on or off.",
+)
+@click.option(
+    "--step",
+    default=DEFAULT_STEP_PAGES,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Free pages reclaimed per transaction.",
+)
+def optimize(full, stats_only, auto, step):
+    """
+    Reclaim free space, defragment the vault and refresh query statistics.
+    The first run switches the vault to incremental auto-vacuum with a full
+    rebuild; later runs give free pages back in short transactions. Only
+    the file layout is touched, so no Master Password is required.
+    """
+    if not os.path.exists(DB_PATH):
+        print_not_initialized()
+        return
+    engine = detect_engine(DB_PATH)
+    if engine == "memory":
+        console.print(
+            "[bold yellow]Memory-engine vaults need no maintenance:[/bold yellow] "
+            "the file is rewritten compact on every change."
+        )
+        return
+    if engine == "log":
+        console.print(
+            "[bold yellow]Log-engine vaults need no maintenance:[/bold yellow] "
+            "the log is compacted in the background once half of it is "
+            "overwritten records."
+        )
+        return
+
+    try:
+        storage = VaultStorage(DB_PATH)
+    except MigrationError as e:
+        console.print(f"[bold red]Migration error:[/bold red] {e}")
+        return
+    try:
+        if auto is not None:
+            storage.set_auto_maintenance(auto)
+            state = "on" if auto else "off"
+            console.print(f"[bold green]✔ Automatic maintenance {state}.[/bold green]")
+            return
+
+        if stats_only:
+            table = Table(
+                title="Vault Storage", border_style="blue", header_style="bold magenta"
+            )
+            table.add_column("Metric", style="cyan")
+            table.add_column("Value", justify="right")
+            for metric, value in storage_stats_rows(
+                database_stats(storage.conn, DB_PATH)
+            ):
+                table.add_row(metric, value)
+            console.print(table)
+            state = "on" if storage.get_auto_maintenance() else "off"
+            console.print(f"[dim]Automatic maintenance: {state}[/dim]")
+            return
+
+        # A rebuild rewrites the whole file: wait for other commands to finish
+        rebuild = full or needs_rebuild(database_stats(storage.conn, DB_PATH))
+        with exclusive_vault_lock(DB_PATH) if rebuild else nullcontext():
+            with console.status("[bold green]Optimizing vault...") as status:
+
+                def report_progress(action, done, total):
+                    text = OPTIMIZE_STEPS[action].format(done=done, total=total)
+                    status.update(f"[bold green]{text}")
+
+                report = optimize_vault(
+                    storage, full=full, step_pages=step, progress=report_progress
+                )
+    except VaultLockedError as e:
+        console.print(f"[bold yellow]Optimize postponed:[/bold yellow] {e}")
+        return
+    finally:
+        storage.close()
+
+    table = Table(
+        title="Vault Storage", border_style="blue", header_style="bold magenta"
+    )
+    table.add_column("Metric", style="cyan")
+    table.add_column("Before", justify="right")
+    table.add_column("After", justify="right", style="green")
+    for (metric, before), (_, after) in zip(
+        storage_stats_rows(report.before), storage_stats_rows(report.after)
+    ):
+        table.add_row(metric, before, after)
+    console.print(table)
+
+    saved = report.bytes_saved
+    console.print(
+        Panel(
+            f"[bold green]✔ Vault optimized[/bold green] in "
+            f"{format_duration(report.seconds)}\n"
+            f"Steps: {', '.join(report.actions)}\n"
+            f"Space reclaimed: {format_size(max(saved, 0))}",
+            border_style="green",
+            expand=False,
+        )
+    )
+
+
+# --- CIPHER COMMAND ---
+@cli.command(cls=OrderedUsageCommand)
+@click.option(
+    "--set",
+    "new_cipher",
+    type=click.Choice([*CIPHER_IDS]),
+    help="Cipher for new and rewritten records.",
+)
+@click.option(
+    "--rewrite",
+    is_flag=True,
+    help="Re-encrypt every record with the preferred cipher now.",
+)
+@click.option("--benchmark", is_flag=True, help="Measure every cipher on this machine.")
+def cipher(new_cipher, rewrite, benchmark):
+    """
+    Show or change the cipher used to encrypt stored records.
+    Records keep the cipher they were written with and move to the preferred
+    one whenever they are rewritten (or all at once with --rewrite).
+    """
+    if benchmark:
+        table = Table(title="Cipher Benchmark (64-byte records)", border_style="blue")
+        table.add_column("Cipher", style="cyan")
+        table.add_column("Round trips/s", justify="right", style="green")
+        results = benchmark_ciphers(CIPHER_NAMES, duration=0.2)
+        for cipher_id, rate in sorted(results.items(), key=lambda r: -r[1]):
+            table.add_row(CIPHER_NAMES[cipher_id], f"{rate:,.0f}")
+        console.print(table)
+
+    session = unlock_session()
+    if session is None:
+        return
+
+    with session:
+        if new_cipher:
+            session.set_cipher(CIPHER_IDS[new_cipher])
+            console.print(
+                f"[bold green]✔[/bold green] New records will use [bold cyan]{new_cipher}[/bold cyan]."
+            )
+        if rewrite:
+            count = session.reencrypt()
+            console.print(f"[bold green]✔[/bold green] {count} record(s) re-encrypted.")
+
+        preferred = CIPHER_NAMES[session.crypto.cipher]
+        usage = session.cipher_usage()
+
+    table = Table(title="Records per Cipher", border_style="blue")
+    table.add_column("Cipher", style="cyan")
+    table.add_column("Records", justify="right")
+    for cipher_id, count in sorted(usage.items()):
+        name = CIPHER_NAMES.get(cipher_id, "aes-256-gcm (legacy format)")
+        table.add_row(name, str(count))
+    console.print(f"Preferred cipher: [bold cyan]{preferred}[/bold cyan]")
+    if usage:
+        console.print(table)
+
+
+# --- ENGINE COMMAND ---
+@cli.command(cls=OrderedUsageCommand)
+@click.argument("new_engine", required=False, type=click.Choice([*ENGINES]))
+def engine(new_engine):
+    """
+    Show the storage engine, or convert the vault to another one.
+    'sqlite' keeps a SQLite file with each record encrypted; 'memory' keeps
+    one encrypted file, names included, served from memory once unlocked;
+    'log' is served from memory too but appends each change to an encrypted
+    log instead of rewriting the file (for write-heavy vaults).
+    """
+    if not os.path.exists(DB_PATH):
+        print_not_initialized()
+        return
+
+    current = detect_engine(DB_PATH)
+    if new_engine is None:
+        console.print(
+            f"Storage engine: [bold cyan]{current}[/bold cyan] "
+            f"({format_size(os.path.getsize(DB_PATH))})"
+        )
+        return
+    if new_engine == current:
+        console.print(f"[bold yellow]The vault already uses {current}.[/bold yellow]")
+        return
+    try:
+        check_conversion(new_engine)
+    except VaultFileError as e:
+        console.print(f"[bold red]Error:[/bold red] {e}")
+        return
+
+    session = unlock_session(f"Enter your Master Password to convert to {new_engine}:")
+    if session is None:
+        return
+    # The file is about to be replaced: release the session first
+    key = bytes(session.key)
+    session.close()
+
+    try:
+        with exclusive_vault_lock(DB_PATH):
+            with console.status(f"[bold green]Converting to {new_engine}..."):
+                before, after = convert(DB_PATH, key, new_engine)
+    except VaultLockedError as e:
+        console.print(f"[bold yellow]Conversion postponed:[/bold yellow] {e}")
+        return
+
+    console.print(
+        Panel(
+            f"[bold green]✔ Vault converted[/bold green]: {current} → {new_engine}\n"
+            f"File size: {format_size(before)} → {format_size(after)}",
+            border_style="green",
+            expand=False,
+        )
+    )
+
+
+# --- SYNC COMMAND ---
+def describe_entry(entry):
+    """One-line description of a record state for sync prompts and reports."""
+    when = format_timestamp(entry.timestamp)
+    if entry.deleted:
+        return f"deleted {when} (v{entry.version})"
+    return f"user '{entry.username}', updated {when} (v{entry.version})"
+
+
+def ask_which_to_keep(local, remote):
+    """Interactive resolver: asks which side of a conflicting record to keep."""
+    default = newer(local, remote)
+    choice = questionary.select(
+        f"'{local.service}' changed in both vaults. Keep:",
+        choices=[
+            questionary.Choice(f"This vault: {describe_entry(local)}", value="local"),
+            questionary.Choice(
+                f"Other vault: {describe_entry(remote)}", value="remote"
+            ),
+        ],
+        default="local" if default is local else "remote",
+    ).ask()
+    if choice is None:
+        raise click.Abort()
+    return local if choice == "local" else remote
+
+
+@cli.command(cls=OrderedUsageCommand)
+@click.argument("other", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--interactive",
+    is_flag=True,
+    help="Ask which version to keep when a record changed in both vaults.",
+)
+@click.option("--dry-run", is_flag=True, help="Show what would change and stop.")
+def sync(other, interactive, dry_run):
+    """
+    Two-way sync with another copy of this vault (e.g. on a USB drive).
+    Only records that differ are compared and copied, still encrypted.
+    A record changed in one vault since the last sync is copied to the
+    other; one changed in both goes to the most recent change unless
+    --interactive is given. Deletions are propagated.
+    """
+    if os.path.exists(DB_PATH) and os.path.samefile(DB_PATH, other):
+        console.print("[bold red]Error:[/bold red] Cannot sync a vault with itself.")
+        return
+
+    session = unlock_session()
+    if session is None:
+        return
+
+    with session:
+        try:
+            remote = VaultSession.open(other)
+        except (MigrationError, VaultFileError, VaultLockedError) as e:
+            console.print(f"[bold red]Error:[/bold red] {e}")
+            return
+
+        with remote:
+            try:
+                check_same_vault(session, remote.storage)
+            except SyncError as e:
+                console.print(
+                    Panel(f"[bold red]Sync refused:[/bold red] {e}", expand=False)
+                )
+                return
+
+            engine = VaultSync(
+                session.storage,
+                remote.storage,
+                resolve=ask_which_to_keep if interactive else None,
+            )
+            plan = engine.plan()
+            if not plan:
+                if not dry_run:
+                    # Still remembered as the base of the next sync
+                    engine.apply(plan)
+                console.print("[bold green]✔ Vaults are already in sync.[/bold green]")
+                return
+
+            table = Table(title="Sync Plan", border_style="blue")
+            table.add_column("Service", style="cyan")
+            table.add_column("Direction")
+            table.add_column("Copied State")
+            for direction, changes in (("→ other", plan.push), ("← other", plan.pull)):
+                for entry, _ in changes:
+                    table.add_row(entry.service, direction, describe_entry(entry))
+            console.print(table)
+
+            if dry_run:
+                console.print("[yellow]Dry run: no vault was changed.[/yellow]")
+                return
+
+            skipped = engine.apply(plan)
+
+    elapsed = engine.stats["plan"] + engine.stats["apply"]
+    summary = (
+        f"[bold green]✔ Sync complete[/bold green] in {format_duration(elapsed)}\n"
+        f"Sent: {len(plan.push)} · Received: {len(plan.pull)} · "
+        f"Conflicts resolved: {plan.conflicts} · Buckets compared: {plan.buckets_compared}"
+    )
+    if skipped:
+        summary += (
+            f"\n[yellow]{skipped} record(s) changed during the sync and were left "
+            "untouched. Run sync again.[/yellow]"
+        )
+    console.print(Panel(summary, border_style="green", expand=False))
+
+
+# --- VERIFY COMMAND ---
+@cli.command(cls=OrderedUsageCommand)
+@click.option(
+    "--full",
+    is_flag=True,
+    help="Run SQLite's exhaustive integrity_check instead of quick_check.",
+)
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    help="Worker processes checking records (default: one per CPU).",
+)
+@click.option(
+    "--repair-from",
+    "backup_path",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Restore damaged records from this backup copy of the vault.",
+)
+def verify(full, workers, backup_path):
+    """
+    Check the vault file and authenticate every stored password.
+    Past versions and attachments are checked too. Reports truncated,
+    corrupt or wrong-key records by service without showing any plaintext.
+    Exits with status 1 if problems remain.
+    """
+    session = unlock_session()
+    if session is None:
+        return
+
+    with session:
+        with console.status("[bold green]Verifying vault...") as status:
+            report = verify_vault(
+                # Memory vaults have no SQLite file for worker processes to read
+                session.storage.db_path if session.storage.engine == "sqlite" else None,
+                session.storage.conn,
+                session.key,
+                full=full,
+                workers=workers,
+                progress=lambda done: status.update(
+                    f"[bold green]Verifying vault... {done:,} records checked"
+                ),
+            )
+
+        if report.database_errors:
+            console.print(
+                Panel(
+                    "[bold red]Database check failed:[/bold red]\n"
+                    + "\n".join(report.database_errors[:20]),
+                    border_style="red",
+                    expand=False,
+                )
+            )
+        else:
+            check = "integrity_check" if full else "quick_check"
+            console.print(f"[bold green]✔ Database structure OK[/bold green] ({check})")
+
+        if report.damaged:
+            table = Table(title="Damaged Records", border_style="red")
+            table.add_column("Service", style="bold red")
+            table.add_column("Record")
+            table.add_column("Problem")
+            for row in report.damage():
+                table.add_row(*map(escape, row))
+            console.print(table)
+
+        console.print(
+            f"{report.records:,} record(s) verified in {format_duration(report.seconds)} "
+            f"({report.throughput:,.0f}/s, {report.workers} worker(s)) with "
+            f"{report.versions:,} past version(s) and {report.attachments:,} "
+            f"attachment(s), {report.damaged} damaged."
+        )
+
+        remaining = report.damaged
+        if backup_path and report.damaged:
+            try:
+                backup = VaultSession.open(backup_path)
+            except (MigrationError, VaultFileError, VaultLockedError) as e:
+                console.print(f"[bold red]Error:[/bold red] {e}")
+                sys.exit(1)
+            with backup:
+                try:
+                    check_same_vault(session, backup.storage)
+                except SyncError as e:
+                    console.print(f"[bold red]Repair refused:[/bold red] {e}")
+                    sys.exit(1)
+                repaired, unrepaired = repair_records(session, backup.storage, report)
+            remaining = len(unrepaired)
+            console.print(
+                f"[bold green]✔ {len(repaired)} record(s) restored from backup.[/bold green]"
+            )
+            if unrepaired:
+                console.print(
+                    "[bold yellow]Not found or damaged in the backup:[/bold yellow] "
+                    + escape(", ".join(unrepaired))
+                )
+
+    if report.database_errors or remaining:
+        sys.exit(1)
+
+
+# --- SHELL COMMAND ---
+# Commands that manage the vault file itself cannot run on the shell's session
+SHELL_EXCLUDED = ("engine", "init", "optimize", "shell", "wipe")
+
+
+@cli.command(cls=OrderedUsageCommand)
+@click.option(
+    "--idle-timeout",
+    default=int(DEFAULT_IDLE_TIMEOUT),
+    show_default=True,
+    type=click.IntRange(min=0),
+    help="Seconds of inactivity before the vault is locked (0 = never).",
+)
+@click.option(
+    "--cache-size",
+    default=100,
+    show_default=True,
+    type=click.IntRange(min=0),
+    help="Passwords kept decrypted in memory between commands (0 = none).",
+)
+@click.option(
+    "--prefetch",
+    default=DEFAULT_PREFETCH,
+    show_default=True,
+    type=click.IntRange(min=0),
+    help="Most used services decrypted into the cache at unlock.",
+)
+def shell(idle_timeout, cache_size, prefetch):
+    """
+    Interactive shell: unlock once, then run commands with tab completion.
+    Service names are completed from an in-memory index, most recently used
+    first. The passwords used most are decrypted at unlock and kept in
+    memory with the others read, until the vault changes or is locked. The
+    key and the cache are forgotten after --idle-timeout seconds of
+    inactivity and wiped when the shell exits.
+    """
+    session = unlock_session()
+    if session is None:
+        return
+
+    show_timings = bool(os.environ.get("PYVAULT_TIMINGS"))
+
+    def execute(argv):
+        start = time.perf_counter()
+        try:
+            cli.main(args=argv, prog_name="pyvault", standalone_mode=False, obj=session)
+        except click.ClickException as e:
+            e.show()
+        except click.Abort:
+            console.print("[yellow]Aborted.[/yellow]")
+        except SystemExit:
+            pass
+        except Exception as e:
+            console.print(f"[bold red]Error:[/bold red] {e}")
+        if show_timings:
+            elapsed = time.perf_counter() - start
+            console.print(f"[dim]{argv[0]}: {elapsed * 1000:.1f}ms[/dim]")
+
+    def unlock_again():
+        while True:
+            start_time = time.time()
+            master_pwd = questionary.password(
+                "Enter your Master Password to unlock (empty to exit):"
+            ).ask()
+            if not master_pwd or not SecurityProtections.check_input_speed(
+                master_pwd, start_time
+            ):
+                return False
+            try:
+                session.unlock(master_pwd)
+                return True
+            except AuthenticationError:
+                print_security_error()
+
+    console.print(
+        Panel(
+            "[bold green]✔ Vault unlocked.[/bold green] Type 'help' for commands, "
+            "Tab to complete, 'exit' to lock and leave.",
+            border_style="green",
+            expand=False,
+        )
+    )
+    VaultShell(
+        session,
+        execute=execute,
+        unlock=unlock_again,
+        console=console,
+        commands=[name for name in cli.commands if name not in SHELL_EXCLUDED],
+        idle_timeout=idle_timeout or None,
+        cache_size=cache_size,
+        prefetch=prefetch,
+    ).run()
+    console.print("[green]Vault locked. Key wiped from memory.[/green]")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,245 @@
+import os
+import sqlite3
+import time
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+# Free pages returned to the file system per incremental_vacuum step (each
+# step is its own short write transaction)
+DEFAULT_STEP_PAGES = 512
+# Automatic maintenance after a write reclaims space once this many pages
+# are free, one step at a time
+AUTO_VACUUM_THRESHOLD = 256
+# Rows sampled per index by the automatic PRAGMA optimize
+AUTO_ANALYSIS_LIMIT = 400
+# optimize() rebuilds the file when this share of the pages in use is empty
+# (deletes leave pages half empty, which incremental_vacuum cannot give back)
+REBUILD_SLACK = 0.4
+# ... or when this share of the pages is out of order (incremental_vacuum
+# fills holes with pages from the end of the file, scattering them further)
+REBUILD_FRAGMENTATION = 0.5
+
+AUTO_VACUUM_MODES = {0: "none", 1: "full", 2: "incremental"}
+INCREMENTAL = 2
+
+# Actions reported by optimize()
+VACUUM, RECLAIM, ANALYZE, REFRESH, CHECKPOINT = (
+    "vacuum",
+    "reclaim",
+    "analyze",
+    "refresh",
+    "checkpoint",
+)
+
+
+class DatabaseStats(NamedTuple):
+    page_size: int
+    pages: int
+    free_pages: int
+    file_size: int  # bytes, main file only
+    wal_size: int  # bytes
+    auto_vacuum: str  # none, full or incremental
+    # Share of b-tree pages not stored right after the previous page of the
+    # same table or index, and bytes left unused inside pages (both None if
+    # SQLite was built without DBSTAT)
+    fragmentation: Optional[float]
+    unused_bytes: Optional[int]
+    analyzed: bool  # planner statistics gathered (sqlite_stat1)
+
+    @property
+    def free_bytes(self) -> int:
+        return self.free_pages * self.page_size
+
+    @property
+    def slack(self) -> float:
+        """Share of the pages in use left empty (0.0 without DBSTAT)."""
+        used = (self.pages - self.free_pages) * self.page_size
+        return (self.unused_bytes or 0) / used if used else 0.0
+
+
+class OptimizeReport:
+    """Outcome of optimize(): statistics before and after, actions run."""
+
+    def __init__(self, before: DatabaseStats):
+        self.before = before
+        self.after = before
+        self.actions: List[str] = []
+        self.pages_reclaimed = 0
+        self.seconds = 0.0
+
+    @property
+    def bytes_saved(self) -> int:
+        return (self.before.file_size + self.before.wal_size) - (
+            self.after.file_size + self.after.wal_size
+        )
+
+
+def _pragma(conn, name: str):
+    return conn.execute(f"PRAGMA {name}").fetchone()[0]
+
+
+def _layout(conn) -> Tuple[Optional[float], Optional[int]]:
+    """
+    (fragmentation, unused bytes): walks every b-tree in key order through
+    the DBSTAT virtual table, counting the pages that do not follow the
+    previous one on disk and the space left unused in each page. Overflow
+    pages (the tail of values larger than a page) are left out.
+    """
+    try:
+        rows = conn.execute(
+            "SELECT name, pageno, unused FROM dbstat "
+            "WHERE pagetype != 'overflow' ORDER BY name, path"
+        )
+    except sqlite3.OperationalError:
+        return None, None
+    jumps = total = unused = 0
+    previous_name, previous_page = None, None
+    for name, page, page_unused in rows:
+        if name == previous_name and page != previous_page + 1:
+            jumps += 1
+        total += 1
+        unused += page_unused
+        previous_name, previous_page = name, page
+    return (jumps / total if total else 0.0), unused
+
+
+def database_stats(conn, db_path) -> DatabaseStats:
+    """Page, size and layout figures for the vault at db_path."""
+    wal_path = f"{db_path}-wal"
+    analyzed = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'"
+    ).fetchone()
+    fragmentation, unused_bytes = _layout(conn)
+    return DatabaseStats(
+        page_size=_pragma(conn, "page_size"),
+        pages=_pragma(conn, "page_count"),
+        free_pages=_pragma(conn, "freelist_count"),
+        file_size=os.path.getsize(db_path),
+        wal_size=os.path.getsize(wal_path) if os.path.exists(wal_path) else 0,
+        auto_vacuum=AUTO_VACUUM_MODES.get(_pragma(conn, "auto_vacuum"), "none"),
+        fragmentation=fragmentation,
+        unused_bytes=unused_bytes,
+        analyzed=analyzed is not None,
+    )
+
+
+def needs_rebuild(stats: DatabaseStats) -> bool:
+    """
+    Whether optimize() will rebuild the file with VACUUM: to switch it to
+    incremental auto_vacuum, or because its pages are largely empty or out
+    of order.
+    """
+    return (
+        stats.auto_vacuum != AUTO_VACUUM_MODES[INCREMENTAL]
+        or stats.slack >= REBUILD_SLACK
+        or (stats.fragmentation or 0.0) >= REBUILD_FRAGMENTATION
+    )
+
+
+def reclaim_step(storage, pages: int) -> int:
+    """
+    Returns up to `pages` free pages to the file system, in one short write
+    transaction; the number of pages freed. Only shrinks vaults in
+    incremental auto_vacuum mode.
+    """
+    conn = storage.conn
+    before = _pragma(conn, "freelist_count")
+    # executescript() steps the pragma to completion: execute() would stop
+    # after the first page
+    storage._retry_busy(
+        lambda: conn.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+    )
+    return before - _pragma(conn, "freelist_count")
+
+
+def optimize(
+    storage,
+    full: bool = False,
+    step_pages: int = DEFAULT_STEP_PAGES,
+    progress: Optional[Callable[[str, int, int], None]] = None,
+) -> OptimizeReport:
+    """
+    Maintains the vault behind `storage` (a VaultStorage):
+
+    - A vault not yet in incremental auto_vacuum mode, or with largely
+      empty or scattered pages (see needs_rebuild), or full=True, is
+      rebuilt with VACUUM, which defragments it and packs every page. This
+      rewrites the whole file: the caller should hold the exclusive vault
+      lock.
+    - Otherwise free pages are reclaimed `step_pages` at a time, each step
+      a short transaction, so other processes keep working in between.
+    - Planner statistics are gathered with ANALYZE the first time (and with
+      full=True), then kept fresh with PRAGMA optimize.
+    - The WAL is checkpointed and truncated.
+
+    progress(action, done, total) is called as the work advances.
+    """
+    start = time.perf_counter()
+    conn = storage.conn
+    report = OptimizeReport(database_stats(conn, storage.db_path))
+
+    def step(action, done=0, total=0):
+        if progress:
+            progress(action, done, total)
+
+    if full or needs_rebuild(report.before):
+        step(VACUUM)
+        conn.execute(f"PRAGMA auto_vacuum = {INCREMENTAL}")
+        storage._retry_busy(lambda: conn.execute("VACUUM"))
+        report.pages_reclaimed = report.before.free_pages
+        report.actions.append(VACUUM)
+    else:
+        total = _pragma(conn, "freelist_count")
+        while report.pages_reclaimed < total:
+            freed = reclaim_step(storage, step_pages)
+            if not freed:
+                break
+            report.pages_reclaimed += freed
+            step(RECLAIM, report.pages_reclaimed, total)
+        if report.pages_reclaimed:
+            report.actions.append(RECLAIM)
+
+    if full or not report.before.analyzed:
+        step(ANALYZE)
+        storage._retry_busy(lambda: conn.execute("ANALYZE"))
+        report.actions.append(ANALYZE)
+    else:
+        step(REFRESH)
+        storage._retry_busy(lambda: conn.execute("PRAGMA optimize"))
+        report.actions.append(REFRESH)
+
+    step(CHECKPOINT)
+    storage._retry_busy(lambda: conn.execute("PRAGMA wal_checkpoint(TRUNCATE)"))
+    report.actions.append(CHECKPOINT)
+
+    report.after = database_stats(conn, storage.db_path)
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+def auto_maintain(storage):
+    """
+    Light maintenance run when a connection that wrote to the vault closes:
+    one bounded incremental_vacuum step once enough pages are free, and a
+    sampled PRAGMA optimize once `pyvault optimize` gathered statistics.
+    Off when the vault's auto_maintenance setting is 0. Never raises for
+    SQLite errors: maintenance can always wait for the next write.
+    """
+    conn = storage.conn
+    try:
+        row = conn.execute(
+            "SELECT auto_maintenance FROM config WHERE id = 1"
+        ).fetchone()
+        if row is None or not row[0]:
+            return
+        if (
+            _pragma(conn, "auto_vacuum") == INCREMENTAL
+            and _pragma(conn, "freelist_count") >= AUTO_VACUUM_THRESHOLD
+        ):
+            reclaim_step(storage, DEFAULT_STEP_PAGES)
+        if conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'"
+        ).fetchone():
+            conn.execute(f"PRAGMA analysis_limit = {AUTO_ANALYSIS_LIMIT}")
+            conn.execute("PRAGMA optimize")
+    except sqlite3.Error:
+        pass
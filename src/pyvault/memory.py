@@ -0,0 +1,455 @@
+import os
+import sqlite3
+import struct
+from bisect import bisect_right
+from contextlib import contextmanager
+from typing import Optional, Tuple
+
+from cryptography.exceptions import InvalidTag
+
+from pyvault import migrations
+from pyvault.crypto import DEFAULT_CIPHER, STREAM_HEADER_SIZE, StreamCipher
+from pyvault.locking import VaultLock, VaultLockedError, lock_path_for
+from pyvault.storage import DEFAULT_BUSY_RETRIES, DEFAULT_BUSY_TIMEOUT, VaultStorage
+
+# --- File format ---
+# MAGIC | FORMAT_VERSION | cipher id (0: not set) | salt length (u16) | salt
+# | verifier length (u16) | verifier | stream header | chunks, each a u32
+# length followed by the encrypted chunk (see crypto.StreamCipher). The
+# stream's plaintext is everything before the stream header (so the clear
+# header is authenticated too) followed by the SQLite image of the vault.
+# Only the salt, the verifier and the cipher can be read without the key.
+MAGIC = b"PYVAULT\x00"
+FORMAT_VERSION = 1
+CHUNK_SIZE = 1024 * 1024
+# The image is compacted with VACUUM before it is written once this share of
+# its pages is free
+VACUUM_SHARE = 0.25
+# Loading and writing whole images needs sqlite3 serialize()/deserialize()
+HAS_IMAGES = hasattr(sqlite3.Connection, "serialize")
+
+_LENGTH = struct.Struct(">I")
+
+
+class VaultFileError(Exception):
+    """Raised when a memory-engine vault file is damaged or was altered."""
+
+
+def require_images(what: str):
+    """Raises VaultFileError if this Python cannot serialize SQLite images."""
+    if not HAS_IMAGES:
+        raise VaultFileError(f"{what} needs Python 3.11 or newer.")
+
+
+def is_memory_vault(path) -> bool:
+    """True if the file at path is a memory-engine vault."""
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def write_lock_path(db_path) -> str:
+    """Lock file serializing the writers of a memory-engine vault."""
+    return lock_path_for(f"{db_path}.write")
+
+
+def _clear_header(salt, verifier, cipher) -> bytes:
+    salt, verifier = salt or b"", verifier or b""
+    return (
+        MAGIC
+        + bytes((FORMAT_VERSION, cipher or 0))
+        + struct.pack(">H", len(salt))
+        + salt
+        + struct.pack(">H", len(verifier))
+        + verifier
+    )
+
+
+def read_header(data: bytes) -> Tuple[int, Optional[bytes], Optional[bytes], int]:
+    """(header size, salt, verifier, cipher id) of a memory-engine file."""
+    try:
+        if data[: len(MAGIC)] != MAGIC or data[len(MAGIC)] != FORMAT_VERSION:
+            raise ValueError
+        cipher = data[len(MAGIC) + 1]
+        position = len(MAGIC) + 2
+        fields = []
+        for _ in range(2):
+            (size,) = struct.unpack_from(">H", data, position)
+            position += 2
+            fields.append(data[position : position + size] or None)
+            position += size
+        if position > len(data):
+            raise ValueError
+    except (IndexError, ValueError, struct.error):
+        raise VaultFileError("Not a PyVault memory-engine file.") from None
+    return position, fields[0], fields[1], cipher
+
+
+def seal_image(image: bytes, key: bytes, salt, verifier, cipher) -> bytes:
+    """Encrypts a SQLite image into the memory-engine file format."""
+    header = _clear_header(salt, verifier, cipher)
+    stream = StreamCipher.create(key, cipher or DEFAULT_CIPHER)
+    parts = [header, stream.header]
+    plaintext = memoryview(header + image)
+    chunks = range(0, max(len(plaintext), 1), CHUNK_SIZE)
+    for index, start in enumerate(chunks):
+        chunk = stream.encrypt_chunk(
+            index, plaintext[start : start + CHUNK_SIZE], start == chunks[-1]
+        )
+        parts += [_LENGTH.pack(len(chunk)), chunk]
+    return b"".join(parts)
+
+
+def unseal_image(data: bytes, key: bytes) -> bytes:
+    """
+    The SQLite image inside a memory-engine file. Raises VaultFileError if
+    any part of the file fails authentication.
+    """
+    size, _, _, _ = read_header(data)
+    position = size + STREAM_HEADER_SIZE
+    chunks = []
+    try:
+        stream = StreamCipher(key, data[size:position])
+        while position < len(data):
+            (length,) = _LENGTH.unpack_from(data, position)
+            position += _LENGTH.size
+            chunks.append(data[position : position + length])
+            position += length
+        plaintext = b"".join(stream.decrypt_chunks(chunks))
+    except (InvalidTag, ValueError, struct.error):
+        raise VaultFileError(
+            "The vault file is damaged or was altered: it cannot be decrypted."
+        ) from None
+    if plaintext[:size] != data[:size]:
+        raise VaultFileError("The vault file header was altered.")
+    return plaintext[size:]
+
+
+def write_atomically(path, data: bytes):
+    """
+    Replaces the file at path with data: written to a temporary file next
+    to it, flushed to disk, then renamed over it, so readers see either the
+    old file or the new one.
+    """
+    path = os.fspath(path)
+    temporary = f"{path}.tmp-{os.getpid()}"
+    fd = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    sync_directory(path)
+
+
+def sync_directory(path):
+    """Makes a rename to path durable (flushes its directory; POSIX only)."""
+    if hasattr(os, "O_DIRECTORY"):
+        directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+
+def _stamp(path):
+    """Changes whenever the file is replaced or rewritten."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def _empty_image() -> bytes:
+    conn = sqlite3.connect(":memory:")
+    try:
+        conn.execute("PRAGMA user_version = 0")
+        return conn.serialize()
+    finally:
+        conn.close()
+
+
+class MemoryVaultStorage(VaultStorage):
+    """
+    The memory engine: the whole vault is one encrypted, authenticated file
+    (service names and usernames included) that is decrypted into an
+    in-memory SQLite database at unlock and served from RAM. Point lookups
+    and name-sorted listings come from a dict and a sorted array built from
+    it; everything else runs the same SQL as the file engine.
+
+    Until unseal() is given the key only the salt, verifier and cipher (kept
+    in the clear header) can be read. Every committed change rewrites the
+    file atomically (write to a temporary file, then rename). Writers in
+    different processes take turns on a lock file, and each transaction
+    starts by reloading the file if another process replaced it.
+    Needs Python 3.11 or newer (sqlite3 serialize/deserialize).
+    """
+
+    engine = "memory"
+
+    def __init__(
+        self,
+        db_path=None,
+        auto_migrate=True,
+        busy_timeout=DEFAULT_BUSY_TIMEOUT,
+        max_retries=DEFAULT_BUSY_RETRIES,
+        check_same_thread=True,
+    ):
+        require_images(f"The {self.engine} engine")
+        self._key: Optional[bytearray] = None
+        self._loaded = False
+        # Reloads so far, and the file they read (see _stamp)
+        self._loads = 0
+        self._stamp = None
+        self._header = None
+        self._data = None
+        self._writer: Optional[VaultLock] = None
+        # Lookup structures: (loads, total_changes) they were built at
+        self._credentials = None
+        self._catalog = None
+        super().__init__(
+            db_path, auto_migrate, busy_timeout, max_retries, check_same_thread
+        )
+
+    def _open_connection(self, check_same_thread):
+        return sqlite3.connect(
+            ":memory:", isolation_level=None, check_same_thread=check_same_thread
+        )
+
+    def _configure_connection(self):
+        """Nothing to tune: the database lives in memory, one writer at a time."""
+
+    def _initialize_db(self):
+        """Reads the file; its schema is brought up to date by unseal()."""
+        self._read_file()
+
+    def _read_file(self):
+        try:
+            with open(self.db_path, "rb") as f:
+                self._data = f.read()
+        except FileNotFoundError:
+            self._data = None
+        self._stamp = _stamp(self.db_path)
+        if self._data is None:
+            self._header = None
+        else:
+            self._header = read_header(self._data)[1:]
+
+    # --- Key and loading ---
+
+    def unseal(self, key: bytes):
+        """
+        Decrypts the file with the vault key into memory (a new vault starts
+        empty). Raises VaultFileError if the file fails authentication.
+        """
+        self._key = bytearray(key)
+        if self._data is None and self._stamp is not None:
+            self._read_file()
+        self._load()
+
+    def seal(self):
+        """Writes back pending read counts, then drops the data and the key."""
+        if self._loaded:
+            self.flush_access()
+            self.conn.deserialize(_empty_image())
+            self._loaded = False
+            self._credentials = self._catalog = None
+        if self._key is not None:
+            self._key[:] = bytes(len(self._key))
+            self._key = None
+
+    def _load(self):
+        if self._data is None:
+            image = _empty_image()
+        else:
+            image = unseal_image(self._data, bytes(self._key))
+        fresh = self._data is None and self._stamp is None
+        self._data = None
+        self.conn.deserialize(image)
+        self._loaded = True
+        self._loads += 1
+        if migrations.pending_migrations(self.conn):
+            # A new vault is written by its first commit
+            self._lock_writes()
+            try:
+                migrations.upgrade(self.conn)
+                if not fresh:
+                    self._write_back()
+            finally:
+                self._unlock_writes()
+
+    def _refresh(self):
+        """Reloads the vault if another process replaced the file."""
+        if self._loaded and _stamp(self.db_path) != self._stamp:
+            self._read_file()
+            self._load()
+
+    def image(self) -> bytes:
+        self._refresh()
+        return self.conn.serialize()
+
+    def close(self):
+        """Writes back pending read counts, wipes the key and closes."""
+        if self.conn is not None and not self.conn.in_transaction:
+            self.seal()
+        super().close()
+
+    # --- Transactions ---
+
+    def _lock_writes(self):
+        self._writer = VaultLock(
+            f"{self.db_path}.write", exclusive=True, timeout=self.busy_timeout / 1000
+        )
+        try:
+            self._writer.acquire()
+        except VaultLockedError:
+            self._writer = None
+            raise sqlite3.OperationalError("database is locked") from None
+
+    def _unlock_writes(self):
+        if self._writer is not None:
+            self._writer.release()
+            self._writer = None
+
+    @contextmanager
+    def transaction(self, write=False):
+        """
+        Like VaultStorage.transaction(). The outermost block first reloads
+        the file if another process changed it; a block that changed
+        anything writes the file back when it commits. Write transactions
+        hold the writer lock from the start; a read transaction that writes
+        takes it at commit, and fails as busy if the file changed meanwhile.
+        """
+        if self._tx_depth > 0:
+            with super().transaction(write=write) as conn:
+                yield conn
+            return
+        if write:
+            self._lock_writes()
+        try:
+            self._refresh()
+            changes = self.conn.total_changes
+            dirty = False
+            with super().transaction(write=write) as conn:
+                yield conn
+                dirty = self.conn.total_changes != changes
+                if dirty and self._writer is None:
+                    self._lock_writes()
+                    if _stamp(self.db_path) != self._stamp:
+                        raise sqlite3.OperationalError("database is locked")
+            if dirty:
+                self._write_back()
+        finally:
+            self._unlock_writes()
+
+    def _write_back(self):
+        conn = self.conn
+        try:
+            pages = conn.execute("PRAGMA page_count").fetchone()[0]
+            if conn.execute("PRAGMA freelist_count").fetchone()[0] > pages * (
+                VACUUM_SHARE
+            ):
+                conn.execute("VACUUM")
+            master = conn.execute(
+                "SELECT master_salt, master_verifier, cipher FROM config WHERE id = 1"
+            ).fetchone() or (None, None, None)
+            write_atomically(
+                self.db_path,
+                seal_image(conn.serialize(), bytes(self._key), *master),
+            )
+        except BaseException:
+            # Memory holds changes the file does not: go back to the file
+            self._read_file()
+            self._load()
+            raise
+        self._stamp = _stamp(self.db_path)
+        self._header = master
+
+    def change_token(self):
+        """
+        Changes with every reload, every change made here (read counts
+        aside) and whenever another process replaced the file.
+        """
+        stamp = _stamp(self.db_path)
+        return (
+            self._loads,
+            stamp if stamp != self._stamp else None,
+            self.conn.total_changes - self._access_changes,
+        )
+
+    # --- Master data before the key is known ---
+
+    def get_master_data(self):
+        if self._loaded:
+            return super().get_master_data()
+        if self._header is None or self._header[0] is None:
+            return None
+        return self._header[0], self._header[1]
+
+    def get_cipher(self):
+        if self._loaded:
+            return super().get_cipher()
+        return (self._header[2] or None) if self._header else None
+
+    # --- Reads served from memory ---
+
+    def _current(self, built) -> bool:
+        return built is not None and built[0] == (self._loads, self.conn.total_changes)
+
+    def _lookups_allowed(self) -> bool:
+        """
+        Lookup structures are built and used only outside transactions
+        (their writes may still roll back), on the committed data.
+        """
+        if not self._loaded or self.conn.in_transaction:
+            return False
+        self._refresh()
+        return True
+
+    def get_credential(self, service: str):
+        if not self._lookups_allowed():
+            return super().get_credential(service)
+        if not self._current(self._credentials):
+            rows = self.conn.execute(
+                "SELECT service, username, password_blob FROM credentials"
+            )
+            self._credentials = (
+                (self._loads, self.conn.total_changes),
+                {service: (username, blob) for service, username, blob in rows},
+            )
+        return self._credentials[1].get(service)
+
+    def get_credentials(self, services):
+        if not self._lookups_allowed():
+            return super().get_credentials(services)
+        found = {}
+        for service in services:
+            row = self.get_credential(service)
+            if row is not None:
+                found[service] = row
+        return found
+
+    def get_catalog(
+        self, where=None, after=None, limit=None, stream=False, order="name"
+    ):
+        if where is not None or order != "name" or not self._lookups_allowed():
+            return super().get_catalog(where, after, limit, stream, order)
+        if not self._current(self._catalog):
+            rows = super().get_catalog()
+            self._catalog = (
+                (self._loads, self.conn.total_changes),
+                rows,
+                [row[0] for row in rows],
+            )
+        _, rows, names = self._catalog
+        start = 0 if after is None else bisect_right(names, after)
+        page = rows[start:] if limit is None else rows[start : start + limit]
+        return (row for row in page) if stream else page
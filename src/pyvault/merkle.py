@@ -0,0 +1,171 @@
+import hashlib
+import struct
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+# The credentials are spread over 2**LEAF_BITS buckets by a hash of the service
+# name. A fixed tree of fan-out 2**FANOUT_BITS sits on top of the buckets:
+#   level 0: root, level 1: 16 nodes, level 2: 256 nodes, level 3: 4096 leaves.
+# Every node stores the XOR of the record hashes below it, so a write updates
+# its DEPTH + 1 ancestors with a single statement and two vaults holding the
+# same records have identical trees.
+FANOUT_BITS = 4
+DEPTH = 3
+LEAF_BITS = FANOUT_BITS * DEPTH
+FANOUT = 1 << FANOUT_BITS
+BUCKETS = 1 << LEAF_BITS
+
+# Node ids: levels are stored one after another (root = 0)
+_LEVEL_OFFSETS = [sum(FANOUT**i for i in range(level)) for level in range(DEPTH + 1)]
+NODE_COUNT = _LEVEL_OFFSETS[-1] + BUCKETS
+
+# XOR of two signed 64-bit integers; SQLite only has &, | and ~
+_XOR = "({col} | ?) & ~({col} & ?)"
+UPDATE_PATH_SQL = (
+    "UPDATE merkle_nodes SET h1 = {h1}, h2 = {h2} "
+    "WHERE node IN ({nodes})".format(
+        h1=_XOR.format(col="h1"),
+        h2=_XOR.format(col="h2"),
+        nodes=", ".join("?" * (DEPTH + 1)),
+    )
+)
+
+Digest = Tuple[int, int]
+EMPTY: Digest = (0, 0)
+
+
+def node_id(level: int, index: int) -> int:
+    return _LEVEL_OFFSETS[level] + index
+
+
+def bucket_of(service: str) -> int:
+    """Leaf bucket of a service (stable across vaults and versions)."""
+    digest = hashlib.blake2b(service.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") >> (64 - LEAF_BITS)
+
+
+def path(bucket: int) -> List[int]:
+    """Node ids from the root down to the bucket's leaf."""
+    return [
+        node_id(level, bucket >> (FANOUT_BITS * (DEPTH - level)))
+        for level in range(DEPTH + 1)
+    ]
+
+
+def record_hash(
+    service: str,
+    username: Optional[str],
+    blob: Optional[bytes],
+    version: int,
+    timestamp: float,
+) -> bytes:
+    """
+    16-byte hash identifying one state of a record. Tombstones (deleted
+    records) have username and blob set to None.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for part in (service.encode(), (username or "").encode(), blob or b""):
+        h.update(struct.pack("<I", len(part)))
+        h.update(part)
+    h.update(struct.pack("<?qd", blob is None, version, timestamp))
+    return h.digest()
+
+
+def to_digest(hash_bytes: Optional[bytes]) -> Digest:
+    return struct.unpack("<qq", hash_bytes) if hash_bytes else EMPTY
+
+
+def xor(a: Digest, b: Digest) -> Digest:
+    return a[0] ^ b[0], a[1] ^ b[1]
+
+
+# --- Storage helpers (run inside the caller's transaction) ---
+
+
+def create_nodes(conn):
+    conn.executemany(
+        "INSERT OR IGNORE INTO merkle_nodes (node, h1, h2) VALUES (?, 0, 0)",
+        ((node,) for node in range(NODE_COUNT)),
+    )
+
+
+def apply_change(
+    conn, bucket: int, old_hash: Optional[bytes], new_hash: Optional[bytes]
+):
+    """Replaces old_hash by new_hash in every node above the bucket."""
+    d1, d2 = xor(to_digest(old_hash), to_digest(new_hash))
+    if (d1, d2) != EMPTY:
+        conn.execute(UPDATE_PATH_SQL, (d1, d1, d2, d2, *path(bucket)))
+
+
+def apply_changes(conn, deltas: Dict[int, Digest]):
+    """Applies accumulated per-bucket deltas (bulk writes and migrations)."""
+    nodes: Dict[int, Digest] = {}
+    for bucket, delta in deltas.items():
+        for node in path(bucket):
+            nodes[node] = xor(nodes.get(node, EMPTY), delta)
+    conn.executemany(
+        "UPDATE merkle_nodes SET h1 = {h1}, h2 = {h2} WHERE node = ?".format(
+            h1=_XOR.format(col="h1"), h2=_XOR.format(col="h2")
+        ),
+        (
+            (h1, h1, h2, h2, node)
+            for node, (h1, h2) in nodes.items()
+            if (h1, h2) != EMPTY
+        ),
+    )
+
+
+def children(conn, level: int, index: int) -> Dict[int, Digest]:
+    """Digests of the children of a node, keyed by their index in the next level."""
+    first = index * FANOUT
+    offset = _LEVEL_OFFSETS[level + 1]
+    rows = conn.execute(
+        "SELECT node, h1, h2 FROM merkle_nodes WHERE node BETWEEN ? AND ?",
+        (offset + first, offset + first + FANOUT - 1),
+    )
+    return {node - offset: (h1, h2) for node, h1, h2 in rows}
+
+
+def root(conn) -> Digest:
+    row = conn.execute("SELECT h1, h2 FROM merkle_nodes WHERE node = 0").fetchone()
+    return tuple(row) if row else EMPTY
+
+
+def differing_buckets(local, remote) -> List[int]:
+    """
+    Walks two trees from the root and returns the leaf buckets whose digests
+    differ, only descending into differing subtrees.
+    local and remote are callables (level, index) -> {child index: digest}.
+    """
+    frontier = [0]
+    for level in range(DEPTH):
+        next_frontier = []
+        for index in frontier:
+            ours, theirs = local(level, index), remote(level, index)
+            next_frontier.extend(
+                child
+                for child in sorted(ours.keys() | theirs.keys())
+                if ours.get(child, EMPTY) != theirs.get(child, EMPTY)
+            )
+        frontier = next_frontier
+    return frontier
+
+
+class Entry(NamedTuple):
+    """One record state as exchanged by sync; a tombstone has blob None."""
+
+    service: str
+    username: Optional[str]
+    blob: Optional[bytes]
+    version: int
+    timestamp: float
+    record_hash: bytes
+
+    @classmethod
+    def create(cls, service, username, blob, version, timestamp) -> "Entry":
+        digest = record_hash(service, username, blob, version, timestamp)
+        return cls(service, username, blob, version, timestamp, digest)
+
+    @property
+    def deleted(self) -> bool:
+        return self.blob is None
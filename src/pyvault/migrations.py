@@ -0,0 +1,504 @@
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from pyvault import merkle
+
+# Batch step: (connection, resume cursor, batch size) -> (rows processed, next cursor).
+# A next cursor of None means the data phase is complete.
+BatchStep = Callable[[object, Optional[str], int], Tuple[int, Optional[str]]]
+
+DEFAULT_BATCH_SIZE = 500
+
+
+class MigrationError(Exception):
+    """Raised when the vault schema cannot be brought up to date."""
+
+
+class Migration:
+    """
+    One schema version.
+
+    `schema` holds fast DDL statements (or callables taking the connection)
+    applied in a single transaction.
+    `batch` (optional) is a heavy data phase run in small resumable batches;
+    `count` returns how many rows it has to process (used for progress and
+    estimates). The vault's user_version is only bumped once both phases are done.
+    """
+
+    def __init__(
+        self,
+        version: int,
+        description: str,
+        schema: Sequence[str] = (),
+        batch: Optional[BatchStep] = None,
+        count: Optional[Callable[[object], int]] = None,
+    ):
+        self.version = version
+        self.description = description
+        self.schema = schema
+        self.batch = batch
+        self.count = count
+
+    def rows_to_process(self, conn) -> int:
+        return self.count(conn) if self.count else 0
+
+
+# --- Data migrations ---
+
+
+def _backfill_record_hashes(conn, cursor, limit):
+    """v3: hashes every existing record and adds it to the Merkle tree."""
+    rows = conn.execute(
+        "SELECT service, username, password_blob, version, updated_at FROM credentials "
+        "WHERE record_hash IS NULL AND (? IS NULL OR service > ?) "
+        "ORDER BY service LIMIT ?",
+        (cursor, cursor, limit),
+    ).fetchall()
+    deltas = {}
+    for service, username, blob, version, updated_at in rows:
+        digest = merkle.record_hash(service, username, blob, version, updated_at)
+        bucket = merkle.bucket_of(service)
+        conn.execute(
+            "UPDATE credentials SET record_hash = ?, bucket = ? WHERE service = ?",
+            (digest, bucket, service),
+        )
+        deltas[bucket] = merkle.xor(
+            deltas.get(bucket, merkle.EMPTY), merkle.to_digest(digest)
+        )
+    merkle.apply_changes(conn, deltas)
+    return len(rows), (rows[-1][0] if len(rows) == limit else None)
+
+
+def _count_unhashed(conn):
+    return conn.execute(
+        "SELECT COUNT(*) FROM credentials WHERE record_hash IS NULL"
+    ).fetchone()[0]
+
+
+def _backfill_timestamp(column: str) -> BatchStep:
+    """
+    Batch step filling a new timestamp column of existing credentials with
+    their last change, one rowid range per batch. Rows already written with
+    a real value (0 is the column default) are left alone.
+    """
+
+    def step(conn, cursor, limit):
+        rows = conn.execute(
+            "SELECT rowid FROM credentials WHERE rowid > ? ORDER BY rowid LIMIT ?",
+            (int(cursor or 0), limit),
+        ).fetchall()
+        if rows:
+            conn.execute(
+                f"UPDATE credentials SET {column} = updated_at "
+                f"WHERE rowid BETWEEN ? AND ? AND {column} = 0",
+                (rows[0][0], rows[-1][0]),
+            )
+        return len(rows), (str(rows[-1][0]) if len(rows) == limit else None)
+
+    return step
+
+
+def _count_unset(column: str) -> Callable[[object], int]:
+    def count(conn):
+        return conn.execute(
+            f"SELECT COUNT(*) FROM credentials WHERE {column} = 0"
+        ).fetchone()[0]
+
+    return count
+
+
+# --- Schema history ---
+
+MIGRATIONS: List[Migration] = [
+    Migration(
+        1,
+        "Baseline schema (config and credentials tables)",
+        schema=[
+            """
+            CREATE TABLE IF NOT EXISTS config (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                master_salt BLOB NOT NULL,
+                master_verifier BLOB NOT NULL
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS credentials (
+                service TEXT PRIMARY KEY,
+                username TEXT NOT NULL,
+                password_blob BLOB NOT NULL
+            )
+            """,
+        ],
+    ),
+    Migration(
+        2,
+        "Preferred cipher for new records",
+        # NULL: vault created before cipher agility, AES-256-GCM is kept
+        schema=["ALTER TABLE config ADD COLUMN cipher INTEGER"],
+    ),
+    Migration(
+        3,
+        "Record versions, tombstones and Merkle tree for sync",
+        schema=[
+            "ALTER TABLE credentials ADD COLUMN version INTEGER NOT NULL DEFAULT 1",
+            # 0: written before versioning, older than any real change
+            "ALTER TABLE credentials ADD COLUMN updated_at REAL NOT NULL DEFAULT 0",
+            "ALTER TABLE credentials ADD COLUMN record_hash BLOB",
+            "ALTER TABLE credentials ADD COLUMN bucket INTEGER",
+            "CREATE INDEX idx_credentials_bucket ON credentials (bucket)",
+            """
+            CREATE TABLE tombstones (
+                service TEXT PRIMARY KEY,
+                version INTEGER NOT NULL,
+                deleted_at REAL NOT NULL,
+                record_hash BLOB NOT NULL,
+                bucket INTEGER NOT NULL
+            )
+            """,
+            "CREATE INDEX idx_tombstones_bucket ON tombstones (bucket)",
+            """
+            CREATE TABLE merkle_nodes (
+                node INTEGER PRIMARY KEY,
+                h1 INTEGER NOT NULL,
+                h2 INTEGER NOT NULL
+            )
+            """,
+            merkle.create_nodes,
+        ],
+        batch=_backfill_record_hashes,
+        count=_count_unhashed,
+    ),
+    Migration(
+        4,
+        "File attachments stored as encrypted chunks",
+        schema=[
+            """
+            CREATE TABLE attachments (
+                id INTEGER PRIMARY KEY,
+                service TEXT NOT NULL,
+                name TEXT NOT NULL,
+                header BLOB NOT NULL,
+                size INTEGER NOT NULL DEFAULT 0,
+                chunks INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                UNIQUE (service, name)
+            )
+            """,
+            """
+            CREATE TABLE attachment_chunks (
+                attachment_id INTEGER NOT NULL,
+                chunk INTEGER NOT NULL,
+                data BLOB NOT NULL,
+                PRIMARY KEY (attachment_id, chunk)
+            )
+            """,
+        ],
+    ),
+    Migration(
+        5,
+        "Version history of credentials and its retention policy",
+        schema=[
+            # Small rows clustered by (service, version): one service's history
+            # is a single range scan and costs no rowid index
+            """
+            CREATE TABLE credential_history (
+                service TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                username TEXT NOT NULL,
+                password_blob BLOB NOT NULL,
+                created_at REAL NOT NULL,
+                replaced_at REAL NOT NULL,
+                PRIMARY KEY (service, version)
+            ) WITHOUT ROWID
+            """,
+            "CREATE INDEX idx_history_replaced ON credential_history (replaced_at)",
+            # Previous versions kept per service (NULL: no limit) and days a
+            # replaced version is kept (NULL: no limit)
+            "ALTER TABLE config ADD COLUMN history_keep INTEGER DEFAULT 10",
+            "ALTER TABLE config ADD COLUMN history_days REAL",
+        ],
+    ),
+    Migration(
+        6,
+        "Tags, folders and creation times with filter indexes",
+        schema=[
+            "ALTER TABLE credentials ADD COLUMN folder TEXT",
+            "ALTER TABLE credentials ADD COLUMN created_at REAL NOT NULL DEFAULT 0",
+            "CREATE INDEX idx_credentials_folder ON credentials (folder)",
+            "CREATE INDEX idx_credentials_updated ON credentials (updated_at)",
+            "CREATE INDEX idx_credentials_created ON credentials (created_at)",
+            """
+            CREATE TABLE credential_tags (
+                tag TEXT NOT NULL,
+                service TEXT NOT NULL,
+                PRIMARY KEY (tag, service)
+            ) WITHOUT ROWID
+            """,
+            "CREATE INDEX idx_tags_service ON credential_tags (service)",
+        ],
+        # Best guess for existing records: their last change
+        batch=_backfill_timestamp("created_at"),
+        count=_count_unset("created_at"),
+    ),
+    Migration(
+        7,
+        "Last access time of each credential",
+        schema=[
+            "ALTER TABLE credentials ADD COLUMN last_accessed_at REAL NOT NULL DEFAULT 0",
+            "CREATE INDEX idx_credentials_accessed ON credentials (last_accessed_at)",
+        ],
+        # Never read since: the last write is the last access
+        batch=_backfill_timestamp("last_accessed_at"),
+        count=_count_unset("last_accessed_at"),
+    ),
+    Migration(
+        8,
+        "Automatic maintenance setting",
+        schema=[
+            # 1: connections that wrote reclaim free pages and refresh
+            # planner statistics when they close (see pyvault.maintenance)
+            "ALTER TABLE config ADD COLUMN auto_maintenance INTEGER NOT NULL DEFAULT 1",
+        ],
+    ),
+    Migration(
+        9,
+        "Read counts of each credential",
+        schema=[
+            "ALTER TABLE credentials ADD COLUMN access_count INTEGER NOT NULL DEFAULT 0",
+            # Most read first (list --sort frequent, the prefetched hot set)
+            "CREATE INDEX idx_credentials_access_count "
+            "ON credentials (access_count, last_accessed_at)",
+        ],
+    ),
+    Migration(
+        10,
+        "Change feed for caches of long-running processes",
+        schema=[
+            # Bumped by every write transaction that changes a credential
+            "ALTER TABLE config ADD COLUMN change_seq INTEGER NOT NULL DEFAULT 0",
+            # Last change_seq at which each service changed (deleted ones too)
+            """
+            CREATE TABLE changes (
+                service TEXT PRIMARY KEY,
+                seq INTEGER NOT NULL
+            ) WITHOUT ROWID
+            """,
+            "CREATE INDEX idx_changes_seq ON changes (seq)",
+        ],
+    ),
+    Migration(
+        11,
+        "Sync bases for telling one-sided changes from conflicts",
+        schema=[
+            # Random id given at the first sync; copies share it until then
+            "ALTER TABLE config ADD COLUMN vault_id BLOB",
+            # change_seq of this vault and of the peer when they last synced
+            """
+            CREATE TABLE sync_peers (
+                peer BLOB PRIMARY KEY,
+                seq INTEGER NOT NULL,
+                peer_seq INTEGER NOT NULL,
+                synced_at REAL NOT NULL
+            ) WITHOUT ROWID
+            """,
+            # Record state a tombstone deleted (NULL for older tombstones)
+            "ALTER TABLE tombstones ADD COLUMN replaced_hash BLOB",
+        ],
+    ),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+# --- Engine ---
+
+
+def get_version(conn) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def pending_migrations(conn, migrations: Sequence[Migration] = MIGRATIONS):
+    """Returns the migrations newer than the vault's user_version."""
+    current = get_version(conn)
+    latest = migrations[-1].version if migrations else 0
+    if current > latest:
+        raise MigrationError(
+            f"Vault schema v{current} is newer than this PyVault (v{latest}). Please upgrade."
+        )
+    return [m for m in migrations if m.version > current]
+
+
+def _ensure_state_table(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            cursor TEXT,
+            rows_done INTEGER NOT NULL DEFAULT 0,
+            started_at REAL NOT NULL,
+            finished_at REAL
+        )
+        """
+    )
+
+
+def _load_state(conn, version: int):
+    return conn.execute(
+        "SELECT cursor, rows_done FROM schema_migrations WHERE version = ?", (version,)
+    ).fetchone()
+
+
+def _apply_schema(conn, migration: Migration):
+    for statement in migration.schema:
+        if callable(statement):
+            statement(conn)
+        else:
+            conn.execute(statement)
+    conn.execute(
+        "INSERT INTO schema_migrations (version, description, started_at) VALUES (?, ?, ?)",
+        (migration.version, migration.description, time.time()),
+    )
+
+
+def _finish(conn, migration: Migration):
+    conn.execute(
+        "UPDATE schema_migrations SET cursor = NULL, finished_at = ? WHERE version = ?",
+        (time.time(), migration.version),
+    )
+    # PRAGMA user_version is part of the transaction: it only moves on commit
+    conn.execute(f"PRAGMA user_version = {int(migration.version)}")
+
+
+def upgrade(
+    conn,
+    migrations: Sequence[Migration] = MIGRATIONS,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    progress: Optional[Callable[[Migration, int, int], None]] = None,
+) -> List[int]:
+    """
+    Applies every pending migration and returns the versions applied.
+
+    The connection must be in autocommit mode (isolation_level=None).
+    Each data batch commits on its own, so the write lock is held only briefly
+    and readers keep working; an interrupted upgrade resumes from the last
+    committed batch on the next call. Every step re-reads the version and the
+    resume cursor under the write lock, so concurrent upgraders cooperate.
+    """
+    applied = []
+    if not pending_migrations(conn, migrations):
+        return applied
+
+    _ensure_state_table(conn)
+    for migration in pending_migrations(conn, migrations):
+        total = None
+        while True:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if get_version(conn) >= migration.version:
+                    # Another process finished this migration meanwhile
+                    conn.commit()
+                    break
+
+                state = _load_state(conn, migration.version)
+                if state is None:
+                    _apply_schema(conn, migration)
+                    cursor, rows_done = None, 0
+                    if migration.batch is None:
+                        _finish(conn, migration)
+                        conn.commit()
+                        applied.append(migration.version)
+                        break
+                else:
+                    cursor, rows_done = state
+
+                if total is None:
+                    total = rows_done + migration.rows_to_process(conn)
+                    if progress:
+                        progress(migration, rows_done, total)
+
+                processed, cursor = migration.batch(conn, cursor, batch_size)
+                rows_done += processed
+                conn.execute(
+                    "UPDATE schema_migrations SET cursor = ?, rows_done = ? WHERE version = ?",
+                    (cursor, rows_done, migration.version),
+                )
+                if cursor is None:
+                    _finish(conn, migration)
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+
+            if progress:
+                progress(migration, rows_done, max(total, rows_done))
+            if cursor is None:
+                applied.append(migration.version)
+                break
+    return applied
+
+
+def _add_sample_rows(conn, count: int):
+    """Inserts count made-up credentials (the estimate rolls them back)."""
+    conn.executemany(
+        "INSERT OR IGNORE INTO credentials (service, username, password_blob) "
+        "VALUES (?, 'user', ?)",
+        ((f"\x00estimate-{i:06d}", bytes(64)) for i in range(count)),
+    )
+
+
+def estimate(
+    conn,
+    migrations: Sequence[Migration] = MIGRATIONS,
+    rows: Optional[int] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> List[Dict[str, object]]:
+    """
+    Estimates the duration of each pending migration without changing the vault.
+
+    The schema phase and one data batch are executed for real inside a
+    transaction that is always rolled back; the measured per-row cost is then
+    scaled to `rows` (or to the rows currently in the vault). When the vault
+    has no rows left to migrate, the batch runs on made-up rows instead.
+    """
+    report = []
+    pending = pending_migrations(conn, migrations)
+    if not pending:
+        return report
+
+    conn.execute("BEGIN")
+    try:
+        _ensure_state_table(conn)
+        for migration in pending:
+            started = time.perf_counter()
+            if _load_state(conn, migration.version) is None:
+                _apply_schema(conn, migration)
+            schema_seconds = time.perf_counter() - started
+
+            total = migration.rows_to_process(conn)
+            sample = min(batch_size, total)
+            if migration.batch is not None and not sample and rows:
+                # Nothing left to migrate here: time a batch of made-up rows
+                sample = min(batch_size, rows)
+                _add_sample_rows(conn, sample)
+            per_row = 0.0
+            if migration.batch is not None and sample:
+                started = time.perf_counter()
+                processed, _ = migration.batch(conn, None, sample)
+                if processed:
+                    per_row = (time.perf_counter() - started) / processed
+
+            target_rows = total if rows is None else rows
+            report.append(
+                {
+                    "version": migration.version,
+                    "description": migration.description,
+                    "rows": target_rows,
+                    "seconds": schema_seconds + per_row * target_rows,
+                }
+            )
+            # Later migrations may depend on this one's schema
+            _finish(conn, migration)
+    finally:
+        conn.rollback()
+    return report
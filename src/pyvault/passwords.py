@@ -0,0 +1,31 @@
+import secrets
+import string
+from typing import List
+
+PASSWORD_ALPHABET = string.ascii_letters + string.digits + string.punctuation
+
+
+def generate_password(length: int = 20) -> str:
+    """Generates a cryptographically secure random password."""
+    return "".join(secrets.choice(PASSWORD_ALPHABET) for _ in range(length))
+
+
+def generate_passwords(count: int, length: int = 20) -> List[str]:
+    """
+    Generates `count` passwords from one stream of random bytes, mapped to
+    the alphabet in C by bytes.translate() instead of one secrets.choice()
+    call per character. Bytes past the largest multiple of the alphabet size
+    are dropped, so every character stays equally likely.
+    """
+    size = len(PASSWORD_ALPHABET)
+    limit = 256 - 256 % size
+    table = bytes(ord(PASSWORD_ALPHABET[b % size]) for b in range(256))
+    rejected = bytes(range(limit, 256))
+    needed = count * length
+    chars = b""
+    while len(chars) < needed:
+        # Enough bytes on average, plus a margin for the rejected ones
+        draw = (needed - len(chars)) * 256 // limit + 16
+        chars += secrets.token_bytes(draw).translate(table, rejected)
+    text = chars[:needed].decode("ascii")
+    return [text[i : i + length] for i in range(0, needed, length)]
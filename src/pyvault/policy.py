@@ -0,0 +1,459 @@
+"""
+Password policies for `audit`, read from a TOML or JSON file:
+
+    min_length = 12
+    require = ["lower", "upper", "digit"]    # lower, upper, digit, symbol
+    banned = ["password", "acme"]            # substrings, ASCII case ignored
+    max_age = "90d"                          # same ages as the filters
+    reuse = true                             # flag passwords used twice
+
+    [tags.prod]                              # stricter rules for a tag
+    min_length = 20
+    require = ["symbol"]
+    max_age = "30d"
+
+Tag rules only ever tighten the defaults: a credential gets the largest
+minimum length, every required class, every banned substring and the
+shortest maximum age of the defaults and the tags it carries.
+
+Passwords are checked a chunk at a time, packed as UTF-8 into a zero-padded
+matrix of bytes, one row per password. With NumPy each rule is a handful of
+array operations over the whole chunk; without it the same rules run as
+bytes methods (implemented in C) password by password. Both backends give
+the same result: 'symbol' is any character other than an ASCII letter or
+digit (non-ASCII letters included), and lengths are counted in characters.
+"""
+
+import json
+import time
+from typing import Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Tuple
+
+from pyvault.query import parse_age
+
+try:
+    import numpy
+except ImportError:  # optional: pip install "pyvault-cli[fast]"
+    numpy = None
+
+CHARACTER_CLASSES = ("lower", "upper", "digit", "symbol")
+# Rule ids and descriptions, as listed in reports
+RULES = {
+    "min-length": "Password shorter than the policy's minimum length.",
+    "character-class": "Password lacks a required character class.",
+    "banned-substring": "Password contains a banned substring.",
+    "max-age": "Password not changed for longer than the policy allows.",
+    "reuse": "Password shared with other credentials.",
+}
+BACKENDS = ("numpy", "python")
+# Passwords packed into one matrix
+CHUNK_ROWS = 65_536
+
+_LOWER = bytes(range(ord("a"), ord("z") + 1))
+_UPPER = bytes(range(ord("A"), ord("Z") + 1))
+_DIGIT = bytes(range(ord("0"), ord("9") + 1))
+# UTF-8 continuation bytes and NUL (the matrix padding) are not characters
+_NOT_CHARACTERS = bytes(range(0x80, 0xC0)) + b"\0"
+_ASCII_LOWER = bytes.maketrans(_UPPER, _LOWER)
+_KEYS = {"min_length", "require", "banned", "max_age"}
+
+
+class PolicyError(ValueError):
+    pass
+
+
+class Rules(NamedTuple):
+    min_length: int = 0
+    require: FrozenSet[str] = frozenset()
+    banned: Tuple[str, ...] = ()
+    max_age: Optional[float] = None
+
+    def tighten(self, other: "Rules") -> "Rules":
+        """The strictest combination of two sets of rules."""
+        ages = [age for age in (self.max_age, other.max_age) if age is not None]
+        return Rules(
+            max(self.min_length, other.min_length),
+            self.require | other.require,
+            (*self.banned, *(b for b in other.banned if b not in self.banned)),
+            min(ages) if ages else None,
+        )
+
+
+class Violation(NamedTuple):
+    service: str
+    rule: str
+    message: str
+
+
+class PolicyReport(NamedTuple):
+    scanned: int
+    violations: List[Violation]
+    backend: str
+    seconds: float
+
+    def counts(self) -> Dict[str, int]:
+        """Violations per rule, in the order of RULES."""
+        counts = dict.fromkeys(RULES, 0)
+        for violation in self.violations:
+            counts[violation.rule] += 1
+        return {rule: count for rule, count in counts.items() if count}
+
+
+class Policy:
+    """Default rules, stricter rules per tag, and whether reuse is flagged."""
+
+    def __init__(
+        self,
+        rules: Rules = Rules(),
+        tags: Optional[Dict[str, Rules]] = None,
+        reuse: bool = True,
+    ):
+        self.rules = rules
+        self.tags = tags or {}
+        self.reuse = reuse
+        # Distinct rule sets in use: rows point into this list
+        self._variants: List[Rules] = [rules]
+        self._variant_of: Dict[Tuple[str, ...], int] = {(): 0}
+
+    @classmethod
+    def load(cls, path) -> "Policy":
+        """Reads a policy file: TOML, or JSON if the name ends in .json."""
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError as e:
+            raise PolicyError(f"Cannot read policy '{path}': {e.strerror}.") from None
+        try:
+            if str(path).endswith(".json"):
+                document = json.loads(data)
+            else:
+                document = _parse_toml(data)
+        except ValueError as e:
+            raise PolicyError(f"Invalid policy '{path}': {e}") from None
+        return cls.from_dict(document)
+
+    @classmethod
+    def from_dict(cls, document) -> "Policy":
+        if not isinstance(document, dict):
+            raise PolicyError("A policy is a table of rules.")
+        document = dict(document)
+        tags = document.pop("tags", {})
+        reuse = document.pop("reuse", True)
+        if not isinstance(tags, dict):
+            raise PolicyError("'tags' must map tag names to rules.")
+        if not isinstance(reuse, bool):
+            raise PolicyError("'reuse' must be true or false.")
+        return cls(
+            _rules(document, "policy"),
+            {tag: _rules(rules, f"tags.{tag}") for tag, rules in tags.items()},
+            reuse,
+        )
+
+    def rules_for(self, tags: Iterable[str]) -> Rules:
+        return self._variants[self._variant(tags)]
+
+    def _variant(self, tags: Iterable[str]) -> int:
+        if not tags or not self.tags:
+            return 0
+        key = tuple(sorted(tag for tag in tags if tag in self.tags))
+        index = self._variant_of.get(key)
+        if index is None:
+            rules = self.rules
+            for tag in key:
+                rules = rules.tighten(self.tags[tag])
+            index = self._variant_of[key] = len(self._variants)
+            self._variants.append(rules)
+        return index
+
+
+# Mirrors audit's built-in checks
+DEFAULT_POLICY = Policy(Rules(min_length=12))
+
+
+def _parse_toml(data: bytes):
+    try:
+        import tomllib
+    except ImportError:
+        try:
+            import tomli as tomllib
+        except ImportError:
+            raise PolicyError(
+                "TOML policies need Python 3.11 or the tomli package; "
+                "use a .json policy instead."
+            ) from None
+    return tomllib.loads(data.decode("utf-8"))
+
+
+def _rules(table, name: str) -> Rules:
+    if not isinstance(table, dict):
+        raise PolicyError(f"[{name}] must be a table of rules.")
+    unknown = set(table) - _KEYS
+    if unknown:
+        raise PolicyError(f"Unknown rule(s) in [{name}]: {', '.join(sorted(unknown))}.")
+    min_length = table.get("min_length", 0)
+    if not isinstance(min_length, int) or isinstance(min_length, bool):
+        raise PolicyError(f"[{name}] min_length must be a whole number.")
+    require = table.get("require", [])
+    if not isinstance(require, list) or not set(require) <= set(CHARACTER_CLASSES):
+        raise PolicyError(
+            f"[{name}] require lists classes among: {', '.join(CHARACTER_CLASSES)}."
+        )
+    banned = table.get("banned", [])
+    if not isinstance(banned, list) or not all(
+        isinstance(word, str) and word for word in banned
+    ):
+        raise PolicyError(f"[{name}] banned lists non-empty strings.")
+    max_age = table.get("max_age")
+    if max_age is not None:
+        max_age = parse_age(str(max_age))
+        if not max_age:
+            raise PolicyError(f"[{name}] max_age is an age such as 90d or 1y.")
+    return Rules(
+        min_length,
+        frozenset(require),
+        tuple(dict.fromkeys(word.lower() for word in banned)),
+        max_age,
+    )
+
+
+def available_backends() -> List[str]:
+    return [backend for backend in BACKENDS if backend != "numpy" or numpy]
+
+
+def evaluate(
+    policy: Policy,
+    rows: Iterable[Tuple[str, str, Optional[float], Iterable[str]]],
+    backend: Optional[str] = None,
+    now: Optional[float] = None,
+) -> PolicyReport:
+    """
+    Checks (service, password, updated_at, tags) rows against a policy.
+    `backend` is "numpy" (the default when it is installed) or "python".
+    """
+    backend = backend or available_backends()[0]
+    if backend not in available_backends():
+        raise PolicyError(f"The {backend} backend is not available.")
+    check = _check_numpy if backend == "numpy" else _check_python
+    now = time.time() if now is None else now
+    start = time.perf_counter()
+    violations: List[Violation] = []
+    first_use: Dict[bytes, str] = {}
+    shared: Dict[str, List[str]] = {}
+    scanned = 0
+    chunk: List[tuple] = []
+    for service, password, updated_at, tags in rows:
+        data = password.encode("utf-8")
+        if policy.reuse:
+            owner = first_use.setdefault(data, service)
+            if owner != service:
+                shared.setdefault(owner, [owner]).append(service)
+        chunk.append((service, data, updated_at, policy._variant(tags)))
+        if len(chunk) == CHUNK_ROWS:
+            violations += check(policy, chunk, now)
+            scanned += len(chunk)
+            chunk = []
+    if chunk:
+        violations += check(policy, chunk, now)
+        scanned += len(chunk)
+    for services in shared.values():
+        for service in services:
+            others = ", ".join(s for s in services if s != service)
+            violations.append(
+                Violation(service, "reuse", f"Same password as {others}.")
+            )
+    order = {rule: i for i, rule in enumerate(RULES)}
+    violations.sort(key=lambda v: (v.service, order[v.rule]))
+    return PolicyReport(scanned, violations, backend, time.perf_counter() - start)
+
+
+def _length_message(length: int, minimum: int) -> str:
+    return f"{length} characters, the policy requires {minimum}."
+
+
+def _class_message(missing: Iterable[str]) -> str:
+    return f"No {', '.join(missing)} character."
+
+
+def _banned_message(words: Iterable[str]) -> str:
+    return f"Contains {', '.join(repr(w) for w in words)}."
+
+
+def _age_message(age: float, max_age: float) -> str:
+    return f"Not changed for {age // 86400:.0f} days (at most {max_age / 86400:g})."
+
+
+def _check_python(policy: Policy, chunk, now: float) -> List[Violation]:
+    variants = policy._variants
+    violations = []
+    for service, data, updated_at, variant in chunk:
+        rules = variants[variant]
+        length = len(data.translate(None, _NOT_CHARACTERS))
+        if length < rules.min_length:
+            violations.append(
+                Violation(
+                    service, "min-length", _length_message(length, rules.min_length)
+                )
+            )
+        if rules.require:
+            present = {
+                "lower": len(data.translate(None, _LOWER)) < len(data),
+                "upper": len(data.translate(None, _UPPER)) < len(data),
+                "digit": len(data.translate(None, _DIGIT)) < len(data),
+                "symbol": bool(
+                    data.translate(None, _LOWER + _UPPER + _DIGIT + _NOT_CHARACTERS)
+                ),
+            }
+            missing = [c for c in CHARACTER_CLASSES if c in rules.require]
+            missing = [c for c in missing if not present[c]]
+            if missing:
+                violations.append(
+                    Violation(service, "character-class", _class_message(missing))
+                )
+        if rules.banned:
+            lowered = data.translate(_ASCII_LOWER)
+            found = [w for w in rules.banned if w.encode("utf-8") in lowered]
+            if found:
+                violations.append(
+                    Violation(service, "banned-substring", _banned_message(found))
+                )
+        if rules.max_age is not None and updated_at is not None:
+            if now - updated_at > rules.max_age:
+                violations.append(
+                    Violation(
+                        service,
+                        "max-age",
+                        _age_message(now - updated_at, rules.max_age),
+                    )
+                )
+    return violations
+
+
+def _check_numpy(policy: Policy, chunk, now: float) -> List[Violation]:
+    np = numpy
+    services = [row[0] for row in chunk]
+    width = max(1, max(len(row[1]) for row in chunk))
+    matrix = np.frombuffer(
+        b"".join(row[1].ljust(width, b"\0") for row in chunk), dtype=np.uint8
+    ).reshape(len(chunk), width)
+    variant = np.fromiter((row[3] for row in chunk), dtype=np.intp, count=len(chunk))
+    updated = np.array(
+        [np.nan if row[2] is None else row[2] for row in chunk], dtype=np.float64
+    )
+
+    # Rules of each distinct variant, then gathered per row
+    variants = policy._variants
+    banned_words = list(dict.fromkeys(w for rules in variants for w in rules.banned))
+    min_length = np.array([r.min_length for r in variants])[variant]
+    require = np.array(
+        [[c in r.require for c in CHARACTER_CLASSES] for r in variants], dtype=bool
+    )[variant]
+    bans = np.array(
+        [[w in r.banned for w in banned_words] for r in variants], dtype=bool
+    ).reshape(len(variants), len(banned_words))[variant]
+    max_age = np.array([np.inf if r.max_age is None else r.max_age for r in variants])[
+        variant
+    ]
+
+    character = (matrix != 0) & ((matrix & 0xC0) != 0x80)
+    lengths = character.sum(axis=1)
+    lower = (matrix >= ord("a")) & (matrix <= ord("z"))
+    upper = (matrix >= ord("A")) & (matrix <= ord("Z"))
+    digit = (matrix >= ord("0")) & (matrix <= ord("9"))
+    symbol = character & ~(lower | upper | digit)
+    present = np.stack(
+        [lower.any(axis=1), upper.any(axis=1), digit.any(axis=1), symbol.any(axis=1)],
+        axis=1,
+    )
+    missing = require & ~present
+
+    lowered = np.where(upper, matrix + 32, matrix).astype(np.uint8)
+    found = np.zeros((len(chunk), len(banned_words)), dtype=bool)
+    for column, word in enumerate(banned_words):
+        needle = np.frombuffer(word.encode("utf-8"), dtype=np.uint8)
+        span = width - len(needle) + 1
+        if span < 1:
+            continue
+        hits = lowered[:, :span] == needle[0]
+        for offset in range(1, len(needle)):
+            hits &= lowered[:, offset : offset + span] == needle[offset]
+        found[:, column] = hits.any(axis=1)
+    found &= bans
+
+    with np.errstate(invalid="ignore"):
+        age = now - updated
+        old = age > max_age
+
+    short = lengths < min_length
+    lacking = missing.any(axis=1)
+    banned = found.any(axis=1)
+    failed = np.nonzero(short | lacking | banned | old)[0]
+    # Messages are built in Python: only for the failing rows, from lists
+    violations = []
+    for row, is_short, is_lacking, is_banned, is_old in zip(
+        failed.tolist(),
+        short[failed].tolist(),
+        lacking[failed].tolist(),
+        banned[failed].tolist(),
+        old[failed].tolist(),
+    ):
+        service = services[row]
+        if is_short:
+            message = _length_message(int(lengths[row]), int(min_length[row]))
+            violations.append(Violation(service, "min-length", message))
+        if is_lacking:
+            classes = [c for c, m in zip(CHARACTER_CLASSES, missing[row]) if m]
+            violations.append(
+                Violation(service, "character-class", _class_message(classes))
+            )
+        if is_banned:
+            words = [w for w, f in zip(banned_words, found[row]) if f]
+            violations.append(
+                Violation(service, "banned-substring", _banned_message(words))
+            )
+        if is_old:
+            message = _age_message(float(age[row]), float(max_age[row]))
+            violations.append(Violation(service, "max-age", message))
+    return violations
+
+
+def to_json(report: PolicyReport) -> dict:
+    return {
+        "scanned": report.scanned,
+        "violations": [v._asdict() for v in report.violations],
+        "counts": report.counts(),
+        "backend": report.backend,
+        "seconds": round(report.seconds, 6),
+    }
+
+
+def to_sarif(report: PolicyReport, version: str) -> dict:
+    """The report as a SARIF 2.1.0 log (code scanning tools read it)."""
+    run = {
+        "tool": {
+            "driver": {
+                "name": "pyvault",
+                "version": version,
+                "informationUri": "https://github.com/davideciaccio/py-vault",
+                "rules": [
+                    {"id": rule, "shortDescription": {"text": text}}
+                    for rule, text in RULES.items()
+                ],
+            }
+        },
+        "results": [
+            {
+                "ruleId": v.rule,
+                "level": "error",
+                "message": {"text": f"{v.service}: {v.message}"},
+                "locations": [
+                    {"logicalLocations": [{"name": v.service, "kind": "resource"}]}
+                ],
+            }
+            for v in report.violations
+        ],
+        "properties": {"scanned": report.scanned},
+    }
+    return {
+        "$schema": "https://json.schemastore.org/sarif-2.1.0.json",
+        "version": "2.1.0",
+        "runs": [run],
+    }
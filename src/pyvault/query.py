@@ -0,0 +1,261 @@
+import re
+import time
+from datetime import datetime
+from typing import Callable, List, Optional, Tuple
+
+# Filter expressions select credentials for list, export and audit, e.g.
+#   tag:prod and updated<90d and service~gitlab
+#   folder:work/aws or (tag:legacy not tag:keep)
+# Terms:
+#   tag:NAME            has the tag
+#   folder:PATH         in the folder or one of its subfolders
+#   service:NAME        exact service name    service~TEXT   name contains TEXT
+#   username:NAME       exact username        username~TEXT  username contains TEXT
+#   service:prod-*      glob: * any text, ? one character, [abc] one of
+#                       (case-sensitive; also username:); [*], [?] and [[]
+#                       match the character itself
+#   updated<90d         changed in the last 90 days (units: h, d, w, y)
+#   updated>90d         not changed for 90 days
+#   accessed>1y         not read (or written) for a year
+#   created>=2024-01-01 created on or after a date (also <, <=, >)
+# Terms combine with 'and' (or a space), 'or', 'not' and parentheses.
+# Values with spaces or parentheses are quoted: service:"my db"; a quote
+# inside is doubled: service:"my ""db""".
+# tag:, folder:, service: (exact or with a literal prefix) and the time
+# terms compile to conditions on indexed columns, so SQLite only reads the
+# matching rows; username: and the ~ terms are checked row by row.
+
+_TOKEN = re.compile(
+    r"""\s*(?:
+        (?P<paren>[()])
+      | (?P<term>[a-z]+\s*(?:<=|>=|[:~<>=])\s*(?:"(?:[^"]|"")*"|[^\s()"]+))
+      | (?P<word>[^\s()]+)
+    )""",
+    re.VERBOSE | re.IGNORECASE,
+)
+_TERM = re.compile(r"([a-z]+)\s*(<=|>=|[:~<>=])\s*(.*)", re.IGNORECASE | re.DOTALL)
+_AGE = re.compile(r"(\d+(?:\.\d+)?)([hdwy])$", re.IGNORECASE)
+_AGE_UNITS = {"h": 3600, "d": 86400, "w": 7 * 86400, "y": 365 * 86400}
+_TIME_COLUMNS = {
+    "updated": "c.updated_at",
+    "created": "c.created_at",
+    "accessed": "c.last_accessed_at",
+}
+_TEXT_COLUMNS = {"service": "c.service", "username": "c.username"}
+
+Filter = Tuple[str, List[object]]
+
+
+class QueryError(ValueError):
+    """The filter expression is not valid."""
+
+
+def compile_filter(text: str, now: Optional[float] = None) -> Filter:
+    """
+    Compiles a filter expression into an SQL condition on the credentials
+    table (aliased 'c') and its parameters.
+    """
+    parser = _Parser(_tokenize(text), time.time() if now is None else now)
+    sql = parser.parse_or()
+    if parser.peek() is not None:
+        raise QueryError(f"Unexpected '{parser.peek()[1]}'.")
+    return sql, parser.params
+
+
+def _tokenize(text: str) -> List[Tuple[str, str]]:
+    tokens, position = [], 0
+    text = text.strip()
+    while position < len(text):
+        match = _TOKEN.match(text, position)
+        if not match or match.end() == position:
+            raise QueryError(f"Cannot parse '{text[position:]}'.")
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "word":
+            if value.lower() not in ("and", "or", "not"):
+                raise QueryError(
+                    f"Unknown term '{value}' (expected e.g. tag:NAME or updated<90d)."
+                )
+            kind, value = "op", value.lower()
+        tokens.append((kind, value))
+        position = match.end()
+    return tokens
+
+
+def _escape_like(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def is_glob(text: str) -> bool:
+    """True if text holds glob wildcards (*, ? or [...])."""
+    return any(char in text for char in "*?[")
+
+
+def escape_glob(name: str) -> str:
+    """A glob matching only name itself: [*], [?] and [[] for its wildcards."""
+    return re.sub(r"[*?[]", lambda match: f"[{match.group()}]", name)
+
+
+def _glob_regex(pattern: str) -> str:
+    """Regex matching what SQLite's GLOB matches; * and ? are groups."""
+    parts, position = [], 0
+    while position < len(pattern):
+        char = pattern[position]
+        end = pattern.find("]", position + 2) if char == "[" else -1
+        if char == "*":
+            parts.append("(.*)")
+        elif char == "?":
+            parts.append("(.)")
+        elif end != -1:
+            body = pattern[position + 1 : end]
+            negate = body.startswith("^")
+            body = body[1:] if negate else body
+            body = body.replace("\\", "\\\\").replace("[", "\\[")
+            parts.append("[" + ("^" if negate else "") + body + "]")
+            position = end
+        else:
+            parts.append(re.escape(char))
+        position += 1
+    return "".join(parts) + r"\Z"
+
+
+def renamer(source: str, target: str) -> Callable[[str], str]:
+    """
+    Maps service names matching the glob `source` to new names: each * or
+    ? of `target` takes the text matched by the wildcard in the same place
+    of `source` ('prod-*' -> 'legacy/prod-*'). A target without wildcards
+    is a single new name; [*], [?] and [[] stand for the character itself.
+    """
+    regex = re.compile(_glob_regex(source), re.DOTALL)
+    pieces = [""]
+    for part in re.split(r"(\[[*?[]\]|[*?])", target):
+        if part in ("*", "?"):
+            pieces.append("")
+        else:
+            pieces[-1] += part[1] if re.fullmatch(r"\[[*?[]\]", part) else part
+    if len(pieces) > 1 and len(pieces) - 1 != regex.groups:
+        raise QueryError(
+            f"'{target}' must use as many wildcards (* or ?) as '{source}'."
+        )
+
+    def rename(service: str) -> str:
+        match = regex.match(service)
+        if match is None:
+            raise QueryError(f"'{service}' does not match '{source}'.")
+        return pieces[0] + "".join(
+            text + piece for text, piece in zip(match.groups(), pieces[1:])
+        )
+
+    return rename
+
+
+def parse_age(text: str) -> Optional[float]:
+    """Seconds in an age such as '36h', '90d', '12w' or '1y'; None if not one."""
+    age = _AGE.match(text.strip())
+    if not age:
+        return None
+    return float(age.group(1)) * _AGE_UNITS[age.group(2).lower()]
+
+
+def _timestamp(value: str, now: float, op: str) -> Tuple[float, str]:
+    """(timestamp, SQL operator) for an age (90d) or a date (2024-01-31)."""
+    seconds = parse_age(value)
+    if seconds is not None:
+        # An age compares the other way round: updated<90d means
+        # updated_at later than 90 days ago
+        flipped = {"<": ">", "<=": ">=", ">": "<", ">=": "<="}
+        return now - seconds, flipped[op]
+    try:
+        return datetime.fromisoformat(value).timestamp(), op
+    except ValueError:
+        raise QueryError(
+            f"Invalid age or date '{value}' (expected e.g. 90d, 12w, 2024-01-31)."
+        ) from None
+
+
+class _Parser:
+    def __init__(self, tokens, now):
+        self.tokens = tokens
+        self.position = 0
+        self.now = now
+        self.params: List[object] = []
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def advance(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def parse_or(self) -> str:
+        parts = [self.parse_and()]
+        while self.peek() == ("op", "or"):
+            self.advance()
+            parts.append(self.parse_and())
+        return parts[0] if len(parts) == 1 else "(" + " OR ".join(parts) + ")"
+
+    def parse_and(self) -> str:
+        parts = [self.parse_not()]
+        while self.peek() is not None and self.peek() not in (
+            ("op", "or"),
+            ("paren", ")"),
+        ):
+            if self.peek() == ("op", "and"):
+                self.advance()
+            parts.append(self.parse_not())
+        return parts[0] if len(parts) == 1 else "(" + " AND ".join(parts) + ")"
+
+    def parse_not(self) -> str:
+        if self.peek() == ("op", "not"):
+            self.advance()
+            return f"NOT {self.parse_not()}"
+        return self.parse_atom()
+
+    def parse_atom(self) -> str:
+        token = self.advance()
+        if token is None:
+            raise QueryError("Incomplete filter expression.")
+        kind, value = token
+        if token == ("paren", "("):
+            sql = self.parse_or()
+            if self.advance() != ("paren", ")"):
+                raise QueryError("Missing ')'.")
+            return sql
+        if kind != "term":
+            raise QueryError(f"Unexpected '{value}'.")
+        return self.compile_term(value)
+
+    def compile_term(self, term: str) -> str:
+        field, op, value = _TERM.match(term).groups()
+        field = field.lower()
+        if value.startswith('"'):
+            value = value[1:-1].replace('""', '"')
+
+        if field == "tag" and op in (":", "="):
+            self.params.append(value)
+            return "c.service IN (SELECT service FROM credential_tags WHERE tag = ?)"
+        if field == "folder" and op in (":", "="):
+            # The folder itself or anything below it, as one index range
+            prefix = value.rstrip("/")
+            self.params += [prefix, prefix + "/", prefix + "0"]
+            # (IS NOT NULL: false rather than NULL without a folder, for 'not')
+            return (
+                "(c.folder IS NOT NULL AND "
+                "(c.folder = ? OR (c.folder >= ? AND c.folder < ?)))"
+            )
+        if field in _TEXT_COLUMNS and op in (":", "=") and is_glob(value):
+            # A literal prefix (prod-*) is an index range scan
+            self.params.append(value)
+            return f"{_TEXT_COLUMNS[field]} GLOB ?"
+        if field in _TEXT_COLUMNS and op in (":", "="):
+            self.params.append(value)
+            return f"{_TEXT_COLUMNS[field]} = ?"
+        if field in _TEXT_COLUMNS and op == "~":
+            self.params.append(f"%{_escape_like(value)}%")
+            return f"{_TEXT_COLUMNS[field]} LIKE ? ESCAPE '\\'"
+        if field in _TIME_COLUMNS and op in ("<", "<=", ">", ">="):
+            timestamp, sql_op = _timestamp(value, self.now, op)
+            self.params.append(timestamp)
+            return f"{_TIME_COLUMNS[field]} {sql_op} ?"
+        raise QueryError(f"Unsupported term '{term}'.")
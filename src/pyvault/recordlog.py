@@ -0,0 +1,996 @@
+import glob
+import hashlib
+import json
+import os
+import sqlite3
+import struct
+import sys
+import threading
+import zlib
+from array import array
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from cryptography.exceptions import InvalidTag
+
+from pyvault import migrations
+from pyvault.crypto import DEFAULT_CIPHER, STREAM_HEADER_SIZE, StreamCipher
+from pyvault.memory import (
+    MemoryVaultStorage,
+    VaultFileError,
+    _empty_image,
+    _stamp,
+    require_images,
+    seal_image,
+    sync_directory,
+    unseal_image,
+    write_atomically,
+)
+from pyvault.storage import DEFAULT_BUSY_RETRIES, DEFAULT_BUSY_TIMEOUT
+
+# --- File format ---
+# LOG_MAGIC | FORMAT_VERSION | cipher id (0: not set) | log id (16 bytes)
+# | salt length (u16) | salt | verifier length (u16) | verifier, then frames.
+# A frame is one committed transaction: body length (u32) | CRC-32 of the
+# body (u32) | body, where the body is the frame number (u64) | stream header
+# | one chunk encrypted with crypto.StreamCipher under that number. Its
+# plaintext is the log id followed by records: op (u8) | table | key | value
+# count (u16) | values, each a type byte and its data. The first frame starts
+# with the schema, then holds every row; later frames hold the rows a
+# transaction inserted or changed (whole) and the keys of those it deleted.
+# The hint file next to the log is a memory-engine file (see
+# pyvault.memory.seal_image) with the state after the frames up to an offset:
+# the index, then the SQLite image.
+LOG_MAGIC = b"PYVLOG\x00\x00"
+FORMAT_VERSION = 1
+LOG_ID_SIZE = 16
+OP_SCHEMA, OP_UPSERT, OP_DELETE = 0, 1, 2
+# Compaction writes frames of about this many bytes of records
+FRAME_BYTES = 1024 * 1024
+# Compaction starts in the background once the log holds this many bytes of
+# records and more than this share of them were overwritten or deleted
+COMPACT_MIN_BYTES = 1024 * 1024
+GARBAGE_SHARE = 0.5
+# The hint is rewritten once this many bytes were appended after it, and
+# when a connection closes with this many
+HINT_INTERVAL = 4 * 1024 * 1024
+HINT_ON_CLOSE = 64 * 1024
+
+_FRAME = struct.Struct(">II")
+_SEQ = struct.Struct(">Q")
+_U16 = struct.Struct(">H")
+_U32 = struct.Struct(">I")
+_I64 = struct.Struct(">q")
+_F64 = struct.Struct(">d")
+# A value's type byte with its data (or with its size for text and BLOBs)
+_TAGGED_INT = struct.Struct(">Bq")
+_TAGGED_FLOAT = struct.Struct(">Bd")
+_TAGGED_SIZE = struct.Struct(">BI")
+# log id, offset, next frame number, index entries, live bytes, log bytes
+_HINT = struct.Struct(">16sQQQQQ")
+# Enough to hold any log header
+_HEADER_READ = 2 * 0xFFFF + 64
+
+
+def is_log_vault(path) -> bool:
+    """True if the file at path is a log-engine vault."""
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(LOG_MAGIC)) == LOG_MAGIC
+    except OSError:
+        return False
+
+
+def hint_path(db_path) -> str:
+    return f"{db_path}.hint"
+
+
+def log_files(db_path) -> List[str]:
+    """The hint and any compaction left behind by a crash, if present."""
+    paths = glob.glob(glob.escape(f"{db_path}.compact-") + "*")
+    if os.path.exists(hint_path(db_path)):
+        paths.append(hint_path(db_path))
+    return paths
+
+
+def _clear_header(log_id: bytes, salt, verifier, cipher) -> bytes:
+    salt, verifier = salt or b"", verifier or b""
+    return (
+        LOG_MAGIC
+        + bytes((FORMAT_VERSION, cipher or 0))
+        + log_id
+        + _U16.pack(len(salt))
+        + salt
+        + _U16.pack(len(verifier))
+        + verifier
+    )
+
+
+def read_log_header(
+    data: bytes,
+) -> Tuple[int, bytes, Optional[bytes], Optional[bytes], int]:
+    """(header size, log id, salt, verifier, cipher id) of a log-engine file."""
+    try:
+        if (
+            data[: len(LOG_MAGIC)] != LOG_MAGIC
+            or data[len(LOG_MAGIC)] != FORMAT_VERSION
+        ):
+            raise ValueError
+        cipher = data[len(LOG_MAGIC) + 1]
+        position = len(LOG_MAGIC) + 2
+        log_id = data[position : position + LOG_ID_SIZE]
+        position += LOG_ID_SIZE
+        fields = []
+        for _ in range(2):
+            (size,) = _U16.unpack_from(data, position)
+            position += _U16.size
+            fields.append(data[position : position + size] or None)
+            position += size
+        if position > len(data):
+            raise ValueError
+    except (IndexError, ValueError, struct.error):
+        raise VaultFileError("Not a PyVault log-engine file.") from None
+    return position, log_id, fields[0], fields[1], cipher
+
+
+# --- Records ---
+
+
+def _encode(values, out: list):
+    append = out.append
+    for value in values:
+        kind = type(value)
+        if kind is str:
+            data = value.encode("utf-8")
+            append(_TAGGED_SIZE.pack(3, len(data)) + data)
+        elif kind is int:
+            append(_TAGGED_INT.pack(1, value))
+        elif value is None:
+            append(b"\x00")
+        elif kind is bytes:
+            append(_TAGGED_SIZE.pack(4, len(value)) + value)
+        elif isinstance(value, float):
+            append(_TAGGED_FLOAT.pack(2, value))
+        elif isinstance(value, int):
+            append(_TAGGED_INT.pack(1, int(value)))
+        else:
+            data = bytes(value)
+            append(_TAGGED_SIZE.pack(4, len(data)) + data)
+
+
+def _decode(data: bytes, position: int, count: int) -> Tuple[list, int]:
+    values = []
+    append = values.append
+    for _ in range(count):
+        kind = data[position]
+        if kind >= 3:
+            start = position + _TAGGED_SIZE.size
+            position = start + _U32.unpack_from(data, position + 1)[0]
+            append(
+                data[start:position].decode("utf-8")
+                if kind == 3
+                else data[start:position]
+            )
+        elif kind == 1:
+            append(_I64.unpack_from(data, position + 1)[0])
+            position += _TAGGED_INT.size
+        elif kind == 0:
+            append(None)
+            position += 1
+        else:
+            append(_F64.unpack_from(data, position + 1)[0])
+            position += _TAGGED_FLOAT.size
+    return values, position
+
+
+def _record(op: int, table: str, key, values=()) -> bytes:
+    out = [bytes((op,))]
+    _encode((table, key), out)
+    out.append(_U16.pack(len(values)))
+    _encode(values, out)
+    return b"".join(out)
+
+
+def _records(plaintext: bytes) -> Iterator[Tuple[int, str, object, list, int]]:
+    """(op, table, key, values, record size) of each record in a frame."""
+    position = LOG_ID_SIZE
+    while position < len(plaintext):
+        start = position
+        op = plaintext[position]
+        (table, key), position = _decode(plaintext, position + 1, 2)
+        (count,) = _U16.unpack_from(plaintext, position)
+        values, position = _decode(plaintext, position + _U16.size, count)
+        yield op, table, key, values, position - start
+
+
+def _key_hash(table: str, key) -> int:
+    """The index key of a row: 64 bits of BLAKE2b over its table and key."""
+    digest = hashlib.blake2b(f"{table}\x00{key!r}".encode(), digest_size=8)
+    return int.from_bytes(digest.digest(), "big")
+
+
+# --- Frames ---
+
+
+def _frame(
+    stream: StreamCipher, seq: int, log_id: bytes, records: List[bytes]
+) -> bytes:
+    # Frames carry the header of the stream that encrypted them. A stream is
+    # used for one log in one process, whose frame numbers only go up: a
+    # number is written twice only after a failed append, and a failure
+    # reloads the log, which starts a new stream (a new salt)
+    body = (
+        _SEQ.pack(seq)
+        + stream.header
+        + stream.encrypt_chunk(seq, log_id + b"".join(records), False)
+    )
+    return _FRAME.pack(len(body), zlib.crc32(body)) + body
+
+
+def _frames(
+    data: bytes, key: bytes, log_id: bytes, seq: int
+) -> Iterator[Tuple[int, int, bytes]]:
+    """
+    (end offset in data, frame number, plaintext) of the frames in data,
+    which must start with frame number `seq`. Stops at a torn tail (a last
+    frame that is incomplete or fails its checksum: an interrupted append);
+    raises VaultFileError for anything else that does not check out.
+    """
+    position = 0
+    while position + _FRAME.size <= len(data):
+        length, crc = _FRAME.unpack_from(data, position)
+        end = position + _FRAME.size + length
+        body = data[position + _FRAME.size : end]
+        if end > len(data) or zlib.crc32(body) != crc:
+            if end < len(data):
+                raise VaultFileError(
+                    "The vault log is damaged: a record fails its checksum."
+                )
+            return
+        try:
+            (number,) = _SEQ.unpack_from(body)
+            if number != seq:
+                raise ValueError
+            stream = StreamCipher(key, body[_SEQ.size : _SEQ.size + STREAM_HEADER_SIZE])
+            plaintext = stream.decrypt_chunk(
+                seq, body[_SEQ.size + STREAM_HEADER_SIZE :], False
+            )
+            if plaintext[:LOG_ID_SIZE] != log_id:
+                raise ValueError
+        except (InvalidTag, ValueError, struct.error):
+            raise VaultFileError(
+                "The vault log is damaged or was altered: it cannot be decrypted."
+            ) from None
+        yield end, seq, plaintext
+        position = end
+        seq += 1
+
+
+def _append(path, offset: int, frame: bytes):
+    """Writes a frame at offset (cutting off any torn tail) and syncs it."""
+    with open(path, "r+b") as f:
+        f.truncate(offset)
+        f.seek(offset)
+        f.write(frame)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+# --- Tables ---
+
+
+class _Table(NamedTuple):
+    """How the rows of a table are keyed, written, deleted and read back."""
+
+    name: str
+    # Rowid tables are keyed by rowid, WITHOUT ROWID ones by a JSON array of
+    # their primary key (which therefore cannot hold BLOBs)
+    key: str
+    upsert: str
+    delete: str
+    rows: str
+    dirty: str
+    without_rowid: bool
+
+
+def _tables(conn) -> Dict[str, _Table]:
+    tables = {}
+    for name, sql in conn.execute(
+        "SELECT name, sql FROM main.sqlite_master"
+        " WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+    ).fetchall():
+        info = conn.execute(f'PRAGMA main.table_info("{name}")').fetchall()
+        columns = [f'"{row[1]}"' for row in info]
+        pk = [row[1] for row in sorted(info, key=lambda row: row[5]) if row[5]]
+        without_rowid = "WITHOUT ROWID" in " ".join(sql.upper().split())
+        if without_rowid:
+            key = "json_array(" + ", ".join(f'{{t}}."{c}"' for c in pk) + ")"
+            present = f't."{pk[0]}"'
+            delete = " AND ".join(f'"{c}" = ?' for c in pk)
+            join = " AND ".join(
+                f"t.\"{c}\" = json_extract(d.key, '$[{i}]')" for i, c in enumerate(pk)
+            )
+        else:
+            key, present, delete = "{t}.rowid", "t.rowid", "rowid = ?"
+            join = "t.rowid = d.key"
+            # An INTEGER PRIMARY KEY is the rowid and written as a column;
+            # any other rowid is written first
+            types = {row[1]: row[2].upper() for row in info}
+            if len(pk) != 1 or types[pk[0]] != "INTEGER":
+                columns.insert(0, "rowid")
+        selected = ", ".join(f"t.{column}" for column in columns)
+        tables[name] = _Table(
+            name,
+            key,
+            f'INSERT OR REPLACE INTO main."{name}" ({", ".join(columns)})'
+            f' VALUES ({", ".join("?" * len(columns))})',
+            f'DELETE FROM main."{name}" WHERE {delete}',
+            f'SELECT {key.format(t="t")}, {selected} FROM main."{name}" AS t',
+            f"SELECT d.key, {present} IS NOT NULL, {selected}"
+            " FROM (SELECT DISTINCT key FROM log_dirty WHERE tbl = ?) AS d"
+            f' LEFT JOIN main."{name}" AS t ON {join}',
+            without_rowid,
+        )
+    return tables
+
+
+def _schema(conn) -> bytes:
+    """The schema record: the user_version and the statements creating it."""
+    statements = [
+        sql
+        for (sql,) in conn.execute(
+            "SELECT sql FROM main.sqlite_master"
+            " WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' ORDER BY rowid"
+        )
+    ]
+    version = conn.execute("PRAGMA main.user_version").fetchone()[0]
+    return _record(OP_SCHEMA, "", version, statements)
+
+
+def _master(conn) -> Tuple[Optional[bytes], Optional[bytes], int]:
+    """The clear header fields as the config table has them."""
+    row = conn.execute(
+        "SELECT master_salt, master_verifier, cipher FROM config WHERE id = 1"
+    ).fetchone() or (None, None, None)
+    return row[0] or None, row[1] or None, row[2] or 0
+
+
+class _Written(NamedTuple):
+    """A log written from scratch (see _write_log)."""
+
+    offset: int
+    seq: int
+    index: Dict[int, Tuple[int, int]]
+    live: int
+
+
+def _write_log(path, conn, key: bytes, log_id: bytes, salt, verifier, cipher):
+    """
+    Writes every row of conn as a new log at path, synced but not yet
+    renamed into place, and returns what the index needs to know about it.
+    """
+    header = _clear_header(log_id, salt, verifier, cipher)
+    index: Dict[int, Tuple[int, int]] = {}
+    offset, seq, live = len(header), 0, 0
+    records, pending = [_schema(conn)], []
+    stream = StreamCipher.create(key, cipher or DEFAULT_CIPHER)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(header)
+
+        def flush():
+            nonlocal offset, seq, live
+            frame = _frame(stream, seq, log_id, records)
+            f.write(frame)
+            for hashed, size in pending:
+                index[hashed] = (offset, size)
+                live += size
+            offset, seq = offset + len(frame), seq + 1
+            records.clear()
+            pending.clear()
+
+        buffered = 0
+        for table in _tables(conn).values():
+            for row_key, *values in conn.execute(table.rows):
+                record = _record(OP_UPSERT, table.name, row_key, values)
+                records.append(record)
+                pending.append((_key_hash(table.name, row_key), len(record)))
+                buffered += len(record)
+                if buffered >= FRAME_BYTES:
+                    flush()
+                    buffered = 0
+        if records:
+            flush()
+        f.flush()
+        os.fsync(f.fileno())
+    return _Written(offset, seq, index, live)
+
+
+def _replace(temporary, db_path):
+    try:
+        os.replace(temporary, db_path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    sync_directory(db_path)
+
+
+# --- Hint ---
+
+
+def _write_hint(
+    db_path, key: bytes, header, log_id, offset, seq, index, live, total, image
+):
+    """Seals the index and the image as of offset into the hint file."""
+    hashes = array("Q", index.keys())
+    offsets = array("Q", (entry[0] for entry in index.values()))
+    sizes = array("Q", (entry[1] for entry in index.values()))
+    if sys.byteorder == "big":
+        for values in (hashes, offsets, sizes):
+            values.byteswap()
+    plaintext = b"".join(
+        (
+            _HINT.pack(log_id, offset, seq, len(index), live, total),
+            hashes.tobytes(),
+            offsets.tobytes(),
+            sizes.tobytes(),
+            image,
+        )
+    )
+    write_atomically(hint_path(db_path), seal_image(plaintext, key, *header))
+
+
+def _read_hint(db_path, key: bytes, log_id: bytes, size: int):
+    """
+    (offset, seq, index arrays, live, total, image) from the hint file (the
+    arrays: row hashes, frame offsets, record sizes), or None if
+    there is none or it does not belong to this log. The hint only saves
+    reading the log: a missing or damaged one is skipped, never trusted.
+    """
+    try:
+        with open(hint_path(db_path), "rb") as f:
+            plaintext = unseal_image(f.read(), key)
+        hinted, offset, seq, count, live, total = _HINT.unpack_from(plaintext)
+    except (OSError, VaultFileError, struct.error):
+        return None
+    if hinted != log_id or offset > size:
+        return None
+    arrays = []
+    position = _HINT.size
+    for _ in range(3):
+        values = array("Q")
+        values.frombytes(plaintext[position : position + 8 * count])
+        if sys.byteorder == "big":
+            values.byteswap()
+        arrays.append(values)
+        position += 8 * count
+    return offset, seq, arrays, live, total, plaintext[position:]
+
+
+def write_log(db_path, image: bytes, key: bytes, salt, verifier, cipher):
+    """Writes a SQLite image as a log-engine vault (and its hint) in place."""
+    require_images("The log engine")
+    conn = sqlite3.connect(":memory:")
+    temporary = f"{db_path}.tmp-{os.getpid()}"
+    log_id = os.urandom(LOG_ID_SIZE)
+    header = (salt or None, verifier or None, cipher or 0)
+    try:
+        conn.deserialize(image)
+        written = _write_log(temporary, conn, key, log_id, *header)
+        _replace(temporary, db_path)
+        _write_hint(db_path, key, header, log_id, *written, written.live, image)
+    finally:
+        conn.close()
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+class _Compaction:
+    """A compaction running in a background thread (see LogVaultStorage)."""
+
+    def __init__(self, db_path, image: bytes, key: bytes, base: bytes, header):
+        self.path = f"{db_path}.compact-{os.getpid()}"
+        self.log_id = os.urandom(LOG_ID_SIZE)
+        # The log it compacts, and the rows written there since the snapshot
+        self.base = base
+        self.changed = set()
+        self.header = header
+        self.written: Optional[_Written] = None
+        self.error: Optional[BaseException] = None
+        self.thread = threading.Thread(
+            target=self._run, args=(image, key), name="pyvault-compaction", daemon=True
+        )
+        self.thread.start()
+
+    def _run(self, image: bytes, key: bytes):
+        conn = sqlite3.connect(":memory:")
+        try:
+            conn.deserialize(image)
+            self.written = _write_log(self.path, conn, key, self.log_id, *self.header)
+        except BaseException as e:
+            self.error = e
+        finally:
+            conn.close()
+
+    def discard(self):
+        self.thread.join()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class LogVaultStorage(MemoryVaultStorage):
+    """
+    The log engine: like the memory engine the vault is decrypted into an
+    in-memory SQLite database at unlock, but the file is an append-only log
+    of encrypted records instead of one sealed image. A commit appends one
+    frame with the rows the transaction changed (whole rows, found through
+    temporary triggers) and syncs once however many rows it wrote, so
+    write-heavy jobs (rotation, bulk provisioning) pay one append and one
+    fsync per transaction. Every frame carries a CRC-32 and is
+    authenticated: an interrupted append at the end of the log is cut off,
+    anything else that does not check out raises VaultFileError.
+
+    An in-memory index (64-bit row hash to frame offset and record size)
+    tracks how much of the log is still live. Once more than half of it was
+    overwritten or deleted a background thread writes the live rows into a
+    new log; the next commit appends the rows written meanwhile and renames
+    it into place. The hint file holds the index and the image as of some
+    offset, so opening reads it and replays only the frames after it.
+    Schema migrations and master key changes rewrite the log.
+    Needs Python 3.11 or newer (sqlite3 serialize/deserialize): opening,
+    `init --engine log` and `engine log` raise VaultFileError before that.
+    """
+
+    engine = "log"
+
+    def __init__(
+        self,
+        db_path=None,
+        auto_migrate=True,
+        busy_timeout=DEFAULT_BUSY_TIMEOUT,
+        max_retries=DEFAULT_BUSY_RETRIES,
+        check_same_thread=True,
+    ):
+        self._log_id: Optional[bytes] = None
+        # End of the frames read or written so far, and the next frame number
+        self._offset = 0
+        self._seq = 0
+        # Row hash -> (frame offset, record size); bytes of the live records
+        # and of all records in the log; the offset of the last hint. Opening
+        # from a hint keeps its arrays until a write needs the index
+        self._index: Optional[Dict[int, Tuple[int, int]]] = {}
+        self._hinted = None
+        self._live_bytes = 0
+        self._log_bytes = 0
+        self._hint_offset = 0
+        self._tables: Dict[str, _Table] = {}
+        # CREATE INDEX statements held back while replaying (see _apply)
+        self._deferred: List[str] = []
+        self._schema_version = None
+        self._compaction: Optional[_Compaction] = None
+        # Encrypts the frames this process appends (see _frame)
+        self._stream: Optional[StreamCipher] = None
+        super().__init__(
+            db_path, auto_migrate, busy_timeout, max_retries, check_same_thread
+        )
+
+    def _configure_connection(self):
+        """The table the capture triggers note written rows in (see _capture)."""
+        self.conn.execute("PRAGMA recursive_triggers = ON")
+        self.conn.execute("CREATE TEMP TABLE log_dirty (tbl TEXT, key)")
+
+    def _read_file(self):
+        # The header only: the frames are read by _load()
+        self._stamp = _stamp(self.db_path)
+        try:
+            with open(self.db_path, "rb") as f:
+                self._data = f.read(_HEADER_READ)
+        except FileNotFoundError:
+            self._data = None
+        if self._data is None:
+            self._header = self._log_id = None
+        else:
+            _, self._log_id, *header = read_log_header(self._data)
+            self._header = tuple(header)
+
+    # --- Loading ---
+
+    def seal(self):
+        """
+        Finishes a running compaction and brings the hint up to date, then
+        drops the data and the key.
+        """
+        if self._loaded:
+            self.flush_access()
+            self._settle_compaction()
+            if self._log_id is not None and (
+                self._offset - self._hint_offset >= HINT_ON_CLOSE
+            ):
+                self._save_hint()
+            self._drop_capture()
+        super().seal()
+
+    def _load(self):
+        fresh = self._data is None and self._stamp is None
+        self._data = None
+        self._drop_capture()
+        self._replay_all()
+        self._loaded = True
+        self._loads += 1
+        if migrations.pending_migrations(self.conn):
+            # A new vault is written by its first commit
+            self._lock_writes()
+            try:
+                migrations.upgrade(self.conn)
+                if not fresh:
+                    self._rewrite()
+            finally:
+                self._unlock_writes()
+        self._capture()
+
+    def _replay_all(self):
+        """Loads the hint if it matches the log, then the frames after it."""
+        self._abandon_compaction()
+        self._stream = None
+        self._index, self._hinted = {}, None
+        self._live_bytes = self._log_bytes = 0
+        self._offset = self._seq = self._hint_offset = 0
+        self._stamp = _stamp(self.db_path)
+        if self._stamp is None:
+            self._log_id = self._header = None
+            self.conn.deserialize(_empty_image())
+            self._tables = {}
+            return
+        key = bytes(self._key)
+        with open(self.db_path, "rb") as f:
+            size, self._log_id, *header = read_log_header(f.read(_HEADER_READ))
+            self._header = tuple(header)
+            hint = _read_hint(
+                self.db_path, key, self._log_id, os.fstat(f.fileno()).st_size
+            )
+            if hint is None:
+                offset, seq, image = size, 0, _empty_image()
+            else:
+                (
+                    offset,
+                    seq,
+                    self._hinted,
+                    self._live_bytes,
+                    self._log_bytes,
+                    image,
+                ) = hint
+                self._index = None
+            f.seek(offset)
+            data = f.read()
+        self.conn.deserialize(image)
+        self._tables = _tables(self.conn)
+        self._hint_offset = offset
+        self._replay(data, offset, seq)
+        if _master(self.conn) != self._header:
+            raise VaultFileError("The vault file header was altered.")
+
+    def _replay(self, data: bytes, offset: int, seq: int):
+        """Applies the frames in data, read at offset, to the database."""
+        conn = self.conn
+        start = 0
+        self._deferred = []
+        conn.execute("BEGIN")
+        try:
+            for end, number, plaintext in _frames(
+                data, bytes(self._key), self._log_id, seq
+            ):
+                self._apply(plaintext, offset + start)
+                start, seq = end, number + 1
+            for statement in self._deferred:
+                conn.execute(statement)
+            conn.execute("DELETE FROM log_dirty")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._offset, self._seq = offset + start, seq
+
+    def _apply(self, plaintext: bytes, offset: int):
+        conn = self.conn
+        # Runs of records for the same table and op go in one executemany()
+        run, rows = None, []
+        for op, name, key, values, size in _records(plaintext):
+            if (op, name) != run and rows:
+                self._apply_run(*run, rows)
+                rows = []
+            run = (op, name)
+            if op == OP_SCHEMA:
+                # Plain indexes are built once the rows are in (see _replay)
+                for statement in values:
+                    if statement.startswith("CREATE INDEX"):
+                        self._deferred.append(statement)
+                    else:
+                        conn.execute(statement)
+                conn.execute(f"PRAGMA main.user_version = {int(key)}")
+                self._tables = _tables(conn)
+                continue
+            rows.append(values if op == OP_UPSERT else key)
+            self._index_record(name, key, offset, size, op == OP_UPSERT)
+        if rows:
+            self._apply_run(*run, rows)
+
+    def _apply_run(self, op: int, name: str, rows: list):
+        table = self._tables[name]
+        if op == OP_UPSERT:
+            self.conn.executemany(table.upsert, rows)
+        elif table.without_rowid:
+            self.conn.executemany(table.delete, [json.loads(key) for key in rows])
+        else:
+            self.conn.executemany(table.delete, [(key,) for key in rows])
+
+    def _entries(self) -> Dict[int, Tuple[int, int]]:
+        if self._index is None:
+            hashes, offsets, sizes = self._hinted
+            self._index = dict(zip(hashes, zip(offsets, sizes)))
+            self._hinted = None
+        return self._index
+
+    def _index_record(self, table: str, key, offset: int, size: int, live: bool):
+        hashed = _key_hash(table, key)
+        index = self._entries()
+        previous = index.pop(hashed, None)
+        if previous is not None:
+            self._live_bytes -= previous[1]
+        if live:
+            index[hashed] = (offset, size)
+            self._live_bytes += size
+        self._log_bytes += size
+        if self._compaction is not None:
+            self._compaction.changed.add((table, key))
+
+    def _refresh(self):
+        """Replays what other processes appended, or reloads a new log."""
+        if not self._loaded:
+            return
+        stamp = _stamp(self.db_path)
+        if stamp == self._stamp:
+            return
+        if stamp is not None and self._stamp is not None and stamp[0] == self._stamp[0]:
+            with open(self.db_path, "rb") as f:
+                header = f.read(_HEADER_READ)
+                f.seek(self._offset)
+                data = f.read()
+            # Same inode and log: only appended to (or a torn tail cut off)
+            if read_log_header(header)[1] == self._log_id:
+                self._replay(data, self._offset, self._seq)
+                self._stamp = stamp
+                return
+        self._read_file()
+        self._load()
+
+    # --- Capturing written rows ---
+
+    def _capture(self):
+        """
+        Temporary triggers (never stored in the vault) noting the key of
+        every row inserted, updated or deleted in log_dirty. Recursive
+        triggers make the deletes done by INSERT OR REPLACE count too.
+        """
+        conn = self.conn
+        self._tables = _tables(conn)
+        self._schema_version = conn.execute("PRAGMA main.schema_version").fetchone()[0]
+        for table in self._tables.values():
+            old, new = table.key.format(t="OLD"), table.key.format(t="NEW")
+            for event, keys in (
+                ("INSERT", f"('{table.name}', {new})"),
+                ("UPDATE", f"('{table.name}', {old}), ('{table.name}', {new})"),
+                ("DELETE", f"('{table.name}', {old})"),
+            ):
+                conn.execute(
+                    f'CREATE TEMP TRIGGER IF NOT EXISTS "log_{table.name}_{event}"'
+                    f' AFTER {event} ON main."{table.name}" BEGIN'
+                    f" INSERT INTO log_dirty VALUES {keys}; END"
+                )
+
+    def _drop_capture(self):
+        conn = self.conn
+        for (name,) in conn.execute(
+            "SELECT name FROM temp.sqlite_master WHERE type = 'trigger'"
+        ).fetchall():
+            conn.execute(f'DROP TRIGGER temp."{name}"')
+        conn.execute("DELETE FROM log_dirty")
+
+    def _dirty_records(self) -> List[Tuple[str, object, int, bytes]]:
+        """(table, key, op, record) of every row noted in log_dirty."""
+        records = []
+        for (name,) in self.conn.execute(
+            "SELECT DISTINCT tbl FROM log_dirty"
+        ).fetchall():
+            table = self._tables[name]
+            for key, present, *values in self.conn.execute(table.dirty, (name,)):
+                if present:
+                    records.append(
+                        (name, key, OP_UPSERT, _record(OP_UPSERT, name, key, values))
+                    )
+                else:
+                    records.append(
+                        (name, key, OP_DELETE, _record(OP_DELETE, name, key))
+                    )
+        return records
+
+    # --- Writing ---
+
+    def _write_back(self):
+        try:
+            schema = self.conn.execute("PRAGMA main.schema_version").fetchone()[0]
+            if (
+                self._log_id is None
+                or schema != self._schema_version
+                or _master(self.conn) != self._header
+            ):
+                self._rewrite()
+                self._capture()
+            else:
+                self._append_dirty()
+        except BaseException:
+            # Memory holds changes the log does not: go back to the log
+            self._read_file()
+            self._load()
+            raise
+        self._maintain()
+
+    def _append_dirty(self):
+        """Appends the rows the transaction wrote as one frame (one fsync)."""
+        records = self._dirty_records()
+        self.conn.execute("DELETE FROM log_dirty")
+        if not records:
+            return
+        if self._stream is None:
+            self._stream = StreamCipher.create(
+                bytes(self._key), self._header[2] or DEFAULT_CIPHER
+            )
+        frame = _frame(
+            self._stream, self._seq, self._log_id, [r for _, _, _, r in records]
+        )
+        _append(self.db_path, self._offset, frame)
+        for name, key, op, record in records:
+            self._index_record(name, key, self._offset, len(record), op == OP_UPSERT)
+        self._offset += len(frame)
+        self._seq += 1
+        self._stamp = _stamp(self.db_path)
+
+    def _rewrite(self):
+        """Writes the vault as a new log of live records only."""
+        self._abandon_compaction()
+        header = _master(self.conn)
+        log_id = os.urandom(LOG_ID_SIZE)
+        temporary = f"{self.db_path}.tmp-{os.getpid()}"
+        try:
+            written = _write_log(
+                temporary, self.conn, bytes(self._key), log_id, *header
+            )
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        _replace(temporary, self.db_path)
+        self._adopt(log_id, header, written)
+        self._save_hint()
+
+    def _adopt(self, log_id: bytes, header, written: _Written):
+        self._log_id, self._header = log_id, header
+        self._stream = None
+        self._offset, self._seq = written.offset, written.seq
+        self._index, self._hinted = written.index, None
+        self._live_bytes = self._log_bytes = written.live
+        self._stamp = _stamp(self.db_path)
+        self.conn.execute("DELETE FROM log_dirty")
+
+    def _save_hint(self):
+        _write_hint(
+            self.db_path,
+            bytes(self._key),
+            self._header,
+            self._log_id,
+            self._offset,
+            self._seq,
+            self._entries(),
+            self._live_bytes,
+            self._log_bytes,
+            self.conn.serialize(),
+        )
+        self._hint_offset = self._offset
+
+    def _maintain(self):
+        """After a commit: finish or start a compaction, refresh the hint."""
+        if self._compaction is not None:
+            self._finish_compaction(wait=False)
+        elif (
+            self._log_bytes >= COMPACT_MIN_BYTES
+            and self._live_bytes < self._log_bytes * (1 - GARBAGE_SHARE)
+        ):
+            self._compaction = _Compaction(
+                self.db_path,
+                self.conn.serialize(),
+                bytes(self._key),
+                self._log_id,
+                self._header,
+            )
+        if self._offset - self._hint_offset >= HINT_INTERVAL:
+            self._save_hint()
+
+    # --- Compaction ---
+
+    def compact(self) -> Tuple[int, int]:
+        """
+        Rewrites the log with only its live records now (instead of waiting
+        for the background compaction). Returns the size before and after.
+        """
+        before = os.path.getsize(self.db_path)
+        self._lock_writes()
+        try:
+            self._refresh()
+            self._rewrite()
+        finally:
+            self._unlock_writes()
+        return before, os.path.getsize(self.db_path)
+
+    def _finish_compaction(self, wait: bool):
+        """
+        Swaps a finished compaction in (the writer lock is held): appends
+        the rows written since its snapshot to the new log and renames it
+        over the old one. Waits for it to finish if `wait`.
+        """
+        job = self._compaction
+        if job is None or (job.thread.is_alive() and not wait):
+            return
+        self._compaction = None
+        job.thread.join()
+        if job.error is not None or job.base != self._log_id:
+            # Failed, or another process replaced the log it compacted
+            job.discard()
+            return
+        conn = self.conn
+        written = job.written
+        try:
+            conn.executemany("INSERT INTO log_dirty VALUES (?, ?)", job.changed)
+            records = self._dirty_records()
+            conn.execute("DELETE FROM log_dirty")
+            frame = None
+            if records:
+                stream = StreamCipher.create(
+                    bytes(self._key), job.header[2] or DEFAULT_CIPHER
+                )
+                frame = _frame(
+                    stream, written.seq, job.log_id, [r for _, _, _, r in records]
+                )
+                _append(job.path, written.offset, frame)
+            _replace(job.path, self.db_path)
+        except BaseException:
+            job.discard()
+            raise
+        self._adopt(job.log_id, job.header, written)
+        if frame is not None:
+            for name, key, op, record in records:
+                self._index_record(
+                    name, key, self._offset, len(record), op == OP_UPSERT
+                )
+            self._offset += len(frame)
+            self._seq += 1
+            self._stamp = _stamp(self.db_path)
+        self._save_hint()
+
+    def _settle_compaction(self):
+        """Finishes a running compaction before the data is dropped."""
+        if self._compaction is None:
+            return
+        try:
+            self._lock_writes()
+        except sqlite3.OperationalError:
+            self._abandon_compaction()
+            return
+        try:
+            self._refresh()
+            self._finish_compaction(wait=True)
+        finally:
+            self._unlock_writes()
+
+    def _abandon_compaction(self):
+        if self._compaction is not None:
+            self._compaction.discard()
+            self._compaction = None
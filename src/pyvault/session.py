@@ -0,0 +1,697 @@
+import collections
+import os
+import time
+from contextlib import closing, contextmanager
+from typing import (
+    BinaryIO,
+    Callable,
+    Counter,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+from pyvault.cache import DEFAULT_PREFETCH, Credential, SecretCache
+from pyvault.changes import ChangeFeed
+from pyvault.crypto import (
+    DEFAULT_CHUNK_SIZE,
+    CryptoManager,
+    StreamCipher,
+    select_cipher,
+)
+from pyvault.engines import ENGINES, resolve_engine
+from pyvault.locking import VaultLock
+from pyvault.passwords import generate_passwords
+from pyvault.query import escape_glob, is_glob, renamer
+from pyvault.storage import VaultStorage
+
+# Plaintext encrypted at init time and used to check the Master Password
+VERIFIER_PLAINTEXT = "PYVAULT_VERIFIER"
+# Catalog rows read ahead by preload_catalog(); the rest stream afterwards
+PRELOAD_ROWS = 10_000
+
+_NOT_PRELOADED = object()
+
+
+class AuthenticationError(Exception):
+    """Raised when the Master Password does not unlock the vault."""
+
+
+class BulkChangeError(Exception):
+    """Raised when a bulk rename would overwrite or merge credentials."""
+
+
+class VaultSession:
+    """
+    One unlocked vault for the lifetime of a command.
+
+    The session owns a single VaultStorage connection and derives the key once.
+    Work that must be atomic runs in session.transaction(); write transactions
+    take the SQLite write lock up front, and no transaction is kept open while
+    the user answers a prompt, so concurrent pyvault processes are not blocked.
+    While open, the session holds the vault's advisory lock in shared mode.
+    The time spent in each phase is recorded in `timings` (seconds).
+
+    A `reusable` session (used by the interactive shell) survives `with` blocks
+    and is only released by an explicit close(). Long-lived sessions can keep
+    decrypted credentials in a `cache` (see enable_cache()).
+    """
+
+    def __init__(
+        self,
+        storage: VaultStorage,
+        crypto: CryptoManager,
+        lock: Optional[VaultLock] = None,
+    ):
+        self.storage = storage
+        self.crypto = crypto
+        self.lock = lock
+        self.key: Optional[bytearray] = None
+        self.timings: Dict[str, float] = {}
+        self.reusable = False
+        self.cache: Optional[SecretCache] = None
+        self._changes: Optional[ChangeFeed] = None
+        self._preloaded: Dict[tuple, object] = {}
+        self._preload_token = None
+        self._entered_at = None
+
+    @classmethod
+    def open(
+        cls, db_path, check_same_thread=True, engine: Optional[str] = None
+    ) -> "VaultSession":
+        """
+        Opens the vault file at db_path without unlocking it, with the storage
+        engine that wrote it (`engine` if the file does not exist yet).
+        check_same_thread=False: see VaultStorage (for callers that serialize
+        access from several threads themselves).
+        """
+        start = time.perf_counter()
+        lock = VaultLock(db_path)
+        lock.acquire()
+        try:
+            engine = resolve_engine(db_path, engine)
+            storage_class = VaultStorage if engine == "sqlite" else ENGINES[engine]
+            storage = storage_class(db_path, check_same_thread=check_same_thread)
+            session = cls(storage, CryptoManager(), lock)
+        except BaseException:
+            lock.release()
+            raise
+        session.timings["open"] = time.perf_counter() - start
+        return session
+
+    # --- Lifecycle ---
+
+    def __enter__(self):
+        self._entered_at = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.timings["command"] = time.perf_counter() - self._entered_at
+        if not self.reusable:
+            self.close()
+        return False
+
+    def close(self):
+        """Forgets the key, releases the database connection and the vault lock."""
+        self.forget_key()
+        self.storage.close()
+        if self.lock is not None:
+            self.lock.release()
+
+    @contextmanager
+    def transaction(self, write=False):
+        """One atomic unit of work; nested calls become savepoints."""
+        with self.storage.transaction(write=write):
+            yield self
+
+    @property
+    def unlocked(self) -> bool:
+        return self.key is not None
+
+    def forget_key(self):
+        """
+        Overwrites the derived key in memory, drops cached credentials and
+        locks the session.
+        """
+        if self.cache is not None:
+            self.cache.clear()
+        self.storage.seal()
+        if self.key is not None:
+            self.key[:] = bytes(len(self.key))
+            self.key = None
+
+    # --- Authentication ---
+
+    def is_initialized(self) -> bool:
+        """True if the vault already holds a master salt and verifier."""
+        return bool(self.storage.get_master_data())
+
+    def initialize(self, master_password: str, cipher: Optional[int] = None):
+        """
+        Creates the master salt and verifier and leaves the session unlocked.
+        Without an explicit cipher id the fastest one on this host is chosen.
+        """
+        if cipher is None:
+            start = time.perf_counter()
+            cipher = select_cipher()
+            self.timings["cipher_benchmark"] = time.perf_counter() - start
+        self.crypto.cipher = cipher
+
+        start = time.perf_counter()
+        salt = os.urandom(self.crypto.salt_size)
+        key = self.crypto.derive_key(master_password, salt)
+        self.storage.unseal(key)
+        self.storage.store_master_data(
+            salt, self.crypto.encrypt(VERIFIER_PLAINTEXT, key), cipher
+        )
+        self.key = bytearray(key)
+        self.timings["kdf"] = time.perf_counter() - start
+
+    def unlock(self, master_password: str):
+        """
+        Derives the key and checks it against the stored verifier.
+        Raises AuthenticationError on a wrong password or an uninitialized vault.
+        """
+        try:
+            start = time.perf_counter()
+            master = self._take_preloaded(("master",))
+            if master is _NOT_PRELOADED:
+                master = self._read_master()
+            salt, verifier_blob, cipher = master
+            self.timings["read_master"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            key = self.crypto.derive_key(master_password, salt)
+            self.timings["kdf"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            self.crypto.decrypt(verifier_blob, key)
+            self.timings["verify"] = time.perf_counter() - start
+        except Exception as e:
+            raise AuthenticationError("Invalid Master Password.") from e
+        start = time.perf_counter()
+        self.storage.unseal(key)
+        if self.storage.engine != "sqlite":
+            self.timings["unseal"] = time.perf_counter() - start
+        # Kept in a mutable buffer so that forget_key() can overwrite it
+        self.key = bytearray(key)
+        if cipher is not None:
+            self.crypto.cipher = cipher
+
+    def _read_master(self):
+        """(salt, verifier, cipher) in one read transaction (None if not set)."""
+        with self.transaction():
+            master = self.storage.get_master_data() or (None, None)
+            return (*master, self.storage.get_cipher())
+
+    def unlock_with_key(self, key: bytes):
+        """
+        Unlocks with an already derived key (skipping Argon2), checked
+        against the stored verifier like a Master Password.
+        """
+        try:
+            _, verifier_blob = self.storage.get_master_data()
+            cipher = self.storage.get_cipher()
+            self.crypto.decrypt(verifier_blob, bytes(key))
+        except Exception as e:
+            raise AuthenticationError("Invalid vault key.") from e
+        self.storage.unseal(key)
+        self.key = bytearray(key)
+        if cipher is not None:
+            self.crypto.cipher = cipher
+
+    # --- Crypto helpers ---
+
+    def encrypt(self, plaintext: str) -> bytes:
+        """Encrypts with the vault's preferred cipher (records migrate on rewrite)."""
+        return self.crypto.encrypt(plaintext, self.key)
+
+    def decrypt(self, blob: bytes) -> str:
+        return self.crypto.decrypt(blob, self.key)
+
+    # --- Credential operations ---
+
+    def add(self, service: str, username: str, password: str):
+        """Encrypts and stores (or replaces) a credential."""
+        self.storage.add_credential(service, username, self.encrypt(password))
+
+    def reencrypt(self) -> int:
+        """
+        Re-encrypts every credential with the preferred cipher in one
+        transaction, in place: passwords keep their age and no version is
+        created. Returns the number of records.
+        """
+        with self.transaction(write=True):
+            records = [
+                (service, username, self.encrypt(password))
+                for service, username, password in self.inventory()
+            ]
+            return self.storage.rewrite_credentials(records)
+
+    def exists(self, service: str) -> bool:
+        return bool(self.storage.get_credential(service))
+
+    def get(self, service: str) -> Optional[Tuple[str, str]]:
+        """Returns (username, password) for a service, or None if it is missing."""
+        generation = 0
+        if self.cache is not None:
+            self._check_cache()
+            cached = self.cache.get(service)
+            if cached is not None:
+                self.storage.record_access([service])
+                return cached
+            generation = self.cache.generation
+        credential = self._take_preloaded(("get", service))
+        if credential is _NOT_PRELOADED:
+            credential = self.storage.get_credential(service)
+        if not credential:
+            return None
+        username, password_blob = credential[0], credential[1]
+        plaintext = self.decrypt(password_blob)
+        self.storage.record_access([service])
+        if self.cache is not None:
+            self.cache.put(service, Credential(username, plaintext), generation)
+        return username, plaintext
+
+    def delete(self, service: str):
+        self.storage.delete_credential(service)
+
+    # --- Read-ahead ---
+
+    def warm_up(self, prepare: Optional[Callable[["VaultSession"], None]] = None):
+        """
+        Does the part of unlocking that needs no password ahead of time (e.g.
+        while the prompt is open): reads the salt and verifier, sets up the
+        cipher backend, then lets `prepare(session)` preload what the command
+        will read. Errors of `prepare` are not raised: the command reads again
+        and reports them.
+        """
+        start = time.perf_counter()
+        with self.transaction():
+            self._start_preload()
+            master = self._read_master()
+        self._preloaded[("master",)] = master
+        if master[0] is not None:
+            self.crypto.warm_up(master[2])
+        if prepare is not None:
+            try:
+                prepare(self)
+            except Exception:
+                pass
+        self.timings["warm_up"] = time.perf_counter() - start
+
+    def preload(self, services: Iterable[str]):
+        """
+        Reads the stored rows of `services` for get() ahead of time. Like
+        every preloaded read, a row is used once, and only if the vault did
+        not change since.
+        """
+        with self.transaction():
+            self._start_preload()
+            for service in services:
+                self._preloaded[("get", service)] = self.storage.get_credential(service)
+
+    def preload_catalog(
+        self,
+        where: Optional[str] = None,
+        after: Optional[str] = None,
+        limit: Optional[int] = None,
+        order: str = "name",
+    ):
+        """
+        Reads ahead the first rows (at most PRELOAD_ROWS) of a catalog() call
+        with the same arguments.
+        """
+        wanted = PRELOAD_ROWS if limit is None else min(limit, PRELOAD_ROWS)
+        with self.transaction():
+            self._start_preload()
+            rows = self.storage.get_catalog(where, after, wanted, order=order)
+        complete = len(rows) < wanted or wanted == limit
+        self._preloaded[("catalog", where, after, limit, order)] = (rows, complete)
+
+    def _start_preload(self):
+        """Called in the read transaction of a preload: drops stale values."""
+        token = self.storage.change_token()
+        if token != self._preload_token:
+            self._preloaded.clear()
+            self._preload_token = token
+
+    def _take_preloaded(self, key):
+        """
+        The value preloaded for `key`, once; _NOT_PRELOADED if there is none
+        or the vault changed since it was read (which drops them all).
+        """
+        if key not in self._preloaded:
+            return _NOT_PRELOADED
+        if self.storage.change_token() != self._preload_token:
+            self._preloaded.clear()
+            return _NOT_PRELOADED
+        return self._preloaded.pop(key)
+
+    # --- Access tracking and the secret cache ---
+
+    def enable_cache(self, max_entries: int, ttl: Optional[float] = None):
+        """
+        Keeps up to `max_entries` decrypted credentials read by get() in
+        memory (for at most `ttl` seconds if set). A change to a credential,
+        by this session or another process, drops just that entry (see
+        ChangeFeed); forget_key() empties it.
+        """
+        self.cache = SecretCache(max_entries, ttl)
+        self._changes = ChangeFeed(self.storage)
+
+    def _check_cache(self):
+        changed = self._changes.poll()
+        if changed is None:
+            self.cache.clear()
+        elif changed:
+            self.cache.invalidate(changed)
+
+    def prefetch(self, limit: int = DEFAULT_PREFETCH) -> List[str]:
+        """
+        Decrypts the `limit` hottest services (see VaultStorage.get_hot) into
+        the cache ahead of their first read; returns them.
+        """
+        if self.cache is None or limit < 1:
+            return []
+        self._check_cache()
+        generation = self.cache.generation
+        rows = self.storage.get_credentials(self.storage.get_hot(limit))
+        hot = [
+            (service, Credential(username, self.decrypt(blob)))
+            for service, (username, blob) in rows.items()
+        ]
+        self.cache.warm(hot, generation)
+        return [service for service, _ in hot]
+
+    def access_coverage(self, sizes: Iterable[int]):
+        """Recorded reads and the share the N most read services account for."""
+        self.storage.flush_access()
+        return self.storage.get_access_coverage(sizes)
+
+    # --- Version history ---
+
+    def get_version(self, service: str, version: int) -> Optional[Tuple[str, str]]:
+        """(username, password) of a version (current or past), or None."""
+        credential = self.storage.get_credential_version(service, version)
+        if not credential:
+            return None
+        username, password_blob = credential
+        return username, self.decrypt(password_blob)
+
+    def history(self, service: str) -> List[Tuple[int, str, float, Optional[float]]]:
+        """
+        (version, username, saved at, replaced at) of every kept version,
+        newest first; the current one (replaced at None) comes first.
+        """
+        with self.transaction():
+            current = self.storage.get_credential(service)
+            info = self.storage.get_credential_info(service)
+            past = self.storage.get_history(service)
+        rows = [(info[0], current[0], info[1], None)] if current else []
+        return rows + [tuple(row) for row in past]
+
+    def restore(self, service: str, version: int) -> Optional[int]:
+        """
+        Makes a past version current again (as a new version, so the one it
+        replaces stays in the history). Returns the new version, or None if
+        that version is not kept.
+        """
+        with self.transaction(write=True):
+            credential = self.storage.get_credential_version(service, version)
+            if not credential:
+                return None
+            # The blob must still open with this vault's key
+            self.decrypt(credential[1])
+            self.storage.add_credential(service, *credential)
+            return self.storage.get_credential_info(service)[0]
+
+    # --- Password age ---
+
+    def stale(
+        self, max_age: float, where: Optional[str] = None
+    ) -> List[Tuple[str, str, float, float]]:
+        """
+        (service, username, updated at, last accessed at) of the credentials
+        not changed for `max_age` seconds, oldest first.
+        """
+        return self.storage.get_stale(time.time() - max_age, where)
+
+    def rotate(
+        self, max_age: float, where: Optional[str] = None, length: int = 20
+    ) -> List[Tuple[str, str, float, int]]:
+        """
+        Gives every credential not changed for `max_age` seconds a new
+        generated password, in one transaction. Passwords are generated in
+        bulk and encrypted before anything is written; the replaced ones stay
+        in the history. Returns (service, username, previous change, new
+        version) for each rotated credential.
+        """
+        with self.transaction(write=True):
+            stale = self.stale(max_age, where)
+            passwords = generate_passwords(len(stale), length)
+            blobs = [self.encrypt(password) for password in passwords]
+            rotated = []
+            for (service, username, updated_at, _), blob in zip(stale, blobs):
+                self.storage.add_credential(service, username, blob)
+                version = self.storage.get_credential_info(service)[0]
+                rotated.append((service, username, updated_at, version))
+        return rotated
+
+    def list(self, where: Optional[str] = None) -> List[Tuple[str, str]]:
+        """
+        Returns (service, username) pairs sorted by service, only those
+        matching the filter expression `where` if given (see pyvault.query).
+        """
+        return self.storage.get_all_credentials(where)
+
+    # --- Bulk changes by pattern ---
+
+    def name_pattern(self, name: str, literal: bool = False) -> str:
+        """
+        The pattern for a name given on the command line: the name of a
+        stored service, or any name if literal, matches only itself (its
+        wildcards escaped, see query.escape_glob).
+        """
+        if literal or (is_glob(name) and self.exists(name)):
+            return escape_glob(name)
+        return name
+
+    def matching(
+        self, pattern: str, where: Optional[str] = None
+    ) -> List[Tuple[str, str]]:
+        """
+        (service, username) of the credentials whose name matches the glob
+        `pattern` (e.g. 'cluster-a/*'; a name without wildcards matches only
+        itself) and the filter expression `where`, sorted by service.
+        """
+        condition = 'service:"{}"'.format(pattern.replace('"', '""'))
+        return self.list(f"{condition} and ({where})" if where else condition)
+
+    def delete_matching(self, pattern: str, where: Optional[str] = None) -> List[str]:
+        """Deletes the matching credentials in one transaction; their names."""
+        with self.transaction(write=True):
+            services = [service for service, _ in self.matching(pattern, where)]
+            self.storage.delete_credentials(services)
+        return services
+
+    def rename_plan(
+        self, source: str, target: str, where: Optional[str] = None
+    ) -> List[Tuple[str, str]]:
+        """
+        (old name, new name) of each credential matching `source` (and
+        `where`) under `target` (see query.renamer). Raises BulkChangeError
+        if a new name is already used or given to two credentials.
+        """
+        rename = renamer(source, target)
+        plan = [
+            (service, rename(service))
+            for service, _ in self.matching(source, where)
+            if rename(service) != service
+        ]
+        taken = collections.Counter(new for _, new in plan)
+        for _, new in plan:
+            if taken[new] > 1:
+                raise BulkChangeError(f"Several credentials would be named '{new}'.")
+            if self.storage.get_credential(new) is not None:
+                raise BulkChangeError(f"'{new}' already exists.")
+        return plan
+
+    def rename_matching(
+        self, source: str, target: str, where: Optional[str] = None
+    ) -> List[Tuple[str, str]]:
+        """Applies rename_plan() in one transaction; returns the plan."""
+        with self.transaction(write=True):
+            plan = self.rename_plan(source, target, where)
+            self.storage.rename_credentials(plan)
+        return plan
+
+    def set_username_matching(
+        self, pattern: str, username: str, where: Optional[str] = None
+    ) -> List[str]:
+        """
+        Gives the matching credentials `username` in one transaction, each as
+        a new version. Returns the services changed.
+        """
+        with self.transaction(write=True):
+            services = [
+                service
+                for service, current in self.matching(pattern, where)
+                if current != username
+            ]
+            self.storage.set_usernames(services, username)
+        return services
+
+    def inventory(self, where: Optional[str] = None) -> Iterator[Tuple[str, str, str]]:
+        """
+        Yields (service, username, password) for every stored credential, or
+        those matching `where`. Records are read and decrypted one at a time.
+        """
+        for service, username, blob in self.storage.get_full_inventory(
+            stream=True, where=where
+        ):
+            yield service, username, self.decrypt(blob)
+
+    def policy_inventory(
+        self, where: Optional[str] = None
+    ) -> Iterator[Tuple[str, str, Optional[float], Tuple[str, ...]]]:
+        """
+        Yields (service, password, updated at, tags) for pyvault.policy,
+        decrypting one record at a time.
+        """
+        for service, blob, updated_at, tags in self.storage.get_policy_inventory(where):
+            yield service, self.decrypt(blob), updated_at, tags
+
+    # --- Tags and folders ---
+
+    def catalog(
+        self,
+        where: Optional[str] = None,
+        after: Optional[str] = None,
+        limit: Optional[int] = None,
+        order: str = "name",
+    ) -> Iterator[Tuple[str, str, Optional[str], Optional[str]]]:
+        """
+        Yields (service, username, folder, tags) of the matching credentials
+        sorted by service (or "recent": last read first, "frequent": most
+        read first), starting after the service `after`, at most `limit`.
+        Rows are streamed from SQLite: close the iterator when stopping early.
+        """
+        if order != "name":
+            # Reads counted by this session so far count too
+            self.storage.flush_access()
+        preloaded = self._take_preloaded(("catalog", where, after, limit, order))
+        if preloaded is not _NOT_PRELOADED:
+            rows, complete = preloaded
+            if complete:
+                return _preloaded_rows(rows)
+            if order == "name":
+                remaining = None if limit is None else limit - len(rows)
+                return _preloaded_rows(
+                    rows,
+                    lambda: self.storage.get_catalog(
+                        where, rows[-1][0], remaining, stream=True
+                    ),
+                )
+        return self.storage.get_catalog(where, after, limit, stream=True, order=order)
+
+    def labels(self, service: str) -> Optional[Tuple[Optional[str], List[str]]]:
+        """(folder, tags) of a credential, or None if it is not stored."""
+        return self.storage.get_labels(service)
+
+    def label(
+        self,
+        service: str,
+        add: Iterable[str] = (),
+        remove: Iterable[str] = (),
+        folder: Optional[str] = None,
+    ) -> bool:
+        """
+        Adds and removes tags and, if folder is given, moves the credential
+        ('' for no folder). Returns False if the service is not stored.
+        """
+        with self.transaction(write=True):
+            if not self.storage.get_credential(service):
+                return False
+            self.storage.add_tags(service, add)
+            self.storage.remove_tags(service, remove)
+            if folder is not None:
+                self.storage.set_folder(service, folder.strip("/") or None)
+        return True
+
+    # --- Attachments ---
+
+    def attach(
+        self,
+        service: str,
+        name: str,
+        source: BinaryIO,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+    ) -> int:
+        """
+        Encrypts the file or pipe `source` chunk by chunk and attaches it to a
+        service (replacing an attachment of the same name). Returns its size.
+        """
+        stream = StreamCipher.create(self.key, self.crypto.cipher)
+        return self.storage.add_attachment(
+            service, name, stream.header, stream.encrypt_file(source, chunk_size)
+        )
+
+    def attachments(self, service: str) -> List[Tuple[str, int]]:
+        """(name, size) of the files attached to a service."""
+        return self.storage.get_attachments(service)
+
+    def read_attachment(self, service: str, name: str, dest: BinaryIO) -> Optional[int]:
+        """
+        Decrypts an attachment into `dest` one chunk at a time and returns the
+        number of bytes written, or None if there is no such attachment.
+        Raises InvalidTag if the stored chunks were altered, reordered or cut.
+        """
+        written = 0
+        with self.transaction():
+            attachment = self.storage.get_attachment(service, name)
+            if attachment is None:
+                return None
+            attachment_id, header, _ = attachment
+            stream = StreamCipher(self.key, header)
+            # Closed before the transaction ends, even if a chunk fails to open
+            with closing(
+                self.storage.stream_attachment_chunks(attachment_id)
+            ) as chunks:
+                for data in stream.decrypt_chunks(chunks):
+                    dest.write(data)
+                    written += len(data)
+        return written
+
+    def detach(self, service: str, name: str) -> bool:
+        return self.storage.delete_attachment(service, name)
+
+    # --- Cipher management ---
+
+    def set_cipher(self, cipher: int):
+        """Switches the cipher for new and rewritten records; old ones stay readable."""
+        self.storage.set_cipher(cipher)
+        self.crypto.cipher = cipher
+
+    def cipher_usage(self) -> Counter:
+        """Number of stored records per cipher id (read from the blob headers)."""
+        return collections.Counter(
+            self.crypto.cipher_of(blob)
+            for _, _, blob in self.storage.get_full_inventory(stream=True)
+        )
+
+    def format_timings(self) -> str:
+        """Human readable summary of the recorded phase timings."""
+        return " · ".join(
+            f"{phase} {seconds * 1000:.1f}ms" for phase, seconds in self.timings.items()
+        )
+
+
+def _preloaded_rows(rows, rest=None):
+    """Preloaded catalog rows, then those `rest()` streams (if given)."""
+    yield from rows
+    if rest is not None:
+        yield from rest()
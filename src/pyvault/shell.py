@@ -0,0 +1,301 @@
+import asyncio
+import bisect
+import itertools
+import shlex
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from prompt_toolkit import PromptSession
+from prompt_toolkit.completion import Completer, Completion
+from prompt_toolkit.history import InMemoryHistory
+
+from pyvault.session import VaultSession
+
+# Seconds without input after which the shell forgets the key
+DEFAULT_IDLE_TIMEOUT = 300.0
+
+# Commands whose first argument is a service name, completed from the index
+SERVICE_COMMANDS = ("add", "find", "get", "rm")
+
+# Cache sizes for which 'stats' shows the share of reads they would serve
+COVERAGE_SIZES = (5, 10, 20, 50, 100)
+
+# Commands handled by the shell itself
+BUILTINS = {
+    "find": "Filter services and usernames by text (no database access).",
+    "stats": "Show the secret cache hit rate and how reads spread over services.",
+    "lock": "Forget the key now; the Master Password is asked again.",
+    "help": "Show this help.",
+    "exit": "Close the shell and wipe the key from memory (also: quit, Ctrl-D).",
+}
+
+# Reader: (prompt, idle timeout in seconds or None) -> line
+LineReader = Callable[[str, Optional[float]], str]
+
+
+class IdleTimeout(Exception):
+    """No input was received within the idle timeout."""
+
+
+class ServiceIndex:
+    """
+    In-memory index of (service, username) pairs for completion and filtering.
+
+    Services are kept sorted, so finding those with a prefix is a binary
+    search; completions are then offered most recently used first.
+    refresh() only reloads the index when the vault changed since the last load.
+    """
+
+    def __init__(self):
+        self.services: List[str] = []
+        self.usernames: Dict[str, str] = {}
+        # service -> recency rank (lower: used more recently)
+        self.rank: Dict[str, int] = {}
+        self._token = None
+        self._used = itertools.count(-1, -1)
+
+    def refresh(self, session: VaultSession, force: bool = False) -> bool:
+        """Reloads the index if the vault changed; returns True if it did."""
+        token = session.storage.change_token()
+        if not force and token == self._token:
+            return False
+        rows = session.storage.get_catalog(order="recent")
+        self.services = sorted(service for service, *_ in rows)
+        self.usernames = {service: username for service, username, *_ in rows}
+        self.rank = {row[0]: rank for rank, row in enumerate(rows)}
+        self._token = token
+        return True
+
+    def used(self, service: str):
+        """Moves a service to the front of the completion order."""
+        if service in self.usernames:
+            self.rank[service] = next(self._used)
+
+    def complete(self, prefix: str) -> List[str]:
+        """Services starting with prefix, most recently used first."""
+        start = bisect.bisect_left(self.services, prefix)
+        matches = []
+        for service in self.services[start:]:
+            if not service.startswith(prefix):
+                break
+            matches.append(service)
+        return sorted(matches, key=lambda service: self.rank.get(service, 0))
+
+    def filter(self, text: str) -> List[Tuple[str, str]]:
+        """(service, username) pairs containing text (case-insensitive)."""
+        needle = text.lower()
+        return [
+            (service, self.usernames[service])
+            for service in self.services
+            if needle in service.lower() or needle in self.usernames[service].lower()
+        ]
+
+    def clear(self):
+        self.services = []
+        self.usernames = {}
+        self.rank = {}
+        self._token = None
+
+
+class ShellCompleter(Completer):
+    """Completes command names, then service names for SERVICE_COMMANDS."""
+
+    def __init__(self, commands: Iterable[str], index: ServiceIndex):
+        self.commands = sorted(commands)
+        self.index = index
+
+    def get_completions(self, document, complete_event):
+        text = document.text_before_cursor
+        words = text.split()
+        completing_new_word = not words or text[-1].isspace()
+
+        if not words or (len(words) == 1 and not completing_new_word):
+            prefix = words[0] if words else ""
+            for name in self.commands:
+                if name.startswith(prefix):
+                    yield Completion(name, start_position=-len(prefix))
+            return
+
+        if words[0] in SERVICE_COMMANDS and len(words) == (
+            1 if completing_new_word else 2
+        ):
+            prefix = "" if completing_new_word else words[1]
+            for service in self.index.complete(prefix):
+                yield Completion(shlex.quote(service), start_position=-len(prefix))
+
+
+def prompt_reader(completer: Completer) -> LineReader:
+    """
+    Line reader backed by prompt_toolkit, with tab completion and an in-memory
+    history (never written to disk). Raises IdleTimeout when the timeout expires.
+    """
+    prompt_session = PromptSession(
+        completer=completer, history=InMemoryHistory(), complete_while_typing=False
+    )
+
+    async def ask(message: str) -> str:
+        try:
+            return await prompt_session.prompt_async(message)
+        except KeyboardInterrupt:
+            # Ctrl-C discards the current line, as in a regular shell
+            return ""
+
+    def read(message: str, timeout: Optional[float]) -> str:
+        # A short-lived event loop per line, so commands that run their own
+        # prompts (questionary) never find a loop already running
+        try:
+            return asyncio.run(asyncio.wait_for(ask(message), timeout))
+        except asyncio.TimeoutError:
+            raise IdleTimeout() from None
+
+    return read
+
+
+class VaultShell:
+    """
+    Read-eval loop over one unlocked, reusable VaultSession.
+
+    `execute(argv)` runs a regular pyvault command against the session and
+    `unlock()` asks for the Master Password again after the shell was locked,
+    returning False to leave the shell. With a `cache_size`, passwords read
+    are kept decrypted in the session's cache and the `prefetch` hottest
+    services are decrypted into it after every unlock. On exit the key is
+    overwritten and the index and cache dropped.
+    """
+
+    def __init__(
+        self,
+        session: VaultSession,
+        execute: Callable[[List[str]], None],
+        unlock: Callable[[], bool],
+        console,
+        commands: Iterable[str],
+        idle_timeout: Optional[float] = DEFAULT_IDLE_TIMEOUT,
+        read_line: Optional[LineReader] = None,
+        prompt: str = "pyvault> ",
+        cache_size: int = 0,
+        prefetch: int = 0,
+    ):
+        self.session = session
+        self.execute = execute
+        self.unlock = unlock
+        self.console = console
+        self.commands = sorted(commands)
+        self.idle_timeout = idle_timeout
+        self.prompt = prompt
+        self.cache_size = cache_size
+        self.prefetch = prefetch
+        self.index = ServiceIndex()
+        self.read_line = read_line or prompt_reader(
+            ShellCompleter([*self.commands, *BUILTINS, "quit"], self.index)
+        )
+
+    def run(self):
+        self.session.reusable = True
+        if self.cache_size:
+            self.session.enable_cache(self.cache_size)
+        self.warm_up()
+        try:
+            while True:
+                self.index.refresh(self.session)
+                try:
+                    line = self.read_line(self.prompt, self.idle_timeout)
+                except IdleTimeout:
+                    self.lock()
+                    self.console.print(
+                        "[bold yellow]Vault locked after inactivity.[/bold yellow]"
+                    )
+                    if not self.unlock():
+                        break
+                    self.warm_up()
+                    continue
+                except KeyboardInterrupt:
+                    continue
+                except EOFError:
+                    break
+                if not self.dispatch(line):
+                    break
+        finally:
+            self.close()
+
+    def dispatch(self, line: str) -> bool:
+        """Runs one input line; returns False when the shell should exit."""
+        try:
+            argv = shlex.split(line)
+        except ValueError as e:
+            self.console.print(f"[bold red]Error:[/bold red] {e}")
+            return True
+        if not argv:
+            return True
+
+        name = argv[0]
+        if name in ("exit", "quit"):
+            return False
+        if name == "help":
+            self.print_help()
+        elif name == "lock":
+            self.lock()
+            if not self.unlock():
+                return False
+            self.warm_up()
+        elif name == "find":
+            self.find(" ".join(argv[1:]))
+        elif name == "stats":
+            self.print_stats()
+        elif name in self.commands:
+            if name in SERVICE_COMMANDS and len(argv) > 1:
+                self.index.used(argv[1])
+            self.execute(argv)
+        else:
+            self.console.print(
+                f"[bold red]Unknown command:[/bold red] {name}. Type 'help' for a list."
+            )
+        return True
+
+    def find(self, text: str):
+        matches = self.index.filter(text)
+        if not matches:
+            self.console.print(f"[yellow]No services matching '{text}'.[/yellow]")
+            return
+        for service, username in matches:
+            self.console.print(f"[cyan]{service}[/cyan]  [green]{username}[/green]")
+
+    def warm_up(self):
+        """Pre-decrypts the hot set into the cache (after each unlock)."""
+        if self.session.cache is not None and self.prefetch:
+            self.session.prefetch(self.prefetch)
+
+    def print_stats(self):
+        cache = self.session.cache
+        if cache is None:
+            self.console.print("Secret cache: off")
+        else:
+            stats = cache.stats()
+            self.console.print(
+                f"Secret cache: {stats.hits} hit(s), {stats.misses} miss(es) "
+                f"([bold]{stats.hit_rate:.0%}[/bold] hit rate), "
+                f"{stats.entries}/{stats.max_entries} entries, "
+                f"{stats.prefetched} prefetched"
+            )
+        total, coverage = self.session.access_coverage(COVERAGE_SIZES)
+        if not total:
+            self.console.print("No reads recorded yet.")
+            return
+        self.console.print(f"Reads recorded: {total:,}. Share served by the top:")
+        for size, share in coverage:
+            self.console.print(f"  {size:>4} services  {share:6.1%}")
+
+    def print_help(self):
+        self.console.print("[bold]Vault commands:[/bold] " + ", ".join(self.commands))
+        self.console.print("Use '<command> --help' for details.")
+        for name, description in BUILTINS.items():
+            self.console.print(f"  [bold cyan]{name:<6}[/bold cyan] {description}")
+
+    def lock(self):
+        """Forgets the key and the cached service names; the connection stays open."""
+        self.session.forget_key()
+        self.index.clear()
+
+    def close(self):
+        self.index.clear()
+        self.session.reusable = False
+        self.session.close()
@@ -0,0 +1,214 @@
+import hashlib
+import random
+import string
+import struct
+from typing import Dict, Iterable, List, Tuple
+
+# Mersenne prime used for the universal hash family of the MinHash signatures
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+# LSH buckets larger than this are compared against one anchor only
+_FULL_COMPARE_LIMIT = 32
+
+# Common "leet speak" substitutions folded back to letters before shingling
+_LEET_TABLE = str.maketrans(
+    {
+        "@": "a",
+        "4": "a",
+        "3": "e",
+        "1": "i",
+        "!": "i",
+        "0": "o",
+        "$": "s",
+        "5": "s",
+        "7": "t",
+    }
+)
+
+
+def password_skeleton(password: str) -> str:
+    """
+    Reduces a password to its structural skeleton.
+    Letters are lowercased, every run of digits becomes '9' and every run of
+    symbols becomes '#', so 'Summer2023!' and 'summer2024?' share 'summer9#'.
+    """
+    skeleton = []
+    for char in password.lower():
+        if char in string.ascii_lowercase:
+            skeleton.append(char)
+            continue
+        token = "9" if char.isdigit() else "#"
+        if not skeleton or skeleton[-1] != token:
+            skeleton.append(token)
+    return "".join(skeleton)
+
+
+def _shingles(password: str, size: int = 3) -> set:
+    """Returns the set of character n-grams of a normalized password."""
+    normalized = password.lower().translate(_LEET_TABLE)
+    if len(normalized) <= size:
+        return {normalized}
+    return {normalized[i : i + size] for i in range(len(normalized) - size + 1)}
+
+
+def _shingle_hash(shingle: str) -> int:
+    """Stable 32-bit hash of a shingle (independent of PYTHONHASHSEED)."""
+    digest = hashlib.blake2b(shingle.encode(), digest_size=4).digest()
+    return int.from_bytes(digest, "little")
+
+
+def _jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b)
+
+
+class _DisjointSet:
+    """Minimal union-find used to merge candidate pairs into clusters."""
+
+    def __init__(self, size: int):
+        self.parent = list(range(size))
+
+    def find(self, item: int) -> int:
+        while self.parent[item] != item:
+            self.parent[item] = self.parent[self.parent[item]]
+            item = self.parent[item]
+        return item
+
+    def union(self, a: int, b: int) -> bool:
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a == root_b:
+            return False
+        self.parent[root_b] = root_a
+        return True
+
+
+class SimilarityDetector:
+    """
+    Groups near-identical passwords in roughly linear time.
+
+    Two stages run on the distinct passwords of the vault:
+      1. Skeleton bucketing: passwords with the same structural skeleton
+         (see password_skeleton) are grouped directly, whatever `threshold`
+         (use_skeleton=False turns the stage off).
+      2. MinHash/LSH: signatures over character shingles are split into bands,
+         only passwords colliding in at least one band are compared, and a
+         pair is merged when its exact Jaccard similarity reaches `threshold`.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.6,
+        bands: int = 16,
+        rows: int = 2,
+        min_length: int = 6,
+        use_skeleton: bool = True,
+    ):
+        if not 0.0 < threshold <= 1.0:
+            raise ValueError("Similarity threshold must be in the range (0, 1].")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = rows
+        self.min_length = min_length
+        self.use_skeleton = use_skeleton
+
+        # Fixed seed: signatures must be reproducible between runs
+        rng = random.Random(0x5EED)
+        self._perms = [
+            (rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME))
+            for _ in range(bands * rows)
+        ]
+
+    def _signature(self, shingles: set) -> bytes:
+        # Packed as 32-bit values: a fraction of the size of a tuple of ints,
+        # which matters with one signature per distinct password
+        hashes = [_shingle_hash(s) for s in shingles]
+        return struct.pack(
+            f"<{len(self._perms)}I",
+            *(
+                min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes)
+                for a, b in self._perms
+            ),
+        )
+
+    def find_clusters(
+        self, entries: Iterable[Tuple[str, str]]
+    ) -> List[Dict[str, object]]:
+        """
+        Clusters (service, password) pairs by password similarity.
+        Exact duplicates collapse into one candidate (reuse is reported
+        separately); only clusters of at least two DISTINCT passwords are
+        returned, as dicts with the sorted 'services' and the 'match' stage.
+        """
+        services_by_password: Dict[str, List[str]] = {}
+        for service, password in entries:
+            if len(password) < self.min_length:
+                continue
+            services_by_password.setdefault(password, []).append(service)
+
+        passwords = sorted(services_by_password)
+        if len(passwords) < 2:
+            return []
+
+        clusters = _DisjointSet(len(passwords))
+        # Passwords merged by the skeleton stage: their clusters are "pattern" ones
+        pattern_members = []
+
+        if self.use_skeleton:
+            by_skeleton: Dict[str, int] = {}
+            for idx, pwd in enumerate(passwords):
+                skeleton = password_skeleton(pwd)
+                # Skeletons with too few letters ('9#') would lump unrelated PINs together
+                if sum(c.isalpha() for c in skeleton) < 4:
+                    continue
+                if skeleton in by_skeleton:
+                    clusters.union(by_skeleton[skeleton], idx)
+                    pattern_members.append(idx)
+                else:
+                    by_skeleton[skeleton] = idx
+
+        # Shingle sets are rebuilt for the few candidate pairs instead of being
+        # kept for every password
+        signatures = [self._signature(_shingles(pwd)) for pwd in passwords]
+        band_size = self.rows * 4
+        for band in range(self.bands):
+            start = band * band_size
+            buckets: Dict[bytes, List[int]] = {}
+            for idx, signature in enumerate(signatures):
+                buckets.setdefault(signature[start : start + band_size], []).append(idx)
+
+            for members in buckets.values():
+                # Oversized buckets are only compared against their first member
+                # to keep the worst case linear in the bucket size
+                anchors = (
+                    members if len(members) <= _FULL_COMPARE_LIMIT else members[:1]
+                )
+                for pos, anchor in enumerate(anchors):
+                    for other in members[pos + 1 :]:
+                        if clusters.find(anchor) == clusters.find(other):
+                            continue
+                        score = _jaccard(
+                            _shingles(passwords[anchor]), _shingles(passwords[other])
+                        )
+                        if score >= self.threshold:
+                            clusters.union(anchor, other)
+
+        grouped: Dict[int, List[int]] = {}
+        for idx in range(len(passwords)):
+            grouped.setdefault(clusters.find(idx), []).append(idx)
+        pattern_roots = {clusters.find(idx) for idx in pattern_members}
+
+        report = []
+        for root, members in grouped.items():
+            if len(members) < 2:
+                continue
+            services = sorted(
+                svc for idx in members for svc in services_by_password[passwords[idx]]
+            )
+            report.append(
+                {
+                    "services": services,
+                    "match": "pattern" if root in pattern_roots else "fuzzy",
+                }
+            )
+        report.sort(key=lambda cluster: cluster["services"])
+        return report
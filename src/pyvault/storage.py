@@ -1,19 +1,63 @@
+import os
+import random
 import sqlite3
+import time
 from contextlib import contextmanager
 from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 from platformdirs import user_data_dir
 
+from pyvault import cache, maintenance, merkle, migrations, query
+from pyvault.merkle import Entry
+
 # Application name used for system-specific data directories
 APP_NAME = "pyvault"
 
+# How long SQLite waits on a locked database before reporting SQLITE_BUSY (ms)
+DEFAULT_BUSY_TIMEOUT = int(os.environ.get("PYVAULT_BUSY_TIMEOUT", "5000"))
+# Extra attempts (with jittered exponential backoff) once busy_timeout expired
+DEFAULT_BUSY_RETRIES = 5
+# Expired history rows removed by each write (the rest go with later writes)
+HISTORY_PRUNE_STEP = 50
+# Reads are counted in memory and written back in one transaction once this
+# many services are pending or this many seconds passed (and on close)
+ACCESS_FLUSH_SIZE = 256
+ACCESS_FLUSH_INTERVAL = 30.0
+
+# ORDER BY clauses of get_catalog()
+CATALOG_ORDERS = {
+    "name": "c.service ASC",
+    "recent": "c.last_accessed_at DESC, c.service ASC",
+    "frequent": "c.access_count DESC, c.last_accessed_at DESC, c.service ASC",
+}
+
+
+def _is_busy(error: sqlite3.OperationalError) -> bool:
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
+
 
 class VaultStorage:
     """Handles all database interactions for PyVault with a unified schema."""
 
-    def __init__(self, db_path=None):
+    # Storage engine name (see pyvault.engines)
+    engine = "sqlite"
+
+    def __init__(
+        self,
+        db_path=None,
+        auto_migrate=True,
+        busy_timeout=DEFAULT_BUSY_TIMEOUT,
+        max_retries=DEFAULT_BUSY_RETRIES,
+        check_same_thread=True,
+    ):
         """
         Initialize the storage.
         If no db_path is provided, it uses the standard system data directory.
+        With auto_migrate=False pending schema migrations are left to migrate().
+        busy_timeout (ms) and max_retries control how concurrent access is waited out.
+        check_same_thread=False lets other threads use the connection; the
+        caller must then make sure only one thread uses it at a time.
         """
         if db_path is None:
             # Get the OS-specific data directory for 'pyvault'
@@ -28,57 +72,268 @@ class VaultStorage:
             # Allows passing a custom path (useful for testing)
             self.db_path = Path(db_path)
 
-        self._initialize_db()
+        # A single connection is shared by every call made through this instance.
+        # Autocommit mode: transactions are opened explicitly by transaction().
+        self.conn = self._open_connection(check_same_thread)
+        self._tx_depth = 0
+        self._wrote = False
+        # change_seq taken by the current transaction (see _log_changes)
+        self._change_seq = None
+        # service -> [reads, last read] not yet written back
+        self._accesses = {}
+        self._accesses_since = None
+        # Rows changed by access write-backs, left out of change_token()
+        self._access_changes = 0
+        self.busy_timeout = busy_timeout
+        self.max_retries = max_retries
 
-        # Keep a persistent connection for backward compatibility with older commands
-        self.conn = sqlite3.connect(str(self.db_path))
+        try:
+            self._configure_connection()
+            if auto_migrate:
+                self._initialize_db()
+        except BaseException:
+            self.close()
+            raise
 
-    @contextmanager
-    def _connect(self):
-        """Context manager for reliable database connections."""
+    def _open_connection(self, check_same_thread):
         # Using str() for compatibility with older sqlite3 versions
-        conn = sqlite3.connect(str(self.db_path))
+        return sqlite3.connect(
+            str(self.db_path),
+            isolation_level=None,
+            check_same_thread=check_same_thread,
+        )
+
+    def _configure_connection(self):
+        """
+        Enables WAL so readers never block writers, and waits on locks.
+        Deleted data is overwritten with zeros (secure_delete), so old
+        ciphertext does not linger in free pages. New vaults start in
+        incremental auto_vacuum mode: free pages can be given back to the
+        file system in small steps instead of a full VACUUM.
+        """
+        self.conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout)}")
+        self.conn.execute("PRAGMA secure_delete = ON")
+        if self.conn.execute("PRAGMA page_count").fetchone()[0] == 0:
+            # Only takes effect before the first table is created
+            self.conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        # Persistent: once switched, every process opens the vault in WAL mode
+        self._retry_busy(lambda: self.conn.execute("PRAGMA journal_mode = WAL"))
+
+    def _retry_busy(self, operation):
+        """
+        Runs operation(), retrying with jittered exponential backoff when SQLite
+        still reports the database as locked after busy_timeout.
+        Only used where a retry is safe: BEGIN, COMMIT and standalone statements.
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                return operation()
+            except sqlite3.OperationalError as e:
+                if not _is_busy(e) or attempt == self.max_retries:
+                    raise
+                time.sleep(random.uniform(0, min(1.0, 0.05 * 2**attempt)))
+
+    def close(self):
+        """
+        Closes the shared connection, rolling back any unfinished transaction.
+        Pending reads are written back first, then a connection that wrote to
+        the vault runs the light automatic maintenance (see
+        maintenance.auto_maintain).
+        """
+        if self.conn is not None:
+            if self.conn.in_transaction:
+                self.conn.rollback()
+            else:
+                self.flush_access()
+                if self._wrote:
+                    maintenance.auto_maintain(self)
+            self.conn.close()
+            self.conn = None
+            self._tx_depth = 0
+
+    @contextmanager
+    def transaction(self, write=False):
+        """
+        Groups every storage call made inside the block into one transaction.
+        Nested blocks become savepoints, so an inner failure only undoes its own work.
+        Write transactions take the write lock up front (BEGIN IMMEDIATE): concurrent
+        writers then queue on busy_timeout instead of failing halfway through.
+        """
+        depth = self._tx_depth
+        if depth == 0:
+            begin = "BEGIN IMMEDIATE" if write else "BEGIN"
+            self._retry_busy(lambda: self.conn.execute(begin))
+        else:
+            self.conn.execute(f"SAVEPOINT sp_{depth}")
+        self._tx_depth += 1
         try:
+            yield self.conn
+        except BaseException:
+            self._tx_depth -= 1
+            # A rolled back change_seq bump is taken again by the next change
+            self._change_seq = None
+            if depth == 0:
+                self.conn.rollback()
+            else:
+                self.conn.execute(f"ROLLBACK TO sp_{depth}")
+                self.conn.execute(f"RELEASE sp_{depth}")
+            raise
+        else:
+            self._tx_depth -= 1
+            if depth == 0:
+                self._change_seq = None
+                try:
+                    self._retry_busy(self.conn.commit)
+                except BaseException:
+                    self.conn.rollback()
+                    raise
+                self._wrote = self._wrote or write
+            else:
+                self.conn.execute(f"RELEASE sp_{depth}")
+
+    @contextmanager
+    def _connect(self, write=False):
+        """Yields the shared connection inside a (possibly nested) transaction."""
+        with self.transaction(write=write) as conn:
             yield conn
-            conn.commit()
+
+    # --- Vault key (engines encrypting the whole file) ---
+
+    def unseal(self, key: bytes):
+        """
+        Gives the engine the vault key once the Master Password checked out.
+        Nothing to do here: SQLite files encrypt each record, not the file.
+        """
+
+    def seal(self):
+        """Makes the engine forget the key (see unseal)."""
+
+    def image(self) -> bytes:
+        """The whole database as one SQLite image (a consistent snapshot)."""
+        copy = sqlite3.connect(":memory:")
+        try:
+            self.conn.backup(copy)
+            image = bytearray(copy.serialize())
         finally:
-            conn.close()
+            copy.close()
+        # File format versions 2/2 mark a WAL database, which cannot be
+        # deserialized into memory: mark it as a rollback-journal one (1/1)
+        image[18:20] = b"\x01\x01"
+        return bytes(image)
 
     def _initialize_db(self):
-        """Creates the necessary tables if they do not exist."""
+        """
+        Brings the schema up to date through the migration framework.
+        Once PRAGMA user_version is current this costs a single pragma read.
+        """
+        migrations.upgrade(self.conn)
+
+    # --- Schema Management ---
+
+    def schema_version(self) -> int:
+        """Returns the schema version stored in PRAGMA user_version."""
+        return migrations.get_version(self.conn)
+
+    def pending_migrations(self):
+        """Lists the migrations not yet applied to this vault."""
+        return migrations.pending_migrations(self.conn)
+
+    def migrate(self, batch_size=migrations.DEFAULT_BATCH_SIZE, progress=None):
+        """Applies pending migrations in resumable batches; returns the versions applied."""
+        return migrations.upgrade(self.conn, batch_size=batch_size, progress=progress)
+
+    def estimate_migrations(self, rows=None, batch_size=migrations.DEFAULT_BATCH_SIZE):
+        """Dry-run: estimated duration of each pending migration (vault unchanged)."""
+        return migrations.estimate(self.conn, rows=rows, batch_size=batch_size)
+
+    def change_token(self):
+        """
+        Cheap marker that changes whenever the vault contents may have changed:
+        PRAGMA data_version tracks commits of other connections, total_changes
+        the rows modified through this one (except read counts written back).
+        """
+        data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        return data_version, self.conn.total_changes - self._access_changes
+
+    # --- Change feed ---
+
+    def _log_changes(self, conn, services):
+        """
+        Records that services changed, under the change_seq of the current
+        transaction (bumped by its first change). Vaults without master
+        data (not initialized) keep no feed.
+        """
+        if self._change_seq is None:
+            if not conn.execute(
+                "UPDATE config SET change_seq = change_seq + 1 WHERE id = 1"
+            ).rowcount:
+                return
+            self._change_seq = conn.execute(
+                "SELECT change_seq FROM config WHERE id = 1"
+            ).fetchone()[0]
+        conn.executemany(
+            "INSERT INTO changes (service, seq) VALUES (?, ?) "
+            "ON CONFLICT (service) DO UPDATE SET seq = excluded.seq",
+            ((service, self._change_seq) for service in services),
+        )
+
+    def change_seq(self) -> int:
+        """Current change sequence number: grows with every committed change."""
         with self._connect() as conn:
-            # Configuration table for security parameters
-            conn.execute(
-                """
-                CREATE TABLE IF NOT EXISTS config (
-                    id INTEGER PRIMARY KEY CHECK (id = 1),
-                    master_salt BLOB NOT NULL,
-                    master_verifier BLOB NOT NULL
-                )
-            """
-            )
+            row = conn.execute("SELECT change_seq FROM config WHERE id = 1").fetchone()
+        return row[0] if row else 0
+
+    def changes_since(self, seq: int) -> Tuple[int, Optional[List[str]]]:
+        """
+        (current change_seq, services changed after `seq`), read from the
+        index on changes.seq. The services are None if the vault is behind
+        `seq` (e.g. restored from an older copy): anything may have changed.
+        """
+        with self._connect() as conn:
+            row = conn.execute("SELECT change_seq FROM config WHERE id = 1").fetchone()
+            current = row[0] if row else 0
+            if current < seq:
+                return current, None
+            rows = conn.execute(
+                "SELECT service FROM changes WHERE seq > ? ORDER BY seq", (seq,)
+            ).fetchall()
+        return current, [service for (service,) in rows]
 
-            # Credentials table for storing encrypted secrets
+    # --- Maintenance ---
+
+    def get_auto_maintenance(self) -> bool:
+        """Whether closing a connection that wrote runs automatic maintenance."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT auto_maintenance FROM config WHERE id = 1"
+            ).fetchone()
+        return bool(row[0]) if row else True
+
+    def set_auto_maintenance(self, enabled: bool):
+        with self._connect(write=True) as conn:
             conn.execute(
-                """
-                CREATE TABLE IF NOT EXISTS credentials (
-                    service TEXT PRIMARY KEY,
-                    username TEXT NOT NULL,
-                    password_blob BLOB NOT NULL
-                )
-            """
+                "UPDATE config SET auto_maintenance = ? WHERE id = 1", (int(enabled),)
             )
 
     # --- Master Data Management ---
 
-    def store_master_data(self, salt: bytes, verifier_blob: bytes):
-        """Stores the master salt and password verifier."""
-        with self._connect() as conn:
+    def store_master_data(self, salt: bytes, verifier_blob: bytes, cipher=None):
+        """Stores the master salt, password verifier and preferred cipher id."""
+        with self._connect(write=True) as conn:
             conn.execute(
-                "INSERT OR REPLACE INTO config (id, master_salt, master_verifier) VALUES (1, ?, ?)",
-                (salt, verifier_blob),
+                "INSERT OR REPLACE INTO config (id, master_salt, master_verifier, cipher) VALUES (1, ?, ?, ?)",
+                (salt, verifier_blob, cipher),
             )
 
+    def get_master_data(self):
+        """Retrieves the (master_salt, master_verifier) pair in a single query."""
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT master_salt, master_verifier FROM config WHERE id = 1"
+            )
+            return cursor.fetchone()
+
     def get_master_salt(self) -> bytes:
         """Retrieves the master salt used for key derivation."""
         with self._connect() as conn:
@@ -95,14 +350,31 @@ class VaultStorage:
             result = cursor.fetchone()
             return result[0] if result else None
 
+    def get_cipher(self):
+        """Preferred cipher id for new records (None for pre-agility vaults)."""
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT cipher FROM config WHERE id = 1")
+            result = cursor.fetchone()
+            return result[0] if result else None
+
+    def set_cipher(self, cipher: int):
+        """Changes the cipher used for records written from now on."""
+        with self._connect(write=True) as conn:
+            conn.execute("UPDATE config SET cipher = ? WHERE id = 1", (cipher,))
+
     # --- Credential Management ---
 
     def add_credential(self, service: str, username: str, password_blob: bytes):
         """Stores or updates an encrypted credential for a specific service."""
-        with self._connect() as conn:
-            conn.execute(
-                "INSERT OR REPLACE INTO credentials (service, username, password_blob) VALUES (?, ?, ?)",
-                (service, username, password_blob),
+        with self._connect(write=True) as conn:
+            version, previous_hash = self._record_state(conn, service)
+            self._put_entry(
+                conn,
+                Entry.create(
+                    service, username, password_blob, version + 1, time.time()
+                ),
+                previous_hash,
             )
 
     def get_credential(self, service: str):
@@ -115,23 +387,812 @@ class VaultStorage:
             )
             return cursor.fetchone()
 
-    def get_all_credentials(self):
-        """Returns a list of all stored services and their usernames."""
+    # --- Access tracking ---
+
+    def record_access(self, services, accessed_at=None):
+        """
+        Counts a read of each service. Local metadata, outside the record
+        hash: it is not synced and does not create a version. Reads are only
+        counted in memory here; flush_access() writes them back in one
+        transaction, when enough are pending or enough time passed (and on
+        close), so a read does not cost a write.
+        """
+        accessed_at = time.time() if accessed_at is None else accessed_at
+        for service in services:
+            entry = self._accesses.get(service)
+            if entry is None:
+                self._accesses[service] = [1, accessed_at]
+            else:
+                entry[0] += 1
+                entry[1] = max(entry[1], accessed_at)
+        if self._accesses_since is None:
+            self._accesses_since = time.monotonic()
+        if (
+            len(self._accesses) >= ACCESS_FLUSH_SIZE
+            or time.monotonic() - self._accesses_since >= ACCESS_FLUSH_INTERVAL
+        ):
+            self.flush_access()
+
+    def flush_access(self) -> int:
+        """
+        Writes pending read counts and times back; the number of services
+        written. Best effort: inside another transaction, or while another
+        writer holds the vault, they stay pending for the next flush.
+        """
+        if not self._accesses or self._tx_depth:
+            return 0
+        pending = self._accesses
+        changes = self.conn.total_changes
+        try:
+            with self._connect(write=True) as conn:
+                conn.executemany(
+                    "UPDATE credentials SET access_count = access_count + ?, "
+                    "last_accessed_at = MAX(last_accessed_at, ?) WHERE service = ?",
+                    (
+                        (count, accessed_at, service)
+                        for service, (count, accessed_at) in pending.items()
+                    ),
+                )
+        except sqlite3.OperationalError as e:
+            if not _is_busy(e):
+                raise
+            return 0
+        finally:
+            self._access_changes += self.conn.total_changes - changes
+        self._accesses = {}
+        self._accesses_since = None
+        return len(pending)
+
+    def get_hot(self, limit: int, window: float = cache.HOT_WINDOW):
+        """
+        The `limit` services read most often among those read in the last
+        `window` seconds, hottest first.
+        """
+        with self._connect() as conn:
+            return [
+                service
+                for (service,) in conn.execute(
+                    "SELECT service FROM credentials "
+                    "WHERE last_accessed_at >= ? AND access_count > 0 "
+                    "ORDER BY access_count DESC, last_accessed_at DESC LIMIT ?",
+                    (time.time() - window, limit),
+                )
+            ]
+
+    def get_access_coverage(self, sizes):
+        """
+        (reads recorded, [(size, share)]): for each cache size, the share of
+        all recorded reads that went to the `size` most read services, i.e.
+        the hit rate a cache of that size holding them would have had.
+        """
+        sizes = sorted(sizes)
+        covered = dict.fromkeys(sizes, 0)
+        total = 0
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT access_count FROM credentials WHERE access_count > 0 "
+                "ORDER BY access_count DESC"
+            )
+            for rank, (count,) in enumerate(rows, start=1):
+                total += count
+                for size in sizes:
+                    if rank <= size:
+                        covered[size] += count
+        return total, [
+            (size, covered[size] / total if total else 0.0) for size in sizes
+        ]
+
+    def get_credentials(self, services):
+        """{service: (username, password_blob)} for those of `services` stored."""
+        services = [*dict.fromkeys(services)]
+        found = {}
+        with self._connect() as conn:
+            # Bounded by SQLite's host parameter limit (999 on old builds)
+            for start in range(0, len(services), 500):
+                batch = services[start : start + 500]
+                placeholders = ", ".join("?" * len(batch))
+                for service, username, blob in conn.execute(
+                    "SELECT service, username, password_blob FROM credentials "
+                    f"WHERE service IN ({placeholders})",
+                    batch,
+                ):
+                    found[service] = (username, blob)
+        return found
+
+    def get_credentials_page(self, after=None, limit=500, where=None):
+        """
+        Up to `limit` (service, username, password_blob) rows sorted by
+        service, following the service `after` (keyset pagination).
+        """
+        condition, params = self._filter(where)
+        if after is not None:
+            condition, params = f"c.service > ? AND {condition}", [after, *params]
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT service, username, password_blob FROM credentials AS c "
+                f"WHERE {condition} ORDER BY service ASC LIMIT ?",
+                [*params, limit],
+            ).fetchall()
+
+    @staticmethod
+    def _filter(where):
+        """SQL condition on credentials AS c for a filter expression (see query)."""
+        return query.compile_filter(where) if where else ("1", [])
+
+    def get_all_credentials(self, where=None):
+        """
+        Returns stored services and their usernames; with a filter expression
+        (e.g. 'tag:prod and updated<90d') only the matching ones.
+        """
+        condition, params = self._filter(where)
         with self._connect() as conn:
             cursor = conn.cursor()
             cursor.execute(
-                "SELECT service, username FROM credentials ORDER BY service ASC"
+                "SELECT service, username FROM credentials AS c "
+                f"WHERE {condition} ORDER BY service ASC",
+                params,
             )
             return cursor.fetchall()
 
-    def get_full_inventory(self):
-        """Retrieves all stored data for auditing purposes."""
+    def get_stale(self, before: float, where=None):
+        """
+        (service, username, updated_at, last_accessed_at) of the credentials
+        last changed before the timestamp `before`, oldest first: a range scan
+        of the updated_at index.
+        """
+        condition, params = self._filter(where)
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT service, username, updated_at, last_accessed_at "
+                f"FROM credentials AS c WHERE c.updated_at < ? AND {condition} "
+                "ORDER BY c.updated_at ASC",
+                [before, *params],
+            ).fetchall()
+
+    def get_catalog(
+        self, where=None, after=None, limit=None, stream=False, order="name"
+    ):
+        """
+        (service, username, folder, comma-separated tags), sorted by service
+        or by CATALOG_ORDERS[order] (last read first, most read first).
+        Pages are keyset based: `after` skips to the services following that
+        name (sorted by name only), `limit` caps the rows. Rows come in index
+        order, so with stream=True the first one is yielded without reading
+        the rest.
+        """
+        condition, params = self._filter(where)
+        if after is not None:
+            condition, params = f"c.service > ? AND {condition}", [after, *params]
+        sql = (
+            "SELECT service, username, folder, (SELECT group_concat(tag, ', ') "
+            "FROM (SELECT tag FROM credential_tags AS t "
+            "WHERE t.service = c.service ORDER BY tag)) "
+            f"FROM credentials AS c WHERE {condition} "
+            f"ORDER BY {CATALOG_ORDERS[order]} LIMIT ?"
+        )
+        params.append(-1 if limit is None else limit)
+        if stream:
+            return self._stream_rows(sql, params)
+        with self._connect() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def get_full_inventory(self, stream=False, where=None):
+        """
+        Retrieves stored data for auditing purposes (only the rows matching
+        the filter expression `where`, if given).
+        With stream=True the rows are yielded one at a time as SQLite reads
+        them, so memory use does not grow with the size of the vault.
+        """
+        condition, params = self._filter(where)
+        sql = (
+            "SELECT service, username, password_blob FROM credentials AS c "
+            f"WHERE {condition}"
+        )
+        if stream:
+            return self._stream_rows(sql, params)
         with self._connect() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT service, username, password_blob FROM credentials")
+            cursor.execute(sql, params)
             return cursor.fetchall()
 
+    def get_policy_inventory(self, where=None):
+        """
+        Streams (service, password_blob, updated_at, tags) for policy checks
+        (see pyvault.policy), tags as a tuple, in one read transaction.
+        """
+        condition, params = self._filter(where)
+        sql = (
+            "SELECT service, password_blob, updated_at, (SELECT group_concat(tag, "
+            "char(31)) FROM credential_tags AS t WHERE t.service = c.service) "
+            f"FROM credentials AS c WHERE {condition}"
+        )
+        for service, blob, updated_at, tags in self._stream_rows(sql, params):
+            yield service, blob, updated_at, tuple(tags.split("\x1f")) if tags else ()
+
+    def _stream_rows(self, sql, params):
+        # One read transaction for the whole scan: a consistent snapshot
+        with self._connect() as conn:
+            yield from conn.execute(sql, params)
+
+    # --- Tags and folders ---
+
+    def get_labels(self, service: str):
+        """(folder, sorted tags) of a stored credential, or None."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT folder FROM credentials WHERE service = ?", (service,)
+            ).fetchone()
+            if row is None:
+                return None
+            tags = conn.execute(
+                "SELECT tag FROM credential_tags WHERE service = ? ORDER BY tag",
+                (service,),
+            ).fetchall()
+        return row[0], [tag for (tag,) in tags]
+
+    def add_tags(self, service: str, tags):
+        with self._connect(write=True) as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO credential_tags (tag, service) VALUES (?, ?)",
+                ((tag, service) for tag in tags),
+            )
+            self._log_changes(conn, [service])
+
+    def remove_tags(self, service: str, tags):
+        with self._connect(write=True) as conn:
+            conn.executemany(
+                "DELETE FROM credential_tags WHERE tag = ? AND service = ?",
+                ((tag, service) for tag in tags),
+            )
+            self._log_changes(conn, [service])
+
+    def set_folder(self, service: str, folder):
+        """Moves a credential to a folder ('work/aws'); None for no folder."""
+        with self._connect(write=True) as conn:
+            conn.execute(
+                "UPDATE credentials SET folder = ? WHERE service = ?", (folder, service)
+            )
+            self._log_changes(conn, [service])
+
     def delete_credential(self, service: str):
-        """Removes a credential from the vault."""
+        """Removes a credential, leaving a tombstone so that sync propagates it."""
+        with self._connect(write=True) as conn:
+            self._delete(conn, service)
+
+    def delete_credentials(self, services) -> int:
+        """Removes many credentials in one transaction; the number removed."""
+        with self._connect(write=True) as conn:
+            return sum(self._delete(conn, service) for service in services)
+
+    def _delete(self, conn, service: str) -> bool:
+        row = conn.execute(
+            "SELECT version, record_hash FROM credentials WHERE service = ?",
+            (service,),
+        ).fetchone()
+        if row is None:
+            return False
+        self._put_entry(
+            conn, Entry.create(service, None, None, row[0] + 1, time.time()), row[1]
+        )
+        return True
+
+    def set_usernames(self, services, username: str) -> int:
+        """
+        Gives credentials a new username in one transaction, each as a new
+        version (the previous one goes to the history). The password is the
+        same, so updated_at (its age) is kept. Returns the number changed;
+        those already using the username are left alone.
+        """
+        changed = 0
+        with self._connect(write=True) as conn:
+            for service in services:
+                row = conn.execute(
+                    "SELECT username, password_blob, version, updated_at, record_hash "
+                    "FROM credentials WHERE service = ?",
+                    (service,),
+                ).fetchone()
+                if row is None or row[0] == username:
+                    continue
+                entry = Entry.create(service, username, row[1], row[2] + 1, row[3])
+                self._put_entry(conn, entry, row[4], replaced_at=time.time())
+                changed += 1
+        return changed
+
+    def rewrite_credentials(self, records) -> int:
+        """
+        Replaces the username and blob of credentials in place, given
+        (service, username, blob) triples, in one transaction: for a
+        re-encryption or a repair, not a new password, so no version or
+        history entry is created and updated_at is kept. Sync sees the new
+        record hashes. Returns the number rewritten.
+        """
+        rewritten = 0
+        with self._connect(write=True) as conn:
+            for service, username, blob in records:
+                row = conn.execute(
+                    "SELECT version, updated_at, record_hash "
+                    "FROM credentials WHERE service = ?",
+                    (service,),
+                ).fetchone()
+                if row is None:
+                    continue
+                version, updated_at, previous_hash = row
+                entry = Entry.create(service, username, blob, version, updated_at)
+                conn.execute(
+                    "UPDATE credentials SET username = ?, password_blob = ?, "
+                    "record_hash = ? WHERE service = ?",
+                    (username, blob, entry.record_hash, service),
+                )
+                merkle.apply_change(
+                    conn, merkle.bucket_of(service), previous_hash, entry.record_hash
+                )
+                self._log_changes(conn, [service])
+                rewritten += 1
+        return rewritten
+
+    def rename_credentials(self, renames) -> int:
+        """
+        Renames credentials, given (old name, new name) pairs, in one
+        transaction. Their history, tags, folder, attachments, read counts
+        and updated_at (the password's age) follow; sync sees the old name
+        deleted and the new one created. The new names must not be in use.
+        Returns the number renamed.
+        """
+        renamed = 0
+        with self._connect(write=True) as conn:
+            for old, new in renames:
+                row = conn.execute(
+                    "SELECT version, username, password_blob, updated_at, folder, "
+                    "created_at, last_accessed_at, access_count FROM credentials "
+                    "WHERE service = ?",
+                    (old,),
+                ).fetchone()
+                if row is None:
+                    continue
+                version, previous_hash = self._record_state(conn, new)
+                # Numbered after the past versions that move along with it
+                # (and after a tombstone of the new name)
+                entry = Entry.create(
+                    new, row[1], row[2], max(row[0], version) + 1, row[3]
+                )
+                self._put_entry(conn, entry, previous_hash)
+                conn.execute(
+                    "UPDATE credentials SET folder = ?, created_at = ?, "
+                    "last_accessed_at = ?, access_count = ? WHERE service = ?",
+                    (*row[4:], new),
+                )
+                for table in ("credential_history", "credential_tags", "attachments"):
+                    conn.execute(
+                        f"UPDATE {table} SET service = ? WHERE service = ?", (new, old)
+                    )
+                self._delete(conn, old)
+                renamed += 1
+        return renamed
+
+    # --- Attachments ---
+
+    def add_attachment(self, service: str, name: str, header: bytes, chunks):
+        """
+        Stores (or replaces) a file attached to a service. chunks yields
+        (plaintext size, encrypted chunk) pairs and is consumed one at a time,
+        all within one transaction. Returns the plaintext size.
+        """
+        with self._connect(write=True) as conn:
+            self._delete_attachments(conn, service, name)
+            attachment_id = conn.execute(
+                "INSERT INTO attachments (service, name, header, created_at) "
+                "VALUES (?, ?, ?, ?)",
+                (service, name, header, time.time()),
+            ).lastrowid
+            size = count = 0
+            for plain_size, data in chunks:
+                conn.execute(
+                    "INSERT INTO attachment_chunks (attachment_id, chunk, data) "
+                    "VALUES (?, ?, ?)",
+                    (attachment_id, count, data),
+                )
+                size += plain_size
+                count += 1
+            conn.execute(
+                "UPDATE attachments SET size = ?, chunks = ? WHERE id = ?",
+                (size, count, attachment_id),
+            )
+            self._log_changes(conn, [service])
+            return size
+
+    def get_attachment(self, service: str, name: str):
+        """Fetches (id, stream header, size) of an attachment, or None."""
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT id, header, size FROM attachments WHERE service = ? AND name = ?",
+                (service, name),
+            ).fetchone()
+
+    def restore_attachment(self, service: str, name: str, header, size, chunks):
+        """
+        Replaces the stream header and the chunks of an existing attachment
+        in place (a repair, not a change: no entry in the change feed).
+        chunks yields the encrypted chunks in order.
+        """
+        with self._connect(write=True) as conn:
+            row = conn.execute(
+                "SELECT id FROM attachments WHERE service = ? AND name = ?",
+                (service, name),
+            ).fetchone()
+            if row is None:
+                return
+            conn.execute(
+                "DELETE FROM attachment_chunks WHERE attachment_id = ?", (row[0],)
+            )
+            count = 0
+            for count, data in enumerate(chunks, 1):
+                conn.execute(
+                    "INSERT INTO attachment_chunks (attachment_id, chunk, data) "
+                    "VALUES (?, ?, ?)",
+                    (row[0], count - 1, data),
+                )
+            conn.execute(
+                "UPDATE attachments SET header = ?, size = ?, chunks = ? WHERE id = ?",
+                (header, size, count, row[0]),
+            )
+
+    def get_attachments(self, service: str):
+        """Returns (name, size) of every file attached to a service."""
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT name, size FROM attachments WHERE service = ? ORDER BY name",
+                (service,),
+            ).fetchall()
+
+    def stream_attachment_chunks(self, attachment_id: int):
+        """Yields the encrypted chunks of an attachment in order, one at a time."""
+        with self._connect() as conn:
+            for (data,) in conn.execute(
+                "SELECT data FROM attachment_chunks WHERE attachment_id = ? "
+                "ORDER BY chunk",
+                (attachment_id,),
+            ):
+                yield data
+
+    def delete_attachment(self, service: str, name: str) -> bool:
+        """Removes one attachment; returns False if there was none."""
+        with self._connect(write=True) as conn:
+            if not self._delete_attachments(conn, service, name):
+                return False
+            self._log_changes(conn, [service])
+            return True
+
+    def _delete_attachments(self, conn, service: str, name=None) -> int:
+        """Deletes the attachments of a service (only `name` if given)."""
+        ids = [
+            row[0]
+            for row in conn.execute(
+                "SELECT id FROM attachments WHERE service = ? AND (? IS NULL OR name = ?)",
+                (service, name, name),
+            )
+        ]
+        for attachment_id in ids:
+            conn.execute(
+                "DELETE FROM attachment_chunks WHERE attachment_id = ?",
+                (attachment_id,),
+            )
+            conn.execute("DELETE FROM attachments WHERE id = ?", (attachment_id,))
+        return len(ids)
+
+    # --- Version history ---
+
+    def _archive(self, conn, service: str, replaced_at: float):
+        """
+        Copies the live version of a service into the history before it is
+        overwritten, then applies the retention policy incrementally: the
+        service's own surplus versions and at most HISTORY_PRUNE_STEP expired ones.
+        """
+        cursor = conn.execute(
+            # Two vaults synced after a conflict may both have numbered a
+            # version N: the copy replaced last is kept
+            "INSERT OR REPLACE INTO credential_history "
+            "(service, version, username, password_blob, created_at, replaced_at) "
+            "SELECT service, version, username, password_blob, updated_at, ? "
+            "FROM credentials WHERE service = ?",
+            (replaced_at, service),
+        )
+        if not cursor.rowcount:
+            return
+        keep, days = self._history_policy(conn)
+        if keep is not None:
+            self._prune_service(conn, service, keep)
+        if days is not None:
+            self._prune_expired(conn, time.time() - days * 86400, HISTORY_PRUNE_STEP)
+
+    def _history_policy(self, conn):
+        row = conn.execute(
+            "SELECT history_keep, history_days FROM config WHERE id = 1"
+        ).fetchone()
+        return tuple(row) if row else (None, None)
+
+    def _prune_service(self, conn, service: str, keep: int) -> int:
+        """Deletes all but the `keep` newest past versions of one service."""
+        return conn.execute(
+            "DELETE FROM credential_history WHERE service = ? AND version <= ("
+            "SELECT version FROM credential_history WHERE service = ? "
+            "ORDER BY version DESC LIMIT 1 OFFSET ?)",
+            (service, service, keep),
+        ).rowcount
+
+    def _prune_expired(self, conn, cutoff: float, limit: int) -> int:
+        """Deletes up to `limit` versions replaced before cutoff (oldest first)."""
+        return conn.execute(
+            "DELETE FROM credential_history WHERE (service, version) IN ("
+            "SELECT service, version FROM credential_history WHERE replaced_at < ? "
+            "ORDER BY replaced_at LIMIT ?)",
+            (cutoff, limit),
+        ).rowcount
+
+    def get_history_policy(self):
+        """(versions kept per service, days kept); None means no limit."""
+        with self._connect() as conn:
+            return self._history_policy(conn)
+
+    def set_history_policy(self, keep, days):
+        """Changes the retention policy; existing history is pruned by prune_history()."""
+        with self._connect(write=True) as conn:
+            conn.execute(
+                "UPDATE config SET history_keep = ?, history_days = ? WHERE id = 1",
+                (keep, days),
+            )
+
+    def prune_history(self, batch_size=500, progress=None) -> int:
+        """
+        Applies the retention policy to the whole history in short write
+        transactions of at most batch_size rows each, so other processes are
+        never blocked for long. Returns the number of versions removed.
+        """
+        keep, days = self.get_history_policy()
+        removed = 0
+        if days is not None:
+            cutoff = time.time() - days * 86400
+            while True:
+                with self._connect(write=True) as conn:
+                    count = self._prune_expired(conn, cutoff, batch_size)
+                removed += count
+                if progress:
+                    progress(removed)
+                if count < batch_size:
+                    break
+        if keep is not None:
+            with self._connect() as conn:
+                services = [
+                    row[0]
+                    for row in conn.execute(
+                        "SELECT service FROM credential_history GROUP BY service "
+                        "HAVING COUNT(*) > ?",
+                        (keep,),
+                    )
+                ]
+            for start in range(0, len(services), batch_size):
+                with self._connect(write=True) as conn:
+                    for service in services[start : start + batch_size]:
+                        removed += self._prune_service(conn, service, keep)
+                if progress:
+                    progress(removed)
+        return removed
+
+    def get_history(self, service: str):
+        """(version, username, created_at, replaced_at) of past versions, newest first."""
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT version, username, created_at, replaced_at "
+                "FROM credential_history WHERE service = ? ORDER BY version DESC",
+                (service,),
+            ).fetchall()
+
+    def rewrite_history(self, versions):
+        """
+        Replaces the username and blob of past versions in place, given
+        (service, version, username, blob) tuples (a repair).
+        """
+        with self._connect(write=True) as conn:
+            conn.executemany(
+                "UPDATE credential_history SET username = ?, password_blob = ? "
+                "WHERE service = ? AND version = ?",
+                [
+                    (username, blob, service, v)
+                    for service, v, username, blob in versions
+                ],
+            )
+
+    def get_credential_version(self, service: str, version: int):
+        """(username, password_blob) of a version, current or past, or None."""
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT username, password_blob FROM credentials "
+                "WHERE service = ? AND version = ? "
+                "UNION ALL SELECT username, password_blob FROM credential_history "
+                "WHERE service = ? AND version = ?",
+                (service, version, service, version),
+            ).fetchone()
+
+    def get_credential_info(self, service: str):
+        """(version, updated_at) of the live record, or None."""
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT version, updated_at FROM credentials WHERE service = ?",
+                (service,),
+            ).fetchone()
+
+    # --- Record versions and sync ---
+
+    def _record_state(self, conn, service: str):
+        """(version, record_hash) of the live record or tombstone, (0, None) if none."""
+        row = conn.execute(
+            "SELECT version, record_hash FROM credentials WHERE service = ? "
+            "UNION ALL SELECT version, record_hash FROM tombstones WHERE service = ?",
+            (service, service),
+        ).fetchone()
+        return tuple(row) if row else (0, None)
+
+    def _put_entry(self, conn, entry: Entry, previous_hash, replaced_at=None):
+        """
+        Writes a record state and moves the Merkle tree from previous_hash to
+        it. The live version goes to the history as replaced at replaced_at
+        (default: the new state's timestamp).
+        """
+        bucket = merkle.bucket_of(entry.service)
+        if entry.deleted:
+            conn.execute("DELETE FROM credentials WHERE service = ?", (entry.service,))
+            self._delete_attachments(conn, entry.service)
+            # Deleting a credential deletes its past passwords and labels too
+            conn.execute(
+                "DELETE FROM credential_history WHERE service = ?", (entry.service,)
+            )
+            conn.execute(
+                "DELETE FROM credential_tags WHERE service = ?", (entry.service,)
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO tombstones (service, version, deleted_at, record_hash, bucket, replaced_hash) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    entry.service,
+                    entry.version,
+                    entry.timestamp,
+                    entry.record_hash,
+                    bucket,
+                    previous_hash,
+                ),
+            )
+        else:
+            self._archive(
+                conn,
+                entry.service,
+                entry.timestamp if replaced_at is None else replaced_at,
+            )
+            conn.execute(
+                "INSERT INTO credentials (service, username, password_blob, version, updated_at, record_hash, bucket, created_at, last_accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (service) DO UPDATE SET username = excluded.username, "
+                "password_blob = excluded.password_blob, version = excluded.version, "
+                "updated_at = excluded.updated_at, record_hash = excluded.record_hash, "
+                "bucket = excluded.bucket, "
+                "last_accessed_at = MAX(last_accessed_at, excluded.last_accessed_at)",
+                (
+                    entry.service,
+                    entry.username,
+                    entry.blob,
+                    entry.version,
+                    entry.timestamp,
+                    entry.record_hash,
+                    bucket,
+                    entry.timestamp,
+                    entry.timestamp,
+                ),
+            )
+            conn.execute("DELETE FROM tombstones WHERE service = ?", (entry.service,))
+        merkle.apply_change(conn, bucket, previous_hash, entry.record_hash)
+        self._log_changes(conn, [entry.service])
+
+    def put_entries(self, changes):
+        """
+        Applies record states received from another vault, as they are.
+        changes holds (entry, expected record_hash) pairs: a record whose
+        current hash is no longer the expected one changed meanwhile and is
+        skipped. Returns the number of skipped entries.
+        """
+        skipped = 0
+        with self._connect(write=True) as conn:
+            for entry, expected_hash in changes:
+                _, previous_hash = self._record_state(conn, entry.service)
+                if previous_hash != expected_hash:
+                    skipped += 1
+                    continue
+                self._put_entry(conn, entry, previous_hash)
+        return skipped
+
+    def bucket_entries(self, bucket: int):
+        """Live records and tombstones of one Merkle bucket, keyed by service."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT service, username, password_blob, version, updated_at, record_hash "
+                "FROM credentials WHERE bucket = ? "
+                "UNION ALL SELECT service, NULL, NULL, version, deleted_at, record_hash "
+                "FROM tombstones WHERE bucket = ?",
+                (bucket, bucket),
+            ).fetchall()
+        return {row[0]: Entry(*row) for row in rows}
+
+    def descends_from(self, service: str, record_hash: bytes) -> bool:
+        """
+        Whether the current state of a record replaced the state record_hash:
+        it is one of its past versions, or the state its tombstone deleted.
+        """
+        with self._connect() as conn:
+            if conn.execute(
+                "SELECT 1 FROM tombstones WHERE service = ? AND replaced_hash = ?",
+                (service, record_hash),
+            ).fetchone():
+                return True
+            rows = conn.execute(
+                "SELECT username, password_blob, version, created_at "
+                "FROM credential_history WHERE service = ?",
+                (service,),
+            ).fetchall()
+        return any(
+            merkle.record_hash(service, username, blob, version, created_at)
+            == record_hash
+            for username, blob, version, created_at in rows
+        )
+
+    def change_seqs(self, services) -> Dict[str, int]:
+        """change_seq at which each service last changed (0: before the feed)."""
+        services = [*dict.fromkeys(services)]
+        seqs = dict.fromkeys(services, 0)
+        with self._connect() as conn:
+            for start in range(0, len(services), 500):
+                batch = services[start : start + 500]
+                placeholders = ", ".join("?" * len(batch))
+                seqs.update(
+                    conn.execute(
+                        f"SELECT service, seq FROM changes WHERE service IN ({placeholders})",
+                        batch,
+                    )
+                )
+        return seqs
+
+    def get_vault_id(self) -> Optional[bytes]:
+        """Id telling this vault from its copies once they synced, or None."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT vault_id FROM config WHERE id = 1").fetchone()
+        return row[0] if row else None
+
+    def new_vault_id(self) -> Optional[bytes]:
+        """Gives the vault a new random id (None if not initialized)."""
+        vault_id = os.urandom(16)
+        with self._connect(write=True) as conn:
+            if not conn.execute(
+                "UPDATE config SET vault_id = ? WHERE id = 1", (vault_id,)
+            ).rowcount:
+                return None
+        return vault_id
+
+    def sync_base(self, peer: bytes) -> Optional[Tuple[int, int]]:
+        """(own change_seq, peer's change_seq) when last synced with peer, or None."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT seq, peer_seq FROM sync_peers WHERE peer = ?", (peer,)
+            ).fetchone()
+        return tuple(row) if row else None
+
+    def save_sync_base(self, peer: bytes, seq: int, peer_seq: int):
+        with self._connect(write=True) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sync_peers (peer, seq, peer_seq, synced_at) "
+                "VALUES (?, ?, ?, ?)",
+                (peer, seq, peer_seq, time.time()),
+            )
+
+    def merkle_root(self):
+        with self._connect() as conn:
+            return merkle.root(conn)
+
+    def merkle_children(self, level: int, index: int):
         with self._connect() as conn:
-            conn.execute("DELETE FROM credentials WHERE service = ?", (service,))
+            return merkle.children(conn, level, index)
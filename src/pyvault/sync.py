@@ -0,0 +1,195 @@
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from pyvault import merkle
+from pyvault.memory import VaultFileError
+from pyvault.merkle import Entry
+from pyvault.session import VaultSession
+from pyvault.storage import VaultStorage
+
+# (local entry, remote entry) -> the entry both vaults should keep
+Resolver = Callable[[Entry, Entry], Entry]
+
+
+class SyncError(Exception):
+    """The two vaults cannot be synchronized."""
+
+
+def newer(a: Entry, b: Entry) -> Entry:
+    """Last-writer-wins; ties are broken deterministically so both sides agree."""
+    return max(a, b, key=lambda e: (e.timestamp, e.version, e.record_hash))
+
+
+def check_same_vault(session: VaultSession, other: VaultStorage):
+    """
+    Sync copies ciphertext as-is, so both files must be copies of the same
+    vault: same salt and a verifier that opens with the session's key. The
+    other vault is then unsealed with that key (see VaultStorage.unseal).
+    """
+    master = other.get_master_data()
+    if not master:
+        raise SyncError("The other vault is not initialized.")
+    salt, verifier = master
+    local_salt, _ = session.storage.get_master_data()
+    try:
+        if salt != local_salt:
+            raise ValueError
+        session.decrypt(verifier)
+    except Exception:
+        raise SyncError(
+            "The other file is not a copy of this vault (different Master Password "
+            "or salt). Use export/import to merge unrelated vaults."
+        ) from None
+    try:
+        other.unseal(bytes(session.key))
+    except VaultFileError as e:
+        raise SyncError(str(e)) from None
+
+
+class SyncPlan:
+    """Record states to copy in each direction, with the state they replace."""
+
+    def __init__(self):
+        # (entry, hash of the record it overwrites in the target or None)
+        self.push: List[Tuple[Entry, Optional[bytes]]] = []
+        self.pull: List[Tuple[Entry, Optional[bytes]]] = []
+        self.conflicts = 0
+        self.buckets_compared = 0
+
+    def __bool__(self):
+        return bool(self.push or self.pull)
+
+
+class VaultSync:
+    """
+    Two-way sync between two vault files.
+
+    Both vaults keep a Merkle tree over their records (see pyvault.merkle):
+    equal roots mean nothing to do; otherwise only the subtrees whose digests
+    differ are walked and only the records of differing buckets are read.
+    Records present on one side are copied to the other. A record that
+    differs is copied from the side that changed it since the last sync:
+    each vault keeps both change_seqs of its last sync with the other
+    (sync_peers), and the change feed tells which side wrote the record
+    after that. Vaults that never synced (e.g. a fresh copy) fall back to
+    the history: a state the other side replaced is older. Only records
+    changed on both sides are conflicts and go to `resolve`
+    (last-writer-wins by default). Deletions travel as tombstones and win
+    or lose like any other change.
+    """
+
+    def __init__(
+        self,
+        local: VaultStorage,
+        remote: VaultStorage,
+        resolve: Optional[Resolver] = None,
+    ):
+        self.local = local
+        self.remote = remote
+        self.resolve = resolve
+        self.stats: Dict[str, float] = {}
+        self._base: Optional[Tuple[int, int]] = None
+
+    def plan(self) -> SyncPlan:
+        start = time.perf_counter()
+        plan = SyncPlan()
+        if self.local.merkle_root() != self.remote.merkle_root():
+            self._base = self._sync_base()
+            buckets = merkle.differing_buckets(
+                self.local.merkle_children, self.remote.merkle_children
+            )
+            plan.buckets_compared = len(buckets)
+            for bucket in buckets:
+                self._plan_bucket(plan, bucket)
+        self.stats["plan"] = time.perf_counter() - start
+        return plan
+
+    def _sync_base(self) -> Optional[Tuple[int, int]]:
+        """
+        (local, remote) change_seq when the two vaults last synced, or None
+        if they never did or either went back in time since (restored from
+        an older copy): both must still agree on it.
+        """
+        local_id, remote_id = self.local.get_vault_id(), self.remote.get_vault_id()
+        if local_id is None or remote_id is None or local_id == remote_id:
+            return None
+        base = self.local.sync_base(remote_id)
+        if base is None or self.remote.sync_base(local_id) != base[::-1]:
+            return None
+        if self.local.change_seq() < base[0] or self.remote.change_seq() < base[1]:
+            return None
+        return base
+
+    def _plan_bucket(self, plan: SyncPlan, bucket: int):
+        ours = self.local.bucket_entries(bucket)
+        theirs = self.remote.bucket_entries(bucket)
+        differing = [
+            service
+            for service in ours.keys() & theirs.keys()
+            if ours[service].record_hash != theirs[service].record_hash
+        ]
+        if self._base is not None and differing:
+            local_seqs = self.local.change_seqs(differing)
+            remote_seqs = self.remote.change_seqs(differing)
+        for service in sorted(ours.keys() | theirs.keys()):
+            local, remote = ours.get(service), theirs.get(service)
+            if local is None:
+                plan.pull.append((remote, None))
+                continue
+            if remote is None:
+                plan.push.append((local, None))
+                continue
+            if local.record_hash == remote.record_hash:
+                continue
+
+            if self._base is not None:
+                local_moved = local_seqs[service] > self._base[0]
+                remote_moved = remote_seqs[service] > self._base[1]
+            else:
+                local_moved = remote_moved = True
+            if local_moved and not remote_moved:
+                winner = local
+            elif remote_moved and not local_moved:
+                winner = remote
+            elif self.local.descends_from(service, remote.record_hash):
+                winner = local
+            elif self.remote.descends_from(service, local.record_hash):
+                winner = remote
+            else:
+                plan.conflicts += 1
+                winner = newer(local, remote)
+                if self.resolve is not None and not (local.deleted and remote.deleted):
+                    winner = self.resolve(local, remote)
+            if winner is local:
+                plan.push.append((local, remote.record_hash))
+            else:
+                plan.pull.append((remote, local.record_hash))
+
+    def apply(self, plan: SyncPlan) -> int:
+        """
+        Writes the plan (one transaction per vault). Records that changed since
+        the plan was made are left alone; returns how many were skipped.
+        """
+        start = time.perf_counter()
+        skipped = self.remote.put_entries(plan.push) + self.local.put_entries(plan.pull)
+        if not skipped:
+            self._save_base()
+        self.stats["apply"] = time.perf_counter() - start
+        return skipped
+
+    def _save_base(self):
+        """
+        Records the change_seq of both vaults, now holding the same records,
+        as the base of their next sync. Copies that never synced share an
+        id: the other vault gets a new one first.
+        """
+        local_id = self.local.get_vault_id() or self.local.new_vault_id()
+        remote_id = self.remote.get_vault_id()
+        if remote_id is None or remote_id == local_id:
+            remote_id = self.remote.new_vault_id()
+        if local_id is None or remote_id is None:
+            # Not initialized: no change feed to compare against
+            return
+        seq, remote_seq = self.local.change_seq(), self.remote.change_seq()
+        self.local.save_sync_base(remote_id, seq, remote_seq)
+        self.remote.save_sync_base(local_id, remote_seq, seq)
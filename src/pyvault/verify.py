@@ -0,0 +1,348 @@
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from cryptography.exceptions import InvalidTag
+
+from pyvault import merkle
+from pyvault.crypto import CryptoManager, StreamCipher
+
+# Problems reported for a record
+TRUNCATED = "truncated"
+CORRUPT = "corrupt"
+WRONG_KEY = "wrong key"
+
+DEFAULT_BATCH_SIZE = 20_000
+
+
+def classify(
+    crypto: CryptoManager,
+    key: bytes,
+    service: str,
+    username: str,
+    blob: bytes,
+    version: int,
+    updated_at: float,
+    stored_hash: Optional[bytes],
+) -> Optional[str]:
+    """
+    Returns None if the record authenticates, else the kind of problem.
+    A blob failing authentication while still matching the record hash
+    computed when it was written was encrypted with another key; otherwise
+    the row changed after it was written (corruption). The plaintext is
+    never returned.
+    """
+    if not blob or len(blob) < crypto.minimum_size(blob):
+        return TRUNCATED
+    try:
+        crypto.decrypt(blob, key)
+        return None
+    except Exception:
+        pass
+    if stored_hash is not None and stored_hash == merkle.record_hash(
+        service, username, blob, version, updated_at
+    ):
+        return WRONG_KEY
+    return CORRUPT
+
+
+def check_attachment(
+    key: bytes, header: bytes, count: Optional[int], chunks
+) -> Optional[str]:
+    """
+    Returns None if the encrypted chunks of an attachment (`count` of them,
+    if known) all authenticate in order, else the kind of problem (chunks
+    missing at the end: truncated). Streams have no record hash, so a
+    foreign key shows as corrupt.
+    """
+    seen = 0
+
+    def counted():
+        nonlocal seen
+        for chunk in chunks:
+            seen += 1
+            yield chunk
+
+    try:
+        for _ in StreamCipher(key, header).decrypt_chunks(counted()):
+            pass
+    except ValueError:  # Not a stream header
+        return CORRUPT
+    except InvalidTag:
+        return TRUNCATED if count is not None and seen < count else CORRUPT
+    return None if count in (None, seen) else CORRUPT
+
+
+class _Checked(NamedTuple):
+    """What one rowid range of credentials holds, and what is damaged."""
+
+    records: int
+    versions: int
+    attachments: int
+    problems: List[Tuple[str, str]]
+    damaged_versions: List[Tuple[Tuple[str, int], str]]
+    damaged_attachments: List[Tuple[Tuple[str, str], str]]
+
+
+def _check_range(conn, key: bytes, first: int, last: int) -> _Checked:
+    """
+    Checks the records with first <= rowid <= last, their past versions and
+    their attachments (which always belong to a live record).
+    """
+    crypto = CryptoManager()
+    records = conn.execute(
+        "SELECT service, username, password_blob, version, updated_at, record_hash "
+        "FROM credentials WHERE rowid BETWEEN ? AND ?",
+        (first, last),
+    ).fetchall()
+    problems = []
+    for row in records:
+        problem = classify(crypto, key, *row)
+        if problem:
+            problems.append((row[0], problem))
+
+    # Past versions keep no record hash: a foreign key shows as corrupt
+    versions = conn.execute(
+        "SELECT h.service, h.username, h.password_blob, h.version, h.created_at "
+        "FROM credentials AS c JOIN credential_history AS h ON h.service = c.service "
+        "WHERE c.rowid BETWEEN ? AND ?",
+        (first, last),
+    ).fetchall()
+    damaged_versions = []
+    for row in versions:
+        problem = classify(crypto, key, *row, None)
+        if problem:
+            damaged_versions.append(((row[0], row[3]), problem))
+
+    attachments = conn.execute(
+        "SELECT a.id, a.service, a.name, a.header, a.chunks "
+        "FROM credentials AS c JOIN attachments AS a ON a.service = c.service "
+        "WHERE c.rowid BETWEEN ? AND ?",
+        (first, last),
+    ).fetchall()
+    damaged_attachments = []
+    for attachment_id, service, name, header, count in attachments:
+        chunks = (
+            data
+            for (data,) in conn.execute(
+                "SELECT data FROM attachment_chunks WHERE attachment_id = ? "
+                "ORDER BY chunk",
+                (attachment_id,),
+            )
+        )
+        problem = check_attachment(key, header, count, chunks)
+        if problem:
+            damaged_attachments.append(((service, name), problem))
+
+    return _Checked(
+        len(records),
+        len(versions),
+        len(attachments),
+        problems,
+        damaged_versions,
+        damaged_attachments,
+    )
+
+
+def _verify_range(db_uri: str, key: bytes, first: int, last: int) -> _Checked:
+    """Worker: checks a rowid range through its own read-only connection."""
+    conn = sqlite3.connect(db_uri, uri=True)
+    try:
+        return _check_range(conn, key, first, last)
+    finally:
+        conn.close()
+
+
+class VerifyReport:
+    """
+    Outcome of verify_vault(). problems maps service -> kind of damage of
+    the live record, damaged_versions (service, version) -> kind for past
+    versions and damaged_attachments (service, name) -> kind for files.
+    """
+
+    def __init__(self):
+        self.database_errors: List[str] = []
+        self.problems: Dict[str, str] = {}
+        self.damaged_versions: Dict[Tuple[str, int], str] = {}
+        self.damaged_attachments: Dict[Tuple[str, str], str] = {}
+        self.records = 0
+        self.versions = 0
+        self.attachments = 0
+        self.workers = 1
+        self.seconds = 0.0
+
+    @property
+    def damaged(self) -> int:
+        return (
+            len(self.problems)
+            + len(self.damaged_versions)
+            + len(self.damaged_attachments)
+        )
+
+    @property
+    def ok(self) -> bool:
+        return not self.database_errors and not self.damaged
+
+    @property
+    def throughput(self) -> float:
+        return self.records / self.seconds if self.seconds else 0.0
+
+    def damage(self) -> List[Tuple[str, str, str]]:
+        """(service, which copy, kind of damage) of everything damaged, sorted."""
+        rows = [(service, "current", kind) for service, kind in self.problems.items()]
+        rows += [
+            (service, f"version {version}", kind)
+            for (service, version), kind in self.damaged_versions.items()
+        ]
+        rows += [
+            (service, f"attachment {name}", kind)
+            for (service, name), kind in self.damaged_attachments.items()
+        ]
+        return sorted(rows)
+
+
+def check_database(conn, full: bool = False) -> List[str]:
+    """SQLite's own page-level check; returns the reported errors (empty if ok)."""
+    pragma = "integrity_check" if full else "quick_check"
+    messages = [row[0] for row in conn.execute(f"PRAGMA {pragma}")]
+    return [] if messages == ["ok"] else messages
+
+
+def _rowid_ranges(conn, batch_size: int) -> List[Tuple[int, int]]:
+    low, high = conn.execute(
+        "SELECT MIN(rowid), MAX(rowid) FROM credentials"
+    ).fetchone()
+    if low is None:
+        return []
+    return [
+        (start, min(start + batch_size - 1, high))
+        for start in range(low, high + 1, batch_size)
+    ]
+
+
+def verify_vault(
+    db_path,
+    conn,
+    key: bytes,
+    full: bool = False,
+    workers: Optional[int] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    progress=None,
+) -> VerifyReport:
+    """
+    Checks the database structure, then authenticates every stored blob.
+
+    Records are split into rowid ranges checked by a pool of `workers`
+    processes (default: one per CPU), each reading its range through its own
+    read-only connection. Without a db_path (a vault held in memory, see
+    pyvault.memory) the ranges are read through `conn` and checked here.
+    `progress(done)` is called as ranges complete.
+    """
+    report = VerifyReport()
+    start = time.perf_counter()
+    report.database_errors = check_database(conn, full)
+
+    ranges = _rowid_ranges(conn, batch_size)
+    report.workers = max(1, min(workers or os.cpu_count() or 1, len(ranges) or 1))
+    if db_path is None:
+        report.workers = 1
+    key = bytes(key)
+
+    def collect(checked: _Checked):
+        report.records += checked.records
+        report.versions += checked.versions
+        report.attachments += checked.attachments
+        report.problems.update(checked.problems)
+        report.damaged_versions.update(checked.damaged_versions)
+        report.damaged_attachments.update(checked.damaged_attachments)
+        if progress:
+            progress(report.records)
+
+    if db_path is None:
+        for first, last in ranges:
+            collect(_check_range(conn, key, first, last))
+    elif report.workers == 1:
+        db_uri = Path(db_path).resolve().as_uri() + "?mode=ro"
+        for first, last in ranges:
+            collect(_verify_range(db_uri, key, first, last))
+    else:
+        db_uri = Path(db_path).resolve().as_uri() + "?mode=ro"
+        with ProcessPoolExecutor(max_workers=report.workers) as pool:
+            futures = [
+                pool.submit(_verify_range, db_uri, key, first, last)
+                for first, last in ranges
+            ]
+            for future in futures:
+                collect(future.result())
+
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+def _authentic(session, row) -> bool:
+    """True if row is a (username, blob) whose blob opens with the session's key."""
+    if row is None:
+        return False
+    try:
+        session.decrypt(row[1])
+        return True
+    except Exception:
+        return False
+
+
+def repair_records(
+    session, backup, report: VerifyReport
+) -> Tuple[List[str], List[str]]:
+    """
+    Restores what `report` found damaged from a backup copy of the same
+    vault, in place: the same version of each record (else the backup's
+    current one, or the attachment of the same name) is copied over if it
+    authenticates with the session's key. Nothing gets a new version and
+    password ages are kept. Returns
+    (repaired, unrepaired) as descriptions such as 'db (version 3)'.
+    """
+    key = bytes(session.key)
+    repaired, unrepaired = [], []
+    with session.transaction(write=True):
+        for service in sorted(report.problems):
+            # The same version, else the newest one the backup has
+            info = session.storage.get_credential_info(service)
+            row = info and backup.get_credential_version(service, info[0])
+            if not _authentic(session, row):
+                row = backup.get_credential(service)
+            if _authentic(session, row):
+                session.storage.rewrite_credentials([(service, *row)])
+                repaired.append(service)
+            else:
+                unrepaired.append(service)
+
+        for service, version in sorted(report.damaged_versions):
+            row = backup.get_credential_version(service, version)
+            label = f"{service} (version {version})"
+            if _authentic(session, row):
+                session.storage.rewrite_history([(service, version, *row)])
+                repaired.append(label)
+            else:
+                unrepaired.append(label)
+
+        for service, name in sorted(report.damaged_attachments):
+            attachment = backup.get_attachment(service, name)
+            label = f"{service} (attachment {name})"
+            if attachment is None or check_attachment(
+                key, attachment[1], None, backup.stream_attachment_chunks(attachment[0])
+            ):
+                unrepaired.append(label)
+                continue
+            attachment_id, header, size = attachment
+            session.storage.restore_attachment(
+                service,
+                name,
+                header,
+                size,
+                backup.stream_attachment_chunks(attachment_id),
+            )
+            repaired.append(label)
+    return repaired, unrepaired
@@ -0,0 +1,77 @@
+from threading import Lock, Thread
+from typing import Callable, Optional
+
+from pyvault.session import VaultSession
+
+# How long cancel() waits for a warm-up still running (e.g. waiting for the
+# vault lock) before leaving it to close its session itself
+CANCEL_WAIT = 1.0
+
+
+class VaultWarmup:
+    """
+    Opens a vault on a background thread while the user types the Master
+    Password: the database connection and lock, the salt and verifier, the
+    cipher backend and whatever `prepare(session)` preloads (see
+    VaultSession.warm_up). Once the password is in, unlocking is left with
+    the key derivation and one decryption.
+
+        warmup = VaultWarmup("vault.db").start()
+        password = ask()
+        session = warmup.session()  # or warmup.cancel()
+    """
+
+    def __init__(
+        self,
+        db_path,
+        prepare: Optional[Callable[[VaultSession], None]] = None,
+    ):
+        self.db_path = db_path
+        self.prepare = prepare
+        self._session: Optional[VaultSession] = None
+        self._error: Optional[BaseException] = None
+        self._cancelled = False
+        self._lock = Lock()
+        self._thread = Thread(target=self._run, name="pyvault-warmup", daemon=True)
+
+    def start(self) -> "VaultWarmup":
+        self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            # The main thread takes the session over once this one is done
+            session = VaultSession.open(self.db_path, check_same_thread=False)
+        except BaseException as e:
+            self._error = e
+            return
+        try:
+            session.warm_up(self.prepare)
+        except Exception:
+            # Only a head start: unlock() reads again and reports the error
+            pass
+        with self._lock:
+            if self._cancelled:
+                session.close()
+            else:
+                self._session = session
+
+    def session(self) -> VaultSession:
+        """
+        Waits for the warm-up and returns its open (locked) session. Errors
+        opening the vault (MigrationError, VaultLockedError, ...) are raised
+        here, as VaultSession.open would have.
+        """
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+        return self._session
+
+    def cancel(self):
+        """Closes the session: the command ends without unlocking."""
+        self._thread.join(CANCEL_WAIT)
+        with self._lock:
+            self._cancelled = True
+            session, self._session = self._session, None
+        if session is not None:
+            session.close()
@@ -0,0 +1,48 @@
+from unittest.mock import patch
+
+import pytest
+from click.testing import CliRunner
+
+from pyvault.session import VaultSession
+
+
+@pytest.fixture(autouse=True)
+def isolated_cwd(tmp_path, monkeypatch):
+    """Commands use 'vault.db' (and its lock file) in the working directory."""
+    monkeypatch.chdir(tmp_path)
+
+
+@pytest.fixture
+def session(vault):
+    """The test module's `vault`, unlocked."""
+    with VaultSession.open("vault.db") as session:
+        session.unlock("master")
+        yield session
+
+
+@pytest.fixture
+def run_cli():
+    """
+    Runs a command as a user typing `password` at the Master Password prompt
+    and answering `confirm` to every question; other keyword arguments go
+    to CliRunner.invoke. The result also carries how many questions were
+    asked (result.confirmations).
+    """
+
+    def run(command, args, password="master", confirm=True, mix_stderr=True, **kwargs):
+        kwargs.setdefault("terminal_width", 160)
+        with patch("pyvault.main.questionary.password") as mock_password, patch(
+            "pyvault.main.questionary.confirm"
+        ) as mock_confirm, patch(
+            "pyvault.main.SecurityProtections.check_input_speed", return_value=True
+        ), patch(
+            "pyvault.main.SecurityProtections.random_confirmation_challenge",
+            return_value=True,
+        ):
+            mock_password.return_value.ask.return_value = password
+            mock_confirm.return_value.ask.return_value = confirm
+            result = CliRunner(mix_stderr=mix_stderr).invoke(command, args, **kwargs)
+        result.confirmations = mock_confirm.call_count
+        return result
+
+    return run
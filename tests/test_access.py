@@ -0,0 +1,139 @@
+import sqlite3
+import pytest
+from pyvault import storage as storage_module
+from pyvault.api import Vault
+from pyvault.main import list as list_cmd
+from pyvault.session import VaultSession
+from pyvault.storage import VaultStorage
+
+
+@pytest.fixture
+def vault():
+    """vault.db with five credentials; b read 3 times, d twice, a once."""
+    with VaultSession.open("vault.db") as session:
+        session.initialize("master")
+        for service in "abcde":
+            session.add(service, f"{service}-user", f"{service}-password")
+        session.storage.conn.execute("UPDATE credentials SET last_accessed_at = 1000")
+        for service in "bdbadb":
+            session.get(service)
+
+
+def _counts(conn):
+    return dict(conn.execute("SELECT service, access_count FROM credentials"))
+
+
+def test_reads_are_written_back_in_batches(session, monkeypatch):
+    conn = session.storage.conn
+    assert _counts(conn) == {"a": 1, "b": 3, "c": 0, "d": 2, "e": 0}
+
+    statements = []
+    conn.set_trace_callback(statements.append)
+    for _ in range(3):
+        session.get("c")
+    assert not [sql for sql in statements if "UPDATE" in sql or "IMMEDIATE" in sql]
+    assert _counts(conn)["c"] == 0
+
+    # One transaction for every pending service once enough are waiting
+    monkeypatch.setattr(storage_module, "ACCESS_FLUSH_SIZE", 2)
+    session.get("e")
+    assert statements.count("BEGIN IMMEDIATE") == 1
+    assert _counts(conn)["c"] == 3 and _counts(conn)["e"] == 1
+
+    # ... or once they waited long enough
+    monkeypatch.setattr(storage_module, "ACCESS_FLUSH_SIZE", 100)
+    monkeypatch.setattr(storage_module, "ACCESS_FLUSH_INTERVAL", 0)
+    session.get("a")
+    assert _counts(conn)["a"] == 2
+
+
+def test_write_back_waits_for_a_busy_vault(session):
+    session.get("c")
+    other = sqlite3.connect("vault.db", isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+    session.storage.busy_timeout = 0
+    session.storage.conn.execute("PRAGMA busy_timeout = 0")
+    session.storage.max_retries = 0
+    try:
+        assert session.storage.flush_access() == 0
+    finally:
+        other.rollback()
+        other.close()
+    assert session.storage.flush_access() == 1
+    assert _counts(session.storage.conn)["c"] == 1
+
+
+def test_access_writes_are_not_vault_changes(session):
+    token = session.storage.change_token()
+    session.get("c")
+    session.storage.flush_access()
+    assert session.storage.change_token() == token
+    session.add("f", "u", "p")
+    assert session.storage.change_token() != token
+
+
+def test_list_sorted_by_use(vault, run_cli):
+    result = run_cli(
+        list_cmd, ["--sort", "frequent", "--format", "plain"], mix_stderr=False
+    )
+    assert result.stdout.split() == ["b", "d", "a", "c", "e"]
+
+    result = run_cli(
+        list_cmd,
+        ["--sort", "recent", "--format", "plain", "--limit", "2"],
+        mix_stderr=False,
+    )
+    assert result.stdout.split() == ["b", "d"]
+    assert "raise --limit" in result.stderr
+
+    result = run_cli(list_cmd, ["--sort", "recent", "--after", "b"], mix_stderr=False)
+    assert result.exit_code == 2
+    assert "--after only works with --sort name" in result.stderr
+
+
+def test_prefetch_and_session_cache(session):
+    assert session.storage.get_hot(2) == ["b", "d"]
+    assert session.prefetch() == []  # no cache
+
+    session.enable_cache(10)
+    assert session.prefetch(2) == ["b", "d"]
+    statements = []
+    session.storage.conn.set_trace_callback(statements.append)
+    assert session.get("d") == ("d-user", "d-password")
+    assert not [sql for sql in statements if "FROM credentials" in sql]
+    assert session.get("a") == ("a-user", "a-password")
+    stats = session.cache.stats()
+    assert (stats.hits, stats.misses, stats.prefetched) == (1, 1, 2)
+    assert stats.hit_rate == 0.5
+
+    # A change by another process drops just the entries it changed
+    other = VaultStorage("vault.db")
+    other.set_usernames(["d"], "x")
+    other.close()
+    assert session.get("d") == ("x", "d-password")
+    assert "b" in session.cache._entries
+
+    session.forget_key()
+    assert len(session.cache) == 0
+
+
+def test_access_coverage(session):
+    total, coverage = session.access_coverage([1, 2, 10])
+    assert total == 6
+    assert coverage == [(1, 0.5), (2, 5 / 6), (10, 1.0)]
+
+
+def test_api_prefetch_and_cache_stats(vault):
+    with Vault.open("vault.db", password="master", cache_size=5, prefetch=2) as api:
+        assert len(api.cache) == 2
+        assert api.get("b").password == "b-password"
+        assert api.get("c").password == "c-password"
+        stats = api.cache_stats()
+        assert (stats.hits, stats.misses, stats.prefetched) == (1, 1, 2)
+    with Vault.open("vault.db", password="master") as api:
+        with pytest.raises(ValueError):
+            api.prefetch(2)
+
+    # Cache hits are reads too
+    with VaultSession.open("vault.db") as session:
+        assert _counts(session.storage.conn)["b"] == 4
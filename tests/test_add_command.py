@@ -14,12 +14,16 @@ def runner():
 @pytest.fixture
 def mock_vault_deps():
     """Mock delle dipendenze puntando al percorso corretto: pyvault.main"""
-    with patch("pyvault.main.VaultStorage") as mock_storage, patch(
-        "pyvault.main.CryptoManager"
+    with patch("pyvault.session.VaultStorage") as mock_storage, patch(
+        "pyvault.session.CryptoManager"
     ) as mock_crypto, patch("pyvault.main.os.path.exists") as mock_exists, patch(
         "pyvault.main.SecurityProtections.check_input_speed"
     ) as mock_speed:
         mock_exists.return_value = True
+        mock_storage.return_value.get_master_data.return_value = (
+            b"salt",
+            b"verifier",
+        )
         mock_speed.return_value = True
 
         yield {
@@ -33,8 +37,6 @@ def mock_vault_deps():
 @patch("questionary.password")
 def test_add_manual_success(mock_password, runner, mock_vault_deps):
     mock_password.return_value.ask.side_effect = ["master_correct", "service_secret"]
-    mock_vault_deps["storage"].get_master_salt.return_value = b"salt"
-    mock_vault_deps["storage"].get_verifier.return_value = b"verifier"
     mock_vault_deps["crypto"].derive_key.return_value = b"key"
 
     result = runner.invoke(add, ["google", "--username", "mario"])
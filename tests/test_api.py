@@ -0,0 +1,153 @@
+import subprocess
+import sys
+import threading
+import pytest
+from pyvault.api import AuthenticationError, Credential, SecretCache, Vault
+from pyvault.session import VaultSession
+
+
+@pytest.fixture
+def vault_path():
+    with VaultSession.open("vault.db") as session:
+        session.initialize("master")
+        session.add("db", "admin", "s3cret")
+        session.add("mail", "me", "letters")
+    return "vault.db"
+
+
+@pytest.fixture
+def vault(vault_path):
+    with Vault.open(vault_path, password="master", cache_size=2) as vault:
+        yield vault
+
+
+def test_no_ui_modules_are_imported():
+    code = (
+        "import sys, pyvault.api\n"
+        "print(sorted(m for m in ('click', 'rich', 'questionary', 'prompt_toolkit') "
+        "if m in sys.modules))"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    ).stdout
+    assert output.strip() == "[]"
+
+
+def test_open_with_password_or_key(vault_path):
+    with Vault.open(vault_path, password="master") as vault:
+        key = vault.export_key()
+        assert vault.get("db") == Credential("admin", "s3cret")
+    assert vault.closed
+    with pytest.raises(ValueError):
+        vault.get("db")
+
+    with Vault.open(vault_path, key=key) as vault:
+        assert vault.get("db").password == "s3cret"
+    with pytest.raises(AuthenticationError):
+        Vault.open(vault_path, password="wrong")
+    with pytest.raises(AuthenticationError):
+        Vault.open(vault_path, key=bytes(32))
+    with pytest.raises(ValueError):
+        Vault.open(vault_path)
+    with pytest.raises(FileNotFoundError):
+        Vault.open("other.db", password="master")
+
+
+def test_reads_and_writes(vault):
+    assert vault.get("nope") is None and "db" in vault
+    vault.put_many({"a": ("u1", "p1"), "b": ("u2", "p2")})
+    vault.put("c", "u3", "p3")
+    assert vault.get_many(["c", "nope", "a", "a"]) == {
+        "c": Credential("u3", "p3"),
+        "a": Credential("u1", "p1"),
+    }
+    assert [service for service, _ in vault.iter()] == ["a", "b", "c", "db", "mail"]
+    assert dict(vault.iter("service:b")) == {"b": Credential("u2", "p2")}
+    assert vault.delete("b") and not vault.delete("b")
+    assert vault.get("b") is None
+
+
+def test_iter_reads_page_by_page(vault, monkeypatch):
+    monkeypatch.setattr("pyvault.api.ITER_PAGE_SIZE", 3)
+    vault.put_many((f"svc{i:02d}", "u", f"p{i}") for i in range(10))
+    services = [service for service, _ in vault.iter()]
+    assert services == sorted(services) and len(services) == 12
+
+
+def test_put_many_is_all_or_nothing(vault):
+    storage = vault._session.storage
+    real = storage.add_credential
+
+    def fail_on_second(service, *args):
+        if service == "second":
+            raise RuntimeError("disk full")
+        real(service, *args)
+
+    storage.add_credential = fail_on_second
+    vault.get("db")  # cached
+    with pytest.raises(RuntimeError):
+        vault.put_many([("first", "u", "p"), ("second", "u", "p"), ("db", "x", "y")])
+    storage.add_credential = real
+    assert vault.get("first") is None
+    assert vault.get("db") == Credential("admin", "s3cret")
+
+
+def test_cache_is_bounded_and_invalidated_by_writes(vault):
+    cache = vault.cache
+    vault.get("db")
+    vault.get("db")
+    assert (cache.hits, cache.misses) == (1, 1)
+    vault.get_many(["db", "mail"])  # db a hit, then mail read and cached
+    vault.put("extra", "u", "p")
+    vault.get("extra")  # evicts the least recently used: db
+    assert len(cache) == 2 and cache.get("db") is None
+    assert cache.get("mail") == Credential("me", "letters")
+
+    vault.put("db", "admin", "rotated")
+    assert vault.get("db").password == "rotated"
+    vault.delete("db")
+    assert vault.get("db") is None
+
+
+def test_cache_expiry_and_stale_reads():
+    now = [0.0]
+    cache = SecretCache(10, ttl=5, clock=lambda: now[0])
+    cache.put("db", Credential("u", "p"), cache.generation)
+    now[0] = 4.9
+    assert cache.get("db") == Credential("u", "p")
+    now[0] = 5.0
+    assert cache.get("db") is None and len(cache) == 0
+
+    # A value read before a write is not cached after it
+    generation = cache.generation
+    cache.invalidate(["db"])
+    cache.put("db", Credential("u", "old"), generation)
+    assert cache.get("db") is None
+    with pytest.raises(ValueError):
+        SecretCache(0)
+
+
+def test_threads_share_one_vault(vault_path):
+    errors = []
+    with Vault.open(vault_path, password="master", cache_size=16) as vault:
+
+        def worker(n):
+            try:
+                for i in range(30):
+                    vault.put(f"t{n}-{i % 5}", "u", f"{n}-{i}")
+                    assert vault.get(f"t{n}-{i % 5}").password == f"{n}-{i}"
+                    assert vault.get("db").username == "admin"
+                    if i % 10 == 0:
+                        assert len([*vault.iter()]) >= 2
+            except Exception as e:  # pragma: no cover - reported below
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert errors == []
+        assert (
+            len(vault.get_many(f"t{n}-{i}" for n in range(6) for i in range(5))) == 30
+        )
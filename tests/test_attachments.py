@@ -0,0 +1,133 @@
+import io
+import os
+import stat
+import pytest
+from cryptography.exceptions import InvalidTag
+from pyvault.crypto import CHACHA20_POLY1305, StreamCipher
+from pyvault.main import attach, detach, get, rm
+from pyvault.session import VaultSession
+
+CHUNK = 1024
+
+
+@pytest.fixture
+def vault():
+    """An initialized vault.db in the working directory with one credential."""
+    with VaultSession.open("vault.db") as session:
+        session.initialize("master")
+        session.add("db", "admin", "s3cret")
+
+
+@pytest.mark.parametrize("size", [0, 1, CHUNK, 3 * CHUNK, 3 * CHUNK + 7])
+@pytest.mark.parametrize("cipher", [None, CHACHA20_POLY1305])
+def test_attachment_round_trip(vault, size, cipher):
+    data = os.urandom(size)
+    with VaultSession.open("vault.db") as session:
+        session.unlock("master")
+        if cipher is not None:
+            session.set_cipher(cipher)
+        assert session.attach("db", "blob", io.BytesIO(data), chunk_size=CHUNK) == size
+        out = io.BytesIO()
+        assert session.read_attachment("db", "blob", out) == size
+        assert session.read_attachment("db", "missing", io.BytesIO()) is None
+        chunks = session.storage.conn.execute(
+            "SELECT COUNT(*) FROM attachment_chunks"
+        ).fetchone()[0]
+    assert out.getvalue() == data
+    assert chunks == max(1, -(-size // CHUNK))
+
+
+def test_stream_rejects_reordered_truncated_or_foreign_chunks():
+    key = os.urandom(32)
+    stream = StreamCipher.create(key)
+    chunks = [c for _, c in stream.encrypt_file(io.BytesIO(os.urandom(5000)), CHUNK)]
+    other = StreamCipher.create(key)
+
+    def decrypt(sealed, cipher=stream):
+        return b"".join(cipher.decrypt_chunks(sealed))
+
+    for sealed in (
+        chunks[:-1],  # cut at a chunk boundary
+        [chunks[1], chunks[0], *chunks[2:]],  # reordered
+        chunks[1:],  # first chunk dropped
+        [*chunks, chunks[-1]],  # final chunk replayed
+        [],
+    ):
+        with pytest.raises(InvalidTag):
+            decrypt(sealed)
+    with pytest.raises(InvalidTag):
+        decrypt(chunks, StreamCipher(key, other.header))
+
+
+def test_attach_and_get_through_the_cli(vault, tmp_path, run_cli):
+    data = os.urandom(200_000)
+    (tmp_path / "id_ed25519").write_bytes(data)
+
+    result = run_cli(attach, ["db", str(tmp_path / "id_ed25519")])
+    assert result.exit_code == 0, result.output
+    assert "'id_ed25519' (195.3 KiB) attached to db" in result.output
+
+    result = run_cli(get, ["db"])
+    assert "Attachments: id_ed25519 (195.3 KiB)" in result.output
+
+    result = run_cli(get, ["db", "--attachment", "id_ed25519", "-o", "key"])
+    assert result.exit_code == 0, result.output
+    assert (tmp_path / "key").read_bytes() == data
+    assert stat.S_IMODE(os.stat(tmp_path / "key").st_mode) == 0o600
+
+    # stdout carries only the file; messages go to stderr
+    result = run_cli(get, ["db", "--attachment", "id_ed25519"], mix_stderr=False)
+    assert result.exit_code == 0
+    assert result.stdout_bytes == data
+
+    result = run_cli(get, ["db", "--attachment", "nope"], mix_stderr=False)
+    assert result.exit_code == 1
+    assert "No attachment 'nope'" in result.stderr
+
+
+def test_attach_from_stdin_replaces_by_name(vault, monkeypatch, run_cli):
+    monkeypatch.setenv("PYVAULT_MASTER", "master")
+    args = ["db", "-", "--name", "dump.sql", "--password-env", "PYVAULT_MASTER"]
+    assert run_cli(attach, args, input=b"old").exit_code == 0
+    assert run_cli(attach, args, input=b"new contents").exit_code == 0
+    assert run_cli(attach, ["db", "-"], input=b"x").exit_code == 2  # --name missing
+
+    with VaultSession.open("vault.db") as session:
+        session.unlock("master")
+        assert session.attachments("db") == [("dump.sql", 12)]
+        out = io.BytesIO()
+        session.read_attachment("db", "dump.sql", out)
+    assert out.getvalue() == b"new contents"
+
+
+def test_tampered_attachment_is_refused_and_output_removed(vault, run_cli):
+    with VaultSession.open("vault.db") as session:
+        session.unlock("master")
+        session.attach("db", "big", io.BytesIO(os.urandom(5 * CHUNK)), chunk_size=CHUNK)
+        # Drop the final chunk: the stream now ends on a non-final chunk
+        session.storage.conn.execute(
+            "DELETE FROM attachment_chunks WHERE chunk = "
+            "(SELECT MAX(chunk) FROM attachment_chunks)"
+        )
+
+    result = run_cli(get, ["db", "--attachment", "big", "-o", "big.out"])
+    assert result.exit_code == 1
+    assert "authentication failed" in result.stdout
+    assert not os.path.exists("big.out")
+
+
+def test_attachments_follow_their_credential(vault, run_cli):
+    with VaultSession.open("vault.db") as session:
+        session.unlock("master")
+        session.attach("db", "a", io.BytesIO(b"1"))
+        session.attach("db", "b", io.BytesIO(b"2"))
+        assert session.detach("db", "a")
+        assert not session.detach("db", "a")
+
+    assert "No attachment" in run_cli(detach, ["db", "a"]).output
+    assert run_cli(rm, ["db"]).exit_code == 0
+
+    with VaultSession.open("vault.db") as session:
+        conn = session.storage.conn
+        assert conn.execute("SELECT COUNT(*) FROM attachments").fetchone()[0] == 0
+        assert conn.execute("SELECT COUNT(*) FROM attachment_chunks").fetchone()[0] == 0
@@ -18,12 +18,16 @@ def runner():
 
 @patch("questionary.password")
 def test_audit_logic(mock_password, runner):
-    with patch("pyvault.main.VaultStorage") as mock_storage, patch(
-        "pyvault.main.CryptoManager"
+    with patch("pyvault.session.VaultStorage") as mock_storage, patch(
+        "pyvault.session.CryptoManager"
     ) as mock_crypto, patch("pyvault.main.os.path.exists") as mock_exists, patch(
         "pyvault.main.SecurityProtections.check_input_speed"
     ) as mock_speed:
         mock_exists.return_value = True
+        mock_storage.return_value.get_master_data.return_value = (
+            b"salt",
+            b"verifier",
+        )
         mock_speed.return_value = True
         mock_password.return_value.ask.return_value = "master"
 
@@ -60,3 +64,36 @@ def test_audit_logic(mock_password, runner):
 
         # Verifica i messaggi di stato
         assert "Security Audit Report" in clean_output
+
+
+@patch("questionary.password")
+def test_audit_similar_passwords(mock_password, runner):
+    with patch("pyvault.session.VaultStorage") as mock_storage, patch(
+        "pyvault.session.CryptoManager"
+    ) as mock_crypto, patch("pyvault.main.os.path.exists") as mock_exists, patch(
+        "pyvault.main.SecurityProtections.check_input_speed"
+    ) as mock_speed:
+        mock_exists.return_value = True
+        mock_storage.return_value.get_master_data.return_value = (
+            b"salt",
+            b"verifier",
+        )
+        mock_speed.return_value = True
+        mock_password.return_value.ask.return_value = "master"
+
+        mock_storage.return_value.get_full_inventory.return_value = [
+            ("gitlab", "user", b"b1"),
+            ("jira", "user", b"b2"),
+        ]
+        mock_crypto.return_value.decrypt.side_effect = [
+            None,  # Verifier OK
+            "Summer2023!Blue",
+            "Summer2024!Blue",
+        ]
+
+        result = runner.invoke(audit, terminal_width=100)
+        clean_output = strip_ansi(result.output)
+
+        assert result.exit_code == 0
+        assert "Similar Passwords Detected" in clean_output
+        assert "gitlab, jira" in clean_output
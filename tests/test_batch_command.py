@@ -0,0 +1,119 @@
+import json
+import pytest
+from click.testing import CliRunner
+from pyvault.main import batch
+from pyvault.session import VaultSession
+
+
+@pytest.fixture
+def runner(monkeypatch):
+    monkeypatch.setenv("PYVAULT_MASTER", "master")
+    with VaultSession.open("vault.db") as session:
+        session.initialize("master")
+    return CliRunner(mix_stderr=False)
+
+
+def _ops(*operations):
+    return "\n".join(json.dumps(op) for op in operations) + "\n"
+
+
+def _results(output):
+    return [json.loads(line) for line in output.splitlines()]
+
+
+def _services():
+    with VaultSession.open("vault.db") as session:
+        return [service for service, _ in session.list()]
+
+
+def test_batch_mixed_operations(runner):
+    ops = _ops(
+        {"op": "add", "service": "db", "username": "svc", "password": "pw"},
+        {"op": "add", "service": "api", "username": "bot", "generate": 16, "id": 2},
+        {"op": "get", "service": "db"},
+        {"op": "rm", "service": "api"},
+        {"op": "list"},
+    )
+
+    result = runner.invoke(batch, ["--password-env", "PYVAULT_MASTER"], input=ops)
+    results = _results(result.stdout)
+
+    assert result.exit_code == 0
+    assert all(r["ok"] for r in results)
+    assert results[1]["id"] == 2 and len(results[1]["password"]) == 16
+    assert results[2]["password"] == "pw"
+    assert results[4]["services"] == ["db"]
+    assert "5 ok" in result.stderr and "ops/s" in result.stderr
+
+
+def test_batch_stops_at_first_error(runner):
+    ops = _ops(
+        {"op": "add", "service": "a", "username": "u", "password": "p"},
+        {"op": "rm", "service": "missing"},
+        {"op": "add", "service": "b", "username": "u", "password": "p"},
+    )
+
+    result = runner.invoke(batch, ["--password-env", "PYVAULT_MASTER"], input=ops)
+
+    assert result.exit_code == 1
+    assert [r["ok"] for r in _results(result.stdout)] == [True, False]
+    assert _services() == ["a"]
+
+
+def test_batch_continue_on_error(runner):
+    ops = "not json\n" + _ops(
+        {"op": "add", "service": "b", "username": "u", "password": "p"}
+    )
+
+    result = runner.invoke(
+        batch,
+        ["--password-env", "PYVAULT_MASTER", "--continue-on-error"],
+        input=ops,
+    )
+    results = _results(result.stdout)
+
+    assert result.exit_code == 1
+    assert results[0]["error"].startswith("Invalid JSON")
+    assert results[1]["ok"]
+    assert _services() == ["b"]
+
+
+def test_batch_atomic_rolls_back_everything(runner):
+    ops = _ops(
+        {"op": "add", "service": "a", "username": "u", "password": "p"},
+        {"op": "get", "service": "missing"},
+    )
+
+    result = runner.invoke(
+        batch, ["--password-env", "PYVAULT_MASTER", "--atomic"], input=ops
+    )
+
+    assert result.exit_code == 1
+    assert "rolled back" in result.stderr
+    assert _services() == []
+
+
+def test_batch_commits_in_groups(runner):
+    ops = _ops(
+        *(
+            {"op": "add", "service": f"s{i}", "username": "u", "password": "p"}
+            for i in range(25)
+        )
+    )
+
+    result = runner.invoke(
+        batch,
+        ["--password-env", "PYVAULT_MASTER", "--batch-size", "10"],
+        input=ops,
+    )
+
+    assert result.exit_code == 0
+    assert "3 transaction(s)" in result.stderr
+    assert len(_services()) == 25
+
+
+def test_batch_requires_password_env_for_stdin(runner):
+    result = runner.invoke(batch, [], input=_ops({"op": "list"}))
+
+    assert result.exit_code == 2
+    assert "--password-env" in result.stderr
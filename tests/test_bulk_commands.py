@@ -0,0 +1,175 @@
+import io
+import time
+import pytest
+from pyvault.main import mv, rm, set_username
+from pyvault.query import QueryError, escape_glob, renamer
+from pyvault.session import BulkChangeError, VaultSession
+
+DAY = 86400
+
+
+@pytest.fixture
+def vault():
+    """vault.db with a three-node cluster (one tagged, one with history) and bank."""
+    with VaultSession.open("vault.db") as session:
+        session.initialize("master")
+        for service in ("cluster-a/db", "cluster-a/web", "cluster-a/cache", "bank"):
+            session.add(service, "admin", f"{service}-password")
+        session.add("cluster-a/db", "admin", "db-password-2")
+        session.label("cluster-a/web", add=["prod"], folder="clusters")
+        session.attach("cluster-a/db", "dump.sql", io.BytesIO(b"dump"))
+
+
+def test_renamer():
+    assert renamer("prod-*", "legacy/prod-*")("prod-db") == "legacy/prod-db"
+    assert renamer("?-*", "*.?")("a-web") == "a.web"
+    assert renamer("github", "gh")("github") == "gh"
+    with pytest.raises(QueryError):
+        renamer("prod-*", "*-*")
+
+
+def test_escaped_wildcards():
+    assert escape_glob("db[prod]*?") == "db[[]prod][*][?]"
+    assert renamer("db[[]prod]", "db[[]staging] [*]")("db[prod]") == "db[staging] *"
+    assert renamer("[*]-*", "*")("*-web") == "web"
+
+
+def test_literal_names(vault, run_cli):
+    with VaultSession.open("vault.db") as session:
+        session.unlock("master")
+        for service in ("db[prod]", "dbp", "what?", "whatX", 'my "db"'):
+            session.add(service, "admin", "password")
+        assert session.matching('my "db"') == [('my "db"', "admin")]
+
+    # The name of a stored service matches only that service
+    result = run_cli(rm, ["db[prod]"])
+    assert "'db[prod]' has been removed" in result.output
+    result = run_cli(rm, ["what?"])
+    assert "'what?' has been removed" in result.output
+    result = run_cli(rm, ["what?", "--literal"])
+    assert "not found" in result.output
+    result = run_cli(mv, ['my "db"', "db[*]"])
+    assert "1 credential(s) renamed" in result.output
+    result = run_cli(rm, ["--literal", "db[*]", "--dry-run"])
+    assert "│ db[*]   │ admin    │" in result.output
+    result = run_cli(set_username, ["db[[]*", "root"])
+    assert "1 username(s) changed" in result.output
+
+    with VaultSession.open("vault.db") as session:
+        session.unlock("master")
+        assert [service for service, _ in session.matching("[dw]*")] == [
+            "db[*]",
+            "dbp",
+            "whatX",
+        ]
+        assert session.get("db[*]") == ("root", "password")
+
+
+def test_delete_matching(session):
+    statements = []
+    session.storage.conn.set_trace_callback(statements.append)
+    deleted = session.delete_matching("cluster-a/*", where="not tag:prod")
+    # One transaction, leaving tombstones so that sync deletes them elsewhere
+    assert sum(sql.startswith("BEGIN") for sql in statements) == 1
+    assert deleted == ["cluster-a/cache", "cluster-a/db"]
+    assert [service for service, _ in session.list()] == ["bank", "cluster-a/web"]
+    assert session.attachments("cluster-a/db") == []
+    assert _tombstones(session) == ["cluster-a/cache", "cluster-a/db"]
+
+
+def _tombstones(session):
+    rows = session.storage.conn.execute("SELECT service FROM tombstones ORDER BY 1")
+    return [service for (service,) in rows]
+
+
+def test_rename_matching_moves_everything(session):
+    plan = session.rename_matching("cluster-a/*", "cluster-b/*")
+    assert plan == [
+        ("cluster-a/cache", "cluster-b/cache"),
+        ("cluster-a/db", "cluster-b/db"),
+        ("cluster-a/web", "cluster-b/web"),
+    ]
+    assert session.get("cluster-b/db") == ("admin", "db-password-2")
+    assert len(session.history("cluster-b/db")) == 2
+    assert session.labels("cluster-b/web") == ("clusters", ["prod"])
+    assert session.attachments("cluster-b/db") == [("dump.sql", 4)]
+    assert session.matching("cluster-a/*") == []
+    # Sync sees the old names deleted and the new ones created
+    assert _tombstones(session) == [service for service, _ in plan]
+
+
+def test_renamed_history_keeps_its_versions(session):
+    session.rename_matching("cluster-a/db", "db")
+    assert [row[0] for row in session.history("db")] == [3, 1]
+    assert session.get_version("db", 1) == ("admin", "cluster-a/db-password")
+
+    session.add("db", "admin", "db-password-3")
+    assert session.get_version("db", 3) == ("admin", "db-password-2")
+    assert session.restore("db", 1) == 5
+    assert session.get("db") == ("admin", "cluster-a/db-password")
+    assert [row[0] for row in session.history("db")] == [5, 4, 3, 1]
+
+
+def test_rename_refuses_to_overwrite(session):
+    with pytest.raises(BulkChangeError, match="already exists"):
+        session.rename_matching("cluster-a/db", "bank")
+    with pytest.raises(BulkChangeError, match="Several"):
+        session.rename_matching("cluster-a/*", "merged")
+    assert len(session.matching("cluster-a/*")) == 3
+
+
+def test_set_username_matching(session):
+    assert session.set_username_matching("cluster-a/*", "root", "tag:prod") == [
+        "cluster-a/web"
+    ]
+    assert session.get("cluster-a/web") == ("root", "cluster-a/web-password")
+    assert [row[1] for row in session.history("cluster-a/web")] == ["root", "admin"]
+    assert session.set_username_matching("cluster-a/web", "root") == []
+
+
+def test_renames_and_usernames_keep_the_password_age(session):
+    old = time.time() - 400 * DAY
+    session.storage.conn.execute("UPDATE credentials SET updated_at = ?", (old,))
+    assert len(session.stale(365 * DAY)) == 4
+
+    session.set_username_matching("cluster-a/*", "root")
+    session.rename_matching("cluster-a/*", "cluster-b/*")
+
+    stale = session.stale(365 * DAY)
+    assert sorted(service for service, *_ in stale) == [
+        "bank",
+        "cluster-b/cache",
+        "cluster-b/db",
+        "cluster-b/web",
+    ]
+    assert {updated_at for _, _, updated_at, _ in stale} == {old}
+    # The history still says when the username changed
+    assert session.history("cluster-b/db")[1][3] > old
+
+
+def test_bulk_commands_confirm_once(vault, run_cli):
+    result = run_cli(rm, ["cluster-a/*", "--dry-run"])
+    assert "Credentials to delete (3)" in result.output and result.confirmations == 0
+
+    result = run_cli(rm, ["cluster-a/*"], confirm=False)
+    assert "Deletion cancelled" in result.output and result.confirmations == 1
+
+    result = run_cli(mv, ["cluster-a/*", "old/*"])
+    assert result.exit_code == 0, result.output
+    assert "│ cluster-a/web   │ old/web   │" in result.output
+    assert "3 credential(s) renamed" in result.output and result.confirmations == 1
+
+    result = run_cli(set_username, ["old/*", "root", "--where", "tag:prod"])
+    assert "1 username(s) changed" in result.output
+
+    result = run_cli(mv, ["old/db", "bank"])
+    assert "Rename refused" in result.output and result.confirmations == 0
+
+    result = run_cli(mv, ["old/*", "new/*/*"])
+    assert result.exit_code == 2
+
+    result = run_cli(rm, ["old/*"])
+    assert "3 credential(s) deleted in one transaction" in result.output
+    with VaultSession.open("vault.db") as session:
+        session.unlock("master")
+        assert [service for service, _ in session.list()] == ["bank"]
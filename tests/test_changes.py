@@ -0,0 +1,119 @@
+import sys
+import threading
+import pytest
+from pyvault.api import Credential, Vault
+from pyvault.changes import ChangeFeed, VaultWatcher
+from pyvault.session import VaultSession
+from pyvault.storage import VaultStorage
+
+
+@pytest.fixture
+def session():
+    with VaultSession.open("vault.db") as session:
+        session.initialize("master")
+        for service in "abc":
+            session.add(service, f"{service}-user", f"{service}-password")
+        yield session
+
+
+def test_feed_lists_the_services_changed(session):
+    other = VaultStorage("vault.db")
+    feed = ChangeFeed(other)
+    assert feed.poll() == []
+
+    session.add("a", "a-user", "new")
+    session.label("b", add=["prod"])
+    session.storage.set_folder("c", "work")
+    session.storage.delete_credential("a")
+    assert sorted(feed.poll()) == ["a", "b", "c"]
+    assert feed.poll() == []
+
+    seq = other.change_seq()
+    session.storage.add_attachment("b", "key.pem", b"header", [(4, b"data")])
+    session.storage.delete_attachment("b", "key.pem")
+    assert not session.storage.delete_attachment("b", "key.pem")
+    assert other.changes_since(seq) == (seq + 2, ["b"])
+    other.close()
+
+
+def test_one_seq_per_transaction_and_none_on_rollback(session):
+    seq = session.storage.change_seq()
+    with session.transaction(write=True):
+        session.add("x", "user", "password")
+        session.add("y", "user", "password")
+    assert session.storage.changes_since(seq) == (seq + 1, ["x", "y"])
+
+    with pytest.raises(RuntimeError):
+        with session.transaction(write=True):
+            session.add("z", "user", "password")
+            raise RuntimeError
+    session.storage.record_access(["x"])
+    session.storage.flush_access()
+    assert session.storage.changes_since(seq + 1) == (seq + 1, [])
+
+
+def test_feed_resets_when_the_vault_goes_back(session):
+    seq = session.storage.change_seq()
+    assert session.storage.changes_since(seq + 5) == (seq, None)
+
+
+def test_session_cache_drops_only_changed_entries(session):
+    session.enable_cache(10)
+    assert session.get("a") == ("a-user", "a-password")
+    assert session.get("b") == ("b-user", "b-password")
+
+    with VaultSession.open("vault.db") as other:
+        other.unlock("master")
+        other.add("a", "a-user", "changed")
+
+    assert session.get("a") == ("a-user", "changed")
+    assert session.get("b") == ("b-user", "b-password")
+    assert session.cache.stats().hits == 1
+
+
+def test_vault_cache_follows_other_writers(session):
+    with Vault.open("vault.db", password="master", cache_size=10) as vault:
+        assert vault.get_many("abc")["c"] == Credential("c-user", "c-password")
+        first = vault.change_seq()
+        session.add("b", "b-user", "changed")
+
+        # Cache hits never touch the database: refresh() brings them up to date
+        assert vault.get("b").password == "b-password"
+        assert vault.refresh() == ["b"]
+        assert vault.get("b").password == "changed"
+        assert vault.get("a").password == "a-password"
+        assert vault.changes_since(first) == (first + 1, ["b"])
+        assert vault.cache_stats().hits == 2
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify")
+def test_watcher_refreshes_on_writes_by_others(session):
+    with Vault.open("vault.db", password="master", cache_size=10, watch=True) as vault:
+        assert vault._watcher.uses_inotify
+        assert vault.get("a").password == "a-password"
+        refreshed = threading.Event()
+        original = vault.refresh
+
+        def refresh():
+            changed = original()
+            if changed:
+                refreshed.set()
+            return changed
+
+        vault._watcher.callback = refresh
+        session.add("a", "a-user", "changed")
+        assert refreshed.wait(5)
+        assert vault.get("a").password == "changed"
+    assert vault._watcher is None
+
+
+def test_watcher_polls_without_inotify(session, monkeypatch):
+    monkeypatch.setattr("pyvault.changes._open_inotify", lambda directory: None)
+    called = threading.Event()
+    watcher = VaultWatcher("vault.db", called.set, interval=0.05).start()
+    try:
+        assert not watcher.uses_inotify
+        session.add("d", "d-user", "d-password")
+        assert called.wait(5)
+    finally:
+        watcher.stop()
@@ -0,0 +1,122 @@
+import os
+import pytest
+from unittest.mock import patch
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from pyvault.crypto import (
+    AES_256_GCM,
+    AUTO_CANDIDATES,
+    CHACHA20_POLY1305,
+    CIPHER_NAMES,
+    LEGACY_AES_256_GCM,
+    XCHACHA20_POLY1305,
+    CryptoManager,
+    XChaCha20Poly1305,
+    _hchacha20,
+    select_cipher,
+)
+from pyvault.main import cipher
+from pyvault.session import VaultSession
+
+KEY = bytes(range(32))
+
+
+def _legacy_blob(plaintext, key=KEY):
+    nonce = os.urandom(12)
+    return nonce + AESGCM(key).encrypt(nonce, plaintext.encode(), None)
+
+
+@pytest.mark.parametrize("cipher_id", list(CIPHER_NAMES))
+def test_round_trip_and_header(cipher_id):
+    crypto = CryptoManager(cipher_id)
+    blob = crypto.encrypt("s3cret", KEY)
+
+    assert CryptoManager.cipher_of(blob) == cipher_id
+    # Any manager decrypts any cipher: the header decides
+    assert CryptoManager().decrypt(blob, KEY) == "s3cret"
+    with pytest.raises(InvalidTag):
+        crypto.decrypt(blob, bytes(32))
+
+
+def test_header_is_authenticated():
+    blob = bytearray(CryptoManager(AES_256_GCM).encrypt("s3cret", KEY))
+    blob[3] = CHACHA20_POLY1305
+
+    with pytest.raises(InvalidTag):
+        CryptoManager().decrypt(bytes(blob), KEY)
+
+
+def test_legacy_blobs_still_decrypt():
+    blob = _legacy_blob("old")
+
+    assert CryptoManager.cipher_of(blob) == LEGACY_AES_256_GCM
+    assert CryptoManager(CHACHA20_POLY1305).decrypt(blob, KEY) == "old"
+
+
+def test_xchacha_matches_reference_vectors():
+    # draft-irtf-cfrg-xchacha-03, sections 2.2.1 and A.3.1
+    subkey = _hchacha20(KEY, bytes.fromhex("000000090000004a0000000031415927"))
+    assert subkey.hex() == (
+        "82413b4227b27bfed30e42508a877d73a0f9e4d58a74a853c12ec41326d3ecdc"
+    )
+
+    plaintext = (
+        b"Ladies and Gentlemen of the class of '99: If I could offer you only "
+        b"one tip for the future, sunscreen would be it."
+    )
+    sealed = XChaCha20Poly1305(bytes(range(0x80, 0xA0))).encrypt(
+        bytes(range(0x40, 0x58)), plaintext, bytes.fromhex("50515253c0c1c2c3c4c5c6c7")
+    )
+    assert sealed[:8].hex() == "bd6d179d3e83d43b"
+    assert sealed[-16:].hex() == "c0875924c1c7987947deafd8780acf49"
+
+
+def test_select_cipher_returns_a_candidate():
+    assert select_cipher() in AUTO_CANDIDATES
+
+
+@pytest.fixture
+def vault():
+    with VaultSession.open("vault.db") as session:
+        session.crypto.memory_cost = 8192
+        session.initialize("master", cipher=AES_256_GCM)
+        session.add("new", "u", "p1")
+        # Record written before cipher agility
+        session.storage.add_credential("old", "u", _legacy_blob("p0", session.key))
+
+
+def test_records_migrate_lazily_on_rewrite(vault):
+    with VaultSession.open("vault.db") as session:
+        session.crypto.memory_cost = 8192
+        session.unlock("master")
+        assert session.cipher_usage() == {AES_256_GCM: 1, LEGACY_AES_256_GCM: 1}
+
+        session.set_cipher(CHACHA20_POLY1305)
+        session.add("old", "u", "p0-rotated")
+
+        assert session.cipher_usage() == {AES_256_GCM: 1, CHACHA20_POLY1305: 1}
+        assert session.get("new") == ("u", "p1")
+        assert session.get("old") == ("u", "p0-rotated")
+
+
+def test_cipher_command_sets_and_rewrites(vault, run_cli):
+    with VaultSession.open("vault.db") as session:
+        # Versions and password ages, left alone by a re-encryption
+        before = [session.storage.get_credential_info(s) for s in ("new", "old")]
+    with patch("pyvault.session.CryptoManager", side_effect=_cheap_crypto):
+        result = run_cli(cipher, ["--set", "xchacha20-poly1305", "--rewrite"])
+
+    assert result.exit_code == 0
+    assert "2 record(s) re-encrypted" in result.output
+    with VaultSession.open("vault.db") as session:
+        assert session.cipher_usage() == {XCHACHA20_POLY1305: 2}
+        assert session.storage.get_cipher() == XCHACHA20_POLY1305
+        assert [session.storage.get_credential_info(s) for s in ("new", "old")] == (
+            before
+        )
+
+
+def _cheap_crypto():
+    crypto = CryptoManager()
+    crypto.memory_cost = 8192
+    return crypto
@@ -41,6 +41,7 @@ def test_full_application_flow(
     # IMPORTANTE: Ogni chiamata a questionary.password(...).ask() consuma un elemento.
     mock_password.return_value.ask.side_effect = [
         "Master123!",  # 1. init (Master Pwd)
+        "Master123!",  # 1b. init (Confirm Master Pwd)
         "Master123!",  # 2. add google (Master Pwd)
         "password_segreta",  # 3. add google (Service Pwd - Manuale)
         "Master123!",  # 4. add github (Master Pwd)
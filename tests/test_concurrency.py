@@ -0,0 +1,126 @@
+import multiprocessing
+import os
+import time
+import pytest
+from functools import partial
+from pyvault import session
+from pyvault.locking import VaultLock, VaultLockedError, lock_path_for
+from pyvault.main import cli
+from pyvault.session import VaultSession
+from pyvault.storage import VaultStorage
+
+# Scale with PYVAULT_STRESS_WRITERS / _READERS / _OPS for heavier runs
+WRITERS = int(os.environ.get("PYVAULT_STRESS_WRITERS", "4"))
+READERS = int(os.environ.get("PYVAULT_STRESS_READERS", "4"))
+OPS = int(os.environ.get("PYVAULT_STRESS_OPS", "100"))
+
+
+def _writer(db_path, worker_id, results):
+    storage = VaultStorage(db_path)
+    ok = errors = 0
+    for i in range(OPS):
+        try:
+            # Read-then-write in one transaction: the classic 'database is locked' trigger
+            with storage.transaction(write=True):
+                if not storage.get_credential(f"w{worker_id}-{i}"):
+                    storage.add_credential(f"w{worker_id}-{i}", "user", os.urandom(40))
+            ok += 1
+        except Exception:
+            errors += 1
+    storage.close()
+    results.put(("write", ok, errors))
+
+
+def _reader(db_path, deadline, results):
+    storage = VaultStorage(db_path)
+    ok = errors = 0
+    while time.time() < deadline:
+        try:
+            storage.get_all_credentials()
+            storage.get_credential("w0-0")
+            ok += 1
+        except Exception:
+            errors += 1
+    storage.close()
+    results.put(("read", ok, errors))
+
+
+def test_concurrent_writers_and_readers(tmp_path):
+    db_path = str(tmp_path / "vault.db")
+    VaultStorage(db_path).close()
+
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    started = time.time()
+    writers = [
+        ctx.Process(target=_writer, args=(db_path, n, results)) for n in range(WRITERS)
+    ]
+    readers = [
+        ctx.Process(target=_reader, args=(db_path, started + 3, results))
+        for _ in range(READERS)
+    ]
+    for proc in writers + readers:
+        proc.start()
+    stats = [results.get(timeout=120) for _ in writers + readers]
+    for proc in writers + readers:
+        proc.join()
+    elapsed = time.time() - started
+
+    totals = {}
+    for kind, ok, errors in stats:
+        done, failed = totals.get(kind, (0, 0))
+        totals[kind] = (done + ok, failed + errors)
+    for kind, (ok, errors) in totals.items():
+        rate = errors / max(ok + errors, 1)
+        print(
+            f"\n{kind}: {ok} ok, {errors} errors ({rate:.2%}) "
+            f"- {ok / elapsed:.0f} ops/s over {elapsed:.1f}s"
+        )
+
+    assert totals["write"] == (WRITERS * OPS, 0)
+    assert totals["read"][1] == 0
+
+    storage = VaultStorage(db_path)
+    assert len(storage.get_all_credentials()) == WRITERS * OPS
+    assert storage.conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    storage.close()
+
+
+def test_exclusive_lock_waits_for_shared_holders(tmp_path):
+    db_path = tmp_path / "vault.db"
+    shared = VaultLock(db_path)
+    shared.acquire()
+
+    with pytest.raises(VaultLockedError):
+        VaultLock(db_path, exclusive=True, timeout=0.1).acquire()
+
+    shared.release()
+    with VaultLock(db_path, exclusive=True, timeout=0.1):
+        with pytest.raises(VaultLockedError):
+            VaultLock(db_path, timeout=0.1).acquire()
+
+
+@pytest.mark.parametrize("warmup", ["0", "1"])
+def test_commands_report_a_vault_locked_by_maintenance(monkeypatch, run_cli, warmup):
+    VaultStorage("vault.db").close()
+    monkeypatch.setenv("PYVAULT_WARMUP", warmup)
+    monkeypatch.setattr(session, "VaultLock", partial(VaultLock, timeout=0.1))
+
+    with VaultLock("vault.db", exclusive=True):
+        result = run_cli(cli, ["list"])
+
+    assert result.exit_code == 0, result.output
+    assert "in use by another PyVault process" in result.output
+
+
+def test_wipe_keeps_the_lock_file(run_cli):
+    with VaultSession.open("vault.db") as vault_session:
+        vault_session.initialize("master")
+    lock_file = os.stat(lock_path_for("vault.db")).st_ino
+
+    result = run_cli(cli, ["wipe"])
+
+    assert "Vault successfully destroyed" in result.output, result.output
+    assert not os.path.exists("vault.db")
+    # A process that waited on the lock and one starting now share one file
+    assert os.stat(lock_path_for("vault.db")).st_ino == lock_file
@@ -0,0 +1,109 @@
+import pytest
+from pyvault.main import get, history, restore, rm
+from pyvault.session import VaultSession
+
+
+@pytest.fixture
+def vault():
+    """vault.db with 'github' written four times (versions 1-4)."""
+    with VaultSession.open("vault.db") as session:
+        session.initialize("master")
+        for i in range(1, 5):
+            session.add("github", f"user{i}", f"password-{i}")
+
+
+def test_previous_versions_are_kept(session):
+    assert session.get("github") == ("user4", "password-4")
+    assert session.get_version("github", 4) == ("user4", "password-4")
+    assert session.get_version("github", 2) == ("user2", "password-2")
+    assert session.get_version("github", 9) is None
+
+    rows = session.history("github")
+    assert [row[0] for row in rows] == [4, 3, 2, 1]
+    assert rows[0][3] is None  # current
+    assert all(saved <= replaced for _, _, saved, replaced in rows[1:])
+
+
+def test_current_reads_do_not_touch_the_history(session):
+    plan = session.storage.conn.execute(
+        "EXPLAIN QUERY PLAN SELECT username, password_blob FROM credentials "
+        "WHERE service = ?",
+        ("github",),
+    ).fetchall()
+    assert "credential_history" not in str(plan)
+    assert "sqlite_autoindex_credentials" in str(plan)
+
+
+def test_restore_creates_a_new_version(session):
+    assert session.restore("github", 2) == 5
+    assert session.get("github") == ("user2", "password-2")
+    # The version it replaced is still there
+    assert session.get_version("github", 4) == ("user4", "password-4")
+    assert session.restore("github", 42) is None
+
+
+def test_keep_policy_prunes_each_service_as_it_is_written(session):
+    storage = session.storage
+    assert storage.get_history_policy() == (10, None)
+    storage.set_history_policy(2, None)
+    session.add("github", "user5", "password-5")
+    assert [row[0] for row in session.history("github")] == [5, 4, 3]
+
+    # Existing surplus history goes with prune_history()
+    for i in range(3):
+        session.add(f"svc{i}", "u", "a")
+        session.add(f"svc{i}", "u", "b")
+    storage.set_history_policy(None, None)
+    for i in range(3):
+        session.add(f"svc{i}", "u", "c")
+        session.add(f"svc{i}", "u", "d")
+    storage.set_history_policy(1, None)
+    assert storage.prune_history(batch_size=2) == 3 * 2 + 1  # + github
+    assert [row[0] for row in session.history("svc0")] == [4, 3]
+
+
+def test_age_policy_prunes_incrementally(session, monkeypatch):
+    storage = session.storage
+    for i in range(8):
+        session.add(f"old{i}", "u", "a")
+        session.add(f"old{i}", "u", "b")
+    storage.conn.execute("UPDATE credential_history SET replaced_at = 1000")
+    storage.set_history_policy(None, 30)
+
+    # A write removes a bounded number of expired versions
+    monkeypatch.setattr("pyvault.storage.HISTORY_PRUNE_STEP", 4)
+    session.add("github", "user5", "password-5")
+    count = "SELECT COUNT(*) FROM credential_history WHERE replaced_at = 1000"
+    assert storage.conn.execute(count).fetchone()[0] == 3 + 8 - 4
+
+    assert storage.prune_history(batch_size=3) == 7
+    assert storage.conn.execute(count).fetchone()[0] == 0
+    # The version replaced just now is younger than 30 days
+    assert session.get_version("github", 4) == ("user4", "password-4")
+
+
+def test_history_commands(vault, run_cli):
+    result = run_cli(history, ["github"])
+    assert result.exit_code == 0
+    assert "current" in result.output and "user1" in result.output
+
+    result = run_cli(get, ["github", "--version", "3"])
+    assert "Credentials for github (version 3)" in result.output
+    assert "password-3" in result.output
+    assert "not in the history" in run_cli(get, ["github", "--version", "8"]).output
+
+    result = run_cli(restore, ["github", "1"])
+    assert "restored from version 1 (now version 5)" in result.output
+
+    result = run_cli(history, ["--keep", "1", "--keep-days", "90"])
+    assert "3 old version(s) pruned" in result.output
+    assert "kept per service: 1" in result.output
+    assert "90 day(s)" in result.output
+    assert run_cli(history, ["--keep", "0"]).exit_code == 2
+
+    assert run_cli(rm, ["github"]).exit_code == 0
+    with VaultSession.open("vault.db") as session:
+        count = session.storage.conn.execute(
+            "SELECT COUNT(*) FROM credential_history"
+        ).fetchone()[0]
+    assert count == 0
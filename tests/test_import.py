@@ -0,0 +1,118 @@
+import csv
+import pytest
+from click.testing import CliRunner
+from unittest.mock import patch
+from pyvault.importer import (
+    PARSE,
+    WRITE,
+    ImportFileError,
+    ImportPipeline,
+    expand_paths,
+)
+from pyvault.main import import_cmd
+from pyvault.session import VaultSession
+
+
+@pytest.fixture
+def session():
+    with VaultSession.open("vault.db") as session:
+        session.initialize("master")
+        session.add("team-000-0000", "existing", "keep-me")
+        yield session
+
+
+def _write_csv(path, team, count):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["service", "username", "password"])
+        for i in range(count):
+            writer.writerow([f"team-{team:03d}-{i:04d}", f"user{i}", f"pw-{team}-{i}"])
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_files_are_imported_concurrently(session, tmp_path, workers):
+    for team in range(4):
+        _write_csv(tmp_path / f"team{team}.csv", team, 300)
+    # again.csv repeats rows of team2.csv: the first row written wins
+    _write_csv(tmp_path / "again.csv", 2, 50)
+    paths = expand_paths([str(tmp_path / "team*.csv"), str(tmp_path / "again.csv")])
+    assert len(paths) == 5
+
+    pipeline = ImportPipeline(session, workers=workers, batch_size=100, chunk_size=32)
+    report = pipeline.run(paths)
+
+    assert report.total_imported == 4 * 300 - 1
+    assert report.total_skipped == 1 + 50
+    assert report.rows[PARSE] == report.rows[WRITE] == 4 * 300 + 50
+    # Commits every 100 rows or so (whole chunks)
+    assert 1250 // 128 <= report.transactions <= 1250 // 100 + 1
+    assert session.get("team-000-0000") == ("existing", "keep-me")
+    assert session.get("team-003-0299") == ("user299", "pw-3-299")
+    assert len(session.list()) == 4 * 300
+
+
+def test_queues_bound_the_rows_in_flight(session, tmp_path):
+    for team in range(3):
+        _write_csv(tmp_path / f"team{team}.csv", team, 500)
+    lags = []
+
+    def progress(report):
+        lags.append(report.rows[PARSE] - report.rows[WRITE])
+
+    pipeline = ImportPipeline(session, workers=1, batch_size=10, chunk_size=10)
+    pipeline.run(expand_paths([str(tmp_path / "*.csv")]), progress=progress)
+    # Two queued chunks on each side of the encryptor, one being encrypted
+    # and one being written: the parsers wait for the rest
+    assert max(lags) <= 10 * (2 + 1 + 2 + 1)
+
+
+def test_a_bad_file_does_not_stop_the_others(session, tmp_path):
+    _write_csv(tmp_path / "good.csv", 1, 10)
+    (tmp_path / "bitwarden.csv").write_text("name,login_password\nx,y\n")
+    with open(tmp_path / "holes.csv", "w", encoding="utf-8") as f:
+        f.write("service,username,password\na,u,p\n,u,p\nb,u,\n")
+
+    report = ImportPipeline(session).run(
+        expand_paths(
+            [str(tmp_path / f) for f in ("good.csv", "bitwarden.csv", "holes.csv")]
+        )
+    )
+    assert report.imported == [10, 0, 1]
+    assert report.invalid == [0, 0, 2]
+    assert "pyvault formatter" in report.errors[str(tmp_path / "bitwarden.csv")]
+
+    with pytest.raises(ImportFileError):
+        expand_paths([str(tmp_path / "*.tsv")])
+
+
+def test_a_write_error_stops_every_stage(session, tmp_path):
+    _write_csv(tmp_path / "big.csv", 1, 5000)
+
+    def fail(*args):
+        raise RuntimeError("disk full")
+
+    session.storage.add_credential = fail
+    pipeline = ImportPipeline(session, workers=1, batch_size=10, chunk_size=10)
+    with pytest.raises(RuntimeError, match="disk full"):
+        pipeline.run([str(tmp_path / "big.csv")])
+
+
+def test_import_command(session, tmp_path):
+    session.close()
+    _write_csv(tmp_path / "a.csv", 1, 20)
+    _write_csv(tmp_path / "b.csv", 2, 30)
+    with patch("pyvault.main.questionary.password") as mock_password, patch(
+        "pyvault.main.SecurityProtections.check_input_speed", return_value=True
+    ):
+        mock_password.return_value.ask.return_value = "master"
+        result = CliRunner().invoke(
+            import_cmd, ["a.csv", "b.csv", "--batch-size", "7"], terminal_width=120
+        )
+        assert result.exit_code == 0, result.output
+        assert "Import of 2 file(s) complete!" in result.output
+        assert "Imported: 50" in result.output
+        assert "b.csv: 30 imported, 0 skipped" in result.output
+
+        result = CliRunner().invoke(import_cmd, ["missing*.csv"])
+        assert "No file matches" in result.output
+        mock_password.return_value.ask.assert_called_once()
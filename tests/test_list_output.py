@@ -0,0 +1,98 @@
+import json
+import pytest
+from click.testing import CliRunner
+from unittest.mock import patch
+from pyvault.main import list as list_cmd
+from pyvault.main import tag
+from pyvault.session import VaultSession
+
+
+@pytest.fixture
+def vault():
+    """vault.db with svc-00 .. svc-09, the first one labelled."""
+    with VaultSession.open("vault.db") as session:
+        session.initialize("master")
+        with session.transaction(write=True):
+            for i in range(10):
+                session.add(f"svc-{i:02d}", f"user{i}", "password")
+            session.label("svc-00", add=["prod", "db"], folder="work")
+
+
+def test_pages_follow_each_other(vault, run_cli):
+    result = run_cli(list_cmd, ["--format", "plain", "--limit", "4"], mix_stderr=False)
+    assert result.exit_code == 0, result.output
+    assert result.stdout.splitlines() == ["svc-00", "svc-01", "svc-02", "svc-03"]
+    assert "--after svc-03" in result.stderr
+
+    result = run_cli(
+        list_cmd,
+        ["--format", "plain", "--limit", "4", "--after", "svc-07"],
+        mix_stderr=False,
+    )
+    assert result.stdout.splitlines() == ["svc-08", "svc-09"]
+    assert "--after" not in result.stderr
+
+    result = run_cli(list_cmd, ["--limit", "3", "--after", "svc-00"], mix_stderr=False)
+    assert "svc-01" in result.stdout and "svc-04" not in result.stdout
+    assert "continue with --after svc-03" in result.stdout
+
+
+def test_machine_readable_formats(vault, run_cli):
+    with VaultSession.open("vault.db") as session:
+        session.unlock("master")
+        session.add("tab\there", "line\nbreak", "password")
+
+    result = run_cli(list_cmd, ["--format", "json"], mix_stderr=False)
+    records = json.loads(result.stdout)
+    assert len(records) == 11
+    assert records[0] == {
+        "service": "svc-00",
+        "username": "user0",
+        "folder": "work",
+        "tags": ["db", "prod"],
+    }
+    assert records[1]["tags"] == [] and records[1]["folder"] is None
+    result = run_cli(list_cmd, ["--format", "json", "--after", "zzz"], mix_stderr=False)
+    assert json.loads(result.stdout) == []
+
+    lines = run_cli(
+        list_cmd, ["--format", "ndjson", "--where", "tag:prod"], mix_stderr=False
+    ).stdout.splitlines()
+    assert [json.loads(line)["service"] for line in lines] == ["svc-00"]
+
+    lines = run_cli(
+        list_cmd, ["--format", "tsv", "--limit", "2"], mix_stderr=False
+    ).stdout.splitlines()
+    assert lines == [
+        "service\tusername\tfolder\ttags",
+        "svc-00\tuser0\twork\tdb, prod",
+        "svc-01\tuser1\t\t",
+    ]
+    last = run_cli(
+        list_cmd, ["--format", "tsv", "--after", "svc-09"], mix_stderr=False
+    ).stdout.splitlines()[-1]
+    assert last == "tab\\there\tline\\nbreak\t\t"
+
+
+def test_pages_are_read_in_index_order(vault):
+    with VaultSession.open("vault.db") as session:
+        conn = session.storage.conn
+        statements = []
+        conn.set_trace_callback(statements.append)
+        session.storage.get_catalog(after="svc-03", limit=4)
+        conn.set_trace_callback(None)
+        # The traced statement has its parameters inlined
+        query = next(sql for sql in statements if "FROM credentials" in sql)
+        plan = conn.execute(f"EXPLAIN QUERY PLAN {query}").fetchall()
+    details = " ".join(row[-1] for row in plan)
+    # A range seek on the primary key and no sort: rows stream out at once
+    assert "(service>?)" in details
+    assert "TEMP B-TREE" not in details
+
+
+def test_invalid_tag_names_are_refused(vault):
+    with patch("pyvault.main.questionary.password") as mock_password:
+        result = CliRunner().invoke(tag, ["svc-01", "a,b"])
+    assert result.exit_code == 2
+    assert "not a valid tag name" in result.output
+    mock_password.assert_not_called()
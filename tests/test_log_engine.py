@@ -0,0 +1,247 @@
+import os
+import sys
+import threading
+import pytest
+from unittest.mock import patch
+from pyvault import memory, recordlog
+from pyvault.engines import convert, detect_engine
+from pyvault.main import cli
+from pyvault.memory import VaultFileError
+from pyvault.recordlog import LOG_MAGIC, LogVaultStorage, hint_path, read_log_header
+from pyvault.session import VaultSession
+
+pytestmark = pytest.mark.skipif(
+    sys.version_info < (3, 11), reason="sqlite3 serialize() needs Python 3.11"
+)
+
+KEY = bytes(range(32))
+
+
+@pytest.fixture
+def vault():
+    """Log-engine vault.db holding a to c, with a tag and two versions of a."""
+    with VaultSession.open("vault.db", engine="log") as session:
+        session.initialize("master")
+        for service in "abc":
+            session.add(service, f"{service}-user", f"{service}-password")
+        session.add("a", "a-user", "a-password-2")
+        session.label("b", add=["prod"])
+
+
+def _storage():
+    storage = LogVaultStorage("vault.db")
+    storage.unseal(KEY)
+    return storage
+
+
+def _check(session):
+    assert session.get("a") == ("a-user", "a-password-2")
+    assert [row[0] for row in session.catalog()] == [*"abc"]
+    assert [row[0] for row in session.catalog(where="tag:prod")] == ["b"]
+    assert len(session.history("a")) == 2
+
+
+@pytest.mark.parametrize("hint", [True, False])
+def test_the_log_is_encrypted_and_replayed(vault, hint):
+    with open("vault.db", "rb") as f:
+        data = f.read()
+    assert data.startswith(LOG_MAGIC)
+    assert b"a-user" not in data and b"credentials" not in data
+    assert detect_engine("vault.db") == "log"
+    if not hint:
+        os.remove(hint_path("vault.db"))
+
+    with VaultSession.open("vault.db") as session:
+        assert session.storage.engine == "log"
+        session.unlock("master")
+        _check(session)
+
+
+def test_one_frame_and_one_fsync_per_transaction(vault):
+    with VaultSession.open("vault.db") as session:
+        session.unlock("master")
+        seq = session.storage._seq
+        with patch("pyvault.recordlog.os.fsync") as fsync:
+            with session.transaction(write=True):
+                for i in range(20):
+                    session.add(f"bulk{i:02d}", "user", "password")
+        assert fsync.call_count == 1
+        assert session.storage._seq == seq + 1
+
+        # Overwrites and deletes leave garbage the index accounts for
+        live = session.storage._live_bytes
+        session.add("bulk00", "user", "new password")
+        session.storage.delete_credential("bulk01")
+        assert session.storage._log_bytes > session.storage._live_bytes
+        assert session.storage._live_bytes < live + 4096
+
+    with VaultSession.open("vault.db") as session:
+        session.unlock("master")
+        assert session.get("bulk00") == ("user", "new password")
+        assert session.get("bulk01") is None
+        assert len(list(session.catalog())) == 22
+
+
+def test_torn_tail_is_cut_off(vault):
+    size = os.path.getsize("vault.db")
+    with open("vault.db", "ab") as f:
+        f.write(b"\x00\x00\x01\x00partial frame")
+    with VaultSession.open("vault.db") as session:
+        session.unlock("master")
+        _check(session)
+        session.add("d", "d-user", "d-password")
+    os.remove(hint_path("vault.db"))
+    with VaultSession.open("vault.db") as session:
+        session.unlock("master")
+        assert session.get("d") == ("d-user", "d-password")
+    assert os.path.getsize("vault.db") > size
+
+
+def test_damaged_frame_is_refused(vault):
+    os.remove(hint_path("vault.db"))
+    with open("vault.db", "r+b") as f:
+        size = read_log_header(f.read())[0]
+        f.seek(size + 40)
+        byte = f.read(1)
+        f.seek(size + 40)
+        f.write(bytes([byte[0] ^ 1]))
+    with VaultSession.open("vault.db") as session:
+        with pytest.raises(VaultFileError, match="checksum"):
+            session.unlock("master")
+
+
+def test_commits_are_seen_by_other_connections():
+    first, second = _storage(), _storage()
+    first.add_credential("a", "user", b"blob")
+    assert second.get_credential("a") == ("user", b"blob")
+    loads = second._loads
+    second.add_credential("b", "user", b"blob")
+    second.delete_credential("a")
+    assert [row[0] for row in first.get_catalog()] == ["b"]
+    # Appends by the other connection are replayed, not reloaded
+    assert second._loads == loads and first._loads == 1
+    first.close()
+    second.close()
+
+    storage = _storage()
+    with pytest.raises(RuntimeError):
+        with storage.transaction(write=True):
+            storage.add_credential("c", "user", b"blob")
+            raise RuntimeError
+    assert storage.get_credential("c") is None
+    storage.close()
+
+
+def test_concurrent_writers_lose_no_updates():
+    _storage().close()
+
+    def write(prefix):
+        storage = _storage()
+        for i in range(15):
+            storage.add_credential(f"{prefix}{i:02d}", "user", b"blob")
+        storage.close()
+
+    threads = [threading.Thread(target=write, args=(p,)) for p in "xyz"]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    storage = _storage()
+    assert len(storage.get_catalog()) == 45
+    storage.close()
+
+
+def test_background_compaction_reclaims_overwrites(monkeypatch):
+    monkeypatch.setattr(recordlog, "COMPACT_MIN_BYTES", 64 * 1024)
+    # Overwrites keep the old versions in the history: some garbage is enough
+    monkeypatch.setattr(recordlog, "GARBAGE_SHARE", 0.2)
+    release = threading.Event()
+    run = recordlog._Compaction._run
+    monkeypatch.setattr(
+        recordlog._Compaction,
+        "_run",
+        lambda job, image, key: (release.wait(), run(job, image, key)),
+    )
+    storage = _storage()
+    for i in range(50):
+        storage.add_credential(f"s{i:02d}", "user", os.urandom(4096))
+    for round in range(40):
+        for i in range(10):
+            storage.add_credential(f"s{i:02d}", "user", bytes([round]) * 4096)
+        if storage._compaction is not None:
+            break
+    assert storage._compaction is not None
+    log_id = storage._log_id
+
+    # Writes made while it runs are carried over to the new log
+    storage.add_credential("s10", "user", b"during")
+    storage.delete_credential("s11")
+    assert storage._compaction.changed
+    release.set()
+    storage._compaction.thread.join()
+    storage.add_credential("s12", "user", b"after")
+    assert storage._compaction is None and storage._log_id != log_id
+    assert storage._log_bytes < 1.1 * storage._live_bytes
+    assert not [name for name in os.listdir() if ".compact-" in name]
+    storage.close()
+
+    os.remove(hint_path("vault.db"))
+    storage = _storage()
+    assert storage.get_credential("s10") == ("user", b"during")
+    assert storage.get_credential("s11") is None
+    assert storage.get_credential("s12") == ("user", b"after")
+    assert storage.get_credential("s00")[1] == bytes([round]) * 4096
+    assert len(storage.get_catalog()) == 49
+
+    before, after = storage.compact()
+    assert after <= before
+    storage.close()
+
+
+def test_conversion_keeps_everything(vault):
+    with VaultSession.open("vault.db") as session:
+        session.unlock("master")
+        key = bytes(session.key)
+
+    for engine in ("memory", "log", "sqlite", "log"):
+        convert("vault.db", key, engine)
+        assert detect_engine("vault.db") == engine
+        assert os.path.exists(hint_path("vault.db")) == (engine == "log")
+        with VaultSession.open("vault.db") as session:
+            session.unlock("master")
+            _check(session)
+
+
+def test_init_and_optimize_commands(run_cli):
+    result = run_cli(cli, ["init", "--engine", "log"])
+    assert result.exit_code == 0, result.output
+    assert "Engine: log" in result.output
+    assert detect_engine("vault.db") == "log"
+
+    for i in range(3):
+        result = run_cli(cli, ["add", "github", "--username", f"me{i}"])
+        assert result.exit_code == 0, result.output
+    result = run_cli(cli, ["optimize"])
+    assert "compacted in the background" in result.output
+
+    result = run_cli(cli, ["engine", "memory"])
+    assert result.exit_code == 0, result.output
+    assert "log → memory" in result.output
+    assert not os.path.exists(hint_path("vault.db"))
+
+
+def test_log_engine_needs_python_3_11_before_unlocking(run_cli, monkeypatch):
+    monkeypatch.setattr(memory, "HAS_IMAGES", False)
+    result = run_cli(cli, ["init", "--engine", "log"])
+    assert "The log engine needs Python 3.11 or newer." in result.output
+    assert not os.path.exists("vault.db")
+
+    result = run_cli(cli, ["init", "--cipher", "aes-256-gcm"])
+    assert result.exit_code == 0, result.output
+    with patch("pyvault.main.unlock_session") as unlock:
+        result = run_cli(cli, ["engine", "log"])
+    assert "The log engine needs Python 3.11 or newer." in result.output
+    unlock.assert_not_called()
+    with pytest.raises(VaultFileError, match="log engine needs Python 3.11"):
+        LogVaultStorage("other.db")
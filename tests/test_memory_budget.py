@@ -0,0 +1,219 @@
+import csv
+import hashlib
+import subprocess
+import sys
+import tracemalloc
+from contextlib import closing
+import pytest
+from pyvault.crypto import AES_256_GCM
+from pyvault.main import CatalogPage, catalog_lines
+from pyvault.main import attach, audit, export, formatter, get, import_cmd
+from pyvault.main import list as list_cmd
+from pyvault.session import VaultSession
+
+# Every command runs on a small and a four times larger input (records, or
+# KiB for attachments). Streaming
+# commands must stay within a fixed peak whatever the input size; commands
+# that need per-record state (audit, list) within a per-record budget.
+# tracemalloc sees the Python heap only: Argon2 is checked against the RSS.
+KIB = 1024
+MIB = 1024 * KIB
+
+# Extra peak allowed for the larger input of a streaming command. Holding the
+# rows in a list costs several hundred bytes per row, far above this.
+STREAMING_GROWTH = 256 * KIB
+
+
+def _password(i):
+    return hashlib.blake2b(str(i).encode(), digest_size=9).hexdigest()
+
+
+def _rows(count):
+    for i in range(count):
+        yield f"service-{i:07d}", f"user{i}@example.com", _password(i)
+
+
+def _write_csv(path, count, header=("service", "username", "password")):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(_rows(count))
+
+
+def _make_vault(path, count):
+    with VaultSession.open(path) as session:
+        session.initialize("master", cipher=AES_256_GCM)
+        with session.transaction(write=True):
+            for service, username, password in _rows(count):
+                session.add(service, username, password)
+
+
+def _make_file(path, kib):
+    with open(path, "wb") as f:
+        for i in range(kib):
+            f.write(hashlib.blake2b(str(i).encode(), digest_size=64).digest() * 16)
+
+
+def _vault_with_attachment(kib):
+    _make_vault("vault.db", 1)
+    _make_file("dump.bin", kib)
+    with VaultSession.open("vault.db") as session:
+        session.unlock("master")
+        with open("dump.bin", "rb") as f:
+            session.attach("service-0000000", "dump.bin", f)
+
+
+def _peak(run_cli, command, args):
+    """Peak Python heap allocated while the command runs, in bytes."""
+    tracemalloc.start()
+    try:
+        result = run_cli(command, args, catch_exceptions=False)
+        assert result.exit_code == 0, result.output
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _measure(run_cli, tmp_path, monkeypatch, sizes, prepare, command, args):
+    """Peaks for each input size, each run in its own directory."""
+    peaks = []
+    for count in sizes:
+        workdir = tmp_path / str(count)
+        workdir.mkdir()
+        monkeypatch.chdir(workdir)
+        prepare(count)
+        peaks.append(_peak(run_cli, command, args))
+    return peaks
+
+
+@pytest.mark.parametrize(
+    "name, prepare, command, args, budget",
+    [
+        (
+            "import",
+            lambda n: (_make_vault("vault.db", 0), _write_csv("in.csv", n)),
+            import_cmd,
+            ["in.csv"],
+            1 * MIB,
+        ),
+        (
+            "export csv",
+            lambda n: _make_vault("vault.db", n),
+            export,
+            [".", "out", "--format", "csv"],
+            2 * MIB,
+        ),
+        (
+            "export json",
+            lambda n: _make_vault("vault.db", n),
+            export,
+            [".", "out", "--format", "json"],
+            2 * MIB,
+        ),
+        (
+            "formatter",
+            lambda n: _write_csv(
+                "bitwarden.csv", n, ("name", "login_username", "login_password")
+            ),
+            formatter,
+            ["bitwarden.csv", ".", "ready.csv"],
+            1 * MIB,
+        ),
+        (
+            "attach (KiB)",
+            lambda n: (_make_vault("vault.db", 1), _make_file("dump.bin", n)),
+            attach,
+            ["service-0000000", "dump.bin"],
+            1 * MIB,
+        ),
+        (
+            "get --attachment (KiB)",
+            _vault_with_attachment,
+            get,
+            ["service-0000000", "--attachment", "dump.bin", "-o", "out.bin"],
+            1 * MIB,
+        ),
+    ],
+)
+def test_streaming_commands_use_constant_memory(
+    run_cli, tmp_path, monkeypatch, name, prepare, command, args, budget
+):
+    small, large = _measure(
+        run_cli, tmp_path, monkeypatch, (1000, 4000), prepare, command, args
+    )
+    assert large <= budget, f"{name}: peak {large / MIB:.2f} MiB"
+    assert large - small <= STREAMING_GROWTH, (
+        f"{name}: peak grew by {(large - small) / KIB:.0f} KiB "
+        f"from 1000 to 4000 records"
+    )
+
+
+@pytest.mark.parametrize(
+    "name, command, args, per_record",
+    [
+        ("audit", audit, [], 1536),
+        ("audit --no-similarity", audit, ["--no-similarity"], 512),
+        ("list", list_cmd, [], 2 * KIB),
+    ],
+)
+def test_per_record_memory_budget(
+    run_cli, tmp_path, monkeypatch, name, command, args, per_record
+):
+    small, large = _measure(
+        run_cli,
+        tmp_path,
+        monkeypatch,
+        (200, 800),
+        lambda n: _make_vault("vault.db", n),
+        command,
+        args,
+    )
+    growth = (large - small) / 600
+    assert growth <= per_record, f"{name}: {growth:.0f} bytes per record"
+
+
+@pytest.mark.parametrize("output_format", ["plain", "tsv", "json", "ndjson"])
+def test_streamed_list_uses_constant_memory(tmp_path, output_format):
+    # CliRunner keeps stdout in memory, so the lines are dropped here instead
+    peaks = []
+    for count in (1000, 4000):
+        _make_vault(tmp_path / f"{count}.db", count)
+        with VaultSession.open(tmp_path / f"{count}.db") as session:
+            tracemalloc.start()
+            try:
+                rows = session.catalog()
+                with closing(rows):
+                    for _ in catalog_lines(CatalogPage(rows, None), output_format):
+                        pass
+                peaks.append(tracemalloc.get_traced_memory()[1])
+            finally:
+                tracemalloc.stop()
+    assert peaks[1] - peaks[0] <= STREAMING_GROWTH
+
+
+UNLOCK_AND_SCAN = """
+import resource, sys
+from pyvault.session import VaultSession
+
+session = VaultSession.open(sys.argv[1])
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+session.unlock("master")
+for _ in session.inventory():
+    pass
+after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(after - before, session.crypto.memory_cost)
+"""
+
+
+@pytest.mark.skipif(sys.platform != "linux", reason="ru_maxrss is in KiB on Linux")
+def test_unlock_and_scan_rss_budget(tmp_path):
+    """Argon2 allocates memory_cost KiB once; a full scan adds little on top."""
+    _make_vault(tmp_path / "vault.db", 4000)
+    output = subprocess.run(
+        [sys.executable, "-c", UNLOCK_AND_SCAN, str(tmp_path / "vault.db")],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    growth_kib, memory_cost_kib = map(int, output.split())
+    assert growth_kib <= memory_cost_kib + 16 * KIB
@@ -0,0 +1,192 @@
+import os
+import sys
+import threading
+import pytest
+from unittest.mock import patch
+from pyvault import memory
+from pyvault.engines import convert, detect_engine
+from pyvault.main import cli
+from pyvault.memory import MAGIC, MemoryVaultStorage, VaultFileError
+from pyvault.session import VaultSession
+from pyvault.sync import VaultSync, check_same_vault
+
+pytestmark = pytest.mark.skipif(
+    sys.version_info < (3, 11), reason="sqlite3 serialize() needs Python 3.11"
+)
+
+KEY = bytes(range(32))
+
+
+@pytest.fixture
+def vault():
+    """Memory-engine vault.db holding a to c, with a tag and two versions of a."""
+    with VaultSession.open("vault.db", engine="memory") as session:
+        session.initialize("master")
+        for service in "abc":
+            session.add(service, f"{service}-user", f"{service}-password")
+        session.add("a", "a-user", "a-password-2")
+        session.label("b", add=["prod"])
+
+
+def _storage():
+    storage = MemoryVaultStorage("vault.db")
+    storage.unseal(KEY)
+    return storage
+
+
+def test_the_whole_file_is_encrypted(vault):
+    with open("vault.db", "rb") as f:
+        data = f.read()
+    assert data.startswith(MAGIC)
+    assert b"a-user" not in data and b"credentials" not in data
+    assert detect_engine("vault.db") == "memory"
+
+    with VaultSession.open("vault.db") as session:
+        assert session.storage.engine == "memory"
+        session.unlock("master")
+        assert session.get("a") == ("a-user", "a-password-2")
+        assert [row[0] for row in session.catalog()] == [*"abc"]
+        assert [row[0] for row in session.catalog(after="a", limit=1)] == ["b"]
+        assert [row[0] for row in session.catalog(where="tag:prod")] == ["b"]
+
+
+def test_wrong_password_reads_nothing(vault):
+    with VaultSession.open("vault.db") as session:
+        with pytest.raises(Exception):
+            session.unlock("wrong")
+        assert not session.storage._loaded
+
+
+def test_altered_file_is_refused(vault):
+    with open("vault.db", "r+b") as f:
+        f.seek(-10, os.SEEK_END)
+        byte = f.read(1)
+        f.seek(-10, os.SEEK_END)
+        f.write(bytes([byte[0] ^ 1]))
+    with VaultSession.open("vault.db") as session:
+        with pytest.raises(VaultFileError):
+            session.unlock("master")
+
+
+def test_commits_are_seen_by_other_connections():
+    first, second = _storage(), _storage()
+    first.add_credential("a", "user", b"blob")
+    assert second.get_credential("a") == ("user", b"blob")
+    second.add_credential("b", "user", b"blob")
+    assert [row[0] for row in first.get_catalog()] == ["a", "b"]
+    first.close()
+    second.close()
+
+    # Rolled back changes never reach the file
+    storage = _storage()
+    with pytest.raises(RuntimeError):
+        with storage.transaction(write=True):
+            storage.add_credential("c", "user", b"blob")
+            raise RuntimeError
+    assert storage.get_credential("c") is None
+    storage.close()
+    storage = _storage()
+    assert storage.get_credential("c") is None
+    storage.close()
+
+
+def test_concurrent_writers_lose_no_updates():
+    _storage().close()
+
+    def write(prefix):
+        storage = _storage()
+        for i in range(15):
+            storage.add_credential(f"{prefix}{i:02d}", "user", b"blob")
+        storage.close()
+
+    threads = [threading.Thread(target=write, args=(p,)) for p in "xyz"]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    storage = _storage()
+    assert len(storage.get_catalog()) == 45
+    storage.close()
+
+
+def test_conversion_keeps_everything(vault):
+    with VaultSession.open("vault.db") as session:
+        session.unlock("master")
+        key = bytes(session.key)
+
+    for engine in ("sqlite", "memory"):
+        convert("vault.db", key, engine)
+        assert detect_engine("vault.db") == engine
+        with VaultSession.open("vault.db") as session:
+            session.unlock("master")
+            assert session.get("c") == ("c-user", "c-password")
+            assert [row[0] for row in session.catalog(where="tag:prod")] == ["b"]
+            assert len(session.history("a")) == 2
+            session.add("d", "d-user", "d-password")
+            assert session.get("d") == ("d-user", "d-password")
+        with open("vault.db", "rb") as f:
+            assert (b"c-user" in f.read()) == (engine == "sqlite")
+
+
+def test_sync_between_engines(vault, tmp_path):
+    with VaultSession.open("vault.db") as session:
+        session.unlock("master")
+        convert("vault.db", bytes(session.key), "memory")
+    with open("vault.db", "rb") as f:
+        data = f.read()
+    with open("copy.db", "wb") as f:
+        f.write(data)
+
+    with VaultSession.open("vault.db") as session, VaultSession.open(
+        "copy.db"
+    ) as other:
+        session.unlock("master")
+        session.add("d", "d-user", "d-password")
+        check_same_vault(session, other.storage)
+        engine = VaultSync(session.storage, other.storage)
+        engine.apply(engine.plan())
+    with VaultSession.open("copy.db") as other:
+        other.unlock("master")
+        assert other.get("d") == ("d-user", "d-password")
+
+
+def test_init_and_engine_commands(run_cli):
+    result = run_cli(cli, ["init", "--engine", "memory", "--cipher", "aes-256-gcm"])
+    assert result.exit_code == 0, result.output
+    assert "Engine: memory" in result.output
+    assert detect_engine("vault.db") == "memory"
+
+    result = run_cli(cli, ["add", "github", "--username", "me"], password="master")
+    assert result.exit_code == 0, result.output
+
+    result = run_cli(cli, ["engine"])
+    assert "Storage engine: memory" in result.output
+
+    result = run_cli(cli, ["engine", "sqlite"])
+    assert result.exit_code == 0, result.output
+    assert "memory → sqlite" in result.output
+    assert detect_engine("vault.db") == "sqlite"
+
+    result = run_cli(cli, ["engine", "sqlite"])
+    assert "already uses sqlite" in result.output
+
+    result = run_cli(cli, ["engine", "memory"], password="wrong")
+    assert "ACCESS DENIED" in result.output
+    assert detect_engine("vault.db") == "sqlite"
+
+
+def test_engines_need_python_3_11_before_unlocking(run_cli, monkeypatch):
+    monkeypatch.setattr(memory, "HAS_IMAGES", False)
+    result = run_cli(cli, ["init", "--engine", "memory"])
+    assert "The memory engine needs Python 3.11 or newer." in result.output
+    assert not os.path.exists("vault.db")
+
+    # The sqlite engine still works, but cannot be converted
+    result = run_cli(cli, ["init", "--cipher", "aes-256-gcm"])
+    assert result.exit_code == 0, result.output
+    with patch("pyvault.main.unlock_session") as unlock:
+        result = run_cli(cli, ["engine", "memory"])
+    assert "The memory engine needs Python 3.11 or newer." in result.output
+    unlock.assert_not_called()
+    assert detect_engine("vault.db") == "sqlite"
@@ -0,0 +1,193 @@
+import sqlite3
+import pytest
+from click.testing import CliRunner
+from pyvault import migrations
+from pyvault.main import migrate
+from pyvault.migrations import Migration, MigrationError
+from pyvault.storage import VaultStorage
+
+
+def _legacy_vault(path, rows=0):
+    """Creates a vault as written by PyVault <= 1.0.5 (no user_version)."""
+    conn = sqlite3.connect(str(path))
+    conn.execute(
+        "CREATE TABLE config (id INTEGER PRIMARY KEY CHECK (id = 1), "
+        "master_salt BLOB NOT NULL, master_verifier BLOB NOT NULL)"
+    )
+    conn.execute(
+        "CREATE TABLE credentials (service TEXT PRIMARY KEY, "
+        "username TEXT NOT NULL, password_blob BLOB NOT NULL)"
+    )
+    conn.executemany(
+        "INSERT INTO credentials VALUES (?, ?, ?)",
+        [(f"svc{i:04d}", "user", b"blob") for i in range(rows)],
+    )
+    conn.commit()
+    conn.close()
+
+
+def _autocommit(path):
+    return sqlite3.connect(str(path), isolation_level=None)
+
+
+def _tag_migration(fail_after=None):
+    """Test data migration: copies each username into a new column, batch by batch."""
+    calls = {"batches": 0}
+
+    def step(conn, cursor, limit):
+        calls["batches"] += 1
+        if fail_after is not None and calls["batches"] > fail_after:
+            raise RuntimeError("interrupted")
+        rows = conn.execute(
+            "SELECT service FROM credentials WHERE service > ? ORDER BY service LIMIT ?",
+            (cursor or "", limit),
+        ).fetchall()
+        conn.executemany(
+            "UPDATE credentials SET owner = username WHERE service = ?", rows
+        )
+        return len(rows), (rows[-1][0] if len(rows) == limit else None)
+
+    def count(conn):
+        return conn.execute(
+            "SELECT COUNT(*) FROM credentials WHERE owner IS NULL"
+        ).fetchone()[0]
+
+    migration = Migration(
+        migrations.LATEST_VERSION + 1,
+        "Backfill owner",
+        schema=["ALTER TABLE credentials ADD COLUMN owner TEXT"],
+        batch=step,
+        count=count,
+    )
+    return migration, calls
+
+
+def test_new_vault_is_created_at_latest_version(tmp_path):
+    storage = VaultStorage(tmp_path / "vault.db")
+    assert storage.schema_version() == migrations.LATEST_VERSION
+    assert storage.pending_migrations() == []
+    storage.close()
+
+
+def test_legacy_vault_is_upgraded_in_place(tmp_path):
+    db_file = tmp_path / "vault.db"
+    _legacy_vault(db_file, rows=3)
+
+    storage = VaultStorage(db_file)
+    assert storage.schema_version() == migrations.LATEST_VERSION
+    assert len(storage.get_full_inventory()) == 3
+    storage.close()
+
+
+def test_batched_migration_resumes_after_interruption(tmp_path):
+    db_file = tmp_path / "vault.db"
+    _legacy_vault(db_file, rows=25)
+    conn = _autocommit(db_file)
+    migrations.upgrade(conn)
+
+    failing, _ = _tag_migration(fail_after=2)
+    with pytest.raises(RuntimeError):
+        migrations.upgrade(conn, migrations.MIGRATIONS + [failing], batch_size=10)
+    # Two committed batches survive, the version is not bumped yet
+    assert migrations.get_version(conn) == migrations.LATEST_VERSION
+    assert (
+        conn.execute(
+            "SELECT COUNT(*) FROM credentials WHERE owner IS NOT NULL"
+        ).fetchone()[0]
+        == 20
+    )
+
+    resumed, calls = _tag_migration()
+    seen = []
+    applied = migrations.upgrade(
+        conn,
+        migrations.MIGRATIONS + [resumed],
+        batch_size=10,
+        progress=lambda m, done, total: seen.append((done, total)),
+    )
+
+    assert applied == [resumed.version]
+    assert calls["batches"] == 1  # Only the remaining 5 rows
+    assert seen[-1] == (25, 25)
+    assert migrations.get_version(conn) == resumed.version
+    conn.close()
+
+
+def test_timestamp_backfills_run_in_batches(tmp_path):
+    db_file = tmp_path / "vault.db"
+    _legacy_vault(db_file, rows=25)
+    conn = _autocommit(db_file)
+    migrations.upgrade(conn, migrations.MIGRATIONS[:5])
+    conn.execute("UPDATE credentials SET updated_at = 1000 + rowid")
+
+    seen = []
+    migrations.upgrade(
+        conn,
+        batch_size=10,
+        progress=lambda m, done, total: seen.append((m.version, done)),
+    )
+
+    for version in (6, 7):
+        assert [done for v, done in seen if v == version] == [0, 10, 20, 25]
+    assert conn.execute(
+        "SELECT COUNT(*) FROM credentials "
+        "WHERE created_at != updated_at OR last_accessed_at != updated_at"
+    ).fetchone() == (0,)
+    conn.close()
+
+
+def test_estimate_does_not_modify_the_vault(tmp_path):
+    db_file = tmp_path / "vault.db"
+    _legacy_vault(db_file, rows=50)
+    conn = _autocommit(db_file)
+    migrations.upgrade(conn)
+    migration, _ = _tag_migration()
+
+    report = migrations.estimate(
+        conn, migrations.MIGRATIONS + [migration], rows=100_000
+    )
+
+    assert report[0]["version"] == migration.version
+    assert report[0]["rows"] == 100_000
+    assert report[0]["seconds"] > 0
+    assert migrations.get_version(conn) == migrations.LATEST_VERSION
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(credentials)")]
+    assert "owner" not in columns
+    conn.close()
+
+
+def test_estimate_scales_to_rows_of_an_empty_vault(tmp_path):
+    conn = _autocommit(tmp_path / "vault.db")
+    migrations.upgrade(conn)
+    migration, calls = _tag_migration()
+
+    small, large = (
+        migrations.estimate(conn, migrations.MIGRATIONS + [migration], rows=rows)[0]
+        for rows in (10, 1_000_000)
+    )
+
+    # The per-row cost comes from a batch of made-up rows, rolled back
+    assert calls["batches"] == 2
+    assert large["seconds"] > small["seconds"]
+    assert conn.execute("SELECT COUNT(*) FROM credentials").fetchone() == (0,)
+    conn.close()
+
+
+def test_newer_vault_is_rejected(tmp_path):
+    db_file = tmp_path / "vault.db"
+    conn = _autocommit(db_file)
+    conn.execute(f"PRAGMA user_version = {migrations.LATEST_VERSION + 1}")
+    conn.close()
+
+    with pytest.raises(MigrationError):
+        VaultStorage(db_file)
+
+
+def test_migrate_command_reports_up_to_date(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    VaultStorage("vault.db").close()
+
+    result = CliRunner().invoke(migrate, ["--dry-run"])
+
+    assert result.exit_code == 0
+    assert "up to date" in result.output
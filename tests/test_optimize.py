@@ -0,0 +1,175 @@
+import os
+import sqlite3
+import pytest
+from click.testing import CliRunner
+from pyvault import maintenance
+from pyvault.main import optimize
+from pyvault.session import VaultSession
+from pyvault.storage import VaultStorage
+
+# Longer than a page: every record owns overflow pages that a delete frees
+LONG_PASSWORD = "x" * 6000
+
+
+@pytest.fixture
+def vault():
+    """vault.db with 200 credentials holding long passwords."""
+    with VaultSession.open("vault.db") as session:
+        session.initialize("master")
+        with session.transaction(write=True):
+            for i in range(200):
+                session.add(f"svc{i:03}", f"user{i}", LONG_PASSWORD)
+
+
+def _delete(services, auto=True):
+    with VaultSession.open("vault.db") as session:
+        session.unlock("master")
+        session.storage.set_auto_maintenance(auto)
+        with session.transaction(write=True):
+            for service in services:
+                session.delete(service)
+
+
+def _pragma(name):
+    conn = sqlite3.connect("vault.db")
+    try:
+        return conn.execute(f"PRAGMA {name}").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def _disable_auto_vacuum():
+    """Turns vault.db into a vault created before incremental auto_vacuum."""
+    conn = sqlite3.connect("vault.db", isolation_level=None)
+    conn.execute("PRAGMA auto_vacuum = NONE")
+    conn.execute("VACUUM")
+    conn.close()
+
+
+def test_new_vaults_reclaim_space_incrementally(vault):
+    assert _pragma("auto_vacuum") == maintenance.INCREMENTAL
+    storage = VaultStorage("vault.db")
+    try:
+        assert storage.conn.execute("PRAGMA secure_delete").fetchone()[0] == 1
+        assert storage.get_auto_maintenance()
+    finally:
+        storage.close()
+
+
+def test_optimize_rebuilds_older_vaults(vault):
+    _disable_auto_vacuum()
+    _delete([f"svc{i:03}" for i in range(0, 200, 2)], auto=False)
+    size = os.path.getsize("vault.db")
+
+    storage = VaultStorage("vault.db")
+    try:
+        stats = maintenance.database_stats(storage.conn, "vault.db")
+        assert stats.auto_vacuum == "none" and not stats.analyzed
+        assert maintenance.needs_rebuild(stats)
+        report = maintenance.optimize(storage)
+    finally:
+        storage.close()
+
+    assert report.actions == ["vacuum", "analyze", "checkpoint"]
+    assert report.after.auto_vacuum == "incremental" and report.after.analyzed
+    assert report.after.free_pages == 0
+    assert os.path.getsize("vault.db") < size * 0.6
+    assert report.bytes_saved > 0
+    with VaultSession.open("vault.db") as session:
+        session.unlock("master")
+        assert session.get("svc001") == ("user1", LONG_PASSWORD)
+        assert session.get("svc000") is None
+
+
+def test_free_pages_are_reclaimed_in_bounded_steps(vault):
+    storage = VaultStorage("vault.db")
+    try:
+        maintenance.optimize(storage)
+    finally:
+        storage.close()
+    _delete([f"svc{i:03}" for i in range(150)], auto=False)
+    size = os.path.getsize("vault.db")
+
+    storage = VaultStorage("vault.db")
+    steps = []
+    try:
+        stats = maintenance.database_stats(storage.conn, "vault.db")
+        free = stats.free_pages
+        assert free > 100
+        # Whole pages were freed: no rebuild needed
+        assert not maintenance.needs_rebuild(stats)
+        report = maintenance.optimize(
+            storage,
+            step_pages=40,
+            progress=lambda action, done, total: steps.append((action, done)),
+        )
+    finally:
+        storage.close()
+
+    reclaimed = [done for action, done in steps if action == "reclaim"]
+    assert len(reclaimed) == -(-free // 40)
+    assert all(b - a <= 40 for a, b in zip([0] + reclaimed, reclaimed))
+    assert report.pages_reclaimed == free
+    assert report.actions == ["reclaim", "refresh", "checkpoint"]
+    assert _pragma("freelist_count") == 0
+    assert os.path.getsize("vault.db") <= size - free * report.before.page_size
+
+
+def test_automatic_maintenance_after_writes(vault, monkeypatch):
+    monkeypatch.setattr(maintenance, "DEFAULT_STEP_PAGES", 50)
+    monkeypatch.setattr(maintenance, "AUTO_VACUUM_THRESHOLD", 100)
+    _delete([f"svc{i:03}" for i in range(100)], auto=False)
+    free = _pragma("freelist_count")
+    assert free >= maintenance.AUTO_VACUUM_THRESHOLD
+
+    # Turned back on: the closing connection gives one step back
+    _delete([], auto=True)
+    assert _pragma("freelist_count") == free - 50
+
+    # Reads (which record the access time) do not free pages below the threshold
+    monkeypatch.setattr(maintenance, "AUTO_VACUUM_THRESHOLD", free)
+    with VaultSession.open("vault.db") as session:
+        session.unlock("master")
+        session.get("svc150")
+    assert _pragma("freelist_count") == free - 50
+
+
+def test_deleted_data_does_not_linger_in_the_file(vault):
+    with VaultSession.open("vault.db") as session:
+        session.unlock("master")
+        session.add("bank", "account-4242-marker", "hunter2")
+        blob = session.storage.get_credential("bank")[1]
+    _delete(["bank"])
+
+    data = b""
+    for path in ("vault.db", "vault.db-wal"):
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                data += f.read()
+    assert b"account-4242-marker" not in data
+    assert blob[-32:] not in data
+
+
+def test_optimize_command(vault):
+    _disable_auto_vacuum()
+    _delete([f"svc{i:03}" for i in range(0, 200, 2)])
+    runner = CliRunner()
+
+    result = runner.invoke(optimize, ["--stats"], terminal_width=120)
+    assert result.exit_code == 0, result.output
+    assert "Fragmentation" in result.output and "none" in result.output
+    assert "Automatic maintenance: on" in result.output
+
+    result = runner.invoke(optimize, [], terminal_width=120)
+    assert result.exit_code == 0, result.output
+    assert "Vault optimized" in result.output
+    assert "vacuum, analyze, checkpoint" in result.output
+    assert "incremental" in result.output
+
+    result = runner.invoke(optimize, ["--no-auto"])
+    assert "Automatic maintenance off" in result.output
+    storage = VaultStorage("vault.db")
+    try:
+        assert not storage.get_auto_maintenance()
+    finally:
+        storage.close()
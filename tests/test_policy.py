@@ -0,0 +1,204 @@
+import json
+import random
+import pytest
+from click.testing import CliRunner
+from pyvault import policy as policy_module
+from pyvault.main import cli
+from pyvault.policy import (
+    Policy,
+    PolicyError,
+    Rules,
+    Violation,
+    available_backends,
+    evaluate,
+)
+from pyvault.session import VaultSession
+
+DAY = 86400
+NOW = 1_000 * DAY
+
+POLICY_TOML = """
+min_length = 10
+require = ["lower", "digit"]
+banned = ["Acme"]
+max_age = "30d"
+
+[tags.prod]
+min_length = 16
+require = ["symbol"]
+max_age = "7d"
+"""
+
+
+@pytest.fixture(params=["python", "numpy"])
+def backend(request):
+    if request.param not in available_backends():
+        pytest.skip("NumPy is not installed")
+    return request.param
+
+
+def test_load_toml_and_json(tmp_path):
+    (tmp_path / "policy.toml").write_text(POLICY_TOML)
+    policy = Policy.load(tmp_path / "policy.toml")
+    assert policy.rules == Rules(10, frozenset({"lower", "digit"}), ("acme",), 30 * DAY)
+    assert policy.reuse
+    assert policy.rules_for(["prod", "other"]) == Rules(
+        16, frozenset({"lower", "digit", "symbol"}), ("acme",), 7 * DAY
+    )
+
+    (tmp_path / "policy.json").write_text(
+        json.dumps({"min_length": 8, "reuse": False, "tags": {"ci": {"banned": ["x"]}}})
+    )
+    policy = Policy.load(tmp_path / "policy.json")
+    assert policy.rules_for(["ci"]) == Rules(8, banned=("x",))
+    assert not policy.reuse
+
+
+@pytest.mark.parametrize(
+    "document, error",
+    [
+        ({"min_len": 3}, "Unknown rule"),
+        ({"require": ["emoji"]}, "require lists"),
+        ({"max_age": "soon"}, "max_age"),
+        ({"banned": [""]}, "banned"),
+        ({"tags": {"prod": {"min_length": "long"}}}, "tags.prod"),
+    ],
+)
+def test_invalid_policies(document, error):
+    with pytest.raises(PolicyError, match=error):
+        Policy.from_dict(document)
+
+
+def test_violations(backend):
+    policy = Policy.from_dict(
+        {
+            "min_length": 10,
+            "require": ["lower", "upper", "digit", "symbol"],
+            "banned": ["acme"],
+            "max_age": "30d",
+            "tags": {"prod": {"min_length": 12}},
+        }
+    )
+    rows = [
+        ("good", "Str0ng!enough", NOW - DAY, ()),
+        ("short", "Sh0rt!", NOW, ()),
+        ("classes", "lowercase only", NOW, ()),
+        ("banned", "My-ACME-Pass1", NOW, ()),
+        ("old", "Str0ng!enough2", NOW - 40 * DAY, ()),
+        ("prod", "Str0ng!enou", None, ("prod",)),
+        ("unicode", "Pässwörd-1é", NOW, ()),
+    ]
+    report = evaluate(policy, rows, backend=backend, now=NOW)
+    assert report.scanned == 7 and report.backend == backend
+    assert report.violations == [
+        Violation("banned", "banned-substring", "Contains 'acme'."),
+        Violation("classes", "character-class", "No upper, digit character."),
+        Violation("old", "max-age", "Not changed for 40 days (at most 30)."),
+        Violation("prod", "min-length", "11 characters, the policy requires 12."),
+        Violation("short", "min-length", "6 characters, the policy requires 10."),
+    ]
+    assert report.counts() == {
+        "min-length": 2,
+        "character-class": 1,
+        "banned-substring": 1,
+        "max-age": 1,
+    }
+
+
+def test_reuse_is_found_across_chunks(backend, monkeypatch):
+    monkeypatch.setattr(policy_module, "CHUNK_ROWS", 2)
+    rows = [(f"s{i}", "same" if i % 2 else f"p{i}", None, ()) for i in range(5)]
+    report = evaluate(Policy(), rows, backend=backend)
+    assert report.violations == [
+        Violation("s1", "reuse", "Same password as s3."),
+        Violation("s3", "reuse", "Same password as s1."),
+    ]
+    assert evaluate(Policy(reuse=False), rows, backend=backend).violations == []
+
+
+def test_backends_agree():
+    if "numpy" not in available_backends():
+        pytest.skip("NumPy is not installed")
+    generator = random.Random(7)
+    alphabet = "abcXYZ019!-_ éß€\U0001f511"
+    rows = [
+        (
+            f"s{i:04d}",
+            "".join(generator.choice(alphabet) for _ in range(generator.randrange(40))),
+            NOW - generator.randrange(60) * DAY,
+            generator.choice([(), ("prod",), ("ci", "prod")]),
+        )
+        for i in range(2_000)
+    ]
+    policy = Policy.from_dict(
+        {
+            "min_length": 8,
+            "require": ["upper", "symbol"],
+            "banned": ["ab", "c0", "x"],
+            "max_age": "45d",
+            "tags": {"prod": {"require": ["digit"], "banned": ["éß"]}},
+        }
+    )
+    reports = [evaluate(policy, rows, backend=b, now=NOW) for b in ("python", "numpy")]
+    assert reports[0].violations == reports[1].violations
+    assert len(reports[0].violations) > 1_000
+
+
+@pytest.fixture
+def vault():
+    with VaultSession.open("vault.db") as session:
+        session.initialize("master")
+        session.add("github", "me", "Correct-Horse-42")
+        session.add("mail", "me", "letters")
+        session.add("db", "admin", "acme-db-1")
+        session.label("db", add=["prod"])
+    with open("policy.toml", "w") as f:
+        f.write(POLICY_TOML)
+
+
+def test_audit_with_policy_gates_on_violations(vault, run_cli):
+    result = run_cli(cli, ["audit", "--policy", "policy.toml"])
+    assert result.exit_code == 1, result.output
+    assert "Policy Violations" in result.output
+    assert "│ mail    │ min-length       │ 7 characters" in result.output
+    assert "github" not in result.output
+
+    result = run_cli(cli, ["audit", "--policy", "policy.toml", "--format", "json"])
+    report = json.loads(result.output)
+    assert report["scanned"] == 3
+    assert report["counts"] == {
+        "min-length": 2,
+        "character-class": 1,
+        "banned-substring": 1,
+    }
+    assert {v["service"] for v in report["violations"]} == {"db", "mail"}
+
+    result = run_cli(
+        cli, ["audit", "--policy", "policy.toml", "--where", "not tag:prod"]
+    )
+    assert "db" not in result.output
+
+
+def test_audit_sarif_and_password_env(vault, monkeypatch):
+    monkeypatch.setenv("VAULT_PASSWORD", "master")
+    result = CliRunner().invoke(
+        cli, ["audit", "--format", "sarif", "--password-env", "VAULT_PASSWORD"]
+    )
+    # The built-in policy (length and reuse) reports but does not gate
+    assert result.exit_code == 0, result.output
+    sarif = json.loads(result.output)
+    assert sarif["version"] == "2.1.0"
+    results = sarif["runs"][0]["results"]
+    assert [(r["ruleId"], r["message"]["text"]) for r in results] == [
+        ("min-length", "db: 9 characters, the policy requires 12."),
+        ("min-length", "mail: 7 characters, the policy requires 12."),
+    ]
+    assert results[0]["locations"][0]["logicalLocations"][0]["name"] == "db"
+
+
+def test_audit_rejects_a_bad_policy(vault, run_cli):
+    with open("bad.json", "w") as f:
+        f.write('{"min_length": 8, "require": ["emoji"]}')
+    result = run_cli(cli, ["audit", "--policy", "bad.json"])
+    assert result.exit_code == 2
+    assert "require lists classes" in result.output
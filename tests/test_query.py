@@ -0,0 +1,183 @@
+import csv
+import pytest
+from pyvault.main import add, audit, export, rm, tag
+from pyvault.main import list as list_cmd
+from pyvault.query import QueryError, compile_filter
+from pyvault.session import VaultSession
+
+DAY = 86400
+NOW = 1_700_000_000.0
+
+
+@pytest.fixture
+def vault():
+    """vault.db with labelled credentials of different ages."""
+    with VaultSession.open("vault.db") as session:
+        session.initialize("master")
+        for service, folder, tags, age in [
+            ("aws-prod", "work/aws", ["prod", "cloud"], 200),
+            ("aws-dev", "work/aws/dev", ["cloud"], 10),
+            ("gitlab", "work", ["prod"], 100),
+            ("bank", "personal", [], 400),
+            ("workshop", "workshop", ["prod"], 1),
+        ]:
+            session.add(service, f"{service}-user", f"{service}-password-123")
+            session.label(service, add=tags, folder=folder)
+            session.storage.conn.execute(
+                "UPDATE credentials SET updated_at = ?, created_at = ? "
+                "WHERE service = ?",
+                (NOW - age * DAY, NOW - 2 * age * DAY, service),
+            )
+
+
+def _services(session, where):
+    sql, params = compile_filter(where, now=NOW)
+    rows = session.storage.conn.execute(
+        f"SELECT service FROM credentials AS c WHERE {sql} ORDER BY service", params
+    ).fetchall()
+    return [service for (service,) in rows]
+
+
+@pytest.mark.parametrize(
+    "where, expected",
+    [
+        ("tag:prod", ["aws-prod", "gitlab", "workshop"]),
+        ("tag:prod and updated<150d", ["gitlab", "workshop"]),
+        ("tag:prod updated>150d", ["aws-prod"]),
+        ("folder:work", ["aws-dev", "aws-prod", "gitlab"]),
+        ("folder:work/aws/", ["aws-dev", "aws-prod"]),
+        ("folder:work/aws and not tag:prod", ["aws-dev"]),
+        ("tag:cloud or folder:personal", ["aws-dev", "aws-prod", "bank"]),
+        ("(tag:cloud or tag:prod) and created>300d", ["aws-prod"]),
+        ("service~aws AND NOT service:aws-dev", ["aws-prod"]),
+        ('username~"%"', []),
+        ("username:bank-user", ["bank"]),
+        ("created<=2023-01-01", ["aws-prod", "bank"]),
+        ("tag:nothing", []),
+        ("service:aws-*", ["aws-dev", "aws-prod"]),
+        ('service:"*[kb]"', ["bank", "gitlab"]),
+        ("username:????-user", ["bank"]),
+        ('service:"aws-""dev"""', []),
+    ],
+)
+def test_filter_expressions(session, where, expected):
+    assert _services(session, where) == expected
+
+
+def test_not_folder_includes_credentials_without_one(session):
+    session.add("mail", "me", "mail-password-123")
+
+    assert _services(session, "not folder:work") == ["bank", "mail", "workshop"]
+    assert _services(session, "not folder:nothing and not tag:prod") == [
+        "aws-dev",
+        "bank",
+        "mail",
+    ]
+
+
+@pytest.mark.parametrize(
+    "where",
+    [
+        "",
+        "tag:",
+        "prod",
+        "tag:prod and",
+        "(tag:prod",
+        "tag:prod)",
+        "updated<soon",
+        "size>3",
+        "tag<prod",
+    ],
+)
+def test_invalid_expressions(where):
+    with pytest.raises(QueryError):
+        compile_filter(where)
+
+
+@pytest.mark.parametrize(
+    "where, index",
+    [
+        ("tag:prod", "credential_tags USING PRIMARY KEY (tag=?)"),
+        ("folder:work/aws", "idx_credentials_folder"),
+        ("updated<90d", "idx_credentials_updated"),
+        ("created>2024-01-01", "idx_credentials_created"),
+        ("service:aws-*", "sqlite_autoindex_credentials_1 (service>? AND service<?)"),
+    ],
+)
+def test_filters_use_indexes(session, where, index):
+    sql, params = compile_filter(where)
+    plan = session.storage.conn.execute(
+        f"EXPLAIN QUERY PLAN SELECT service FROM credentials AS c WHERE {sql}", params
+    ).fetchall()
+    details = [row[-1] for row in plan]
+    assert any(index in detail for detail in details), details
+    assert "SCAN c" not in details
+
+
+def test_labels_follow_the_credential(session):
+    assert session.labels("aws-prod") == ("work/aws", ["cloud", "prod"])
+    assert session.label("aws-prod", remove=["cloud"], folder="")
+    assert session.labels("aws-prod") == (None, ["prod"])
+    assert not session.label("nope", add=["x"])
+
+    # Writing a new password keeps the labels and the creation time
+    session.add("gitlab", "new-user", "another-password")
+    assert session.labels("gitlab") == ("work", ["prod"])
+    created = session.storage.conn.execute(
+        "SELECT created_at FROM credentials WHERE service = 'gitlab'"
+    ).fetchone()[0]
+    assert created == NOW - 200 * DAY
+
+    session.delete("gitlab")
+    assert session.list("tag:prod") == [
+        ("aws-prod", "aws-prod-user"),
+        ("workshop", "workshop-user"),
+    ]
+
+
+def test_where_option_on_the_commands(vault, run_cli):
+    result = run_cli(list_cmd, ["--where", "tag:prod"])
+    assert result.exit_code == 0, result.output
+    assert "gitlab" in result.output and "work/aws" in result.output
+    assert "bank" not in result.output and "aws-dev" not in result.output
+
+    result = run_cli(list_cmd, ["--where", "tag:prod and"])
+    assert result.exit_code == 2
+    assert "Incomplete filter expression" in result.output
+    assert "No credentials match" in run_cli(list_cmd, ["--where", "tag:x"]).output
+
+    result = run_cli(export, [".", "out", "--where", "folder:work/aws"])
+    assert result.exit_code == 0, result.output
+    with open("out.csv", newline="", encoding="utf-8") as f:
+        assert sorted(row["service"] for row in csv.DictReader(f)) == [
+            "aws-dev",
+            "aws-prod",
+        ]
+
+    result = run_cli(audit, ["--where", "folder:personal", "--no-similarity"])
+    assert "Total Credentials Scanned: 1" in result.output
+
+
+def test_tag_command_and_add_options(vault, run_cli):
+    result = run_cli(tag, ["bank", "finance", "2fa", "--folder", "personal/banks"])
+    assert result.exit_code == 0, result.output
+    assert "folder: personal/banks, tags: 2fa, finance" in result.output
+
+    result = run_cli(tag, ["bank", "--remove", "2fa", "--folder", ""])
+    assert "folder: -, tags: finance" in result.output
+    assert "not found" in run_cli(tag, ["nope", "x"]).output
+
+    result = run_cli(
+        add,
+        ["mail", "--username", "me", "--gen", "--tag", "personal", "--folder", "home"],
+    )
+    assert result.exit_code == 0, result.output
+    with VaultSession.open("vault.db") as session:
+        session.unlock("master")
+        assert session.labels("mail") == ("home", ["personal"])
+    assert run_cli(rm, ["mail"]).exit_code == 0
+    with VaultSession.open("vault.db") as session:
+        count = session.storage.conn.execute(
+            "SELECT COUNT(*) FROM credential_tags WHERE service = 'mail'"
+        ).fetchone()[0]
+    assert count == 0
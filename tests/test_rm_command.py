@@ -11,12 +11,16 @@ def runner():
 
 @pytest.fixture
 def mock_rm_deps():
-    with patch("pyvault.main.VaultStorage") as mock_storage, patch(
-        "pyvault.main.CryptoManager"
+    with patch("pyvault.session.VaultStorage") as mock_storage, patch(
+        "pyvault.session.CryptoManager"
     ) as mock_crypto, patch("pyvault.main.os.path.exists") as mock_exists, patch(
         "pyvault.main.SecurityProtections.check_input_speed"
     ) as mock_speed:
         mock_exists.return_value = True
+        mock_storage.return_value.get_master_data.return_value = (
+            b"salt",
+            b"verifier",
+        )
         mock_speed.return_value = True
 
         yield {"storage": mock_storage.return_value, "crypto": mock_crypto.return_value}
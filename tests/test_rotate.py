@@ -0,0 +1,121 @@
+import collections
+import time
+import pytest
+from pyvault.api import Vault
+from pyvault.main import audit, rotate
+from pyvault.passwords import PASSWORD_ALPHABET, generate_passwords
+from pyvault.session import VaultSession
+
+DAY = 86400
+
+
+@pytest.fixture
+def vault():
+    """vault.db with two credentials last changed 200 and 100 days ago, one today."""
+    with VaultSession.open("vault.db") as session:
+        session.initialize("master")
+        now = time.time()
+        for service, age in [("old", 200), ("older", 300), ("fresh", 0)]:
+            session.add(service, f"{service}-user", f"{service}-password")
+            session.storage.conn.execute(
+                "UPDATE credentials SET updated_at = ?, last_accessed_at = ? "
+                "WHERE service = ?",
+                (now - age * DAY, now - age * DAY, service),
+            )
+        session.label("old", add=["prod"])
+
+
+def test_bulk_generated_passwords():
+    passwords = generate_passwords(500, 40)
+    assert len(passwords) == 500 and len(set(passwords)) == 500
+    assert all(len(p) == 40 and set(p) <= set(PASSWORD_ALPHABET) for p in passwords)
+    counts = collections.Counter("".join(passwords))
+    # 20,000 characters: every one of the 94 shows up, none far too often
+    assert len(counts) == len(PASSWORD_ALPHABET)
+    assert max(counts.values()) < 2 * 20_000 / len(PASSWORD_ALPHABET)
+    assert generate_passwords(0) == []
+
+
+def test_reads_update_the_access_time(session, vault):
+    def accessed(service):
+        return session.storage.conn.execute(
+            "SELECT last_accessed_at FROM credentials WHERE service = ?", (service,)
+        ).fetchone()[0]
+
+    assert time.time() - accessed("old") > 199 * DAY
+    session.get("old")
+    # Written back in batches, not by the read itself
+    assert time.time() - accessed("old") > 199 * DAY
+    session.storage.flush_access()
+    assert time.time() - accessed("old") < 60
+    assert [s for s, _ in session.list("accessed>150d")] == ["older"]
+
+    with Vault.open("vault.db", password="master") as api_vault:
+        api_vault.get_many(["older"])
+    assert time.time() - accessed("older") < 60
+    # Reading is not a change
+    assert [s for s, *_ in session.stale(90 * DAY)] == ["older", "old"]
+
+
+def test_stale_entries_come_from_the_index(session):
+    conn = session.storage.conn
+    statements = []
+    conn.set_trace_callback(statements.append)
+    session.stale(90 * DAY)
+    conn.set_trace_callback(None)
+    query = next(sql for sql in statements if "FROM credentials" in sql)
+    details = " ".join(row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}"))
+    assert "idx_credentials_updated (updated_at<?)" in details
+    assert "TEMP B-TREE" not in details
+
+
+def test_rotate_in_one_transaction(session):
+    rotated = session.rotate(90 * DAY, length=24)
+    assert [(service, version) for service, _, _, version in rotated] == [
+        ("older", 2),
+        ("old", 2),
+    ]
+    for service in ("old", "older"):
+        username, password = session.get(service)
+        assert username == f"{service}-user" and len(password) == 24
+        assert session.get_version(service, 1)[1] == f"{service}-password"
+    assert session.get("fresh") == ("fresh-user", "fresh-password")
+    assert session.rotate(90 * DAY) == []
+
+
+def test_a_failed_rotation_changes_nothing(session):
+    real = session.storage.add_credential
+
+    def fail_on_second(service, *args):
+        if service == "old":
+            raise RuntimeError("disk full")
+        real(service, *args)
+
+    session.storage.add_credential = fail_on_second
+    with pytest.raises(RuntimeError):
+        session.rotate(90 * DAY)
+    session.storage.add_credential = real
+    assert session.get("older") == ("older-user", "older-password")
+
+
+def test_rotate_and_audit_commands(vault, run_cli):
+    result = run_cli(audit, ["--no-similarity"])
+    assert "Stale Passwords" in result.output
+    assert "Not changed for 90 days" in result.output
+    assert "pyvault rotate --older-than 90d" in result.output
+    assert (
+        "No passwords older than 400 days"
+        in run_cli(audit, ["--no-similarity", "--stale-after", "400d"]).output
+    )
+
+    result = run_cli(rotate, ["--older-than", "90d", "--dry-run"])
+    assert "Passwords to rotate (2)" in result.output and "300 days" in result.output
+    assert "cancelled" in run_cli(rotate, ["--older-than", "90d"], confirm=False).output
+    assert run_cli(rotate, ["--older-than", "soon"]).exit_code == 2
+
+    result = run_cli(rotate, ["--older-than", "90d", "--where", "tag:prod"])
+    assert result.exit_code == 0, result.output
+    assert "1 password(s) rotated" in result.output
+    result = run_cli(rotate, ["--older-than", "12w"])
+    assert "1 password(s) rotated" in result.output and "older" in result.output
+    assert "No passwords to rotate" in run_cli(rotate, ["--older-than", "90d"]).output
@@ -0,0 +1,75 @@
+import pytest
+from pyvault.session import AuthenticationError, VaultSession
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    """Opens sessions on a temporary vault with a cheap KDF for speed."""
+    db_file = tmp_path / "vault.db"
+
+    def factory():
+        session = VaultSession.open(db_file)
+        session.crypto.memory_cost = 8192
+        session.crypto.time_cost = 1
+        return session
+
+    with factory() as session:
+        session.initialize("master")
+    return factory
+
+
+def test_unlock_and_roundtrip(session_factory):
+    with session_factory() as session:
+        session.unlock("master")
+        session.add("github", "octocat", "s3cret")
+
+    with session_factory() as session:
+        session.unlock("master")
+        assert session.get("github") == ("octocat", "s3cret")
+        assert session.list() == [("github", "octocat")]
+        assert list(session.inventory()) == [("github", "octocat", "s3cret")]
+
+
+def test_wrong_password_raises(session_factory):
+    session = session_factory()
+    with pytest.raises(AuthenticationError):
+        session.unlock("not-the-master")
+    assert not session.unlocked
+    session.close()
+
+
+def test_session_uses_a_single_connection(session_factory):
+    """Every storage call of a command must share the session connection."""
+    with session_factory() as session:
+        conn = session.storage.conn
+        session.unlock("master")
+        with session.transaction(write=True):
+            session.add("a", "user", "pwd")
+            session.get("a")
+            assert conn.in_transaction
+        assert session.storage.conn is conn
+
+
+def test_failed_transaction_rolls_back(session_factory):
+    with session_factory() as session:
+        session.unlock("master")
+        with pytest.raises(RuntimeError):
+            with session.transaction(write=True):
+                session.add("half-done", "user", "pwd")
+                raise RuntimeError("boom")
+        assert session.get("half-done") is None
+
+
+def test_nested_transaction_is_a_savepoint(session_factory):
+    with session_factory() as session:
+        session.unlock("master")
+        session.add("kept", "user", "pwd")
+        with pytest.raises(ValueError):
+            with session.transaction():
+                session.add("discarded", "user", "pwd")
+                raise ValueError
+
+    with session_factory() as session:
+        session.unlock("master")
+        assert session.exists("kept")
+        assert not session.exists("discarded")
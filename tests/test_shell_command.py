@@ -0,0 +1,123 @@
+import pytest
+from click.testing import CliRunner
+from unittest.mock import patch
+from prompt_toolkit.document import Document
+from pyvault.crypto import CryptoManager
+from pyvault.main import shell
+from pyvault.session import VaultSession
+from pyvault.shell import IdleTimeout, ServiceIndex, ShellCompleter
+
+
+@pytest.fixture
+def vault():
+    with VaultSession.open("vault.db") as session:
+        session.initialize("master")
+        session.add("github", "octocat", "gh-pass")
+        session.add("gitlab", "tanuki", "gl-pass")
+        session.add("mail", "me", "mail-pass")
+
+
+def run_shell(*lines):
+    """Runs 'pyvault shell' over scripted input lines (IdleTimeout is raised)."""
+    script = iter(lines)
+    sessions = []
+
+    def fake_reader(completer):
+        def read(prompt, timeout):
+            line = next(script, None)
+            if line is None:
+                raise EOFError
+            if line is IdleTimeout:
+                raise IdleTimeout
+            return line
+
+        return read
+
+    original_open = VaultSession.open
+
+    def tracking_open(db_path, **kwargs):
+        session = original_open(db_path, **kwargs)
+        sessions.append(session)
+        return session
+
+    with patch("pyvault.shell.prompt_reader", side_effect=fake_reader), patch(
+        "pyvault.main.questionary.password"
+    ) as mock_password, patch(
+        "pyvault.main.SecurityProtections.check_input_speed", return_value=True
+    ), patch.object(
+        VaultSession, "open", side_effect=tracking_open
+    ), patch.object(
+        CryptoManager, "derive_key", autospec=True, side_effect=CryptoManager.derive_key
+    ) as mock_kdf:
+        mock_password.return_value.ask.return_value = "master"
+        result = CliRunner().invoke(shell, [])
+    return result, sessions, mock_kdf
+
+
+def test_shell_runs_commands_with_one_unlock(vault):
+    result, sessions, mock_kdf = run_shell(
+        "list", "get github", "add new-service --username bob --gen", "get mail"
+    )
+
+    assert result.exit_code == 0
+    assert "octocat" in result.output and "gh-pass" in result.output
+    assert "new-service" in result.output and "mail-pass" in result.output
+    assert mock_kdf.call_count == 1
+    assert len(sessions) == 1
+    session = sessions[0]
+    assert not session.unlocked and session.storage.conn is None
+
+
+def test_shell_builtins(vault):
+    result, _, _ = run_shell("find GIT", "wipe", "help", "exit", "list")
+
+    assert "github" in result.output and "gitlab" in result.output
+    assert "Unknown command:" in result.output
+    assert "lock" in result.output
+    # Nothing runs after exit
+    assert "Stored Credentials" not in result.output
+
+
+def test_shell_locks_after_inactivity(vault):
+    result, _, mock_kdf = run_shell(IdleTimeout, "get mail")
+
+    assert "Vault locked after inactivity" in result.output
+    assert "mail-pass" in result.output
+    assert mock_kdf.call_count == 2
+
+
+def test_service_index_and_completion(vault):
+    with VaultSession.open("vault.db") as session:
+        index = ServiceIndex()
+        assert index.refresh(session)
+        assert not index.refresh(session)
+        # Most recently used first: gitlab was written last
+        assert index.complete("git") == ["gitlab", "github"]
+        index.used("github")
+        assert index.complete("git") == ["github", "gitlab"]
+        assert index.filter("tanu") == [("gitlab", "tanuki")]
+
+        session.storage.delete_credential("gitlab")
+        assert index.refresh(session)
+        assert index.complete("git") == ["github"]
+
+    completer = ShellCompleter(["get", "list"], index)
+
+    def complete(text):
+        document = Document(text, len(text))
+        return [c.text for c in completer.get_completions(document, None)]
+
+    assert complete("g") == ["get"]
+    assert complete("get gi") == ["github"]
+    assert complete("list ") == []
+
+
+def test_shell_cache_and_stats(vault):
+    result, sessions, _ = run_shell("get github", "get github", "get mail", "stats")
+
+    assert result.output.count("gh-pass") == 2
+    assert "1 hit(s), 2 miss(es) (33% hit rate), 2/100 entries" in result.output
+    assert "Reads recorded: 3" in result.output
+    assert "5 services  100.0%" in result.output
+    # The second read was served from memory
+    assert sessions[0].cache is not None and len(sessions[0].cache) == 0
@@ -0,0 +1,65 @@
+import pytest
+from pyvault.similarity import SimilarityDetector, password_skeleton
+
+
+def test_skeleton_collapses_digit_and_symbol_runs():
+    """Seasonal variants must share the same structural skeleton."""
+    assert password_skeleton("Summer2023!") == "summer9#"
+    assert password_skeleton("summer2024?") == password_skeleton("Summer2023!")
+
+
+def test_pattern_variants_are_clustered():
+    detector = SimilarityDetector()
+    clusters = detector.find_clusters(
+        [
+            ("gitlab", "Summer2023!"),
+            ("jira", "Summer2024!"),
+            ("bank", "xK9#mQ2$vL7@"),
+        ]
+    )
+
+    assert clusters == [{"services": ["gitlab", "jira"], "match": "pattern"}]
+
+
+def test_fuzzy_variants_are_clustered():
+    """Leet-speak variants differ in structure but not in shingles."""
+    detector = SimilarityDetector(use_skeleton=False)
+    clusters = detector.find_clusters(
+        [("mail", "P@ssw0rd-blue"), ("vpn", "Password-blue7")]
+    )
+
+    assert clusters == [{"services": ["mail", "vpn"], "match": "fuzzy"}]
+
+
+def test_exact_reuse_is_not_a_similarity_cluster():
+    """Identical passwords are reported by the reuse check, not here."""
+    detector = SimilarityDetector()
+    clusters = detector.find_clusters(
+        [("a", "Correct-Horse-1"), ("b", "Correct-Horse-1")]
+    )
+
+    assert clusters == []
+
+
+def test_threshold_controls_fuzzy_matches():
+    entries = [("a", "orange-river-stone"), ("b", "orange-river-storm")]
+
+    assert SimilarityDetector(threshold=0.6, use_skeleton=False).find_clusters(entries)
+    assert not SimilarityDetector(threshold=0.95, use_skeleton=False).find_clusters(
+        entries
+    )
+
+
+def test_pattern_matches_ignore_the_threshold():
+    entries = [("a", "Summer2023!"), ("b", "summer1999?"), ("c", "Summer2023!x")]
+    detector = SimilarityDetector(threshold=1.0)
+
+    # 'c' has another skeleton and is not similar enough at 1.0
+    assert detector.find_clusters(entries) == [
+        {"services": ["a", "b"], "match": "pattern"}
+    ]
+
+
+def test_invalid_threshold_is_rejected():
+    with pytest.raises(ValueError):
+        SimilarityDetector(threshold=0)
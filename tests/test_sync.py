@@ -0,0 +1,218 @@
+import shutil
+import sqlite3
+import time
+import pytest
+from unittest.mock import patch
+from pyvault.main import sync
+from pyvault.session import VaultSession
+from pyvault.storage import VaultStorage
+from pyvault.sync import VaultSync
+
+
+@pytest.fixture
+def vaults(tmp_path):
+    """Two copies of the same vault holding ten records."""
+    local = VaultStorage(tmp_path / "local.db")
+    local.store_master_data(b"salt", b"verifier")
+    with local.transaction(write=True):
+        for i in range(10):
+            local.add_credential(f"svc{i}", "user", f"blob{i}".encode())
+    local.close()
+    shutil.copy(tmp_path / "local.db", tmp_path / "remote.db")
+
+    local = VaultStorage(tmp_path / "local.db")
+    remote = VaultStorage(tmp_path / "remote.db")
+    yield local, remote
+    local.close()
+    remote.close()
+
+
+def _sync(local, remote, resolve=None):
+    engine = VaultSync(local, remote, resolve=resolve)
+    plan = engine.plan()
+    engine.apply(plan)
+    assert local.merkle_root() == remote.merkle_root()
+    return plan
+
+
+def test_identical_vaults_need_nothing(vaults):
+    local, remote = vaults
+    plan = VaultSync(local, remote).plan()
+
+    assert not plan
+    assert plan.buckets_compared == 0
+
+
+def test_one_sided_changes_are_copied_both_ways(vaults):
+    local, remote = vaults
+    local.add_credential("new-local", "a", b"1")
+    remote.add_credential("new-remote", "b", b"2")
+    remote.add_credential("svc3", "updated", b"3")
+
+    plan = _sync(local, remote)
+
+    assert len(plan.push) == 1 and len(plan.pull) == 2
+    assert remote.get_credential("new-local")[0] == "a"
+    assert local.get_credential("new-remote")[0] == "b"
+    assert local.get_credential("svc3")[0] == "updated"
+    # Only the buckets holding the changed records were read
+    assert plan.buckets_compared == 3
+
+
+def test_last_writer_wins_and_deletions_propagate(vaults):
+    local, remote = vaults
+    now = time.time()
+    with patch("pyvault.storage.time.time", return_value=now + 10):
+        local.add_credential("svc1", "older", b"x")
+    with patch("pyvault.storage.time.time", return_value=now + 20):
+        remote.add_credential("svc1", "newer", b"y")
+        remote.delete_credential("svc2")
+
+    plan = _sync(local, remote)
+
+    # svc2 was only deleted on the remote side
+    assert plan.conflicts == 1
+    assert local.get_credential("svc1")[0] == "newer"
+    assert local.get_credential("svc2") is None
+    assert len(local.get_all_credentials()) == 9
+
+    # A newer re-creation beats the tombstone
+    with patch("pyvault.storage.time.time", return_value=now + 30):
+        local.add_credential("svc2", "back", b"z")
+    _sync(local, remote)
+    assert remote.get_credential("svc2")[0] == "back"
+
+
+def test_resolver_decides_conflicts(vaults):
+    local, remote = vaults
+    local.add_credential("svc5", "mine", b"x")
+    remote.add_credential("svc5", "theirs", b"y")
+    seen = []
+
+    def keep_local(ours, theirs):
+        seen.append((ours.username, theirs.username))
+        return ours
+
+    _sync(local, remote, resolve=keep_local)
+
+    assert seen == [("mine", "theirs")]
+    assert remote.get_credential("svc5")[0] == "mine"
+
+
+def _keep_local(seen):
+    def resolve(ours, theirs):
+        seen.append(ours.service)
+        return ours
+
+    return resolve
+
+
+def test_one_sided_changes_of_a_fresh_copy_are_not_conflicts(vaults):
+    local, remote = vaults
+    local.add_credential("svc4", "changed", b"x")
+    remote.delete_credential("svc6")
+    seen = []
+
+    plan = _sync(local, remote, resolve=_keep_local(seen))
+
+    assert plan.conflicts == 0 and seen == []
+    assert remote.get_credential("svc4")[0] == "changed"
+    assert local.get_credential("svc6") is None
+
+
+def test_sync_base_tells_one_sided_changes_from_conflicts(vaults):
+    local, remote = vaults
+    _sync(local, remote)
+    # Without past versions only the base tells which side changed svc1
+    local.set_history_policy(0, None)
+    local.add_credential("svc1", "local-only", b"x")
+    local.add_credential("svc2", "mine", b"y")
+    remote.add_credential("svc2", "theirs", b"z")
+    seen = []
+
+    plan = _sync(local, remote, resolve=_keep_local(seen))
+
+    assert plan.conflicts == 1 and seen == ["svc2"]
+    assert remote.get_credential("svc1")[0] == "local-only"
+    assert remote.get_credential("svc2")[0] == "mine"
+
+
+def test_changes_received_from_another_copy_are_passed_on(vaults, tmp_path):
+    local, remote = vaults
+    shutil.copy(tmp_path / "local.db", tmp_path / "third.db")
+    third = VaultStorage(tmp_path / "third.db")
+    _sync(local, remote)
+    _sync(remote, third)
+    for storage in (remote, third):
+        storage.set_history_policy(0, None)
+    third.add_credential("svc8", "from-third", b"x")
+    _sync(remote, third)
+    seen = []
+
+    plan = _sync(local, remote, resolve=_keep_local(seen))
+
+    assert plan.conflicts == 0 and seen == []
+    assert local.get_credential("svc8")[0] == "from-third"
+    third.close()
+
+
+def test_changes_made_after_planning_are_not_overwritten(vaults):
+    local, remote = vaults
+    local.add_credential("svc7", "planned", b"x")
+    engine = VaultSync(local, remote)
+    plan = engine.plan()
+    remote.add_credential("svc7", "concurrent", b"y")
+
+    assert engine.apply(plan) == 1
+    assert remote.get_credential("svc7")[0] == "concurrent"
+
+
+def test_upgraded_legacy_copies_start_in_sync(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / "a.db"))
+    conn.execute(
+        "CREATE TABLE credentials (service TEXT PRIMARY KEY, "
+        "username TEXT NOT NULL, password_blob BLOB NOT NULL)"
+    )
+    conn.executemany(
+        "INSERT INTO credentials VALUES (?, ?, ?)",
+        [(f"svc{i}", "u", b"blob") for i in range(50)],
+    )
+    conn.commit()
+    conn.close()
+    shutil.copy(tmp_path / "a.db", tmp_path / "b.db")
+
+    a, b = VaultStorage(tmp_path / "a.db"), VaultStorage(tmp_path / "b.db")
+    assert a.merkle_root() == b.merkle_root() != (0, 0)
+    b.delete_credential("svc0")
+    _sync(a, b)
+    assert a.get_credential("svc0") is None
+    a.close()
+    b.close()
+
+
+def test_sync_command(tmp_path, run_cli):
+    with VaultSession.open("vault.db") as session:
+        session.initialize("master")
+        session.add("github", "octocat", "pw")
+    shutil.copy("vault.db", tmp_path / "usb.db")
+    with VaultSession.open(tmp_path / "usb.db") as session:
+        session.unlock("master")
+        session.add("gitlab", "tanuki", "pw2")
+
+    result = run_cli(sync, [str(tmp_path / "usb.db")])
+
+    assert result.exit_code == 0
+    assert "Sync complete" in result.output and "Received: 1" in result.output
+    with VaultSession.open("vault.db") as session:
+        session.unlock("master")
+        assert session.get("gitlab") == ("tanuki", "pw2")
+
+
+def test_sync_refuses_unrelated_vaults(tmp_path, run_cli):
+    for path in ("vault.db", tmp_path / "other.db"):
+        with VaultSession.open(path) as session:
+            session.initialize("master")
+
+    result = run_cli(sync, [str(tmp_path / "other.db")])
+
+    assert "Sync refused" in result.output
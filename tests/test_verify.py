@@ -0,0 +1,125 @@
+import io
+import os
+import shutil
+import pytest
+from pyvault.crypto import CryptoManager
+from pyvault.main import verify
+from pyvault.session import VaultSession
+from pyvault.verify import (
+    CORRUPT,
+    TRUNCATED,
+    WRONG_KEY,
+    repair_records,
+    verify_vault,
+)
+
+
+@pytest.fixture
+def vault():
+    """An initialized vault.db in the working directory with 30 records."""
+    with VaultSession.open("vault.db") as session:
+        session.initialize("master")
+        with session.transaction(write=True):
+            for i in range(30):
+                session.add(f"svc{i:02d}", "user", f"password-{i}")
+
+
+def _damage(storage):
+    blob = storage.get_credential("svc01")[1]
+    flipped = blob[:-1] + bytes([blob[-1] ^ 1])
+    # Raw writes: the record hashes are left as they were
+    storage.conn.execute(
+        "UPDATE credentials SET password_blob = ? WHERE service = 'svc01'", (flipped,)
+    )
+    storage.conn.execute(
+        "UPDATE credentials SET password_blob = ? WHERE service = 'svc02'", (blob[:10],)
+    )
+    # Properly written, but with a key that is not the vault's
+    foreign = CryptoManager().encrypt("x", os.urandom(32))
+    storage.add_credential("svc03", "user", foreign)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_verify_reports_damaged_records(vault, workers):
+    with VaultSession.open("vault.db") as session:
+        session.unlock("master")
+        clean = verify_vault("vault.db", session.storage.conn, session.key)
+        _damage(session.storage)
+        report = verify_vault(
+            "vault.db", session.storage.conn, session.key, workers=workers, batch_size=7
+        )
+
+    assert clean.ok and clean.records == 30
+    assert report.records == 30
+    assert not report.database_errors
+    assert report.problems == {"svc01": CORRUPT, "svc02": TRUNCATED, "svc03": WRONG_KEY}
+
+
+def test_verify_command_repairs_from_backup(vault, tmp_path, run_cli):
+    shutil.copy("vault.db", tmp_path / "backup.db")
+    with VaultSession.open("vault.db") as session:
+        _damage(session.storage)
+
+    result = run_cli(verify, [])
+    assert result.exit_code == 1
+    assert "svc01" in result.output and "wrong key" in result.output
+    assert "password-1" not in result.output
+
+    result = run_cli(verify, ["--repair-from", str(tmp_path / "backup.db")])
+    assert result.exit_code == 0
+    assert "3 record(s) restored" in result.output
+
+    result = run_cli(verify, [])
+    assert result.exit_code == 0
+    assert "0 damaged" in result.output
+
+
+def _flip(data):
+    return data[:-1] + bytes([data[-1] ^ 1])
+
+
+def test_history_and_attachments_are_verified_and_repaired_in_place(vault, tmp_path):
+    with VaultSession.open("vault.db") as session:
+        session.unlock("master")
+        session.add("svc04", "user", "password-4b")
+        session.attach("svc05", "key.pem", io.BytesIO(b"k" * 5000), chunk_size=1024)
+    shutil.copy("vault.db", tmp_path / "backup.db")
+
+    with VaultSession.open("vault.db") as session:
+        session.unlock("master")
+        conn = session.storage.conn
+        blob = conn.execute(
+            "SELECT password_blob FROM credential_history WHERE service = 'svc04'"
+        ).fetchone()[0]
+        conn.execute(
+            "UPDATE credential_history SET password_blob = ? WHERE service = 'svc04'",
+            (_flip(blob),),
+        )
+        conn.execute("DELETE FROM attachment_chunks WHERE chunk = 4")
+        _damage(session.storage)
+        before = session.storage.get_credential_info("svc01")
+
+        report = verify_vault("vault.db", conn, session.key, workers=2, batch_size=7)
+        assert (report.records, report.versions, report.attachments) == (30, 2, 1)
+        assert report.damaged_versions == {("svc04", 1): CORRUPT}
+        assert report.damaged_attachments == {("svc05", "key.pem"): TRUNCATED}
+        assert ("svc05", "attachment key.pem", TRUNCATED) in report.damage()
+
+        with VaultSession.open(tmp_path / "backup.db") as backup:
+            repaired, unrepaired = repair_records(session, backup.storage, report)
+        assert unrepaired == []
+        assert repaired == [
+            "svc01",
+            "svc02",
+            "svc03",
+            "svc04 (version 1)",
+            "svc05 (attachment key.pem)",
+        ]
+
+        assert session.storage.get_credential_info("svc01") == before
+        assert [row[0] for row in session.history("svc04")] == [2, 1]
+        assert session.get_version("svc04", 1) == ("user", "password-4")
+        out = io.BytesIO()
+        session.read_attachment("svc05", "key.pem", out)
+        assert out.getvalue() == b"k" * 5000
+        assert verify_vault(None, conn, session.key).ok
@@ -0,0 +1,126 @@
+import threading
+import pytest
+from click.testing import CliRunner
+from unittest.mock import patch
+from pyvault import session as session_module
+from pyvault.locking import VaultLock
+from pyvault.main import get, list as list_cmd
+from pyvault.migrations import LATEST_VERSION, MigrationError
+from pyvault.session import VaultSession
+from pyvault.storage import VaultStorage
+from pyvault.warmup import VaultWarmup
+
+
+@pytest.fixture
+def vault():
+    """vault.db with five credentials, a to e."""
+    with VaultSession.open("vault.db") as session:
+        session.initialize("master")
+        for service in "abcde":
+            session.add(service, f"{service}-user", f"{service}-password")
+
+
+def _wait_for_warmup():
+    for thread in threading.enumerate():
+        if thread.name == "pyvault-warmup":
+            thread.join()
+
+
+def _invoke(command, args, password="master"):
+    """
+    Runs a command whose prompt returns once the warm-up is done; returns the
+    result and the SQL its session ran after the prompt.
+    """
+    statements = []
+    original_open = VaultSession.open
+
+    def tracking_open(db_path, **kwargs):
+        session = original_open(db_path, **kwargs)
+        sessions.append(session)
+        return session
+
+    def answer():
+        _wait_for_warmup()
+        for session in sessions:
+            session.storage.conn.set_trace_callback(statements.append)
+        return password
+
+    sessions = []
+    with patch("pyvault.main.questionary.password") as mock_password, patch(
+        "pyvault.main.SecurityProtections.check_input_speed", return_value=True
+    ), patch.object(VaultSession, "open", side_effect=tracking_open):
+        mock_password.return_value.ask.side_effect = answer
+        result = CliRunner(mix_stderr=False).invoke(command, args, terminal_width=120)
+    return result, statements
+
+
+def test_get_reads_ahead_while_the_prompt_is_open(vault):
+    result, statements = _invoke(get, ["c"])
+    assert result.exit_code == 0, result.output
+    assert "c-password" in result.output
+    # Left for after the prompt: key derivation, decryption, the read count
+    assert not [
+        sql for sql in statements if "FROM credentials" in sql or "master_salt" in sql
+    ]
+
+
+def test_list_reads_ahead_while_the_prompt_is_open(vault, monkeypatch):
+    result, statements = _invoke(list_cmd, ["--format", "plain"])
+    assert result.stdout.split() == [*"abcde"]
+    assert not [sql for sql in statements if "FROM credentials" in sql]
+
+    # Longer listings continue from the last preloaded row
+    monkeypatch.setattr(session_module, "PRELOAD_ROWS", 2)
+    result, statements = _invoke(list_cmd, ["--format", "plain", "--limit", "4"])
+    assert result.stdout.split() == [*"abcd"]
+    assert [sql for sql in statements if "c.service > 'b'" in sql]
+
+
+def test_preloaded_rows_are_dropped_when_the_vault_changes(vault):
+    with VaultSession.open("vault.db") as session:
+        session.warm_up(lambda session: session.preload(["a", "f"]))
+        session.preload_catalog()
+        other = VaultStorage("vault.db")
+        other.conn.execute("UPDATE credentials SET username = 'x' WHERE service = 'a'")
+        other.close()
+        session.unlock("master")
+        assert session.get("a") == ("x", "a-password")
+        assert [row[:2] for row in session.catalog()][0] == ("a", "x")
+
+    with VaultSession.open("vault.db") as session:
+        session.warm_up(lambda session: session.preload(["f"]))
+        session.unlock("master")
+        session.add("f", "f-user", "f-password")
+        assert session.get("f") == ("f-user", "f-password")
+
+
+def test_preloaded_catalog_matches_the_live_one(vault, monkeypatch):
+    monkeypatch.setattr(session_module, "PRELOAD_ROWS", 2)
+    with VaultSession.open("vault.db") as session:
+        session.unlock("master")
+        session.get("e")
+        for args in [(None, None, None), (None, "b", None), (None, None, 4)]:
+            for order in ("name", "frequent"):
+                live = [*session.catalog(*args, order=order)]
+                session.preload_catalog(*args, order=order)
+                assert [*session.catalog(*args, order=order)] == live
+
+
+def test_cancelled_warmup_releases_the_vault(vault):
+    with patch("pyvault.main.questionary.password") as mock_password:
+        mock_password.return_value.ask.return_value = None
+        result = CliRunner().invoke(get, ["a"])
+    assert result.exit_code == 0
+    _wait_for_warmup()
+    lock = VaultLock("vault.db", exclusive=True, timeout=0)
+    lock.acquire()
+    lock.release()
+
+
+def test_warmup_raises_open_errors(tmp_path):
+    path = tmp_path / "newer.db"
+    storage = VaultStorage(path)
+    storage.conn.execute(f"PRAGMA user_version = {LATEST_VERSION + 1}")
+    storage.close()
+    with pytest.raises(MigrationError):
+        VaultWarmup(path).start().session()
@@ -26,9 +26,10 @@ def test_vault_wipe_flow(
     mock_challenge.return_value = True
     mock_speed.return_value = True
 
-    with patch("pyvault.main.VaultStorage"), patch(
-        "pyvault.main.CryptoManager"
+    with patch("pyvault.session.VaultStorage") as mock_storage, patch(
+        "pyvault.session.CryptoManager"
     ) as mock_crypto:
+        mock_storage.return_value.get_master_data.return_value = (b"salt", b"v")
         # Simula verifica password corretta
         mock_crypto.return_value.decrypt.return_value = True
 